@@ -0,0 +1,2290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_p2p.py
+
+Benchmark del nodo P2P (pacchetto p2p) su loopback.
+Il nodo sotto test gira in un processo figlio (log server su /dev/null),
+il carico viene generato dal processo padre con client asyncio.
+
+Esempi:
+  - confronto engine thread vs async (connessioni per nodo + messaggi/s):
+      python3 bench_p2p.py engines --conns 200 1000 --messages 200
+
+  - eco con più processi worker sulla stessa porta (SO_REUSEPORT):
+      python3 bench_p2p.py workers --workers 1 2 4 --conns 64
+
+  - ConnectionRegistry a 10k/100k connessioni:
+      python3 bench_p2p.py registry --sizes 10000 100000 --with-linear
+
+  - contesa sul lock del registry con molti thread handler:
+      python3 bench_p2p.py contention --threads 1 16 128
+
+  - broadcast con un peer lento (policy drop/block/disconnect):
+      python3 bench_p2p.py fanout --readers 8 --frames 5000
+
+  - richieste correlate in pipeline sulla stessa connessione:
+      python3 bench_p2p.py pipeline --depths 1 4 16 64
+
+  - flood verso un nodo che non legge (inbox limitata, backpressure TCP):
+      python3 bench_p2p.py backpressure --inbox-kb 256 4096 65536
+
+  - costo di server_log sotto flood di messaggi:
+      python3 bench_p2p.py logging --threads 1 8 --backends sync async null
+
+  - simulazione gossip (latenza di propagazione, duplicati):
+      python3 bench_p2p.py gossip --nodes 64 --degree 4 --fanout 3
+
+  - overlay DHT: send_to_node verso nodi non vicini (hop e latenza, 1k nodi su 8 processi):
+      python3 bench_p2p.py dht --nodes 1000 --procs 8 --k 4
+
+  - simulazione discovery (pacchetti per nodo convergente, text vs binary):
+      python3 bench_p2p.py discovery --nodes 100 --loss 0.05
+
+  - bootstrap con indirizzi morti davanti a un nodo vivo (time-to-first-peer):
+      python3 bench_p2p.py bootstrap --dead 3 --inflight 1 8
+
+  - riavvio a freddo (solo multicast) vs a caldo (cache dei peer su disco):
+      python3 bench_p2p.py warm --mesh 8 --restarts 3
+
+  - handshake mTLS al secondo: in chiaro vs TLS completo vs TLS con ripresa di sessione:
+      python3 bench_p2p.py tls --duration 5
+
+  - compressione dei payload: byte sul filo e costo CPU per codec e dimensione:
+      python3 bench_p2p.py compress --sizes 256 4096 65536 1048576 --peers 8
+
+  - messaggi tipizzati: encode/decode per tipo e serializer (struct, json, msgpack/cbor se installati) vs testo:
+      python3 bench_p2p.py serialize --types ping bench_record --messages 50000
+
+  - costo delle metriche (contatori/istogrammi per thread vs contatore con lock):
+      python3 bench_p2p.py metrics --threads 1 8 32
+
+  - API di controllo (daemon): un comando per riga vs batch vs send_many/request_many:
+      python3 bench_p2p.py control --messages 20000
+
+  - costo delle connessioni inattive (risvegli/s e CPU del nodo a riposo):
+      python3 bench_p2p.py idle --conns 0 1000 10000 --window 10
+
+  - trasferimento file: send_file (sendfile + CRC per chunk) vs read-all/sendall, MB/s e memoria:
+      python3 bench_p2p.py transfer --size-mb 512 --runs 3
+
+  - download a sciame da 10 nodi con upload limitato (rarest-first, endgame, sorgenti lente/parziali):
+      python3 bench_p2p.py swarm --sources 1 3 9 --rate-mb 20 --slow 2 --partial 3
+
+  - latenza di send_and_wait sotto carico bulk/flood sulla stessa connessione: FIFO vs corsie con priorità:
+      python3 bench_p2p.py lanes --loads none bulk flood --bulk-kb 64 --seconds 5
+      python3 bench_p2p.py lanes --modes lanes --loads bulk --rcvbuf-kb 256
+
+  - load driver headless (N nodi, echo/broadcast/send_and_wait, report JSON):
+      python3 bench_p2p.py load --nodes 4 --patterns echo broadcast send_and_wait --out load.json
+      python3 bench_p2p.py load --targets p2p_multicast p2p_versione_corretta --discovery
+      python3 bench_p2p.py load --engines async --registries default sharded --log-backend null
+"""
+import argparse
+import asyncio
+import heapq
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import p2p
+
+BENCH_HOST = "127.0.0.1"
+
+# ---------------- Helpers -----------------------------------------------------
+def free_port() -> int:
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind((BENCH_HOST, 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+def proc_status(pid: int) -> Dict[str, int]:
+    """Threads, VmRSS e picco VmHWM (kB) letti da /proc (solo Linux)."""
+    out = {"threads": -1, "rss_kb": -1, "hwm_kb": -1}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    out["threads"] = int(line.split()[1])
+                elif line.startswith("VmRSS:"):
+                    out["rss_kb"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    out["hwm_kb"] = int(line.split()[1])
+    except OSError:
+        pass
+    return out
+
+def _node_main(engine: str, port: int, ready, opts: Dict[str, object], host: str = BENCH_HOST) -> None:
+    """Entry point del processo figlio: avvia solo il server TCP (niente multicast)."""
+    sys.stderr = open(os.devnull, "w")
+    peer = p2p.ENGINES[engine](host, port, **opts)
+    peer.start_server()
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+def spawn_node(engine: str, port: int, host: str = BENCH_HOST, **opts) -> multiprocessing.Process:
+    ready = multiprocessing.Event()
+    proc = multiprocessing.Process(target=_node_main, args=(engine, port, ready, opts, host), daemon=True)
+    proc.start()
+    if not ready.wait(10.0):
+        proc.terminate()
+        raise RuntimeError(f"Nodo {engine} non avviato su porta {port}")
+    return proc
+
+# ---------------- Load generators ---------------------------------------------
+async def _open_conns(port: int, n: int, timeout: float = 10.0):
+    async def one():
+        return await asyncio.wait_for(asyncio.open_connection(BENCH_HOST, port), timeout)
+
+    results = await asyncio.gather(*(one() for _ in range(n)), return_exceptions=True)
+    return [r for r in results if not isinstance(r, Exception)]
+
+PING = p2p.encode_frame(p2p.MSG_TEXT, b"ping")
+PONG = p2p.encode_frame(p2p.MSG_REPLY, b"PING")
+
+async def _ping_pong(reader, writer, messages: int, timeout: float = 5.0) -> int:
+    """Invia il frame 'ping' e attende l'eco 'PING' per `messages` volte; ritorna i round-trip riusciti.
+    Una connessione accettata dal kernel ma mai servita dal nodo scade dopo `timeout`."""
+    done = 0
+    try:
+        for _ in range(messages):
+            writer.write(PING)
+            await writer.drain()
+            if await asyncio.wait_for(reader.readexactly(len(PONG)), timeout) != PONG:
+                break
+            done += 1
+    except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+        pass
+    return done
+
+async def _engine_round(pid: int, port: int, conns: int, messages: int) -> Dict[str, float]:
+    t0 = time.perf_counter()
+    pairs = await _open_conns(port, conns)
+    t_connect = time.perf_counter() - t0
+    # una prima eco per connessione garantisce che il nodo abbia davvero servito tutte le connessioni
+    alive = await asyncio.gather(*(_ping_pong(r, w, 1) for r, w in pairs), return_exceptions=True)
+    served = sum(1 for a in alive if a == 1)
+
+    t0 = time.perf_counter()
+    counts = await asyncio.gather(*(_ping_pong(r, w, messages) for r, w in pairs), return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    total = sum(c for c in counts if isinstance(c, int))
+    status = proc_status(pid)
+
+    for _, w in pairs:
+        w.close()
+    return {
+        **status,
+        "conns_requested": conns,
+        "conns_served": served,
+        "connect_s": round(t_connect, 3),
+        "messages": total,
+        "msgs_per_s": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+# ---------------- Scenarios ---------------------------------------------------
+def bench_engines(args) -> List[Dict[str, float]]:
+    rows = []
+    for engine in args.engines:
+        for conns in args.conns:
+            port = free_port()
+            proc = spawn_node(engine, port)
+            try:
+                row = asyncio.run(_engine_round(proc.pid, port, conns, args.messages))
+            finally:
+                proc.terminate()
+                proc.join()
+            row["engine"] = engine
+            rows.append(row)
+            print(
+                f"engine={engine:6s} conns={row['conns_served']}/{conns} connect_s={row['connect_s']} "
+                f"msgs/s={row['msgs_per_s']} threads={row['threads']} rss_kb={row['rss_kb']}"
+            )
+    return rows
+
+def _pool_main(engine: str, port: int, workers: int, ready) -> None:
+    """Processo figlio: un WorkerPool (--workers) al posto del singolo Peer.
+    I worker escono da soli quando questo processo termina."""
+    sys.stderr = open(os.devnull, "w")
+    pool = p2p.WorkerPool(workers, lambda: p2p.ENGINES[engine](BENCH_HOST, port, reuse_port=True))
+    pool.start_server()
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+def _echo_client(job) -> Dict[str, float]:
+    """Un processo generatore di carico: `conns` connessioni in ping-pong."""
+    port, conns, messages = job
+
+    async def run():
+        pairs = await _open_conns(port, conns)
+        await asyncio.gather(*(_ping_pong(r, w, 1) for r, w in pairs))
+        t0 = time.perf_counter()
+        counts = await asyncio.gather(*(_ping_pong(r, w, messages) for r, w in pairs), return_exceptions=True)
+        elapsed = time.perf_counter() - t0
+        for _, w in pairs:
+            w.close()
+        return {"messages": sum(c for c in counts if isinstance(c, int)), "elapsed": elapsed}
+
+    return asyncio.run(run())
+
+def bench_workers(args) -> List[Dict[str, object]]:
+    """Eco su loopback con 1..N processi worker sulla stessa porta (SO_REUSEPORT).
+    Il carico arriva da --clients processi, così il generatore non è il collo di bottiglia."""
+    rows = []
+    for engine in args.engines:
+        for workers in args.workers:
+            port = free_port()
+            ready = multiprocessing.Event()
+            proc = multiprocessing.Process(target=_pool_main, args=(engine, port, workers, ready), daemon=True)
+            proc.start()
+            try:
+                if not ready.wait(10.0):
+                    raise RuntimeError(f"WorkerPool {engine} non avviato")
+                with multiprocessing.Pool(args.clients) as gen:
+                    parts = gen.map(_echo_client, [(port, args.conns // args.clients, args.messages)] * args.clients)
+            finally:
+                proc.terminate()
+                proc.join()
+            total = sum(pt["messages"] for pt in parts)
+            elapsed = max(pt["elapsed"] for pt in parts)
+            row = {
+                "engine": engine,
+                "workers": workers,
+                "conns": args.conns,
+                "messages": total,
+                "msgs_per_s": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+            }
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+class _NullSock:
+    def close(self) -> None:
+        pass
+
+def _per_op_us(fn, ops: int) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return round((time.perf_counter() - t0) / ops * 1e6, 3)
+
+def bench_registry(args) -> List[Dict[str, float]]:
+    """find_by_addr / find_idle / touch su registry popolati, contro la scansione lineare."""
+    rows = []
+    for n in args.sizes:
+        reg = p2p.ConnectionRegistry()
+        cids = [reg.add(_NullSock(), ("10.0.0.1", 20000 + i), incoming=False) for i in range(n)]
+        probes = [("10.0.0.1", 20000 + (i * 7919) % n) for i in range(args.lookups)]
+        # un 1% di connessioni "vecchie" -> saranno le uniche idle
+        old = time.time() - 1000
+        with reg._lock:
+            for cid in cids[-max(1, n // 100):]:
+                sock, addr, inc, _ = reg._conns[cid]
+                reg._conns[cid] = (sock, addr, inc, old)
+                heapq.heappush(reg._idle_heap, (old, cid))
+
+        def scan_lookup():
+            for a in probes:
+                for cid, (_, addr, _, _) in reg.items():
+                    if addr == a:
+                        break
+
+        row = {
+            "connections": n,
+            "find_by_addr_us": _per_op_us(lambda: [reg.find_by_addr(a) for a in probes], len(probes)),
+            "linear_scan_us": _per_op_us(scan_lookup, len(probes)) if args.with_linear else -1,
+            "touch_us": _per_op_us(lambda: [reg.touch(c) for c in cids[: args.lookups]], min(n, args.lookups)),
+            "find_idle_ms": round(_per_op_us(lambda: reg.find_idle(500), 1) / 1000, 3),
+            "idle_found": len(reg.find_idle(500)),
+        }
+        rows.append(row)
+        print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+def bench_contention(args) -> List[Dict[str, float]]:
+    """T thread che martellano touch/push_msg/pop_msg ognuno sulla propria connessione."""
+    rows = []
+    for name in args.registries:
+        for threads in args.threads:
+            reg = p2p.make_registry(name)
+            cids = [reg.add(_NullSock(), ("10.0.0.2", 30000 + i), incoming=True) for i in range(threads)]
+            start = threading.Barrier(threads + 1)
+
+            def worker(cid):
+                start.wait()
+                for _ in range(args.ops):
+                    reg.touch(cid)
+                    reg.push_msg(cid, "x")
+                    reg.pop_msg(cid, timeout=0)
+
+            pool = [threading.Thread(target=worker, args=(c,)) for c in cids]
+            for t in pool:
+                t.start()
+            start.wait()
+            t0 = time.perf_counter()
+            for t in pool:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            row = {
+                "registry": name,
+                "threads": threads,
+                "ops_per_s": round(3 * args.ops * threads / elapsed, 1),
+            }
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+def _read_frames(sock: socket.socket, count: int, out: list, idle: float = 2.0) -> None:
+    """Legge fino a `count` frame (o finché il flusso resta fermo per `idle` secondi)."""
+    reader = p2p.FrameReader()
+    sock.settimeout(idle)
+    got = 0
+    last = time.perf_counter()
+    while got < count:
+        try:
+            if not reader.recv_from(sock):
+                break
+        except socket.timeout:
+            break
+        got += sum(1 for _ in reader.frames())
+        last = time.perf_counter()
+    out.append((got, last))
+
+def bench_fanout(args) -> List[Dict[str, object]]:
+    """broadcast verso N lettori veloci + 1 peer che non legge mai: quanto soffrono i veloci?"""
+    sys.stderr = open(os.devnull, "w")
+    rows = []
+    payload = "x" * args.size
+    for engine in args.engines:
+        for policy in args.policies:
+            port = free_port()
+            peer = p2p.ENGINES[engine](
+                BENCH_HOST, port, send_queue_size=args.queue, slow_policy=policy, send_block_timeout=args.block_timeout
+            )
+            peer.start_server()
+            slow = socket.create_connection((BENCH_HOST, port))
+            slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            fast = [socket.create_connection((BENCH_HOST, port)) for _ in range(args.readers)]
+            while len(peer.list_peers()) < args.readers + 1:
+                time.sleep(0.01)
+            done: list = []
+            readers = [threading.Thread(target=_read_frames, args=(s, args.frames, done)) for s in fast]
+            for t in readers:
+                t.start()
+            t0 = time.perf_counter()
+            for _ in range(args.frames):
+                peer.broadcast(payload)
+            t_bcast = time.perf_counter() - t0
+            for t in readers:
+                t.join(30)
+            stats = peer.send_queue_stats()
+            slow_stats = max(stats, key=lambda st: st["dropped"]) if stats else {}
+            row = {
+                "engine": engine,
+                "policy": policy,
+                "broadcast_s": round(t_bcast, 3),
+                "fast_delivered": min((g for g, _ in done), default=0),
+                "fast_done_s": round(max((ts for _, ts in done), default=t0) - t0, 3),
+                "max_depth": max((st["high_water"] for st in stats), default=0),
+                "slow_dropped": slow_stats.get("dropped", 0),
+                "connections_left": len(peer.list_peers()),
+            }
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()), file=sys.stdout)
+            for sk in fast + [slow]:
+                sk.close()
+            peer.stop_server()
+    return rows
+
+def bench_pipeline(args) -> List[Dict[str, object]]:
+    """Richieste correlate in volo sulla stessa connessione: throughput al crescere della profondità."""
+    sys.stderr = open(os.devnull, "w")
+    rows = []
+    for engine in args.engines:
+        port = free_port()
+        proc = spawn_node(engine, port)
+        # il client non ascolta: porta 0 = sempre "minore", la regola anti-duplicato lo lascia chiamare
+        client = p2p.ENGINES[engine](BENCH_HOST, 0)
+        try:
+            cid = client.connect(BENCH_HOST, port)
+            for depth in args.depths:
+                inflight = []
+                done = 0
+                t0 = time.perf_counter()
+                for i in range(args.requests):
+                    inflight.append(client.send_request(cid, f"req {i}")[1])
+                    if len(inflight) >= depth:
+                        inflight.pop(0).result(timeout=10)
+                        done += 1
+                for fut in inflight:
+                    fut.result(timeout=10)
+                    done += 1
+                elapsed = time.perf_counter() - t0
+                row = {"engine": engine, "depth": depth, "requests": done, "req_per_s": round(done / elapsed, 1)}
+                rows.append(row)
+                print(" ".join(f"{k}={v}" for k, v in row.items()))
+        finally:
+            client.stop_server()
+            proc.terminate()
+            proc.join()
+    return rows
+
+def bench_backpressure(args) -> List[Dict[str, object]]:
+    """Un mittente che inonda un nodo che non legge mai: con l'inbox limitata il nodo
+    smette di leggere, il mittente resta bloccato in send e la RSS del nodo non cresce."""
+    rows = []
+    chunk = p2p.encode_frame(p2p.MSG_BINARY, b"x" * args.size)
+    for engine in args.engines:
+        for limit in args.inbox_kb:
+            port = free_port()
+            proc = spawn_node(engine, port, inbox_bytes=limit * 1024)
+            try:
+                rss0 = proc_status(proc.pid)["rss_kb"]
+                s = socket.create_connection((BENCH_HOST, port))
+                s.settimeout(0.2)
+                sent = 0
+                deadline = time.monotonic() + args.seconds
+                while time.monotonic() < deadline:
+                    try:
+                        sent += s.send(chunk)
+                    except socket.timeout:
+                        pass   # buffer del kernel pieni: il nodo ha smesso di leggere
+                status = proc_status(proc.pid)
+                s.close()
+            finally:
+                proc.terminate()
+                proc.join()
+            row = {
+                "engine": engine,
+                "inbox_kb": limit,
+                "sent_mb": round(sent / 2**20, 1),
+                "rss_growth_kb": status["rss_kb"] - rss0,
+            }
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+def bench_logging(args) -> List[Dict[str, object]]:
+    """Costo per chiamata di server_log nel thread chiamante, per ogni backend di log
+    (p2p.LOG_BACKENDS), con T thread che loggano insieme."""
+    sys.stderr = open(os.devnull, "w")
+    addr, cid, message = ("10.0.0.3", 8000), 7, "x" * 64
+    log = lambda: p2p.server_log("[%s] Ricevuto da %s (id=%s): %s", "bench", addr, cid, message)
+    filtered = lambda: p2p.server_log("[%s] Ricevuto da %s (id=%s): %s", "bench", addr, cid, message, level=p2p.LOG_DEBUG)
+    variants = [(backend, backend, log) for backend in args.backends] + [("async-filtered", "async", filtered)]
+    rows = []
+    for name, backend, fn in variants:
+        p2p.set_log_backend(backend)
+        for threads in args.threads:
+            start = threading.Barrier(threads + 1)
+
+            def worker():
+                start.wait()
+                for _ in range(args.calls):
+                    fn()
+
+            pool = [threading.Thread(target=worker) for _ in range(threads)]
+            for t in pool:
+                t.start()
+            before = p2p.log_stats()
+            start.wait()
+            t0 = time.perf_counter()
+            for t in pool:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            after = p2p.log_stats()
+            row = {
+                "variant": name,
+                "threads": threads,
+                "us_per_call": round(elapsed / (args.calls * threads) * 1e6, 3),
+                "dropped": after["dropped"] - before["dropped"],
+            }
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()), file=sys.stdout)
+            p2p.flush_server_logs()
+    return rows
+
+# ---------------- Gossip simulation -------------------------------------------
+def _gossip_node(engine: str, port: int, fanout: int, conn) -> None:
+    """Processo figlio della simulazione: un Peer in modalità gossip pilotato via Pipe."""
+    sys.stderr = open(os.devnull, "w")
+    peer = p2p.ENGINES[engine](BENCH_HOST, port, broadcast_mode="gossip", gossip_fanout=fanout)
+    received = []
+    peer.on_gossip = lambda msg_id, hops, text: received.append((msg_id, hops, time.time()))
+    peer.start_server()
+    conn.send("ready")
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == "dial":
+            ok = 0
+            for pr in arg:
+                try:
+                    peer.connect(BENCH_HOST, pr)
+                    ok += 1
+                except Exception:
+                    pass
+            conn.send(ok)
+        elif cmd == "gossip":
+            conn.send(peer.gossip(arg))
+        elif cmd == "report":
+            conn.send({"received": received[:], "stats": dict(peer.gossip_stats), "conns": len(peer.registry)})
+        elif cmd == "stop":
+            break
+    peer.stop_server()
+
+def _overlay(n: int, degree: int, rng) -> List[List[int]]:
+    """Anello (connesso) + archi casuali fino a ~degree vicini per nodo.
+    Ritorna per ogni nodo gli indici da chiamare: sempre verso indice maggiore,
+    così rispetta la regola anti-duplicato di Peer (porte crescenti)."""
+    edges = {(min(i, (i + 1) % n), max(i, (i + 1) % n)) for i in range(n)}
+    target = n * degree // 2
+    while len(edges) < target:
+        a, b = rng.sample(range(n), 2)
+        edges.add((min(a, b), max(a, b)))
+    dials: List[List[int]] = [[] for _ in range(n)]
+    for a, b in edges:
+        dials[a].append(b)
+    return dials
+
+def bench_gossip(args) -> List[Dict[str, object]]:
+    import random
+
+    rng = random.Random(args.seed)
+    ports = sorted(free_port() for _ in range(args.nodes))
+    nodes = []
+    for port in ports:
+        parent, child = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=_gossip_node, args=(args.engine, port, args.fanout, child), daemon=True)
+        proc.start()
+        nodes.append((proc, parent))
+    rows = []
+    try:
+        for _, conn in nodes:
+            conn.recv()
+        for (_, conn), targets in zip(nodes, _overlay(args.nodes, args.degree, rng)):
+            conn.send(("dial", [ports[t] for t in targets]))
+        for _, conn in nodes:
+            conn.recv()
+        time.sleep(0.5)
+
+        prev_dups = 0
+        for r in range(args.rounds):
+            origin = rng.randrange(args.nodes)
+            t0 = time.time()
+            nodes[origin][1].send(("gossip", f"round {r}"))
+            msg_id = nodes[origin][1].recv()
+            time.sleep(args.settle)
+
+            latencies, hops, dups, conns = [], [], 0, []
+            for i, (_, conn) in enumerate(nodes):
+                conn.send(("report", None))
+                rep = conn.recv()
+                conns.append(rep["conns"])
+                dups += rep["stats"]["duplicates"]
+                for mid, h, ts in rep["received"]:
+                    if mid == msg_id:
+                        latencies.append(ts - t0)
+                        hops.append(h)
+            latencies.sort()
+            delivered = len(latencies)
+            row = {
+                "nodes": args.nodes,
+                "fanout": args.fanout,
+                "avg_conns": round(sum(conns) / len(conns), 1),
+                "coverage": round(delivered / (args.nodes - 1), 3),
+                "max_hops": max(hops, default=0),
+                "p50_ms": round(latencies[delivered // 2] * 1000, 2) if latencies else -1,
+                "max_ms": round(latencies[-1] * 1000, 2) if latencies else -1,
+                # i contatori dei nodi sono cumulativi: il round conta la differenza
+                "dup_per_delivery": round((dups - prev_dups) / max(1, delivered), 2),
+            }
+            prev_dups = dups
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    finally:
+        for proc, conn in nodes:
+            try:
+                conn.send(("stop", None))
+            except Exception:
+                pass
+        for proc, _ in nodes:
+            proc.join(5)
+            if proc.is_alive():
+                proc.terminate()
+    return rows
+
+# ---------------- DHT routing simulation --------------------------------------
+def _dht_host(engine: str, ports: List[int], k: int, join_threads: int, conn) -> None:
+    """Processo figlio della simulazione DHT: ospita più Peer (uno per porta) pilotati via Pipe.
+    Ogni messaggio instradato porta il suo time.time() di invio: i processi girano sulla stessa macchina."""
+    import concurrent.futures
+    import random
+
+    sys.stderr = open(os.devnull, "w")
+    peers = {port: p2p.ENGINES[engine](BENCH_HOST, port, dht_k=k) for port in ports}
+    received = []
+    for peer in peers.values():
+        peer.on_route = lambda origin, hops, text: received.append((hops, time.time() - float(text)))
+        peer.start_server()
+    conn.send([peers[p].node_id for p in ports])
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == "dial":
+            ok = 0
+            for port, target in arg:
+                try:
+                    peers[port].connect(BENCH_HOST, target)
+                    ok += 1
+                except Exception:
+                    pass
+            conn.send(ok)
+        elif cmd == "join":
+            with concurrent.futures.ThreadPoolExecutor(join_threads) as pool:
+                list(pool.map(lambda peer: peer.dht_join(), peers.values()))
+            conn.send(None)
+        elif cmd == "send":
+            count, ids, gap, seed = arg
+            rng = random.Random(seed)
+            local = list(peers.values())
+            failed = 0
+            for _ in range(count):
+                src = rng.choice(local)
+                dest = rng.choice(ids)
+                while dest == src.node_id:
+                    dest = rng.choice(ids)
+                try:
+                    src.send_to_node(dest, repr(time.time()))
+                except (ConnectionError, KeyError):
+                    failed += 1
+                time.sleep(gap)
+            conn.send(failed)
+        elif cmd == "report":
+            totals: Dict[str, int] = {}
+            for peer in peers.values():
+                for key, v in peer.dht_stats.items():
+                    totals[key] = totals.get(key, 0) + v
+            conn.send({
+                "received": received[:],
+                "conns": [len(peer.registry) for peer in peers.values()],
+                "contacts": [len(peer.routes) for peer in peers.values()],
+                "stats": totals,
+            })
+            received.clear()
+        elif cmd == "stop":
+            break
+    for peer in peers.values():
+        peer.stop_server()
+
+def bench_dht(args) -> List[Dict[str, object]]:
+    """Overlay DHT su loopback: N nodi distribuiti su P processi, bootstrap ad anello +
+    un arco casuale per nodo, dht_join() su tutti (due passate), poi messaggi
+    send_to_node() tra coppie casuali: hop, latenza e consegna rispetto a log2(N)."""
+    import math
+    import random
+
+    rng = random.Random(args.seed)
+    ports_set = set()
+    while len(ports_set) < args.nodes:   # con 1000 porte free_port() può ripetersi
+        ports_set.add(free_port())
+    ports = sorted(ports_set)
+    procs = max(1, min(args.procs, args.nodes))
+    groups = [ports[i::procs] for i in range(procs)]
+    owner = {port: g for g, group in enumerate(groups) for port in group}
+    hosts = []
+    for group in groups:
+        parent, child = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=_dht_host, args=(args.engine, group, args.k, args.join_threads, child), daemon=True)
+        proc.start()
+        hosts.append((proc, parent))
+
+    def everyone(cmd, arg=None, per_host=None):
+        for g, (_, conn) in enumerate(hosts):
+            conn.send((cmd, per_host[g] if per_host is not None else arg))
+        return [conn.recv() for _, conn in hosts]
+
+    rows = []
+    try:
+        ids = [nid for _, conn in hosts for nid in conn.recv()]
+        # anello + un arco casuale per nodo, sempre dalla porta minore (regola anti-duplicato)
+        dials: List[List] = [[] for _ in groups]
+        for i, port in enumerate(ports[:-1]):
+            dials[owner[port]].append((port, ports[i + 1]))
+            j = rng.randrange(i + 1, len(ports))
+            if j != i + 1:
+                dials[owner[port]].append((port, ports[j]))
+        t0 = time.perf_counter()
+        everyone("dial", per_host=dials)
+        t_boot = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for _ in range(args.join_passes):
+            everyone("join")
+        t_join = time.perf_counter() - t0
+        time.sleep(0.5)
+        everyone("report")   # azzera le consegne della fase di join
+
+        per_host = max(1, args.messages // procs)
+        failed = sum(everyone("send", per_host=[(per_host, ids, args.gap, args.seed + g) for g in range(procs)]))
+        time.sleep(args.settle)
+        reports = everyone("report")
+        samples = sorted((h, lat) for r in reports for h, lat in r["received"])
+        hops = sorted(h for h, _ in samples)
+        lat = sorted(l for _, l in samples)
+        conns = [c for r in reports for c in r["conns"]]
+        contacts = [c for r in reports for c in r["contacts"]]
+        stats: Dict[str, int] = {}
+        for r in reports:
+            for key, v in r["stats"].items():
+                stats[key] = stats.get(key, 0) + v
+        sent = per_host * procs
+        row = {
+            "nodes": args.nodes,
+            "procs": procs,
+            "k": args.k,
+            "log2_n": round(math.log2(args.nodes), 2),
+            "bootstrap_s": round(t_boot, 2),
+            "join_s": round(t_join, 2),
+            "avg_conns": round(sum(conns) / len(conns), 1),
+            "avg_contacts": round(sum(contacts) / len(contacts), 1),
+            "sent": sent,
+            "delivery": round(len(samples) / sent, 4),
+            "no_route": failed + stats.get("unroutable", 0),
+            "hops_mean": round(sum(hops) / len(hops), 2) if hops else -1,
+            "hops_p50": hops[len(hops) // 2] if hops else -1,
+            "hops_p99": hops[min(len(hops) - 1, int(len(hops) * 0.99))] if hops else -1,
+            "hops_max": hops[-1] if hops else -1,
+            "lat_p50_ms": round(lat[len(lat) // 2] * 1000, 2) if lat else -1,
+            "lat_p99_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000, 2) if lat else -1,
+        }
+        rows.append(row)
+        print(" ".join(f"{k}={v}" for k, v in row.items()))
+    finally:
+        for _, conn in hosts:
+            try:
+                conn.send(("stop", None))
+            except Exception:
+                pass
+        for proc, _ in hosts:
+            proc.join(10)
+            if proc.is_alive():
+                proc.terminate()
+    return rows
+
+# ---------------- Discovery simulation ----------------------------------------
+class _SimClock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self) -> float:
+        return self.t
+
+def _simulate_discovery(fmt: str, args) -> Dict[str, object]:
+    """Simulazione a eventi discreti di `args.nodes` nodi con p2p.DiscoveryState
+    (stessa logica dei due engine): nessun socket, il multicast consegna ogni
+    pacchetto a tutti gli altri nodi (con perdita `args.loss`), un connect
+    riuscito è istantaneo. Un nodo è "convergente" quando è connesso a tutti."""
+    import random
+
+    rng = random.Random(args.seed)
+    clock = _SimClock()
+    addrs = [(f"10.0.{i // 250}.{i % 250 + 1}", 8000) for i in range(args.nodes)]
+    adj: Dict[tuple, set] = {a: set() for a in addrs}
+    nodes: Dict[tuple, p2p.DiscoveryState] = {}
+    events = [(rng.uniform(0, args.join_window), i, "join", a) for i, a in enumerate(addrs)]
+    heapq.heapify(events)
+    seq = len(events)
+    packets = packet_bytes = 0
+    converged_at = None
+    at_convergence: Dict[str, int] = {}
+
+    def totals() -> Dict[str, int]:
+        out = {"packets": packets, "bytes": packet_bytes}
+        for key in ("received", "slow_path"):
+            out[key] = sum(n.stats[key] for n in nodes.values())
+        return out
+
+    while events and events[0][0] <= args.duration:
+        t, _, kind, a = heapq.heappop(events)
+        clock.t = t
+        if kind == "join":
+            nodes[a] = p2p.DiscoveryState(
+                a,
+                peer_addrs=lambda a=a: sorted(adj[a]),
+                is_connected=lambda x, a=a: x in adj[a],
+                can_dial=lambda x, a=a: a < x,   # regola anti-duplicato di Peer._should_initiate
+                imin=args.imin,
+                imax=args.imax,
+                fmt=fmt,
+                clock=clock,
+                rng=random.Random(rng.random()),
+            )
+        else:
+            node = nodes[a]
+            pkt = node.poll()
+            if pkt is not None:
+                packets += 1
+                packet_bytes += len(pkt)
+                for b, other in list(nodes.items()):
+                    if b == a or rng.random() < args.loss:
+                        continue
+                    for x in other.on_packet(pkt):
+                        if x in nodes:
+                            adj[b].add(x)
+                            adj[x].add(b)
+                            other.dial_ok(x)
+                        else:
+                            other.dial_failed(x)
+        seq += 1
+        heapq.heappush(events, (t + max(nodes[a].next_wakeup(), 1e-3), seq, "wake", a))
+        if converged_at is None and len(nodes) == args.nodes and all(len(v) == args.nodes - 1 for v in adj.values()):
+            converged_at = t
+            at_convergence = totals()
+
+    end = totals()
+    steady_s = args.duration - converged_at if converged_at is not None else 0.0
+    n = args.nodes
+    row = {
+        "announce": fmt,
+        "nodes": n,
+        "converged_s": round(converged_at, 2) if converged_at is not None else -1,
+        "pkts_per_node_to_converge": round(at_convergence.get("packets", packets) / n, 2),
+        "steady_pkts_per_node_min": round((end["packets"] - at_convergence.get("packets", 0)) / n / steady_s * 60, 2) if steady_s else -1,
+        "steady_rx_per_node_min": round((end["received"] - at_convergence.get("received", 0)) / n / steady_s * 60, 1) if steady_s else -1,
+        "lookups_per_rx": round(end["slow_path"] / max(1, end["received"]), 3),
+        "avg_pkt_bytes": round(packet_bytes / max(1, packets), 1),
+    }
+    return row
+
+def bench_discovery(args) -> List[Dict[str, object]]:
+    rows = []
+    for fmt in args.formats:
+        row = _simulate_discovery(fmt, args)
+        rows.append(row)
+        print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+# ---------------- Bootstrap ---------------------------------------------------
+# i nodi bootstrap stanno su 127.0.0.2: sempre "maggiori" di 127.0.0.1, così la
+# regola anti-duplicato lascia al nodo sotto test il compito di connettersi
+BOOTSTRAP_HOST = "127.0.0.2"
+
+def _tarpit() -> List[socket.socket]:
+    """Indirizzo "morto": listen con backlog pieno, i connect successivi non
+    ricevono né SYN-ACK né RST e scadono solo per timeout (come un host spento)."""
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind((BOOTSTRAP_HOST, 0))
+    srv.listen(0)
+    fillers = []
+    for _ in range(2):
+        c = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        c.setblocking(False)
+        c.connect_ex(srv.getsockname())
+        fillers.append(c)
+    time.sleep(0.05)
+    return [srv] + fillers
+
+def _time_to_first_peer(peer, limit: float) -> float:
+    t0 = time.perf_counter()
+    if isinstance(peer, p2p.AsyncPeer):
+        peer._loop.call_soon_threadsafe(lambda: peer._spawn(peer._bootstrap()))
+    else:
+        threading.Thread(target=peer._bootstrap_connect, daemon=True).start()
+    while time.perf_counter() - t0 < limit:
+        if peer.list_peers():
+            return time.perf_counter() - t0
+        time.sleep(0.001)
+    return -1.0
+
+def bench_bootstrap(args) -> List[Dict[str, object]]:
+    pits = [_tarpit() for _ in range(args.dead)]
+    dead = [s[0].getsockname() for s in pits]
+    live_port = free_port()
+    live = spawn_node("thread", live_port, host=BOOTSTRAP_HOST)
+    rows = []
+    try:
+        for engine in args.engines:
+            for inflight in args.inflight:
+                peer = p2p.ENGINES[engine](
+                    BENCH_HOST, free_port(),
+                    bootstrap=dead + [(BOOTSTRAP_HOST, live_port)],
+                    bootstrap_inflight=inflight,
+                )
+                peer.start_server()
+                try:
+                    ttfp = _time_to_first_peer(peer, args.limit)
+                finally:
+                    peer.stop_server()
+                row = {"engine": engine, "dead": args.dead, "inflight": inflight, "first_peer_s": round(ttfp, 3)}
+                rows.append(row)
+                print(" ".join(f"{k}={v}" for k, v in row.items()))
+            # DialPool: connect concorrenti allo stesso indirizzo -> un solo socket
+            peer = p2p.ENGINES[engine](BENCH_HOST, free_port())
+            peer.start_server()
+            try:
+                threads = [threading.Thread(target=peer.connect, args=(BOOTSTRAP_HOST, live_port)) for _ in range(args.racers)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                row = {"engine": engine, "racers": args.racers, "conns": len(peer.list_peers()), **peer._dial_pool.stats}
+            finally:
+                peer.stop_server()
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    finally:
+        live.terminate()
+        for group in pits:
+            for s in group:
+                s.close()
+    return rows
+
+# ---------------- Peer cache (warm restart) -----------------------------------
+def _mesh_node(engine: str, port: int, opts: Dict[str, object], ready) -> None:
+    """Nodo della mesh già attiva: server + discovery multicast, su BOOTSTRAP_HOST."""
+    sys.stderr = open(os.devnull, "w")
+    peer = p2p.ENGINES[engine](BOOTSTRAP_HOST, port, **opts)
+    peer.start_server()
+    peer.start_discovery()
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+def _time_to_mesh(peer, want: int, limit: float) -> float:
+    t0 = time.perf_counter()
+    peer.start_server()
+    peer.start_discovery()
+    try:
+        while time.perf_counter() - t0 < limit:
+            if len(peer.list_peers()) >= want:
+                return time.perf_counter() - t0
+            time.sleep(0.005)
+        return -1.0
+    finally:
+        peer.stop_discovery()
+        peer.stop_server()
+
+def bench_warm(args) -> List[Dict[str, object]]:
+    """Il nodo sotto test (127.0.0.1, quindi è lui a connettersi) viene riavviato
+    più volte contro una mesh di `args.mesh` nodi: a freddo conosce solo il
+    multicast, a caldo anche la cache scritta dall'avvio precedente."""
+    rows = []
+    for engine in args.engines:
+        opts = {"mcast_group": args.mcast_group, "mcast_port": free_port()}
+        ready = []
+        procs = []
+        for _ in range(args.mesh):
+            ev = multiprocessing.Event()
+            proc = multiprocessing.Process(target=_mesh_node, args=(engine, free_port(), opts, ev), daemon=True)
+            proc.start()
+            procs.append(proc)
+            ready.append(ev)
+        cache_dir = tempfile.mkdtemp(prefix="p2p-bench-")
+        try:
+            for ev in ready:
+                if not ev.wait(10.0):
+                    raise RuntimeError("nodo della mesh non avviato")
+            time.sleep(args.settle)   # la mesh rallenta gli announce (trickle) prima del riavvio
+            for mode in ("cold", "warm"):
+                times = []
+                for i in range(args.restarts):
+                    cache = os.path.join(cache_dir, "peers") if mode == "warm" else None
+                    if mode == "warm" and i == 0:
+                        # primo avvio: riempie la cache, non misurato
+                        _time_to_mesh(p2p.ENGINES[engine](BENCH_HOST, free_port(), peer_cache=cache, **opts), args.mesh, args.limit)
+                    peer = p2p.ENGINES[engine](BENCH_HOST, free_port(), peer_cache=cache, **opts)
+                    times.append(_time_to_mesh(peer, args.mesh, args.limit))
+                ok = sorted(t for t in times if t >= 0)
+                row = {
+                    "engine": engine,
+                    "mode": mode,
+                    "mesh": args.mesh,
+                    "restarts": args.restarts,
+                    "timeouts": len(times) - len(ok),
+                    "median_s": round(ok[len(ok) // 2], 3) if ok else -1,
+                    "max_s": round(ok[-1], 3) if ok else -1,
+                }
+                rows.append(row)
+                print(" ".join(f"{k}={v}" for k, v in row.items()))
+        finally:
+            for proc in procs:
+                proc.terminate()
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return rows
+
+# ---------------- TLS ---------------------------------------------------------
+TLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SSL", "2.SSL", "server_client_cert_gen")
+TLS_MODES = ("plain", "full", "resume")
+
+def bench_tls(args) -> List[Dict[str, object]]:
+    """Riconnessioni in serie (connect, una send_and_wait, disconnect) verso un
+    nodo in un processo figlio: misura le connessioni/handshake al secondo."""
+    rows = []
+    for engine in args.engines:
+        for mode in args.modes:
+            def tls():
+                return p2p.PeerTLS.from_dir(args.tls_dir, resume=(mode == "resume")) if mode != "plain" else None
+
+            port = free_port()
+            node = spawn_node(engine, port, host=BOOTSTRAP_HOST, tls=tls())
+            client_tls = tls()
+            peer = p2p.ENGINES[engine](BENCH_HOST, free_port(), tls=client_tls)
+            peer.start_server()
+            done = 0
+            try:
+                t0 = time.perf_counter()
+                while time.perf_counter() - t0 < args.duration:
+                    cid = peer.connect(BOOTSTRAP_HOST, port)
+                    peer.send_and_wait(cid, "ping", timeout=5.0)
+                    peer.disconnect(cid)
+                    done += 1
+                elapsed = time.perf_counter() - t0
+            finally:
+                peer.stop_server()
+                node.terminate()
+            stats = client_tls.stats if client_tls is not None else {"handshakes": 0, "resumed": 0}
+            row = {
+                "engine": engine,
+                "mode": mode,
+                "conns": done,
+                "conns_per_s": round(done / elapsed, 1),
+                "ms_per_conn": round(elapsed / max(1, done) * 1000, 3),
+                **stats,
+            }
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+# ---------------- Compression -------------------------------------------------
+def _log_payload(size: int, seed: int = 1) -> str:
+    """Testo simile a log/JSON applicativi (comprimibile come un payload reale)."""
+    import random
+
+    rng = random.Random(seed)
+    users = [f"user{i:03d}" for i in range(50)]
+    actions = ("login", "logout", "upload", "download", "ping", "sync")
+    out = []
+    n = 0
+    while n < size:
+        line = (f'{{"ts": {1700000000 + n}, "level": "INFO", "user": "{rng.choice(users)}", '
+                f'"action": "{rng.choice(actions)}", "bytes": {rng.randrange(1 << 20)}}}\n')
+        out.append(line)
+        n += len(line)
+    return "".join(out)[:size]
+
+def bench_compress(args) -> List[Dict[str, object]]:
+    rows = []
+    codecs = ["off"] + list(p2p.CODEC_NAMES)
+    for size in args.sizes:
+        kinds = {"text": p2p.encode_message(_log_payload(size)), "random": p2p.encode_message(os.urandom(size))}
+        for kind, frame in kinds.items():
+            for name in codecs:
+                comp = p2p.Compression([] if name == "off" else [name], min_bytes=args.min_bytes)
+                codec = p2p.CODEC_NAMES.get(name, 0)
+                reps = max(3, min(2000, args.budget // max(1, size)))
+                t0 = time.perf_counter()
+                for _ in range(reps):
+                    wire = comp.pack(frame, codec)
+                    comp.stats["cpu_s"] = 0.0
+                pack_us = (time.perf_counter() - t0) / reps * 1e6
+                unpack_us = 0.0
+                if wire is not frame:
+                    payload = memoryview(wire)[p2p.FRAME_HEADER.size:]
+                    t0 = time.perf_counter()
+                    for _ in range(reps):
+                        comp.unpack(payload)
+                    unpack_us = (time.perf_counter() - t0) / reps * 1e6
+                row = {
+                    "size": size,
+                    "data": kind,
+                    "codec": name,
+                    "wire_bytes": len(wire),
+                    "ratio": round(len(wire) / len(frame), 3),
+                    "pack_us": round(pack_us, 1),
+                    "unpack_us": round(unpack_us, 1),
+                    "pack_MBps": round(size / pack_us, 1) if wire is not frame else -1,
+                }
+                rows.append(row)
+                print(" ".join(f"{k}={v}" for k, v in row.items()))
+
+    # broadcast: una compressione per messaggio, non per peer
+    p2p.set_log_level("warning")
+    for engine in args.engines:
+        ports = sorted(free_port() for _ in range(args.peers + 1))
+        src = p2p.ENGINES[engine](BENCH_HOST, ports[0])
+        sinks = [p2p.ENGINES[engine](BENCH_HOST, port) for port in ports[1:]]
+        for node in [src] + sinks:
+            node.start_server()
+        try:
+            for port in ports[1:]:
+                src.connect(BENCH_HOST, port)
+            deadline = time.monotonic() + 10.0
+            while any(src.compression.codec(cid) == 0 for cid, *_ in src.list_peers()) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            payload = _log_payload(args.broadcast_size)
+            t0 = time.perf_counter()
+            for _ in range(args.messages):
+                src.broadcast(payload)
+            elapsed = time.perf_counter() - t0
+            st = src.compression.stats
+            row = {
+                "engine": engine,
+                "broadcast_size": args.broadcast_size,
+                "peers": args.peers,
+                "messages": args.messages,
+                "compressions": st["frames"],
+                "raw_bytes": st["raw_bytes"] * args.peers,
+                "wire_bytes": st["wire_bytes"] * args.peers,
+                "compress_ms": round(st["cpu_s"] * 1000, 1),
+                "msgs_per_s": round(args.messages / elapsed, 1),
+            }
+        finally:
+            for node in [src] + sinks:
+                node.stop_server()
+        rows.append(row)
+        print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+# ---------------- Typed messages ----------------------------------------------
+_BENCH_RECORD = p2p.register_schema(200, "bench_record", [
+    ("id", "u64"), ("ts", "f64"), ("port", "u16"), ("hops", "u8"), ("ok", "bool"),
+    ("user", "str"), ("action", "str"), ("note", "str"),
+])
+_BENCH_BULK = p2p.register_schema(201, "bench_bulk", [("id", "u64"), ("offset", "u64"), ("data", "bytes")])
+
+def _typed_samples(kind: str, rng, bulk: int) -> List[Dict[str, object]]:
+    """256 messaggi diversi per tipo; solo l'ultimo campo stringa contiene spazi
+    (così la baseline testo con split(" ") resta corretta)."""
+    words = ("login", "logout", "upload", "download", "sync")
+    out = []
+    for i in range(256):
+        if kind == "ping":
+            out.append({"seq": i, "sent": time.time()})
+        elif kind == "chat":
+            out.append({"text": " ".join(rng.choice(words) for _ in range(rng.randint(4, 12)))})
+        elif kind == "bench_record":
+            out.append({"id": rng.getrandbits(64), "ts": time.time(), "port": rng.randrange(1 << 16), "hops": i % 8,
+                        "ok": i % 2 == 0, "user": f"user{rng.randrange(1000):03d}", "action": rng.choice(words),
+                        "note": " ".join(rng.choice(words) for _ in range(6))})
+        else:
+            out.append({"id": i, "offset": i * bulk, "data": rng.randbytes(bulk)})
+    return out
+
+def _text_encode(schema, fields: Dict[str, object]) -> bytes:
+    """Baseline: i campi stringificati a mano, separati da spazi (come oggi con MSG_TEXT)."""
+    vals = []
+    for n, k in schema.fields:
+        v = fields[n]
+        vals.append(v.hex() if k == "bytes" else str(int(v)) if k == "bool" else str(v))
+    return " ".join(vals).encode("utf-8")
+
+_TEXT_PARSE = {"str": str, "bytes": bytes.fromhex, "f64": float, "bool": lambda v: v == "1"}
+
+def _text_decode(schema, body: bytes) -> Dict[str, object]:
+    parts = str(body, "utf-8").split(" ", len(schema.fields) - 1)
+    return {n: _TEXT_PARSE.get(k, int)(v) for (n, k), v in zip(schema.fields, parts)}
+
+def bench_serialize(args) -> List[Dict[str, object]]:
+    """Per tipo di messaggio e serializer: byte del corpo, µs per encode (build),
+    decode completo, lettura di un solo campo (lazy) e del solo header (nodo che inoltra)."""
+    import random
+
+    rng = random.Random(args.seed)
+    probe = {"ping": "seq", "chat": "text", "bench_record": "id", "bench_bulk": "id"}
+    rows = []
+    for kind in args.types:
+        schema = p2p.get_schema(kind)
+        samples = _typed_samples(kind, rng, args.bulk_kb * 1024)
+        n = args.messages
+        batch = [samples[i % len(samples)] for i in range(n)]
+        for ser in ["text"] + args.serializers:
+            if ser == "text":
+                bodies = [_text_encode(schema, f) for f in batch]
+                assert _text_decode(schema, bodies[0]) == batch[0]
+                idx = schema.names.index(probe[kind])
+                enc = lambda: [_text_encode(schema, f) for f in batch]
+                dec = lambda: [_text_decode(schema, b) for b in bodies]
+                one = lambda: [str(b, "utf-8").split(" ", idx + 1)[idx] for b in bodies]
+                head = None
+            else:
+                payloads = [p2p.TypedMessage.build(schema, f, ser).payload() for f in batch]
+                bodies = payloads
+                assert p2p.TypedMessage.parse(payloads[0]).fields() == batch[0]
+                enc = lambda: [p2p.TypedMessage.build(schema, f, ser).payload() for f in batch]
+                dec = lambda: [p2p.TypedMessage.parse(p).fields() for p in payloads]
+                one = lambda: [p2p.TypedMessage.parse(p)[probe[kind]] for p in payloads]
+                head = lambda: [p2p.TypedMessage.parse(p).schema for p in payloads]
+            row = {
+                "type": kind,
+                "serializer": ser,
+                "bytes": round(sum(len(b) for b in bodies) / n, 1),
+                "encode_us": min(_per_op_us(enc, n) for _ in range(args.runs)),
+                "decode_us": min(_per_op_us(dec, n) for _ in range(args.runs)),
+                "field_us": min(_per_op_us(one, n) for _ in range(args.runs)),
+                "header_us": min(_per_op_us(head, n) for _ in range(args.runs)) if head else -1,
+            }
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+# ---------------- Metrics overhead --------------------------------------------
+class _LockedCounters:
+    """Il contatore "ovvio": un dict condiviso protetto da un lock, come riferimento."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+
+    def inc(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+def bench_metrics(args) -> List[Dict[str, object]]:
+    """ns per chiamata con T thread che aggiornano insieme, poi costo di stats()."""
+    rows = []
+    variants = {
+        "locked-inc": lambda m: m.inc("msgs_in"),
+        "inc": lambda m: m.inc("msgs_in"),
+        "observe": lambda m: m.observe("send_and_wait", 0.00042),
+    }
+    for name, fn in variants.items():
+        for threads in args.threads:
+            metrics = _LockedCounters() if name.startswith("locked") else p2p.Metrics()
+            start = threading.Barrier(threads + 1)
+
+            def worker():
+                start.wait()
+                for _ in range(args.calls):
+                    fn(metrics)
+
+            pool = [threading.Thread(target=worker) for _ in range(threads)]
+            for t in pool:
+                t.start()
+            start.wait()
+            t0 = time.perf_counter()
+            for t in pool:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            row = {"variant": name, "threads": threads, "ns_per_call": round(elapsed / (args.calls * threads) * 1e9, 1)}
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+
+    # snapshot: una shard per thread ancora vivo (i thread terminati sono già accorpati)
+    for threads in args.threads:
+        metrics = p2p.Metrics()
+        done = threading.Event()
+        ready = threading.Barrier(threads + 1)
+
+        def holder():
+            metrics.inc("msgs_in")
+            metrics.observe("send_and_wait", 0.001)
+            ready.wait()
+            done.wait()
+
+        pool = [threading.Thread(target=holder) for _ in range(threads)]
+        for t in pool:
+            t.start()
+        ready.wait()
+        reps = 200
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            metrics.snapshot()
+        snap_us = (time.perf_counter() - t0) / reps * 1e6
+        done.set()
+        for t in pool:
+            t.join()
+        row = {"variant": "snapshot", "threads": threads, "us_per_call": round(snap_us, 1)}
+        rows.append(row)
+        print(" ".join(f"{k}={v}" for k, v in row.items()))
+
+    # stats() completo (+ testo Prometheus) di un nodo con N connessioni
+    p2p.set_log_level("warning")
+    for engine in args.engines:
+        ports = sorted(free_port() for _ in range(args.peers + 1))
+        nodes = [p2p.ENGINES[engine](BENCH_HOST, port) for port in ports]
+        for node in nodes:
+            node.start_server()
+        try:
+            for port in ports[1:]:
+                nodes[0].connect(BENCH_HOST, port)
+            reps = 100
+            t0 = time.perf_counter()
+            for _ in range(reps):
+                text = p2p.prometheus_text(nodes[0].stats())
+            row = {
+                "variant": "stats+prometheus",
+                "engine": engine,
+                "peers": args.peers,
+                "us_per_call": round((time.perf_counter() - t0) / reps * 1e6, 1),
+                "text_bytes": len(text),
+            }
+        finally:
+            for node in nodes:
+                node.stop_server()
+        rows.append(row)
+        print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+# ---------------- Control API -------------------------------------------------
+def bench_control(args) -> List[Dict[str, object]]:
+    """Messaggi/s pilotando un nodo dal socket di controllo, come farebbe uno script."""
+    p2p.set_log_level("warning")
+    rows = []
+    for engine in args.engines:
+        ports = sorted(free_port() for _ in range(2))
+        # policy block: la misura riguarda il socket di controllo, non gli scarti
+        src, dst = (p2p.ENGINES[engine](BENCH_HOST, port, slow_policy="block", inbox_bytes=0) for port in ports)
+        src.start_server()
+        dst.start_server()
+        path = os.path.join(tempfile.mkdtemp(prefix="p2p-bench-"), "ctl.sock")
+        ctl = p2p.ControlServer(src, path)
+        ctl.start()
+        client = p2p.ControlClient(path)
+        try:
+            cid = client.call("connect", ip=BENCH_HOST, port=ports[1])
+            msgs = [f"msg-{i}" for i in range(args.messages)]
+            nreq = min(args.messages, args.requests)
+
+            def per_line_send():
+                for m in msgs:
+                    client.call("send", cid=cid, message=m)
+
+            def batch_send():
+                for i in range(0, len(msgs), args.batch):
+                    client.batch([{"op": "send", "cid": cid, "message": m} for m in msgs[i:i + args.batch]])
+
+            def send_many():
+                for i in range(0, len(msgs), args.batch):
+                    client.call("send_many", cid=cid, messages=msgs[i:i + args.batch])
+
+            def per_line_request():
+                for m in msgs[:nreq]:
+                    client.call("send_and_wait", cid=cid, message=m)
+
+            def request_many():
+                for i in range(0, nreq, args.batch):
+                    client.call("request_many", cid=cid, messages=msgs[i:i + args.batch])
+
+            variants = [
+                ("send/riga", per_line_send, len(msgs)),
+                ("send/batch", batch_send, len(msgs)),
+                ("send_many", send_many, len(msgs)),
+                ("send_and_wait/riga", per_line_request, nreq),
+                ("request_many", request_many, nreq),
+            ]
+            for name, fn, count in variants:
+                t0 = time.perf_counter()
+                fn()
+                elapsed = time.perf_counter() - t0
+                row = {"engine": engine, "variant": name, "messages": count, "msgs_per_s": round(count / elapsed, 1)}
+                rows.append(row)
+                print(" ".join(f"{k}={v}" for k, v in row.items()))
+        finally:
+            client.close()
+            ctl.stop()
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            src.stop_server()
+            dst.stop_server()
+    return rows
+
+# ---------------- Idle cost ---------------------------------------------------
+def proc_wakeups(pid: int) -> Dict[str, float]:
+    """Context switch (volontari + involontari) di tutti i thread e tempo CPU (s), da /proc."""
+    switches = 0
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        tasks = []
+    for tid in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/status") as f:
+                for line in f:
+                    if line.startswith(("voluntary_ctxt_switches:", "nonvoluntary_ctxt_switches:")):
+                        switches += int(line.split()[1])
+        except OSError:
+            pass   # thread terminato nel frattempo
+    cpu = 0.0
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        pass
+    return {"switches": switches, "cpu_s": cpu}
+
+def _idle_node(engine: str, port: int, mport: int, discovery: bool, ready) -> None:
+    sys.stderr = open(os.devnull, "w")
+    peer = p2p.ENGINES[engine](BENCH_HOST, port, mcast_port=mport, keepalive=p2p.KEEPALIVE_DEFAULT)
+    peer.start_server()
+    if discovery:
+        peer.start_discovery()
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+async def _idle_round(pid: int, port: int, conns: int, window: float) -> Dict[str, object]:
+    pairs = await _open_conns(port, conns, timeout=60.0)
+    alive = await asyncio.gather(*(_ping_pong(r, w, 1, timeout=30.0) for r, w in pairs), return_exceptions=True)
+    served = sum(1 for a in alive if a == 1)
+    await asyncio.sleep(1.0)   # lascia finire accept, log e thread di avvio
+    before = proc_wakeups(pid)
+    await asyncio.sleep(window)   # connessioni aperte e mute: il nodo dovrebbe dormire
+    after = proc_wakeups(pid)
+    status = proc_status(pid)
+    for _, w in pairs:
+        w.close()
+    return {
+        "conns": served,
+        "threads": status["threads"],
+        "rss_kb": status["rss_kb"],
+        "wakeups_s": round((after["switches"] - before["switches"]) / window, 1),
+        "cpu_ms_s": round((after["cpu_s"] - before["cpu_s"]) / window * 1000, 2),
+    }
+
+def bench_idle(args) -> List[Dict[str, object]]:
+    """Costo di N connessioni inattive: risvegli/s (context switch di tutti i thread)
+    e CPU del processo nodo, misurati a riposo dopo l'apertura delle connessioni."""
+    rows = []
+    for engine in args.engines:
+        for conns in args.conns:
+            port = free_port()
+            ready = multiprocessing.Event()
+            proc = multiprocessing.Process(
+                target=_idle_node, args=(engine, port, free_port(), not args.no_discovery, ready), daemon=True
+            )
+            proc.start()
+            try:
+                if not ready.wait(10.0):
+                    raise RuntimeError(f"Nodo {engine} non avviato su porta {port}")
+                row = {"engine": engine, "requested": conns, **asyncio.run(_idle_round(proc.pid, port, conns, args.window))}
+            finally:
+                proc.terminate()
+                proc.join()
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+# ---------------- File transfer -----------------------------------------------
+def _naive_receiver(srv: socket.socket, path: str) -> None:
+    """Baseline ingenua: lunghezza di 8 byte, tutto il file in memoria, poi un'unica write."""
+    while True:
+        c, _ = srv.accept()
+        with c:
+            head = b""
+            while len(head) < 8:
+                head += c.recv(8 - len(head))
+            size = int.from_bytes(head, "big")
+            data = bytearray()
+            while len(data) < size:
+                part = c.recv(1024 * 1024)
+                if not part:
+                    break
+                data += part
+            with open(path, "wb") as f:
+                f.write(data)
+            c.sendall(b"k")
+
+def _transfer_node(engine: str, port: int, raw_port: int, files_dir: str, ready) -> None:
+    """Nodo ricevente: Peer con --files-dir più il ricevitore ingenuo sulla porta raw_port."""
+    sys.stderr = open(os.devnull, "w")
+    peer = p2p.ENGINES[engine](BENCH_HOST, port, files_dir=files_dir)
+    peer.start_server()
+    srv = socket.create_server((BENCH_HOST, raw_port))
+    threading.Thread(target=_naive_receiver, args=(srv, os.path.join(files_dir, "naive.bin")), daemon=True).start()
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+def _transfer_sender(method: str, src: str, port: int, chunk: int, conn) -> None:
+    """Un invio in un processo pulito: tempo e picco di RSS del mittente."""
+    import resource
+
+    sys.stderr = open(os.devnull, "w")
+    t0 = time.perf_counter()
+    if method == "sendfile":
+        sender = p2p.ENGINES["thread"](BENCH_HOST, free_port())
+        sender.send_file(BENCH_HOST, port, src, chunk=chunk)
+    else:
+        with open(src, "rb") as f:
+            data = f.read()
+        with socket.create_connection((BENCH_HOST, port)) as s:
+            s.sendall(len(data).to_bytes(8, "big"))
+            s.sendall(data)
+            s.recv(1)
+    conn.send((time.perf_counter() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+def _ping_during(peer, cid: int, stop: threading.Event, out: List[float]) -> None:
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        if peer.send_and_wait(cid, "ping", timeout=5.0) is not None:
+            out.append(time.perf_counter() - t0)
+        time.sleep(0.005)
+
+def bench_transfer(args) -> List[Dict[str, object]]:
+    """File da --size-mb MB su loopback: send_file (sendfile + CRC per chunk + prealloc,
+    connessione dedicata) vs baseline read-all/sendall. MB/s, picco RSS del mittente
+    e del ricevitore, RTT di send_and_wait sulla connessione messaggi durante l'invio."""
+    p2p.set_log_level("warning")
+    rows = []
+    work = tempfile.mkdtemp(prefix="p2p-transfer-")
+    src = os.path.join(work, "src.bin")
+    with open(src, "wb") as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            f.write(block)
+    size = os.path.getsize(src)
+    try:
+        for engine, method in [(None, "naive")] + [(e, "sendfile") for e in args.engines]:
+            dest = os.path.join(work, "dest")
+            os.makedirs(dest, exist_ok=True)
+            port, raw_port = sorted((free_port(), free_port()))[::-1]
+            ready = multiprocessing.Event()
+            proc = multiprocessing.Process(target=_transfer_node, args=(engine or "thread", port, raw_port, dest, ready), daemon=True)
+            proc.start()
+            pinger = p2p.ENGINES["thread"](BENCH_HOST, 1024)   # porta bassa: è lui a poter aprire la connessione
+            try:
+                if not ready.wait(10.0):
+                    raise RuntimeError(f"Nodo ricevente non avviato su porta {port}")
+                cid = pinger.connect(BENCH_HOST, port)
+                idle_rtt: List[float] = []
+                stop = threading.Event()
+                threading.Timer(0.5, stop.set).start()
+                _ping_during(pinger, cid, stop, idle_rtt)
+                times, rss, rtt = [], [], []
+                for _ in range(args.runs):
+                    for name in os.listdir(dest):
+                        os.unlink(os.path.join(dest, name))
+                    parent, child = multiprocessing.Pipe()
+                    sender = multiprocessing.Process(
+                        target=_transfer_sender,
+                        args=(method, src, raw_port if method == "naive" else port, args.chunk_kb * 1024, child), daemon=True,
+                    )
+                    stop = threading.Event()
+                    pings = threading.Thread(target=_ping_during, args=(pinger, cid, stop, rtt), daemon=True)
+                    pings.start()
+                    sender.start()
+                    elapsed, maxrss = parent.recv()
+                    sender.join()
+                    stop.set()
+                    pings.join()
+                    times.append(elapsed)
+                    rss.append(maxrss)
+                idle_rtt.sort()
+                rtt.sort()
+                row = {
+                    "method": method,
+                    "engine": engine or "-",
+                    "size_mb": round(size / 1e6, 1),
+                    "best_mb_s": round(size / min(times) / 1e6, 1),
+                    "mean_mb_s": round(size / (sum(times) / len(times)) / 1e6, 1),
+                    "sender_rss_mb": round(max(rss) / 1024, 1),
+                    "receiver_hwm_mb": round(proc_status(proc.pid)["hwm_kb"] / 1024, 1),
+                    "ping_idle_p50_ms": round(_percentile(idle_rtt, 0.5) * 1000, 2),
+                    "ping_p50_ms": round(_percentile(rtt, 0.5) * 1000, 2),
+                    "ping_p99_ms": round(_percentile(rtt, 0.99) * 1000, 2),
+                }
+            finally:
+                pinger.stop_server()
+                proc.terminate()
+                proc.join()
+                shutil.rmtree(dest, ignore_errors=True)
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return rows
+
+# ---------------- Swarm download ----------------------------------------------
+def _swarm_seeder(engine: str, port: int, files_dir: str, rate: float, ready) -> None:
+    """Nodo sorgente: serve i file di files_dir con upload limitato a rate byte/s (link lento simulato)."""
+    sys.stderr = open(os.devnull, "w")
+    peer = p2p.ENGINES[engine](BENCH_HOST, port, files_dir=files_dir, serve_rate=rate)
+    peer.start_server()
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+def _seed_dir(path: str, src: str, partial: Optional[float], rng) -> None:
+    """Copia (hard link) di src in path: intera, o solo una frazione casuale dei chunk (.part + .part.swarm)."""
+    from p2p import swarm
+
+    os.makedirs(path)
+    name = os.path.basename(src)
+    if partial is None:
+        os.link(src, os.path.join(path, name))
+        return
+    size = os.path.getsize(src)
+    n = swarm.chunk_count(size, p2p.FILE_CHUNK)
+    bits = bytearray((n + 7) // 8)
+    for i in range(n):
+        if rng.random() < partial:
+            bits[i >> 3] |= 0x80 >> (i & 7)
+    os.link(src, os.path.join(path, name + ".part"))
+    with open(os.path.join(path, name + ".part.swarm"), "wb") as f:
+        f.write(swarm.SWARM_META.pack(size, p2p.FILE_CHUNK, swarm.file_digest(src)) + bits)
+
+def bench_swarm(args) -> List[Dict[str, object]]:
+    """Download di un file da --size-mb MB da 1..N sorgenti con upload limitato a --rate-mb MB/s
+    ciascuna (link loopback strozzati): MB/s aggregati, speedup su una sorgente, duplicati
+    dell'endgame, throughput per sorgente. --slow sorgenti vanno a 1/5 del rate,
+    --partial sorgenti hanno solo metà dei chunk (rarest-first)."""
+    import random
+
+    p2p.set_log_level("warning")
+    rng = random.Random(args.seed)
+    work = tempfile.mkdtemp(prefix="p2p-swarm-")
+    src = os.path.join(work, "image.bin")
+    with open(src, "wb") as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            f.write(block)
+    nseed = max(args.sources)
+    ports_set = set()
+    while len(ports_set) < nseed:
+        ports_set.add(free_port())
+    ports = sorted(ports_set)
+    procs = []
+    rows = []
+    try:
+        for i, port in enumerate(ports):
+            rate = args.rate_mb * 1e6 / (5 if i >= nseed - args.slow else 1)
+            partial = 0.5 if 0 < i <= args.partial else None   # la sorgente 0 ha sempre il file intero
+            _seed_dir(os.path.join(work, f"seed{i}"), src, partial, rng)
+            ready = multiprocessing.Event()
+            proc = multiprocessing.Process(target=_swarm_seeder, args=(args.engine, port, os.path.join(work, f"seed{i}"), rate, ready), daemon=True)
+            proc.start()
+            procs.append((proc, ready))
+        for proc, ready in procs:
+            if not ready.wait(10.0):
+                raise RuntimeError("Nodo sorgente non avviato")
+        dest = os.path.join(work, "fetch")
+        os.makedirs(dest)
+        fetcher = p2p.ENGINES["thread"](BENCH_HOST, free_port(), files_dir=dest)
+        base = None
+        for k in args.sources:
+            times = []
+            for _ in range(args.runs):
+                for name in os.listdir(dest):
+                    os.unlink(os.path.join(dest, name))
+                r = fetcher.fetch_blob("image.bin", sources=[(BENCH_HOST, p) for p in ports[:k]], pipeline=args.pipeline)
+                times.append(r["seconds"])
+            per_source = [v["mb_s"] for v in r["sources"].values()]
+            best = min(times)
+            if base is None:
+                base = best
+            row = {
+                "sources": k,
+                "rate_mb_s": args.rate_mb,
+                "size_mb": round(r["size"] / 1e6, 1),
+                "best_s": round(best, 2),
+                "mb_s": round(r["size"] / best / 1e6, 1),
+                "ideal_mb_s": round(sum(args.rate_mb / (5 if i >= nseed - args.slow else 1) for i in range(k)), 1),
+                "speedup": round(base / best, 2),
+                "duplicates": r["duplicates"],
+                "src_mb_s_min": min(per_source),
+                "src_mb_s_max": max(per_source),
+            }
+            rows.append(row)
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+    finally:
+        for proc, _ in procs:
+            proc.terminate()
+            proc.join()
+        shutil.rmtree(work, ignore_errors=True)
+    return rows
+
+# ---------------- Priority lanes ----------------------------------------------
+def _lanes_sink(engine: str, port: int, lanes: bool, rcvbuf: Optional[int], ready) -> None:
+    """Nodo ricevente: svuota di continuo le inbox, così non smette mai di leggere."""
+    sys.stderr = open(os.devnull, "w")
+    peer = p2p.ENGINES[engine](BENCH_HOST, port, priority_lanes=lanes, lane_rcvbuf=rcvbuf)
+    peer.start_server()
+    ready.set()
+    while True:
+        busy = False
+        for cid, *_ in peer.list_peers():
+            while peer.recv(cid, timeout=0) is not None:
+                busy = True
+        if not busy:
+            time.sleep(0.001)
+
+def _lanes_load(peer, cid: int, message: bytes, batch: int, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            peer.send_many(cid, [message] * batch)
+        except (KeyError, ConnectionError):
+            return
+
+def bench_lanes(args) -> List[Dict[str, object]]:
+    """Latenza di send_and_wait (ping) mentre la stessa connessione è saturata da
+    frame bulk o da un flood di messaggi piccoli: coda FIFO unica vs corsie con priorità."""
+    p2p.set_log_level("warning")
+    rows = []
+    # incomprimibili: si misura la coda, non zlib/zstd
+    loads = {"none": None, "bulk": os.urandom(args.bulk_kb * 1024), "flood": os.urandom(args.flood_bytes)}
+    rcvbuf = args.rcvbuf_kb * 1024 or None
+    for engine in args.engines:
+        for mode in args.modes:
+            lanes = mode == "lanes"
+            for load in args.loads:
+                port = free_port()
+                ready = multiprocessing.Event()
+                proc = multiprocessing.Process(target=_lanes_sink, args=(engine, port, lanes, rcvbuf, ready), daemon=True)
+                proc.start()
+                ready.wait(10.0)
+                # porta 0: il client non ascolta, la regola anti-duplicato lo lascia chiamare
+                client = p2p.ENGINES[engine](BENCH_HOST, 0, priority_lanes=lanes, lane_rcvbuf=rcvbuf,
+                                             slow_policy="block", send_queue_size=args.queue)
+                stop = threading.Event()
+                loaders = []
+                try:
+                    cid = client.connect(BENCH_HOST, port)
+                    client.send_and_wait(cid, "warmup", timeout=5)
+                    if loads[load] is not None:
+                        loaders = [threading.Thread(target=_lanes_load, args=(client, cid, loads[load], args.batch, stop), daemon=True)
+                                   for _ in range(args.senders)]
+                        for t in loaders:
+                            t.start()
+                        time.sleep(args.warmup)   # code e buffer pieni prima di misurare
+                    sent0 = client.send_queue_stats()[0]["sent_bytes"]
+                    rtts, lost = [], 0
+                    t_start = time.perf_counter()
+                    deadline = t_start + args.seconds
+                    while time.perf_counter() < deadline:
+                        t0 = time.perf_counter()
+                        if client.send_and_wait(cid, "ping", timeout=args.timeout) is None:
+                            lost += 1
+                        else:
+                            rtts.append(time.perf_counter() - t0)
+                        time.sleep(args.interval)
+                    elapsed = time.perf_counter() - t_start
+                    st = client.send_queue_stats()[0]
+                finally:
+                    stop.set()
+                    client.stop_server()
+                    for t in loaders:
+                        t.join(timeout=5)
+                    proc.terminate()
+                    proc.join()
+                rtts.sort()
+                row = {
+                    "engine": engine,
+                    "mode": mode,
+                    "load": load,
+                    "rcvbuf_kb": args.rcvbuf_kb,
+                    "pings": len(rtts),
+                    "lost": lost,
+                    **_latency_ms(rtts),
+                    "p90_ms": round(_percentile(rtts, 0.90) * 1000, 3),
+                    "max_ms": round(rtts[-1] * 1000, 3) if rtts else -1,
+                    "load_mb_s": round((st["sent_bytes"] - sent0) / elapsed / 1e6, 1),
+                    "queued": st["depth"],
+                }
+                rows.append(row)
+                print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return rows
+
+# ---------------- Load driver -------------------------------------------------
+LOAD_PATTERNS = ("echo", "broadcast", "send_and_wait")
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return -1.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+def _latency_ms(vals: List[float]) -> Dict[str, float]:
+    vals = sorted(vals)
+    return {
+        "p50_ms": round(_percentile(vals, 0.50) * 1000, 3),
+        "p99_ms": round(_percentile(vals, 0.99) * 1000, 3),
+    }
+
+def _load_node(target: str, engine: Optional[str], port: int, opts: Dict[str, object], conn) -> None:
+    """Processo figlio del load driver: un Peer del modulo `target` pilotato via Pipe.
+
+    Ogni connessione ha un thread consumer che svuota l'inbox e riconosce i messaggi
+    di misura: "b|<ts>|..." (broadcast ricevuto) e "E|<TS>|..." (eco di "e|<ts>|...",
+    rimandata in maiuscolo dal lato che accetta). I timestamp sono time.time(): i nodi
+    girano sulla stessa macchina."""
+    sys.stderr = open(os.devnull, "w")
+    mod = importlib.import_module(target)
+    if hasattr(mod, "set_log_backend"):
+        mod.set_log_backend(opts["log_backend"])
+    if hasattr(mod, "set_log_level"):
+        mod.set_log_level(opts["log_level"])
+    cls = mod.ENGINES[engine] if engine else mod.Peer
+    kwargs = {"registry": opts["registry"]} if opts["registry"] else {}
+    if opts["discovery"]:
+        kwargs.update(mcast_group=opts["mcast_group"], mcast_port=opts["mcast_port"])
+        if "discover_interval" in cls.__init__.__code__.co_varnames:
+            kwargs["discover_interval"] = 0.5
+    peer = cls(BENCH_HOST, port, **kwargs)
+    peer.start_server()
+    if opts["discovery"]:
+        peer.start_discovery()
+    recv = getattr(peer, "recv", None) or peer.registry.pop_msg
+    conn.send("ready")
+
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == "dial":
+            for pr in arg:
+                try:
+                    peer.connect(BENCH_HOST, pr)
+                except Exception:
+                    pass
+            conn.send("ok")
+        elif cmd == "wait_peers":
+            want, timeout = arg
+            deadline = time.monotonic() + timeout
+            while len(peer.list_peers()) < want and time.monotonic() < deadline:
+                time.sleep(0.05)
+            conn.send(len(peer.list_peers()))
+        elif cmd == "run":
+            conn.send(_load_run(peer, recv, arg))
+        elif cmd == "stop":
+            break
+    if opts["discovery"]:
+        peer.stop_discovery()
+    peer.stop_server()
+
+def _load_run(peer, recv, spec: Dict[str, object]) -> Dict[str, object]:
+    pattern, messages, window = spec["pattern"], spec["messages"], spec["window"]
+    pad = "x" * spec["size"]
+    rows = peer.list_peers()
+    outgoing = [row[0] for row in rows if row[2] == "out"]
+    lat: List[float] = []
+    lock = threading.Lock()
+    state = {"done": 0, "sent": 0, "last": time.time()}
+    credits = {cid: threading.Semaphore(window) for cid in outgoing}
+    stop = threading.Event()
+
+    def consume(cid):
+        while not stop.is_set() and peer.registry.get(cid) is not None:
+            msg = recv(cid, 0.2)
+            if not isinstance(msg, str) or msg[:2] not in ("b|", "E|"):
+                continue   # richieste "e|" in arrivo (già rimandate dal nodo) o timeout
+            now = time.time()
+            with lock:
+                lat.append(now - float(msg[2:msg.index("|", 2)]))
+                state["done"] += 1
+                state["last"] = now
+            if msg[0] == "E":
+                credits[cid].release()
+
+    def echo_sender(cid):
+        for _ in range(messages):
+            if not credits[cid].acquire(timeout=spec["timeout"]):
+                return
+            peer.send(cid, f"e|{time.time()!r}|{pad}")
+            with lock:
+                state["sent"] += 1
+
+    def request_sender(cid, count):
+        for _ in range(count):
+            t = time.time()
+            reply = peer.send_and_wait(cid, f"r|{pad}", timeout=spec["timeout"])
+            now = time.time()
+            with lock:
+                state["sent"] += 1
+                if reply is not None:
+                    lat.append(now - t)
+                    state["done"] += 1
+                    state["last"] = now
+
+    consumers = [threading.Thread(target=consume, args=(row[0],), daemon=True) for row in rows]
+    for t in consumers:
+        t.start()
+    if pattern == "echo":
+        senders = [threading.Thread(target=echo_sender, args=(cid,)) for cid in outgoing]
+        expected = messages * len(outgoing)
+    elif pattern == "send_and_wait":
+        per = max(1, messages // window)
+        senders = [threading.Thread(target=request_sender, args=(cid, per)) for cid in outgoing for _ in range(window)]
+        expected = per * window * len(outgoing)
+    else:
+        def broadcaster():
+            for _ in range(messages):
+                peer.broadcast(f"b|{time.time()!r}|{pad}")
+                with lock:
+                    state["sent"] += 1
+        senders = [threading.Thread(target=broadcaster)]
+        expected = messages * (len(rows))   # ogni vicino fa broadcast `messages` volte
+
+    cpu0 = os.times()
+    t0 = time.time()
+    for t in senders:
+        t.start()
+    for t in senders:
+        t.join()
+    deadline = time.monotonic() + spec["timeout"]
+    while state["done"] < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    cpu1 = os.times()
+    elapsed = max(1e-9, state["last"] - t0)
+    cpu_s = (cpu1.user - cpu0.user) + (cpu1.system - cpu0.system)
+    for t in consumers:
+        t.join(1.0)
+    return {
+        "port": peer.port,
+        "conns": len(rows),
+        "sent": state["sent"],
+        "completed": state["done"],
+        "expected": expected,
+        "elapsed_s": round(elapsed, 4),
+        "cpu_s": round(cpu_s, 3),
+        "cpu_pct": round(100.0 * cpu_s / elapsed, 1),
+        **proc_status(os.getpid()),
+        "latencies": lat,
+    }
+
+def _load_round(target: str, engine: Optional[str], registry: Optional[str], pattern: str, args) -> Dict[str, object]:
+    ports = sorted(free_port() for _ in range(args.nodes))
+    opts = {
+        "log_level": args.log_level,
+        "log_backend": args.log_backend,
+        "registry": registry,
+        "discovery": args.discovery,
+        "mcast_group": args.mcast_group,
+        "mcast_port": free_port(),
+    }
+    nodes = []
+    for port in ports:
+        parent, child = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=_load_node, args=(target, engine, port, opts, child), daemon=True)
+        proc.start()
+        nodes.append((proc, parent))
+
+    def ask(conn, cmd, arg, timeout):
+        conn.send((cmd, arg))
+        if not conn.poll(timeout):
+            raise RuntimeError(f"nessuna risposta a {cmd!r} entro {timeout}s")
+        return conn.recv()
+
+    record: Dict[str, object] = {
+        "target": target,
+        "engine": engine or "thread",
+        "registry": registry or "default",
+        "log_backend": args.log_backend,
+        "pattern": pattern,
+        "nodes": args.nodes,
+        "mesh": "multicast" if args.discovery else "dial",
+        "messages": args.messages,
+        "size": args.size,
+        "window": args.window,
+    }
+    try:
+        for _, conn in nodes:
+            if not conn.poll(10.0):
+                raise RuntimeError("nodo non avviato")
+            conn.recv()
+        if not args.discovery:
+            # mesh completa: ogni nodo chiama i nodi con porta maggiore (regola anti-duplicato)
+            for i, (_, conn) in enumerate(nodes):
+                ask(conn, "dial", ports[i + 1:], 30.0)
+        linked = [ask(conn, "wait_peers", (args.nodes - 1, args.mesh_timeout), args.mesh_timeout + 5) for _, conn in nodes]
+        record["mesh_conns"] = linked
+        spec = {
+            "pattern": pattern,
+            "messages": args.messages,
+            "size": args.size,
+            "window": args.window,
+            "timeout": args.timeout,
+        }
+        for _, conn in nodes:
+            conn.send(("run", spec))
+        per_node = []
+        for _, conn in nodes:
+            if not conn.poll(args.timeout * 4 + 30):
+                raise RuntimeError("run senza risposta")
+            per_node.append(conn.recv())
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    finally:
+        for _, conn in nodes:
+            try:
+                conn.send(("stop", None))
+            except Exception:
+                pass
+        for proc, _ in nodes:
+            proc.join(5)
+            if proc.is_alive():
+                proc.terminate()
+
+    lat = [v for n in per_node for v in n["latencies"]]
+    completed = sum(n["completed"] for n in per_node)
+    elapsed = max(n["elapsed_s"] for n in per_node)
+    record.update({
+        "completed": completed,
+        "expected": sum(n["expected"] for n in per_node),
+        "elapsed_s": elapsed,
+        "throughput_msgs_s": round(completed / elapsed, 1) if elapsed > 0 else 0.0,
+        **_latency_ms(lat),
+        "per_node": [
+            {**{k: v for k, v in n.items() if k != "latencies"}, **_latency_ms(n["latencies"])}
+            for n in per_node
+        ],
+    })
+    return record
+
+def bench_load(args) -> List[Dict[str, object]]:
+    """Load driver headless: per ogni modulo target, engine e pattern avvia `--nodes`
+    nodi su loopback (mesh via connect o via multicast su lo), genera il carico
+    e scrive un report JSON (throughput, p50/p99, CPU e RSS per nodo)."""
+    records = []
+    for target in args.targets:
+        try:
+            mod = importlib.import_module(target)
+        except Exception as e:   # p.es. un sorgente troncato: il report lo registra
+            records.append({"target": target, "error": f"{type(e).__name__}: {e}"})
+            continue
+        engines = args.engines if hasattr(mod, "ENGINES") else [None]
+        registries = args.registries if hasattr(mod, "REGISTRIES") else [None]
+        for engine in engines:
+            for registry in registries:
+                for pattern in args.patterns:
+                    rec = _load_round(target, engine, registry, pattern, args)
+                    records.append(rec)
+                    print(
+                        f"target={target} engine={rec['engine']} registry={rec['registry']} pattern={pattern} "
+                        f"msgs_s={rec.get('throughput_msgs_s', -1)} p50_ms={rec.get('p50_ms', -1)} "
+                        f"p99_ms={rec.get('p99_ms', -1)}" + (f" error={rec['error']}" if "error" in rec else ""),
+                        file=sys.stderr,
+                    )
+    report = json.dumps(records, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    return records
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark P2P node su loopback")
+    sub = p.add_subparsers(dest="scenario", required=True)
+
+    e = sub.add_parser("engines", help="Peer (thread) vs AsyncPeer: connessioni per nodo e messaggi/s")
+    e.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    e.add_argument("--conns", nargs="+", type=int, default=[100, 1000], help="Numero connessioni per nodo")
+    e.add_argument("--messages", type=int, default=100, help="Round-trip per connessione")
+    e.set_defaults(func=bench_engines)
+
+    wk = sub.add_parser("workers", help="Eco con --workers 1..N processi sulla stessa porta (SO_REUSEPORT)")
+    wk.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    wk.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    wk.add_argument("--conns", type=int, default=64, help="Connessioni totali")
+    wk.add_argument("--messages", type=int, default=2000, help="Round-trip per connessione")
+    wk.add_argument("--clients", type=int, default=4, help="Processi generatori di carico")
+    wk.set_defaults(func=bench_workers)
+
+    r = sub.add_parser("registry", help="Microbenchmark ConnectionRegistry (lookup per indirizzo, idle)")
+    r.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000], help="Connessioni registrate")
+    r.add_argument("--lookups", type=int, default=1000, help="Operazioni misurate per dimensione")
+    r.add_argument("--with-linear", action="store_true", help="Misura anche la scansione lineare (lenta)")
+    r.set_defaults(func=bench_registry)
+
+    c = sub.add_parser("contention", help="touch/push_msg/pop_msg concorrenti: registry a lock unico vs sharded")
+    c.add_argument("--registries", nargs="+", default=sorted(p2p.REGISTRIES), choices=sorted(p2p.REGISTRIES))
+    c.add_argument("--threads", nargs="+", type=int, default=[1, 16, 128], help="Thread concorrenti")
+    c.add_argument("--ops", type=int, default=5000, help="Iterazioni per thread")
+    c.set_defaults(func=bench_contention)
+
+    f = sub.add_parser("fanout", help="broadcast con un peer lento: policy drop/block/disconnect")
+    f.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    f.add_argument("--policies", nargs="+", default=list(p2p.SLOW_POLICIES), choices=p2p.SLOW_POLICIES)
+    f.add_argument("--readers", type=int, default=8, help="Peer veloci")
+    f.add_argument("--frames", type=int, default=5000, help="Broadcast da inviare")
+    f.add_argument("--size", type=int, default=4096, help="Byte per messaggio")
+    f.add_argument("--queue", type=int, default=256, help="Frame per coda di invio")
+    f.add_argument("--block-timeout", type=float, default=0.005, help="Attesa massima per frame con policy block")
+    f.set_defaults(func=bench_fanout)
+
+    q = sub.add_parser("pipeline", help="send_request/send_and_wait: throughput vs richieste in volo")
+    q.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    q.add_argument("--depths", nargs="+", type=int, default=[1, 4, 16, 64], help="Richieste in volo")
+    q.add_argument("--requests", type=int, default=5000, help="Richieste per profondità")
+    q.set_defaults(func=bench_pipeline)
+
+    b = sub.add_parser("backpressure", help="flood verso un nodo che non legge: inbox limitata in byte")
+    b.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    b.add_argument("--inbox-kb", nargs="+", type=int, default=[256, 4096, 65536], help="Limite inbox per connessione (kB)")
+    b.add_argument("--size", type=int, default=65536, help="Byte per messaggio")
+    b.add_argument("--seconds", type=float, default=3.0, help="Durata del flood")
+    b.set_defaults(func=bench_backpressure)
+
+    lg = sub.add_parser("logging", help="server_log: backend sync vs writer in background vs null")
+    lg.add_argument("--backends", nargs="+", default=["sync", "async", "null"], choices=sorted(p2p.LOG_BACKENDS))
+    lg.add_argument("--threads", nargs="+", type=int, default=[1, 8])
+    lg.add_argument("--calls", type=int, default=50_000, help="Chiamate per thread")
+    lg.set_defaults(func=bench_logging)
+
+    g = sub.add_parser("gossip", help="Simulazione multi-processo della diffusione gossip")
+    g.add_argument("--engine", default="async", choices=sorted(p2p.ENGINES))
+    g.add_argument("--nodes", type=int, default=32, help="Processi/nodi nella mesh")
+    g.add_argument("--degree", type=int, default=4, help="Connessioni medie per nodo")
+    g.add_argument("--fanout", type=int, default=p2p.DEFAULT_GOSSIP_FANOUT, help="Vicini per inoltro")
+    g.add_argument("--rounds", type=int, default=5, help="Messaggi gossip da misurare")
+    g.add_argument("--settle", type=float, default=1.0, help="Secondi di attesa per round")
+    g.add_argument("--seed", type=int, default=1)
+    g.set_defaults(func=bench_gossip)
+
+    ds = sub.add_parser("discovery", help="Simulazione discovery multicast: announce text vs binary con digest")
+    ds.add_argument("--formats", nargs="+", default=list(p2p.ANNOUNCE_FORMATS), choices=p2p.ANNOUNCE_FORMATS)
+    ds.add_argument("--nodes", type=int, default=50)
+    ds.add_argument("--duration", type=float, default=900.0, help="Secondi simulati")
+    ds.add_argument("--join-window", type=float, default=30.0, help="I nodi entrano a caso in [0, join-window]")
+    ds.add_argument("--imin", type=float, default=p2p.DISCOVER_INTERVAL)
+    ds.add_argument("--imax", type=float, default=p2p.DISCOVER_MAX_INTERVAL)
+    ds.add_argument("--loss", type=float, default=0.0, help="Probabilità di perdita per pacchetto e ricevente")
+    ds.add_argument("--seed", type=int, default=1)
+    ds.set_defaults(func=bench_discovery)
+
+    bs = sub.add_parser("bootstrap", help="Bootstrap con indirizzi morti: time-to-first-peer seriale vs parallelo, riuso DialPool")
+    bs.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    bs.add_argument("--dead", type=int, default=3, help="Indirizzi morti (timeout) prima di quello vivo")
+    bs.add_argument("--inflight", type=int, nargs="+", default=[1, p2p.BOOTSTRAP_MAX_INFLIGHT], help="1 = vecchio comportamento seriale")
+    bs.add_argument("--racers", type=int, default=8, help="connect() concorrenti verso lo stesso peer")
+    bs.add_argument("--limit", type=float, default=30.0, help="Attesa massima per il primo peer")
+    bs.set_defaults(func=bench_bootstrap)
+
+    wm = sub.add_parser("warm", help="Riavvio a freddo (multicast) vs a caldo (cache dei peer): tempo per la mesh completa")
+    wm.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    wm.add_argument("--mesh", type=int, default=8, help="Nodi già attivi a cui riconnettersi")
+    wm.add_argument("--restarts", type=int, default=3, help="Riavvii misurati per modalità")
+    wm.add_argument("--settle", type=float, default=10.0, help="Secondi di vita della mesh prima dei riavvii")
+    wm.add_argument("--limit", type=float, default=120.0, help="Attesa massima per la mesh completa")
+    wm.add_argument("--mcast-group", default=p2p.MCAST_GRP)
+    wm.set_defaults(func=bench_warm)
+
+    tl = sub.add_parser("tls", help="mTLS: riconnessioni/s in chiaro, con handshake completo e con ripresa di sessione")
+    tl.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    tl.add_argument("--modes", nargs="+", default=list(TLS_MODES), choices=TLS_MODES)
+    tl.add_argument("--duration", type=float, default=5.0, help="Secondi per modalità")
+    tl.add_argument("--tls-dir", default=TLS_DIR, help="Certificati generati da SSL/2.SSL (gen_certs)")
+    tl.set_defaults(func=bench_tls)
+
+    cz = sub.add_parser("compress", help="Compressione negoziata: byte sul filo e CPU per codec e dimensione, broadcast")
+    cz.add_argument("--sizes", type=int, nargs="+", default=[256, 1024, 4096, 65536, 1048576])
+    cz.add_argument("--min-bytes", type=int, default=p2p.COMPRESS_MIN_BYTES, help="Soglia di compressione")
+    cz.add_argument("--budget", type=int, default=64 << 20, help="Byte elaborati per misura (ripetizioni = budget/size)")
+    cz.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    cz.add_argument("--peers", type=int, default=8, help="Peer che ricevono il broadcast")
+    cz.add_argument("--messages", type=int, default=200, help="Messaggi broadcast")
+    cz.add_argument("--broadcast-size", type=int, default=16384)
+    cz.set_defaults(func=bench_compress)
+
+    sr = sub.add_parser("serialize", help="Messaggi tipizzati: byte e µs di encode/decode/campo singolo per tipo e serializer")
+    sr.add_argument("--types", nargs="+", default=["ping", "chat", "bench_record", "bench_bulk"],
+                    choices=["ping", "chat", "bench_record", "bench_bulk"])
+    sr.add_argument("--serializers", nargs="+", default=list(p2p.SERIALIZER_NAMES), choices=list(p2p.SERIALIZER_NAMES))
+    sr.add_argument("--messages", type=int, default=20000, help="Messaggi per misura")
+    sr.add_argument("--bulk-kb", type=int, default=16, help="Dimensione del campo bytes di bench_bulk")
+    sr.add_argument("--runs", type=int, default=3, help="Ripetizioni (si tiene la migliore)")
+    sr.add_argument("--seed", type=int, default=1)
+    sr.set_defaults(func=bench_serialize)
+
+    mt = sub.add_parser("metrics", help="Costo di contatori/istogrammi per thread, snapshot e stats()")
+    mt.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    mt.add_argument("--calls", type=int, default=200000, help="Chiamate per thread")
+    mt.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    mt.add_argument("--peers", type=int, default=64, help="Connessioni del nodo di cui si chiede stats()")
+    mt.set_defaults(func=bench_metrics)
+
+    ct = sub.add_parser("control", help="API di controllo: comando per riga vs batch vs send_many/request_many")
+    ct.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    ct.add_argument("--messages", type=int, default=20000, help="Messaggi inviati per variante")
+    ct.add_argument("--requests", type=int, default=5000, help="Richieste per le varianti con risposta")
+    ct.add_argument("--batch", type=int, default=1000, help="Messaggi per chiamata batch/send_many/request_many")
+    ct.set_defaults(func=bench_control)
+
+    dh = sub.add_parser("dht", help="Simulazione overlay DHT: hop e latenza di send_to_node con N nodi")
+    dh.add_argument("--nodes", type=int, default=1000)
+    dh.add_argument("--procs", type=int, default=8, help="Processi che ospitano i nodi")
+    dh.add_argument("--engine", default="async", choices=sorted(p2p.ENGINES))
+    dh.add_argument("--k", type=int, default=4, help="Contatti per bucket cercati da dht_join")
+    dh.add_argument("--join-passes", type=int, default=2, help="Giri di dht_join su tutti i nodi")
+    dh.add_argument("--join-threads", type=int, default=16, help="dht_join in parallelo per processo")
+    dh.add_argument("--messages", type=int, default=2000, help="Messaggi instradati in totale")
+    dh.add_argument("--gap", type=float, default=0.002, help="Pausa tra due invii dello stesso processo (s)")
+    dh.add_argument("--settle", type=float, default=3.0, help="Attesa consegne dopo l'ultimo invio (s)")
+    dh.add_argument("--seed", type=int, default=1)
+    dh.set_defaults(func=bench_dht)
+
+    il = sub.add_parser("idle", help="Connessioni inattive: risvegli/s e CPU del nodo a riposo")
+    il.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    il.add_argument("--conns", nargs="+", type=int, default=[0, 1000, 10000], help="Connessioni inattive verso il nodo")
+    il.add_argument("--window", type=float, default=10.0, help="Secondi di misura a riposo")
+    il.add_argument("--no-discovery", action="store_true", help="Senza multicast (solo server TCP e connessioni)")
+    il.set_defaults(func=bench_idle)
+
+    tf = sub.add_parser("transfer", help="File grandi: send_file (sendfile, CRC, prealloc, ripresa) vs read-all/sendall")
+    tf.add_argument("--size-mb", type=int, default=256)
+    tf.add_argument("--chunk-kb", type=int, default=1024)
+    tf.add_argument("--runs", type=int, default=3)
+    tf.add_argument("--engines", nargs="+", default=["thread", "async"], choices=sorted(p2p.ENGINES))
+    tf.set_defaults(func=bench_transfer)
+
+    sw = sub.add_parser("swarm", help="Download multi-sorgente (rarest-first, endgame) con link loopback strozzati")
+    sw.add_argument("--size-mb", type=int, default=256)
+    sw.add_argument("--sources", type=int, nargs="+", default=[1, 3, 9], help="Sorgenti usate per ogni download")
+    sw.add_argument("--rate-mb", type=float, default=20.0, help="Upload massimo di ogni sorgente (MB/s)")
+    sw.add_argument("--slow", type=int, default=0, help="Sorgenti (le ultime) a 1/5 del rate")
+    sw.add_argument("--partial", type=int, default=0, help="Sorgenti (dopo la prima) con solo metà dei chunk")
+    sw.add_argument("--pipeline", type=int, default=4, help="GET in volo per sorgente")
+    sw.add_argument("--engine", default="thread", choices=sorted(p2p.ENGINES), help="Engine delle sorgenti")
+    sw.add_argument("--runs", type=int, default=1)
+    sw.add_argument("--seed", type=int, default=1)
+    sw.set_defaults(func=bench_swarm)
+
+    la = sub.add_parser("lanes", help="Latenza di send_and_wait con la connessione saturata: FIFO unica vs corsie con priorità")
+    la.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES))
+    la.add_argument("--modes", nargs="+", default=["fifo", "lanes"], choices=["fifo", "lanes"])
+    la.add_argument("--loads", nargs="+", default=["none", "bulk", "flood"], choices=["none", "bulk", "flood"])
+    la.add_argument("--bulk-kb", type=int, default=64, help="Dimensione dei frame bulk")
+    la.add_argument("--flood-bytes", type=int, default=256, help="Dimensione dei messaggi del flood")
+    la.add_argument("--senders", type=int, default=2, help="Thread che saturano la connessione")
+    la.add_argument("--batch", type=int, default=64, help="Messaggi per send_many dei thread di carico")
+    la.add_argument("--queue", type=int, default=p2p.DEFAULT_SEND_QUEUE, help="Frame per coda (in totale, su tutte le corsie)")
+    la.add_argument("--rcvbuf-kb", type=int, default=0, help="lane_rcvbuf di entrambi i nodi in KiB (0 = autotuning del kernel)")
+    la.add_argument("--seconds", type=float, default=5.0, help="Durata della misura")
+    la.add_argument("--warmup", type=float, default=1.0, help="Secondi di carico prima di misurare")
+    la.add_argument("--interval", type=float, default=0.005, help="Pausa tra due ping")
+    la.add_argument("--timeout", type=float, default=10.0, help="Ping senza risposta entro questo tempo = perso")
+    la.set_defaults(func=bench_lanes)
+
+    ld = sub.add_parser("load", help="Load driver headless: N nodi, echo/broadcast/send_and_wait, report JSON")
+    ld.add_argument("--targets", nargs="+", default=["p2p_multicast"], help="Moduli da misurare (p2p_multicast, p2p_versione_corretta)")
+    ld.add_argument("--engines", nargs="+", default=sorted(p2p.ENGINES), choices=sorted(p2p.ENGINES), help="Solo per i moduli con ENGINES")
+    ld.add_argument("--registries", nargs="+", default=["default"], choices=sorted(p2p.REGISTRIES), help="Solo per i moduli con REGISTRIES")
+    ld.add_argument("--patterns", nargs="+", default=list(LOAD_PATTERNS), choices=LOAD_PATTERNS)
+    ld.add_argument("--nodes", type=int, default=4, help="Nodi (processi) nella mesh")
+    ld.add_argument("--messages", type=int, default=2000, help="Messaggi per connessione (broadcast: per nodo)")
+    ld.add_argument("--size", type=int, default=64, help="Byte di padding per messaggio")
+    ld.add_argument("--window", type=int, default=8, help="Messaggi/richieste in volo per connessione")
+    ld.add_argument("--timeout", type=float, default=10.0, help="Attesa massima per risposte e consegne")
+    ld.add_argument("--discovery", action="store_true", help="Mesh via multicast su lo invece di connect espliciti")
+    ld.add_argument("--mcast-group", default=p2p.MCAST_GRP)
+    ld.add_argument("--mesh-timeout", type=float, default=15.0, help="Attesa massima per la mesh completa")
+    ld.add_argument("--log-level", default="warning", choices=sorted(p2p.LOG_LEVELS), help="Livello log dei nodi")
+    ld.add_argument("--log-backend", default="async", choices=sorted(p2p.LOG_BACKENDS), help="Backend dei log server nei nodi")
+    ld.add_argument("--out", help="File JSON di output (default stdout)")
+    ld.set_defaults(func=bench_load)
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+p2p
+
+Nodo P2P (multicast discovery + TCP) come pacchetto importabile. I due script
+p2p_multicast.py e p2p_versione_corretta.py sono solo punti di ingresso.
+
+Backend intercambiabili, scelti per nome:
+  - trasporto: ENGINES     ("thread" = un thread per connessione, "async" = unico event loop)
+  - registry:  REGISTRIES  ("default" = lock unico, "sharded" = lock per shard)
+  - logging:   LOG_BACKENDS via set_log_backend() ("async", "sync", "null")
+  - codec:     CODECS / CODEC_NAMES (zlib, più lz4/zstd se installati)
+  - messaggi:  SERIALIZERS / SERIALIZER_NAMES (struct, json, più msgpack/cbor se installati),
+               schemi registrati con register_schema()
+
+Uso:
+    import p2p
+    peer = p2p.ENGINES["async"]("127.0.0.1", 8000, registry="sharded")
+    peer.start_server()
+"""
+from .config import (
+    Addr, ConnID, DEFAULT_BOOTSTRAP_IPS, DEFAULT_BOOTSTRAP_PORT, DEFAULT_SEND_WAIT_TIMEOUT, DISCOVER_INTERVAL,
+    DISCOVER_MAX_INTERVAL, IDLE_TIMEOUT, MCAST_GRP, MCAST_PORT, MCAST_TTL,
+)
+from .idle import IDLE_SLACK, KEEPALIVE_DEFAULT, Waker, serve_until, set_keepalive, wait_readable
+from .logs import (
+    LOG_BACKENDS, LOG_DEBUG, LOG_ERROR, LOG_INFO, LOG_LEVELS, LOG_WARNING, AsyncLogWriter, NullLogWriter,
+    SyncLogWriter, buffered_log, flush_logs, flush_server_logs, log_critical, log_stats, server_log,
+    set_log_backend, set_log_level, set_log_tag,
+)
+from .metrics import (
+    CONN_IO_KEYS, HIST_BUCKETS, METRICS_HOST, Metrics, MetricsExporter, format_stats, hist_quantile,
+    merge_stats, prometheus_text,
+)
+from .wire import (
+    CORR_HEADER, DATA_OPENERS, FRAME_HEADER, HELLO_ADDR, MAX_FRAME_SIZE, MSG_BINARY, MSG_BLOB_GET, MSG_BLOB_HAVE,
+    MSG_BLOB_QUERY, MSG_CODECS, MSG_COMPRESSED, MSG_FILE_ACK,
+    MSG_FILE_CHUNK, MSG_FILE_OFFER, MSG_FIND_NODE, MSG_FLOW, MSG_GOSSIP, MSG_HELLO, MSG_NODES, MSG_REPLY, MSG_REQUEST,
+    MSG_RESPONSE, MSG_ROUTE, MSG_TEXT, MSG_TYPED, RECV_CHUNK, FrameError, FrameReader, encode_frame, encode_message,
+)
+from .compression import CODEC_NAMES, CODECS, COMPRESS_MIN_BYTES, Compression
+from .registry import (
+    DEFAULT_INBOX_BYTES, INBOX_OVERDRAFT, REGISTRIES, ConnectionRegistry, ConnRecord, Inbox, ShardedConnectionRegistry,
+    make_registry,
+)
+from .correlation import PendingRequests
+from .queues import (
+    CONTROL_TYPES, DEFAULT_SEND_QUEUE, LANE_CONTROL, LANE_CONTROL_RESERVE, LANE_GOSSIP, LANE_MESSAGES, LANE_NAMES,
+    LANE_NOTSENT_LOWAT, LANE_QUANTUM, LANE_WEIGHTS, SEND_BLOCK_TIMEOUT, SLOW_POLICIES, Lanes, SendQueue, frame_lane,
+    set_notsent_lowat, set_rcvbuf,
+)
+from .gossip import BROADCAST_MODES, DEFAULT_GOSSIP_FANOUT, GOSSIP_HEADER, GOSSIP_MAX_HOPS, SeenSet
+from .dialing import BOOTSTRAP_MAX_INFLIGHT, BOOTSTRAP_STAGGER, AsyncDialPool, DialBackoff, DialPool
+from .peercache import PEER_CACHE_FAIL, PEER_CACHE_OK, PEER_CACHE_SEEN, PeerCache
+from .tls import TLS_FILES, PeerTLS
+from .discovery import (
+    ANNOUNCE_FORMATS, ANNOUNCE_MAX_PEERS, DiscoveryState, decode_announce, encode_announce, peer_set_digest,
+)
+from .dht import (
+    DHT_ALPHA, DHT_ID_BITS, DHT_K, ROUTE_DATA, ROUTE_DIAL, ROUTE_HEADER, ROUTE_MAX_HOPS, ROUTE_TYPED, RoutingTable,
+    bucket_index, node_id,
+)
+from .transfer import (
+    FILE_CHUNK, FILE_RETRIES, FILE_TIMEOUT, FileChunkError, FileTransferError, receive_file, send_file,
+)
+from .swarm import (
+    DIGEST_SIZE, GET_HEADER, HAVE_HEADER, NO_DIGEST, SWARM_MAX_SOURCES, SWARM_PIPELINE, RateLimiter, SwarmDownload,
+    chunk_count, fetch_blob, file_digest, local_blob, serve_blob,
+)
+from .messages import (
+    DEFAULT_SERIALIZER, FIELD_KINDS, SCHEMA_NAMES, SCHEMAS, SERIALIZER_NAMES, SERIALIZERS, TYPED_HEADER,
+    FieldKindError, MessageError, Schema, Serializer, TypedMessage, get_schema, get_serializer, register_schema,
+)
+from .peer import P2PRequestHandler, Peer
+from .aio import AsyncPeer
+from .engines import ENGINES
+from .control import ControlClient, ControlError, ControlServer
+from .workers import WorkerPool
+from .repl import repl
+from .cli import default_control_path, get_local_ip, main, parse_args, parse_bootstrap_arg
@@ -0,0 +1,799 @@
+# -*- coding: utf-8 -*-
+"""asyncio engine: AsyncPeer, same API as Peer on a single event loop."""
+import asyncio
+import concurrent.futures
+import os
+import socket
+import threading
+import time
+from typing import Dict, Tuple, Optional, List
+
+from .config import Addr, ConnID
+from .logs import buffered_log, server_log
+from .wire import (
+    CORR_HEADER, DATA_OPENERS, OPENER_WAIT, FrameError, FrameReader, MSG_BLOB_HAVE, MSG_FILE_ACK, MSG_FILE_OFFER,
+    MSG_REQUEST, encode_frame, encode_message,
+)
+from .registry import Inbox
+from .queues import Lanes, set_notsent_lowat, set_rcvbuf
+from .dialing import AsyncDialPool
+from .tls import TLS_HANDSHAKE_TIMEOUT, _tls_session
+from .dht import DHT_QUERY_TIMEOUT, node_id
+from .transfer import FILE_ACK_HEADER, FILE_REFUSED
+from .swarm import HAVE_HEADER, NO_DIGEST
+from .peer import Peer
+
+# ---------------- Async engine ------------------------------------------------
+class _AsyncConn:
+    """Registry handle for a connection owned by the event loop.
+    Stored in place of the raw socket so ConnectionRegistry.remove() can close it
+    from any thread without touching the transport outside the loop."""
+    __slots__ = ("loop", "proto")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, proto: "_FrameProtocol"):
+        self.loop = loop
+        self.proto = proto
+
+    def shutdown(self, how: int) -> None:
+        pass   # nobody blocks on the socket: close() is enough for the loop
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.proto.transport.close)
+
+
+class _FrameProtocol(asyncio.BufferedProtocol):
+    """One TCP connection of an AsyncPeer. The loop reads straight into the
+    FrameReader buffer (get_buffer/buffer_updated), no intermediate bytes."""
+
+    def __init__(self, peer: "AsyncPeer", incoming: bool, addr: Optional[Addr] = None):
+        self.peer = peer
+        self.incoming = incoming
+        self.addr = addr
+        self.cid: Optional[ConnID] = None
+        self.transport = None
+        self.reader = FrameReader()
+        self._paused = False
+        self._drain_waiters: List[asyncio.Future] = []
+        # bounded outbound lanes drained by _writer(), same policies as SendQueue
+        self.lanes = Lanes(peer.send_queue_size, peer.lane_weights, peer.priority_lanes)
+        self._has_frames = asyncio.Event()
+        self._has_room = asyncio.Event()
+        self._writer_task = None
+        self.high_water = 0
+        self.dropped = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.queued_bytes = 0
+        self._inbox: Optional[Inbox] = None
+        self._reading_paused = False
+        self._ssl = None   # SSLObject of a dialed TLS connection, until its session is remembered
+        self._register_timer = None   # accepted and still silent: may yet open a transfer
+
+    @property
+    def tag(self) -> str:
+        return "p2p-loop" if self.incoming else f"out-{self.cid}"
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            self.peer._tune_socket(sock)
+            if self.peer.priority_lanes:
+                set_notsent_lowat(sock)
+            if self.peer.lane_rcvbuf:
+                set_rcvbuf(sock, self.peer.lane_rcvbuf)
+        if self.addr is None:
+            self.addr = transport.get_extra_info("peername")[:2]
+        sslobj = transport.get_extra_info("ssl_object")
+        if sslobj is not None:
+            self.peer.tls.handshake_done(sslobj)
+            if not self.incoming:
+                self._ssl = sslobj
+        if self.incoming:
+            self.peer.metrics.inc("accepted")
+            # registered at the first frame that is not a DATA_OPENERS one (wire.py)
+            self._register_timer = self.peer._loop.call_later(OPENER_WAIT, self._register)
+        else:
+            self._register()
+
+    def _register(self) -> None:
+        if self._register_timer is not None:
+            self._register_timer.cancel()
+            self._register_timer = None
+        if self.cid is not None or self.transport.is_closing():
+            return
+        self.cid = self.peer.registry.add(_AsyncConn(self.peer._loop, self), self.addr, incoming=self.incoming)
+        if not self.incoming:
+            self.peer.routes.add(node_id(self.addr), self.addr, self.cid)
+        self._writer_task = self.peer._spawn(self._writer())
+        if not self.incoming:
+            hello = self.peer._hello_frame()
+            if hello is not None:
+                self.put_nowait(hello)
+        self._inbox = self.peer.registry.inbox(self.cid)
+        if self._inbox is not None:
+            loop = self.peer._loop
+            self._inbox.on_full = lambda: self.peer._send_flow(self.cid, True)   # pushed by _on_frame, on the loop
+            self._inbox.on_drain = lambda: loop.call_soon_threadsafe(self._inbox_drained)
+        if self.incoming:
+            server_log(f"[{self.tag}] Connessione IN registrata: id={self.cid} addr={self.addr}")
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.reader.writable()
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.reader.advance(nbytes)
+        if self._ssl is not None:
+            self.peer.tls.remember(self.addr, self._ssl)
+            self._ssl = None
+        if self.cid is not None:
+            self.peer.registry.touch(self.cid)
+        try:
+            for msg_type, payload in self.reader.frames():
+                if msg_type in DATA_OPENERS:
+                    if self.cid is not None:
+                        raise FrameError("Apertura di trasferimento su una connessione già registrata")
+                    self._register_timer.cancel()
+                    self._hand_off(msg_type, bytes(payload))
+                    return
+                if self.cid is None:
+                    self._register()
+                    if self.cid is None:   # closing
+                        return
+                self.peer._on_frame(self.cid, self.addr, msg_type, payload, self.tag, self.incoming)
+        except FrameError as e:
+            server_log(f"[{self.tag}] Errore gestione connessione {self.addr}: {e}")
+            self.transport.close()
+            return
+        if self._inbox is not None and self._inbox.full and not self._reading_paused:
+            # inbox over its limit: stop reading, TCP pushes back on the sender
+            self._reading_paused = True
+            self.transport.pause_reading()
+
+    def _hand_off(self, msg_type: int, opener: bytes) -> None:
+        """Dedicated transfer connection: disk writes must not run on the loop,
+        so a blocking duplicate of the socket goes to its own thread and the
+        transport lets go of the original. TLS state cannot be handed over."""
+        sock = self.transport.get_extra_info("socket")
+        if self.peer.tls is not None or sock is None:
+            server_log(f"[{self.tag}] Trasferimento file da {self.addr} rifiutato: non supportato con TLS su engine async")
+            self.peer.file_stats["refused"] += 1
+            if msg_type == MSG_FILE_OFFER:
+                self.transport.write(encode_frame(MSG_FILE_ACK, FILE_ACK_HEADER.pack(0, FILE_REFUSED)))
+            else:
+                self.transport.write(encode_frame(MSG_BLOB_HAVE, HAVE_HEADER.pack(0, 0, NO_DIGEST)))
+            self.transport.close()
+            return
+        raw = socket.socket(fileno=os.dup(sock.fileno()))
+        raw.setblocking(True)
+        self.transport.abort()
+        addr = self.addr
+
+        def serve():
+            with raw:
+                self.peer._serve_data(msg_type, raw, addr, opener, "file-in")
+
+        threading.Thread(target=serve, name="file-in", daemon=True).start()
+
+    def _inbox_drained(self) -> None:
+        # scheduled from the consuming thread: a push on the loop may have
+        # crossed the limit again (and sent its hold) since
+        if not self._inbox.throttled:
+            self.peer._send_flow(self.cid, False)
+        self._resume_reading()
+
+    def _resume_reading(self) -> None:
+        if self._reading_paused and not self._inbox.full and not self.transport.is_closing():
+            self._reading_paused = False
+            self.transport.resume_reading()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self._ssl is not None:
+            self.peer.tls.remember(self.addr, self._ssl)
+            self._ssl = None
+        if self.cid is None:   # handed off to a transfer thread, or closed before its first frame
+            if self._register_timer is not None:
+                self._register_timer.cancel()
+            return
+        if self.incoming:
+            server_log(f"[{self.tag}] Chiusura IN id={self.cid} addr={self.addr}")
+        else:
+            server_log(f"[{self.tag}] Connessione OUT id={self.cid} chiusa")
+        self.peer.registry.remove(self.cid)
+        self._wake_writers(ConnectionError("Connessione chiusa"))
+        self._has_room.set()   # blocked put()s see the transport closing
+        self.peer._pending.fail_connection(self.cid)
+        self.peer._forget_route(self.cid)
+        self.peer.compression.forget(self.cid)
+        self.peer.metrics.fold_conn(self.reader.frames_in, self.reader.bytes_in, self.sent, self.sent_bytes, self.dropped)
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+
+    # ---- outbound queue
+    def _queued(self, frame: bytes, lane: int) -> None:
+        self.lanes.push(frame, lane)
+        self._has_frames.set()
+        self.queued_bytes += len(frame)
+        depth = len(self.lanes)
+        if depth > self.high_water:
+            self.high_water = depth
+
+    def _full(self, disconnect: bool = True) -> bool:
+        self.dropped += 1
+        if disconnect and self.peer.slow_policy == "disconnect":
+            server_log(f"[{self.tag}] Peer lento {self.addr}: coda piena -> chiudo")
+            self.transport.abort()   # close() would wait to flush to a peer that does not read
+        return False
+
+    def put_nowait(self, frame: bytes, drop: bool = False) -> bool:
+        """Queue a frame without waiting; drop=True: a full queue drops (and
+        counts) it whatever the policy (receive paths, see Peer._enqueue_nowait)."""
+        lane = self.lanes.lane(frame)
+        if self.lanes.full(lane):
+            return self._full(disconnect=not drop)
+        self._queued(frame, lane)
+        return True
+
+    async def put(self, frame: bytes, block: Optional[bool] = None) -> bool:
+        """Queue a frame according to the node's slow-consumer policy
+        (block=True: wait for room whatever the policy, like SendQueue.put)."""
+        if self.transport.is_closing():
+            return False
+        if block is None:
+            block = self.peer.slow_policy == "block"
+        lane = self.lanes.lane(frame)
+        if self.lanes.full(lane):
+            if not block:
+                return self._full()
+            deadline = self.peer._loop.time() + self.peer.send_block_timeout
+            while self.lanes.full(lane):
+                self._has_room.clear()
+                try:
+                    await asyncio.wait_for(self._has_room.wait(), deadline - self.peer._loop.time())
+                except asyncio.TimeoutError:
+                    return self._full()
+                if self.transport.is_closing():
+                    return False
+        self._queued(frame, lane)
+        return True
+
+    async def _writer(self) -> None:
+        try:
+            while True:
+                while not self.lanes.ready():
+                    self._has_frames.clear()
+                    await self._has_frames.wait()
+                frame = self.lanes.pop()
+                self._has_room.set()
+                self.queued_bytes -= len(frame)
+                self.transport.write(frame)
+                await self.drain()
+                self.sent += 1
+                self.sent_bytes += len(frame)
+                self.peer.registry.touch(self.cid)
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "cid": self.cid,
+            "addr": self.addr,
+            "depth": len(self.lanes),
+            "high_water": self.high_water,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "lanes": self.lanes.depths(),
+            "held": self.lanes.held,
+        }
+
+    def hold(self, held: bool) -> None:
+        self.lanes.hold(held)
+        self._has_frames.set()
+
+    # ---- write flow control (what StreamWriter.drain does for streams)
+    def pause_writing(self) -> None:
+        self._paused = True
+
+    def resume_writing(self) -> None:
+        self._paused = False
+        self._wake_writers(None)
+
+    def _wake_writers(self, exc: Optional[Exception]) -> None:
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for fut in waiters:
+            if not fut.done():
+                if exc is None:
+                    fut.set_result(None)
+                else:
+                    fut.set_exception(exc)
+
+    async def drain(self) -> None:
+        if self.transport.is_closing():
+            raise ConnectionError("Connessione chiusa")
+        if not self._paused:
+            return
+        fut = self.peer._loop.create_future()
+        self._drain_waiters.append(fut)
+        await fut
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, peer: "AsyncPeer"):
+        self.peer = peer
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.peer._on_discover(data)
+
+    def error_received(self, exc: Exception) -> None:
+        server_log(f"[mcast-async] Errore recvfrom: {exc}")
+
+
+class AsyncPeer:
+    """Drop-in alternative to Peer: same public API (connect/send/send_and_wait/
+    broadcast/list_peers), but every TCP connection and the multicast socket are
+    multiplexed on a single asyncio loop running in one background thread,
+    instead of one thread per connection."""
+
+    __init__ = Peer.__init__
+
+    def _init_engine(self) -> None:
+        """The loop and its thread; connections and timers live on it."""
+        self._mcast_transport = None
+        self._dial_pool = AsyncDialPool()
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = None
+        self._tasks = set()
+
+    # ---------------- loop plumbing ---------------------------------------
+    def _ensure_loop(self):
+        if self._loop_thread is not None:
+            return
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="p2p-loop", daemon=True)
+        self._loop_thread.start()
+
+    def _on_loop(self) -> bool:
+        """Called from the loop thread itself: an on_route/on_gossip callback,
+        or code run by a task. Waiting there for the loop would deadlock it."""
+        return threading.current_thread() is self._loop_thread
+
+    def _not_on_loop(self, what: str) -> None:
+        if self._on_loop():
+            raise RuntimeError(f"{what} attende l'event loop: non chiamarlo da una callback (on_route/on_gossip), usa un altro thread")
+
+    def _run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the loop from a foreign thread and wait for its result."""
+        if self._on_loop():
+            coro.close()
+            self._not_on_loop("Questa chiamata")
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """Schedule a background task (must be called from the loop thread)."""
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    # ---------------- server ------------------------------------------------
+    def start_server(self):
+        tls = {}
+        if self.tls is not None:
+            tls = {"ssl": self.tls.server, "ssl_handshake_timeout": TLS_HANDSHAKE_TIMEOUT}
+
+        async def _start():
+            return await self._loop.create_server(
+                lambda: _FrameProtocol(self, incoming=True), self.host, self.port, reuse_address=True,
+                reuse_port=self.reuse_port or None, backlog=1024, **tls
+            )
+
+        try:
+            self.server = self._run(_start())
+        except Exception as e:
+            buffered_log(f"[server] Impossibile avviare server su {self.host}:{self.port}: {e}")
+            raise
+        server_log(f"[server] Peer (async) in ascolto su {self.host}:{self.port}")
+
+    def stop_server(self):
+        self._stop_event.set()
+        if self.peer_cache is not None:
+            self.peer_cache.close()
+        if self._loop_thread is None:
+            return
+
+        async def _shutdown():
+            if self.server:
+                self.server.close()
+            for cid, (handle, _, _, _) in self.registry.items():
+                handle.proto.transport.close()
+                self.registry.remove(cid)
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            # let them unwind before the loop stops ("Task was destroyed but it is pending")
+            if tasks:
+                await asyncio.wait(tasks, timeout=1.0)
+
+        try:
+            self._run(_shutdown(), timeout=5.0)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5.0)
+
+    # ---------------- outgoing connections ---------------------------------
+    def _should_initiate(self, remote: Addr) -> bool:
+        return (self.host, self.port) < remote
+
+    async def _connect(self, ip: str, port: int, timeout: float) -> ConnID:
+        tls = {}
+        if self.tls is not None:
+            tls = {"ssl": self.tls.client, "ssl_handshake_timeout": TLS_HANDSHAKE_TIMEOUT}
+            # picked up by _ResumingContext.wrap_bio in this task's context
+            _tls_session.set(self.tls.session_for((ip, port)))
+        t0 = time.perf_counter()
+        try:
+            _, proto = await asyncio.wait_for(
+                self._loop.create_connection(lambda: _FrameProtocol(self, incoming=False, addr=(ip, port)), ip, port, **tls),
+                timeout,
+            )
+        except Exception as e:
+            self._dial_failed((ip, port))
+            raise ConnectionError(f"Connessione fallita a {ip}:{port}: {e}")
+        self._dial_ok((ip, port), time.perf_counter() - t0)
+        server_log(f"[peer] Connessione OUT stabilita id={proto.cid} addr={(ip,port)}")
+        return proto.cid
+
+    def _healthy_conn(self, addr: Addr) -> Optional[ConnID]:
+        cid = self.registry.find_by_addr(addr)
+        if cid is None:
+            return None
+        entry = self.registry.get(cid)
+        if entry is not None and not entry[0].proto.transport.is_closing():
+            return cid
+        self.registry.remove(cid)
+        return None
+
+    async def _dial_pooled(self, ip: str, port: int, timeout: float = 3.0) -> ConnID:
+        async def opener():
+            if not self._should_initiate((ip, port)):
+                raise ConnectionError("Regola anti-duplicato: non avviare connessione verso peer con ordine minore/uguale.")
+            return await self._connect(ip, port, timeout)
+
+        return await self._dial_pool.dial((ip, port), self._healthy_conn, opener)
+
+    def connect(self, ip: str, port: int, timeout: float = 3.0) -> ConnID:
+        if ip == self.host and port == self.port:
+            raise ConnectionError("Tentativo connessione verso se stessi; ignorato.")
+        return self._run(self._dial_pooled(ip, port, timeout))
+
+    # ---------------- messaging ---------------------------------------------
+    async def _write(self, cid: ConnID, frame: bytes) -> None:
+        entry = self.registry.get(cid)
+        if not entry:
+            raise KeyError("Connessione non trovata")
+        handle, addr, _, _ = entry
+        if not await handle.proto.put(frame):
+            raise ConnectionError(f"Invio fallito su {addr}: coda di invio piena (policy={self.slow_policy})")
+
+    def _write_nowait(self, cid: ConnID, frame: bytes) -> None:
+        """_write() for callers already on the loop: never waits for room, so
+        the "block" policy behaves as "drop" there."""
+        entry = self.registry.get(cid)
+        if not entry:
+            raise KeyError("Connessione non trovata")
+        handle, addr, _, _ = entry
+        if not handle.proto.put_nowait(frame):
+            raise ConnectionError(f"Invio fallito su {addr}: coda di invio piena (policy={self.slow_policy})")
+
+    def _queue(self, cid: ConnID, frame: bytes) -> None:
+        if self._on_loop():
+            self._write_nowait(cid, frame)
+        else:
+            self._run(self._write(cid, frame))
+
+    _on_frame = Peer._on_frame
+
+    # frames are compressed in the calling thread, not on the loop
+    def send(self, cid: ConnID, message):
+        self._queue(cid, self.compression.for_conn(cid, encode_message(message)))
+
+    def send_request(self, cid: ConnID, message: str) -> Tuple[int, concurrent.futures.Future]:
+        corr, fut = self._pending.new(cid)
+        frame = encode_frame(MSG_REQUEST, CORR_HEADER.pack(corr) + message.encode("utf-8"))
+        try:
+            self._queue(cid, self.compression.for_conn(cid, frame))
+        except Exception:
+            self._pending.discard(corr)
+            raise
+        return corr, fut
+
+    def send_and_wait(self, cid: ConnID, message: str, timeout: Optional[float] = None) -> Optional[str]:
+        self._not_on_loop("send_and_wait")   # the reply is read by the loop we would be blocking
+        return Peer.send_and_wait(self, cid, message, timeout)
+
+    send_typed = Peer.send_typed
+
+    async def _write_many(self, cid: ConnID, frames: List[bytes]) -> int:
+        entry = self.registry.get(cid)
+        if not entry:
+            raise KeyError("Connessione non trovata")
+        proto = entry[0].proto
+        queued = 0
+        for frame in frames:
+            if not await proto.put(frame, block=True):
+                break
+            queued += 1
+        return queued
+
+    # Peer._send_bulk with one trip to the loop for the whole list;
+    # the frames are built (and compressed) in the calling thread
+    def _send_bulk(self, cid: ConnID, frames) -> int:
+        if not self._on_loop():
+            return self._run(self._write_many(cid, list(frames)))
+        entry = self.registry.get(cid)
+        if not entry:
+            raise KeyError("Connessione non trovata")
+        queued = 0
+        for frame in frames:
+            if not entry[0].proto.put_nowait(frame):
+                break
+            queued += 1
+        return queued
+
+    send_many = Peer.send_many
+    send_requests = Peer.send_requests
+
+    def request_many(self, cid: ConnID, messages: List[str], timeout: Optional[float] = None,
+                     window: Optional[int] = None) -> List[Optional[str]]:
+        self._not_on_loop("request_many")
+        return Peer.request_many(self, cid, messages, timeout, window)
+
+    _has_room = Peer._has_room
+    _broadcast_frames = Peer._broadcast_frames
+    _gossip_fanout = Peer._gossip_fanout
+    _on_gossip = Peer._on_gossip
+    _gossip_origin = Peer._gossip_origin
+
+    def _enqueue_nowait(self, cid: ConnID, frame: bytes) -> bool:
+        entry = self.registry.get(cid)
+        return entry[0].proto.put_nowait(frame, drop=True) if entry is not None else False
+
+    _send_flow = Peer._send_flow
+
+    def _hold_data(self, cid: ConnID, held: bool) -> None:
+        entry = self.registry.get(cid)
+        if entry is not None:
+            entry[0].proto.hold(held)
+
+    # send_to_node from a foreign thread waits for room, from on_route it does not
+    _send_frame = _queue
+
+    _forget_route = Peer._forget_route
+    send_to_node = Peer.send_to_node
+    _route_out = Peer._route_out
+    _on_route = Peer._on_route
+    _deliver_routed = Peer._deliver_routed
+    _on_dial_request = Peer._on_dial_request
+    _on_find_node = Peer._on_find_node
+    _on_nodes = Peer._on_nodes
+
+    def dht_lookup(self, target: int, timeout: float = DHT_QUERY_TIMEOUT) -> List[Addr]:
+        self._not_on_loop("dht_lookup")   # the NODES answers are read by the loop
+        return Peer.dht_lookup(self, target, timeout)
+
+    _dht_link = Peer._dht_link
+    dht_join = Peer.dht_join
+
+    def _dht_dial(self, addr: Addr) -> None:
+        async def dial():
+            try:
+                await self._dial_pooled(addr[0], addr[1])
+            except Exception as e:
+                server_log(f"[dht] Connessione a {addr[0]}:{addr[1]} fallita: {e}")
+
+        self._spawn(dial())
+
+    # transfers use their own blocking sockets and threads, not the loop
+    send_file = Peer.send_file
+    _file_socket = Peer._file_socket
+    _serve_data = Peer._serve_data
+    _accept_file = Peer._accept_file
+    _serve_blob = Peer._serve_blob
+    fetch_blob = Peer.fetch_blob
+
+    def gossip(self, message: str, msg_id: Optional[int] = None) -> int:
+        msg_id, frame = self._gossip_origin(message, msg_id)
+        if self._on_loop():
+            self._gossip_fanout(frame)
+            return msg_id
+
+        async def _start():
+            self._gossip_fanout(frame)
+
+        self._run(_start())
+        return msg_id
+
+    def broadcast(self, message):
+        if self.broadcast_mode == "gossip":
+            self.gossip(message)
+            return
+        frames = self._broadcast_frames(encode_message(message))
+        # compressed here, in the calling thread: only the queueing runs on the loop
+        protos = [handle.proto for _, (handle, _, _, _) in self.registry.items()]
+        out = [frames(proto.cid) for proto in protos]
+
+        def _report(queued):
+            dropped = [proto.addr for proto, ok in zip(protos, queued) if not ok]
+            if dropped:
+                server_log(f"[broadcast] Frame non accodato per {len(dropped)} peer lenti: {dropped}")
+
+        if self._on_loop():
+            _report([proto.put_nowait(frame) for proto, frame in zip(protos, out)])
+            return
+
+        async def _fanout():
+            _report(await asyncio.gather(*(proto.put(frame) for proto, frame in zip(protos, out))))
+
+        self._run(_fanout())
+
+    def send_queue_stats(self) -> List[Dict[str, object]]:
+        return [handle.proto.stats() for _, (handle, _, _, _) in self.registry.items()]
+
+    def _rx_reader(self, cid: ConnID) -> Optional[FrameReader]:
+        entry = self.registry.get(cid)
+        return entry[0].proto.reader if entry is not None else None
+
+    conn_stats = Peer.conn_stats
+    stats = Peer.stats
+
+    def _conn_memory(self, cid: ConnID) -> Dict[str, int]:
+        entry = self.registry.get(cid)
+        inbox = self.registry.inbox(cid)
+        if entry is None:
+            return {"rx_buf": 0, "inbox": 0, "tx_queued": 0}
+        proto = entry[0].proto
+        return {
+            "rx_buf": proto.reader.capacity,
+            "inbox": inbox.nbytes if inbox is not None else 0,
+            "tx_queued": proto.queued_bytes + proto.transport.get_write_buffer_size(),
+        }
+
+    recv = Peer.recv
+    list_peers = Peer.list_peers
+
+    def disconnect(self, cid: ConnID) -> None:
+        if self.registry.get(cid) is None:
+            raise KeyError("Connessione non trovata")
+        self.registry.remove(cid)
+
+    # ---------------- Multicast discovery ---------------------------------
+    _create_mcast_socket = Peer._create_mcast_socket
+
+    _make_discovery = Peer._make_discovery
+    _hello_frame = Peer._hello_frame
+    _tune_socket = Peer._tune_socket
+
+    def _on_discover(self, data: bytes) -> None:
+        for peer_ip, peer_port in self.discovery.on_packet(data):
+            server_log(f"[mcast-async] Scoperto peer {peer_ip}:{peer_port} -> provo connessione")
+            self._spawn(self._dial(peer_ip, peer_port, "mcast-async"))
+
+    async def _dial(self, ip: str, port: int, tag: str) -> None:
+        if not self._has_room():
+            return
+        try:
+            await self._dial_pooled(ip, port)
+            self.discovery.dial_ok((ip, port))
+        except Exception as e:
+            self.discovery.dial_failed((ip, port))
+            server_log(f"[{tag}] Connessione fallita a {ip}:{port}: {e}")
+
+    _bootstrap_targets = Peer._bootstrap_targets
+    _cache_note = Peer._cache_note
+    _dial_ok = Peer._dial_ok
+    _dial_failed = Peer._dial_failed
+    _bootstrap_retry = Peer._bootstrap_retry
+
+    async def _bootstrap(self) -> None:
+        """Peer._bootstrap_connect on the loop: staggered, bounded, with backoff."""
+        targets = self._bootstrap_targets()
+        pending = set(targets)
+        slots = asyncio.Semaphore(self.bootstrap_inflight)
+        finished = asyncio.Event()
+
+        async def attempt(addr: Addr):
+            try:
+                await self._dial_pooled(*addr)
+            except Exception as e:
+                if self._bootstrap_retry(addr):
+                    delay = self._bootstrap_backoff.failed(addr)
+                    server_log(f"[bootstrap] Connessione a {addr[0]}:{addr[1]} fallita: {e} (riprovo tra {delay:.0f}s)")
+                else:
+                    server_log(f"[bootstrap] Peer in cache {addr[0]}:{addr[1]} non raggiungibile: {e}")
+                    pending.discard(addr)
+            else:
+                self._bootstrap_backoff.ok(addr)
+                pending.discard(addr)
+            finally:
+                slots.release()
+                finished.set()
+
+        while pending and not self._stop_event.is_set() and self._has_room():
+            round_tasks = []
+            for addr in [a for a in targets if a in pending and self._bootstrap_backoff.ready(a)]:
+                if self._stop_event.is_set() or not self._has_room():
+                    return
+                await slots.acquire()
+                finished.clear()
+                server_log(f"[bootstrap] Tentativo connessione a {addr[0]}:{addr[1]}")
+                round_tasks.append(self._spawn(attempt(addr)))
+                try:
+                    await asyncio.wait_for(finished.wait(), self.bootstrap_stagger)
+                except asyncio.TimeoutError:
+                    pass
+            if round_tasks:
+                await asyncio.gather(*round_tasks, return_exceptions=True)
+            wait = self._bootstrap_backoff.next_retry(pending)
+            if wait is None:
+                return
+            await asyncio.sleep(wait)
+
+    async def _announce(self) -> None:
+        while not self._stop_event.is_set():
+            packet = self.discovery.poll()
+            if packet is not None:
+                try:
+                    self._mcast_transport.sendto(packet, (self.mcast_group, self.mcast_port))
+                except Exception as e:
+                    server_log(f"[mcast-async] Errore invio announce: {e}")
+            await asyncio.sleep(max(0.01, self.discovery.next_wakeup()))
+
+    async def _idle_monitor(self) -> None:
+        while not self._stop_event.is_set():
+            for cid, addr in self.registry.find_idle(self.idle_timeout):
+                server_log(f"[idle-monitor] Connessione id={cid} addr={addr} idle>={self.idle_timeout}s -> chiudo")
+                self.registry.remove(cid)
+            await asyncio.sleep(self._idle_wait())
+
+    _idle_wait = Peer._idle_wait
+
+    def start_discovery(self):
+        self._ensure_loop()
+        try:
+            sock = self._create_mcast_socket()
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.host))
+            except Exception:
+                pass
+            sock.setblocking(False)
+        except Exception as e:
+            buffered_log(f"[mcast] Impossibile inizializzare multicast: {e}")
+            sock = None
+
+        async def _start():
+            if sock is not None:
+                self._mcast_transport, _ = await self._loop.create_datagram_endpoint(
+                    lambda: _DiscoveryProtocol(self), sock=sock
+                )
+                server_log(f"[mcast-async] Ascolto multicast {self.mcast_group}:{self.mcast_port} iface={self.host}")
+                self._spawn(self._announce())
+            if self._bootstrap_targets():
+                self._spawn(self._bootstrap())
+            self._spawn(self._idle_monitor())
+
+        self._run(_start())
+
+    def stop_discovery(self):
+        self._stop_event.set()
+        transport = self._mcast_transport
+        if transport is None:
+            return
+        sock = transport.get_extra_info("socket")
+        try:
+            mreq = socket.inet_aton(self.mcast_group) + socket.inet_aton(self.host)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, mreq)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(transport.close)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Command line: argument parsing and main()."""
+import argparse
+import os
+import signal
+import socket
+import sys
+import tempfile
+from typing import List, Optional
+
+from .config import (
+    DEFAULT_BOOTSTRAP_IPS, DEFAULT_BOOTSTRAP_PORT, DEFAULT_SEND_WAIT_TIMEOUT, DISCOVER_INTERVAL,
+    DISCOVER_MAX_INTERVAL, IDLE_TIMEOUT, MCAST_GRP, MCAST_PORT,
+)
+from .idle import KEEPALIVE_DEFAULT
+from .logs import LOG_BACKENDS, LOG_LEVELS, buffered_log, flush_logs, set_log_backend, set_log_level
+from .metrics import METRICS_HOST, MetricsExporter
+from .compression import CODEC_NAMES, COMPRESS_MIN_BYTES
+from .messages import DEFAULT_SERIALIZER, SERIALIZER_NAMES
+from .registry import DEFAULT_INBOX_BYTES, REGISTRIES
+from .queues import DEFAULT_SEND_QUEUE, LANE_WEIGHTS, SLOW_POLICIES
+from .gossip import BROADCAST_MODES, DEFAULT_GOSSIP_FANOUT
+from .dialing import BOOTSTRAP_MAX_INFLIGHT
+from .tls import PeerTLS
+from .discovery import ANNOUNCE_FORMATS
+from .engines import ENGINES
+from .control import ControlServer
+from .workers import WorkerPool
+from .repl import repl
+
+# ---------------- Helpers -----------------------------------------------------
+def parse_bootstrap_arg(arg: Optional[str]):
+    if not arg:
+        return [(ip, DEFAULT_BOOTSTRAP_PORT) for ip in DEFAULT_BOOTSTRAP_IPS]
+    pairs = []
+    for part in arg.split(","):
+        p = part.strip()
+        if not p:
+            continue
+        if ":" in p:
+            ip, pr = p.split(":", 1)
+            try:
+                port = int(pr)
+            except ValueError:
+                continue
+        else:
+            ip = p
+            port = DEFAULT_BOOTSTRAP_PORT
+        pairs.append((ip, port))
+    return pairs
+
+def default_control_path(host: str, port: int) -> str:
+    return os.path.join(tempfile.gettempdir(), f"p2p-{host}-{port}.sock")
+
+def get_local_ip(remote_host="8.8.8.8", remote_port=80):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect((remote_host, remote_port))
+        ip = s.getsockname()[0]
+    except Exception:
+        ip = "127.0.0.1"
+    finally:
+        try:
+            s.close()
+        except Exception:
+            pass
+    return ip
+
+DESCRIPTION = "P2P multicast (buffered logger + server->stderr)"
+
+def parse_args(argv: Optional[List[str]] = None, description: str = DESCRIPTION, **defaults):
+    """Options of the node; `defaults` overrides option defaults (see main)."""
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument("--host", "-H", default=None, help="Host bind IP (default auto-detected)")
+    p.add_argument("--port", "-p", type=int, default=8000, help="Porta di ascolto (default 8000)")
+    p.add_argument("--mcast", default=MCAST_GRP, help="Multicast group (default %(default)s)")
+    p.add_argument("--mport", type=int, default=MCAST_PORT, help="Multicast port (default %(default)s)")
+    p.add_argument("--announce", choices=ANNOUNCE_FORMATS, default="binary", help="binary = announce compatto con digest e intervallo adattivo, text = DISCOVER ip port fisso (default %(default)s)")
+    p.add_argument("--discover-max", type=float, default=DISCOVER_MAX_INTERVAL, help="Intervallo massimo announce binari a rete stabile, secondi (default %(default)s)")
+    p.add_argument("--bootstrap", default=None, help="Optional comma-separated bootstrap list ip:port (default uses embedded VMware IPs)")
+    p.add_argument("--compress", nargs="+", default=None, metavar="CODEC", help=f"Codec negoziabili, migliore per primo tra quelli comuni (default tutti gli installati: {' '.join(CODEC_NAMES)}; 'off' per disattivare)")
+    p.add_argument("--compress-min", type=int, default=COMPRESS_MIN_BYTES, help="Payload più piccoli di così non vengono compressi (default %(default)s byte)")
+    p.add_argument("--serializer", choices=list(SERIALIZER_NAMES), default=DEFAULT_SERIALIZER, help="Codifica dei messaggi tipizzati inviati (typed); si decodifica qualunque serializer installato (default %(default)s)")
+    p.add_argument("--tls-dir", default=None, metavar="DIR", help="mTLS tra peer: cartella con ca_cert.pem, server_*.pem e client_*.pem (SSL/2.SSL gen_certs)")
+    p.add_argument("--tls-no-resume", action="store_true", help="Disattiva la ripresa di sessione TLS 1.3 (ticket)")
+    p.add_argument("--peer-cache", default=None, metavar="FILE", help="File dei peer noti (punteggi, ultimo contatto): al riavvio si riconnette ai migliori")
+    p.add_argument("--bootstrap-inflight", type=int, default=BOOTSTRAP_MAX_INFLIGHT, help="Connect di bootstrap in parallelo (default %(default)s)")
+    p.add_argument("--files-dir", default=None, metavar="DIR", help="Accetta file dai peer (sendfile) salvandoli in DIR; senza, ogni offerta è rifiutata")
+    p.add_argument("--serve-rate", type=float, default=None, metavar="MB_S", help="Limite di upload per i download a sciame serviti da --files-dir, MB/s (default illimitato)")
+    p.add_argument("--idle", type=int, default=IDLE_TIMEOUT, help="Idle timeout in seconds (default %(default)s)")
+    p.add_argument("--keepalive", type=int, nargs="*", default=None, metavar="N",
+                   help=f"TCP keepalive del kernel sulle connessioni: IDLE INTERVALLO PROBE in secondi (senza valori {' '.join(map(str, KEEPALIVE_DEFAULT))}); un peer morto viene chiuso senza thread in polling")
+    p.add_argument("--send-timeout", type=float, default=DEFAULT_SEND_WAIT_TIMEOUT, help="Timeout send_and_wait in seconds (default %(default)s)")
+    p.add_argument("--registry", choices=sorted(REGISTRIES), default="default", help="default = lock unico, sharded = lock per shard (default %(default)s)")
+    p.add_argument("--send-queue", type=int, default=DEFAULT_SEND_QUEUE, help="Frame in coda di invio per connessione (default %(default)s)")
+    p.add_argument("--slow-policy", choices=SLOW_POLICIES, default="drop", help="Coda di invio piena: drop, block o disconnect (default %(default)s)")
+    p.add_argument("--lane-weights", type=int, nargs=2, default=list(LANE_WEIGHTS), metavar=("MSG", "GOSSIP"), help="Pesi (round robin sui byte) tra i messaggi del nodo e il gossip inoltrato in coda; i frame di controllo passano sempre per primi (default %(default)s)")
+    p.add_argument("--lane-rcvbuf", type=int, default=None, metavar="KB", help="Buffer di ricezione fisso (KiB) sulle connessioni messaggi: meno dati davanti alle risposte, ma finestra TCP limitata (default autotuning del kernel)")
+    p.add_argument("--no-lanes", action="store_true", help="Una sola coda FIFO per connessione: richieste e risposte aspettano dietro ai dati in coda")
+    p.add_argument("--broadcast", choices=BROADCAST_MODES, default="direct", help="direct = a tutte le connessioni, gossip = epidemico con fanout (default %(default)s)")
+    p.add_argument("--fanout", type=int, default=DEFAULT_GOSSIP_FANOUT, help="Vicini a cui inoltrare ogni gossip (default %(default)s)")
+    p.add_argument("--max-peers", type=int, default=None, help="Smetti di aprire connessioni oltre questo numero (default illimitato)")
+    p.add_argument("--log-level", choices=sorted(LOG_LEVELS, key=LOG_LEVELS.get), default="info", help="Soglia dei log server su stderr (default %(default)s)")
+    p.add_argument("--log-backend", choices=sorted(LOG_BACKENDS), default="async", help="async = writer in background, sync = scrittura immediata nel thread chiamante, null = scarta (default %(default)s)")
+    p.add_argument("--inbox-bytes", type=int, default=DEFAULT_INBOX_BYTES, help="Byte non letti per connessione prima di chiedere al mittente di trattenere i dati (MSG_FLOW); oltre il doppio si smette di leggere dal socket, 0 = non conservare i messaggi (default %(default)s)")
+    p.add_argument("--engine", choices=sorted(ENGINES), default="thread", help="thread = un thread per connessione, async = unico event loop (default %(default)s)")
+    p.add_argument("--workers", type=int, default=1, help="Processi che condividono la porta con SO_REUSEPORT (default %(default)s)")
+    p.add_argument("--daemon", action="store_true", help="Nessuna REPL: il nodo si pilota solo dall'API di controllo (--control) e termina con SIGTERM/SIGINT o op stop")
+    p.add_argument("--control", default=None, metavar="PATH", help="Socket Unix dell'API di controllo JSON lines (default con --daemon: <tmp>/p2p-HOST-PORT.sock)")
+    p.add_argument("--metrics-port", type=int, default=None, metavar="PORT", help=f"Esporta le metriche via HTTP su {METRICS_HOST}:PORT (/metrics testo Prometheus, /stats JSON)")
+    p.set_defaults(**defaults)
+    return p.parse_args(argv)
+
+# ---------------- Main -------------------------------------------------------
+def main(argv: Optional[List[str]] = None, description: str = DESCRIPTION, **defaults):
+    """Entry point of both scripts. Keyword arguments change option defaults,
+    e.g. main(announce="text", log_backend="sync"); the command line still wins."""
+    args = parse_args(argv, description, **defaults)
+    host = args.host if args.host else get_local_ip()
+    port = args.port
+    set_log_backend(args.log_backend)
+    set_log_level(args.log_level)
+    bootstrap = parse_bootstrap_arg(args.bootstrap)
+    bootstrap = [(ip, pr) for (ip, pr) in bootstrap if not (ip == host and pr == port)]
+
+    buffered_log(f"[main] Avvio peer su {host}:{port} (multicast {args.mcast}:{args.mport}) send_timeout={args.send_timeout}s engine={args.engine} workers={args.workers}")
+
+    keepalive = None
+    if args.keepalive is not None:
+        if len(args.keepalive) not in (0, 3):
+            buffered_log("[main] --keepalive vuole 0 o 3 valori: IDLE INTERVALLO PROBE")
+            flush_logs()
+            sys.exit(2)
+        keepalive = tuple(args.keepalive) or KEEPALIVE_DEFAULT
+
+    def make_peer():
+        return ENGINES[args.engine](
+            host,
+            port,
+            bootstrap=bootstrap,
+            mcast_group=args.mcast,
+            mcast_port=args.mport,
+            discover_interval=DISCOVER_INTERVAL,
+            discover_max_interval=args.discover_max,
+            announce_format=args.announce,
+            idle_timeout=args.idle,
+            send_wait_timeout=args.send_timeout,
+            registry=args.registry,
+            send_queue_size=args.send_queue,
+            slow_policy=args.slow_policy,
+            broadcast_mode=args.broadcast,
+            gossip_fanout=args.fanout,
+            max_peers=args.max_peers,
+            inbox_bytes=args.inbox_bytes,
+            reuse_port=args.workers > 1,
+            bootstrap_inflight=args.bootstrap_inflight,
+            peer_cache=args.peer_cache,
+            tls=PeerTLS.from_dir(args.tls_dir, resume=not args.tls_no_resume) if args.tls_dir else None,
+            compress=[] if args.compress == ["off"] else args.compress,
+            compress_min=args.compress_min,
+            keepalive=keepalive,
+            files_dir=args.files_dir,
+            serve_rate=args.serve_rate * 1e6 if args.serve_rate else None,
+            serializer=args.serializer,
+            priority_lanes=not args.no_lanes,
+            lane_weights=tuple(args.lane_weights),
+            lane_rcvbuf=args.lane_rcvbuf * 1024 if args.lane_rcvbuf else None,
+        )
+
+    if args.workers > 1:
+        peer = WorkerPool(args.workers, make_peer, broadcast_mode=args.broadcast, send_wait_timeout=args.send_timeout)
+    else:
+        peer = make_peer()
+
+    try:
+        peer.start_server()
+    except Exception as e:
+        buffered_log(f"[main] Impossibile avviare server: {e}")
+        flush_logs()
+        sys.exit(1)
+
+    peer.start_discovery()
+
+    exporter = None
+    if args.metrics_port is not None:
+        exporter = MetricsExporter(peer.stats, args.metrics_port)
+        try:
+            exporter.start()
+        except OSError as e:
+            buffered_log(f"[main] Impossibile esporre le metriche su {METRICS_HOST}:{args.metrics_port}: {e}")
+            exporter = None
+
+    ctl = None
+    control = args.control or (default_control_path(host, port) if args.daemon else None)
+    if control:
+        ctl = ControlServer(peer, control)
+        try:
+            ctl.start()
+        except OSError as e:
+            buffered_log(f"[main] Impossibile avviare l'API di controllo su {control}: {e}")
+            ctl = None
+            if args.daemon:
+                peer.stop_discovery()
+                peer.stop_server()
+                flush_logs()
+                sys.exit(1)
+
+    try:
+        if args.daemon:
+            buffered_log(f"[main] Modalità daemon: controllo su {control} (op stop o SIGTERM per terminare)")
+            stop = lambda signum, frame: ctl.stopped.set()
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT, stop)
+            flush_logs()
+            ctl.stopped.wait()   # signal handlers still run: the wait is interruptible
+        else:
+            repl(peer)
+    finally:
+        buffered_log("[main] Arresto...")
+        if ctl is not None:
+            ctl.stop()
+        if exporter is not None:
+            exporter.stop()
+        peer.stop_discovery()
+        peer.stop_server()
+        flush_logs()
+        print("Peer terminato.")
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Per-connection payload compression negotiated in the HELLO."""
+import functools
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple, Optional, List
+
+from .config import ConnID
+from .wire import (
+    FRAME_HEADER, FrameError, MAX_FRAME_SIZE, MSG_BINARY, MSG_COMPRESSED, MSG_REPLY, MSG_REQUEST,
+    MSG_RESPONSE, MSG_TEXT, MSG_TYPED, encode_frame,
+)
+
+# ---------------- Compression -------------------------------------------------
+# Optional codecs: used only when installed on both ends (negotiated per connection).
+try:
+    import lz4.frame as _lz4
+except ImportError:
+    _lz4 = None
+try:
+    import zstandard as _zstd
+except ImportError:
+    _zstd = None
+
+COMPRESSED_HEADER = struct.Struct("!BB")   # codec, type of the inner frame
+COMPRESS_MIN_BYTES = 1024       # smaller payloads are sent as they are
+COMPRESS_PROBE = 4096           # large payloads: compress this prefix first, give up if it does not shrink
+COMPRESSIBLE = (MSG_TEXT, MSG_REPLY, MSG_BINARY, MSG_REQUEST, MSG_RESPONSE, MSG_TYPED)
+
+# codec ids are bits: a peer announces the set it can decode as one mask byte
+CODEC_ZLIB = 1
+CODEC_LZ4 = 2
+CODEC_ZSTD = 4
+
+def _zlib_decompress(data: bytes, limit: int) -> bytes:
+    d = zlib.decompressobj()
+    out = d.decompress(data, limit)
+    if d.unconsumed_tail or not d.eof:
+        raise FrameError("zlib: payload oltre il limite o troncato")
+    return out
+
+def _lz4_decompress(data: bytes, limit: int) -> bytes:
+    d = _lz4.LZ4FrameDecompressor()
+    out = d.decompress(data, max_length=limit)
+    if not d.eof:
+        raise FrameError("lz4: payload oltre il limite o troncato")
+    return out
+
+_zstd_local = threading.local()
+
+def _zstd_compress(data) -> bytes:
+    # a ZstdCompressor must not be used by two threads at once: one per sending thread
+    compressor = getattr(_zstd_local, "compressor", None)
+    if compressor is None:
+        compressor = _zstd_local.compressor = _zstd.ZstdCompressor(level=3)
+    return compressor.compress(data)
+
+def _zstd_decompress(data: bytes, limit: int) -> bytes:
+    return _zstd.ZstdDecompressor().decompress(data, max_output_size=limit)
+
+# what a codec raises on a corrupt payload (lz4.frame: RuntimeError)
+CODEC_ERRORS: Tuple[type, ...] = (zlib.error, RuntimeError) + ((_zstd.ZstdError,) if _zstd is not None else ())
+
+# best first: id -> (name, compress, decompress(data, limit))
+CODECS: "OrderedDict[int, Tuple[str, Callable[[bytes], bytes], Callable[[bytes, int], bytes]]]" = OrderedDict()
+if _zstd is not None:
+    CODECS[CODEC_ZSTD] = ("zstd", _zstd_compress, _zstd_decompress)
+if _lz4 is not None:
+    CODECS[CODEC_LZ4] = ("lz4", _lz4.compress, _lz4_decompress)
+CODECS[CODEC_ZLIB] = ("zlib", functools.partial(zlib.compress, level=6), _zlib_decompress)
+CODEC_NAMES = {name: cid for cid, (name, _, _) in CODECS.items()}
+
+class Compression:
+    """Payload compression of one node.
+
+    The dialing side appends the mask of codecs it can decode to its HELLO,
+    the accepting side answers with MSG_CODECS; each side then sends with
+    the best codec both ends know. Frames are compressed only above
+    min_bytes and only when that makes them smaller; broadcast compresses
+    once per codec in use, not once per peer."""
+
+    def __init__(self, codecs: Optional[List[str]] = None, min_bytes: int = COMPRESS_MIN_BYTES):
+        names = list(CODEC_NAMES) if codecs is None else codecs
+        unknown = [n for n in names if n not in CODEC_NAMES]
+        if unknown:
+            raise ValueError(f"Codec non disponibili: {unknown} (installati: {list(CODEC_NAMES)})")
+        self.mask = 0
+        for name in names:
+            self.mask |= CODEC_NAMES[name]
+        self.min_bytes = min_bytes
+        self._tx: Dict[ConnID, int] = {}
+        self._stats_lock = threading.Lock()   # pack() runs on every sending thread
+        self.stats = {"frames": 0, "raw_bytes": 0, "wire_bytes": 0, "skipped": 0, "cpu_s": 0.0}
+
+    def hello_tail(self) -> bytes:
+        return bytes([self.mask]) if self.mask else b""
+
+    def negotiate(self, cid: ConnID, remote_mask: int) -> None:
+        common = self.mask & remote_mask
+        for codec in CODECS:
+            if codec & common:
+                self._tx[cid] = codec
+                return
+        self._tx.pop(cid, None)
+
+    def codec(self, cid: ConnID) -> int:
+        return self._tx.get(cid, 0)
+
+    def forget(self, cid: ConnID) -> None:
+        self._tx.pop(cid, None)
+
+    def pack(self, frame: bytes, codec: int) -> bytes:
+        """frame as a MSG_COMPRESSED frame with codec, or unchanged."""
+        if not codec or len(frame) - FRAME_HEADER.size < self.min_bytes or frame[4] not in COMPRESSIBLE:
+            return frame
+        compress = CODECS[codec][1]
+        payload = memoryview(frame)[FRAME_HEADER.size:]
+        t0 = time.perf_counter()
+        if len(payload) > 4 * COMPRESS_PROBE and len(compress(payload[:COMPRESS_PROBE])) > COMPRESS_PROBE * 0.9:
+            data = None
+        else:
+            data = compress(payload)
+        cpu = time.perf_counter() - t0
+        if data is None or len(data) + COMPRESSED_HEADER.size >= len(payload):
+            with self._stats_lock:
+                self.stats["cpu_s"] += cpu
+                self.stats["skipped"] += 1   # incompressible (already compressed, random)
+            return frame
+        out = encode_frame(MSG_COMPRESSED, COMPRESSED_HEADER.pack(codec, frame[4]) + data)
+        with self._stats_lock:
+            self.stats["cpu_s"] += cpu
+            self.stats["frames"] += 1
+            self.stats["raw_bytes"] += len(frame)
+            self.stats["wire_bytes"] += len(out)
+        return out
+
+    def for_conn(self, cid: ConnID, frame: bytes) -> bytes:
+        return self.pack(frame, self._tx.get(cid, 0))
+
+    def unpack(self, payload) -> Tuple[int, bytes]:
+        """(inner type, payload) of a MSG_COMPRESSED frame."""
+        if len(payload) < COMPRESSED_HEADER.size:
+            raise FrameError("Frame compresso troppo corto")
+        codec, msg_type = COMPRESSED_HEADER.unpack_from(payload)
+        if not codec & self.mask or codec not in CODECS or msg_type not in COMPRESSIBLE:
+            raise FrameError(f"Frame compresso non valido (codec={codec}, tipo={msg_type})")
+        try:
+            return msg_type, CODECS[codec][2](bytes(payload[COMPRESSED_HEADER.size:]), MAX_FRAME_SIZE)
+        except CODEC_ERRORS as e:
+            raise FrameError(f"Frame compresso corrotto ({CODECS[codec][0]}): {e}") from None
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Defaults shared by every module: multicast group, timeouts, bootstrap list."""
+from typing import Tuple
+
+# ---------------- Configuration ------------------------------------------------
+MCAST_GRP = "239.255.0.1"
+MCAST_PORT = 9999
+MCAST_TTL = 1
+DISCOVER_INTERVAL = 5.0          # announce interval right after a change (text: always)
+DISCOVER_MAX_INTERVAL = 60.0     # binary announces back off up to this once the peer set is stable
+IDLE_TIMEOUT = 300
+DEFAULT_SEND_WAIT_TIMEOUT = 5.0
+
+ConnID = int
+Addr = Tuple[str, int]
+
+DEFAULT_BOOTSTRAP_IPS = [
+    "192.168.58.143",
+    "192.168.58.2",
+    "192.168.58.1",
+    "192.168.58.137",
+    "192.168.58.139",
+    "192.168.58.140",
+    "192.168.58.254",
+]
+DEFAULT_BOOTSTRAP_PORT = 8000
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""JSON-lines control API over a Unix socket."""
+import json
+import os
+import socket
+import socketserver
+import threading
+from typing import Callable, Dict, Optional, List
+
+from .idle import Waker, serve_until
+from .logs import server_log
+from .messages import TypedMessage
+
+# ---------------- Control plane -----------------------------------------------
+# JSON lines over a Unix socket: one request per line, {"op": "<name>", ...args},
+# one reply per line, {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+# Used between WorkerPool and its workers, and by --daemon / --control for
+# scripts. Bulk ops keep the per-line cost off high-rate callers:
+#   {"op": "send_many", "cid": 1, "messages": [...]}        -> frames queued
+#   {"op": "request_many", "cid": 1, "messages": [...]}     -> replies, pipelined
+#   {"op": "batch", "calls": [{"op": ...}, ...]}            -> one reply per call
+class ControlError(Exception):
+    pass
+
+def _jsonable(value):
+    """MSG_BINARY payloads travel as {"hex": "..."} on the control socket,
+    TypedMessages as {"schema": name, "serializer": name, "fields": {...}}."""
+    if isinstance(value, (bytes, bytearray)):
+        return {"hex": bytes(value).hex()}
+    if isinstance(value, TypedMessage):
+        fields = {k: _jsonable(v) for k, v in value.fields().items()}
+        return {"schema": value.name, "serializer": value.serializer.name, "fields": fields}
+    return value
+
+def _from_jsonable(value):
+    if isinstance(value, dict) and "hex" in value:
+        return bytes.fromhex(value["hex"])
+    if isinstance(value, dict) and "schema" in value:
+        fields = {k: _from_jsonable(v) for k, v in value["fields"].items()}
+        return TypedMessage.build(value["schema"], fields, value["serializer"])
+    return value
+
+class ControlServer:
+    """Serves the control API of one peer on a Unix socket path."""
+
+    def __init__(self, peer, path: str):
+        self.peer = peer
+        self.path = path
+        self.stopped = threading.Event()
+        self.server = None
+        self.ops: Dict[str, Callable[..., object]] = {
+            "list_peers": lambda: self.peer.list_peers(),
+            "connect": lambda ip, port: self.peer.connect(ip, port),
+            "send": lambda cid, message: self.peer.send(cid, _from_jsonable(message)),
+            "send_typed": lambda cid, schema, fields: self.peer.send_typed(cid, schema, {k: _from_jsonable(v) for k, v in fields.items()}),
+            "send_and_wait": lambda cid, message, timeout=None: self.peer.send_and_wait(cid, message, timeout),
+            "send_many": lambda cid, messages: self.peer.send_many(cid, [_from_jsonable(m) for m in messages]),
+            "request_many": lambda cid, messages, timeout=None, window=None: self.peer.request_many(cid, messages, timeout, window),
+            "broadcast": lambda message: self.peer.broadcast(_from_jsonable(message)),
+            "gossip": lambda message, msg_id=None: self.peer.gossip(message, msg_id),
+            "send_to_node": lambda dest, message: self.peer.send_to_node(dest, message),
+            "dht_join": lambda: self.peer.dht_join(),
+            "send_file": lambda ip, port, path, name=None: self.peer.send_file(ip, port, path, name),
+            "fetch_blob": lambda name, sources=None: self.peer.fetch_blob(name, [tuple(s) for s in sources] if sources else None),
+            "recv": lambda cid, timeout=0: _jsonable(self.peer.recv(cid, timeout)),
+            "queues": lambda: self.peer.send_queue_stats(),
+            "stats": lambda: self.peer.stats(),
+            "disconnect": lambda cid: self.peer.disconnect(cid),
+            "start_discovery": lambda: self.peer.start_discovery(),
+            "stop_discovery": lambda: self.peer.stop_discovery(),
+            "stop": self.stopped.set,
+            "batch": lambda calls: [self.dispatch(call) for call in calls],
+        }
+        # REPL names
+        self.ops["peers"] = self.ops["list_peers"]
+        self.ops["close"] = self.ops["disconnect"]
+
+    def dispatch(self, req) -> Dict[str, object]:
+        if not isinstance(req, dict) or req.get("op") not in self.ops:
+            return {"ok": False, "error": "Richiesta non valida o op sconosciuta"}
+        args = dict(req)
+        op = self.ops[args.pop("op")]
+        try:
+            return {"ok": True, "result": op(**args)}
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    def start(self) -> None:
+        ctl = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        reply = ctl.dispatch(json.loads(line))
+                    except ValueError:
+                        reply = {"ok": False, "error": "JSON non valido"}
+                    self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+        class _Server(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = _Server(self.path, _Handler)
+        os.chmod(self.path, 0o600)   # the API can send anything as this node: owner only
+        self._waker = Waker()
+        self._thread = threading.Thread(target=serve_until, args=(self.server, self._waker), name="control", daemon=True)
+        self._thread.start()
+        server_log(f"[control] API di controllo su {self.path}")
+
+    def stop(self) -> None:
+        if self.server:
+            self._waker.set()
+            self._thread.join()
+            self.server.server_close()
+            self._waker.close()
+            self.server = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+class ControlClient:
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self._rfile = self.sock.makefile("rb")
+        self._lock = threading.Lock()
+
+    def call(self, op: str, **args):
+        line = json.dumps({"op": op, **args}).encode("utf-8") + b"\n"
+        with self._lock:
+            self.sock.sendall(line)
+            raw = self._rfile.readline()
+        if not raw:
+            raise ControlError("Connessione di controllo chiusa")
+        reply = json.loads(raw)
+        if not reply["ok"]:
+            raise ControlError(reply["error"])
+        return reply["result"]
+
+    def batch(self, calls: List[Dict[str, object]]) -> List[Dict[str, object]]:
+        """Several {"op": ...} requests in one round trip; one {"ok": ...}
+        reply per call, a failing call does not stop the others."""
+        return self.call("batch", calls=calls)
+
+    def close(self) -> None:
+        try:
+            self._rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Correlation ids of in-flight MSG_REQUESTs."""
+import concurrent.futures
+import itertools
+import threading
+from typing import Dict, Tuple
+
+from .config import ConnID
+
+# ---------------- Request/response correlation --------------------------------
+class PendingRequests:
+    """Correlation id -> Future of the matching MSG_RESPONSE.
+    Each send_and_wait owns its own id, so concurrent callers on one connection
+    never steal each other's replies and late replies are simply dropped."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, Tuple[ConnID, concurrent.futures.Future]] = {}
+        self.late = 0
+
+    def new(self, cid: ConnID) -> Tuple[int, concurrent.futures.Future]:
+        corr = next(self._ids)
+        fut: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            self._pending[corr] = (cid, fut)
+        return corr, fut
+
+    def resolve(self, corr: int, value: str) -> bool:
+        with self._lock:
+            item = self._pending.pop(corr, None)
+        if item is None:
+            self.late += 1
+            return False
+        item[1].set_result(value)
+        return True
+
+    def discard(self, corr: int) -> None:
+        with self._lock:
+            self._pending.pop(corr, None)
+
+    def fail_connection(self, cid: ConnID) -> None:
+        """Fail every request still waiting on a connection that went away."""
+        with self._lock:
+            dead = [corr for corr, (c, _) in self._pending.items() if c == cid]
+            items = [self._pending.pop(corr) for corr in dead]
+        for _, fut in items:
+            fut.set_exception(ConnectionError("Connessione chiusa prima della risposta"))
+
+    def __len__(self) -> int:
+        return len(self._pending)
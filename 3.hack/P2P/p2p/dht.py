@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Kademlia-style overlay: node ids, XOR-distance k-buckets and routed frames."""
+import hashlib
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .config import Addr, ConnID
+
+# ---------------- DHT routing -------------------------------------------------
+# Node ids are 64-bit hashes of the listening address, so any peer that knows an
+# address (HELLO, announces, FIND_NODE answers) knows the id too: nothing new to
+# exchange on connect. Buckets hold live connections only, a routed frame is
+# always forwarded over an existing TCP connection.
+DHT_ID_BITS = 64
+DHT_K = 8              # contacts a lookup tries to keep per bucket
+DHT_ALPHA = 3          # FIND_NODE queries in parallel per lookup round
+DHT_MAX_ROUNDS = 8     # a lookup stops earlier as soon as it stops getting closer
+DHT_QUERY_TIMEOUT = 2.0
+# ROUTE_DIAL requests a node acts on: per second on average, and in a burst
+# (a dht_join links to a few buckets' worth of contacts at once)
+DHT_DIAL_RATE = 2.0
+DHT_DIAL_BURST = 2 * DHT_K
+ROUTE_MAX_HOPS = DHT_ID_BITS   # every hop fixes at least one more leading bit
+
+ROUTE_HEADER = struct.Struct("!QQBB")   # destination id, origin id, hops so far, kind
+ROUTE_DATA = 0    # UTF-8 text for the destination node
+ROUTE_DIAL = 1    # HELLO_ADDR of the origin: "connect to me" (anti-duplicate rule: only it may dial)
+ROUTE_TYPED = 2   # TYPED_HEADER + body (messages.py): forwarded undecoded, parsed by the destination only
+FIND_HEADER = struct.Struct("!QQ")      # query id, target id; answered with MSG_NODES
+NODES_HEADER = struct.Struct("!Q")      # query id, then HELLO_ADDR per contact
+
+def node_id(addr: Addr) -> int:
+    """64-bit id of the node listening on addr."""
+    digest = hashlib.blake2b(f"{addr[0]}:{addr[1]}".encode("ascii"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+def bucket_index(a: int, b: int) -> int:
+    """Index of the k-bucket b falls into as seen from a (-1 when a == b):
+    the position of the highest bit in which the two ids differ."""
+    return (a ^ b).bit_length() - 1
+
+class RoutingTable:
+    """Connected peers by XOR distance from our own id, in DHT_ID_BITS buckets.
+
+    Every live connection whose listening address is known is a contact, so
+    routing can use all of them; `k` only bounds how many contacts a lookup
+    goes out of its way to connect to per bucket (wants()). Near buckets are
+    nearly empty and far ones cover half the id space each, which is what
+    makes a greedy next hop halve the remaining distance: O(log N) hops."""
+
+    def __init__(self, own_id: int, k: int = DHT_K):
+        self.own_id = own_id
+        self.k = k
+        self._lock = threading.Lock()
+        self._buckets: List[Dict[int, Tuple[Addr, ConnID]]] = [{} for _ in range(DHT_ID_BITS)]
+        self._by_cid: Dict[ConnID, int] = {}
+
+    def add(self, nid: int, addr: Addr, cid: ConnID) -> None:
+        i = bucket_index(self.own_id, nid)
+        if i < 0:
+            return
+        with self._lock:
+            self._buckets[i][nid] = (addr, cid)
+            self._by_cid[cid] = nid
+
+    def remove(self, cid: ConnID) -> None:
+        with self._lock:
+            nid = self._by_cid.pop(cid, None)
+            if nid is None:
+                return
+            bucket = self._buckets[bucket_index(self.own_id, nid)]
+            entry = bucket.get(nid)
+            if entry is not None and entry[1] == cid:
+                del bucket[nid]
+
+    def wants(self, nid: int) -> bool:
+        """True if connecting to nid would add a contact to a bucket below k."""
+        i = bucket_index(self.own_id, nid)
+        if i < 0:
+            return False
+        with self._lock:
+            bucket = self._buckets[i]
+            return nid not in bucket and len(bucket) < self.k
+
+    def next_hop(self, dest: int) -> Optional[Tuple[int, ConnID]]:
+        """(id, cid) of the contact closest to dest, if closer than ourselves.
+        Contacts in dest's bucket all are, and beat every other bucket; only
+        when that bucket is empty can a nearer bucket still help."""
+        b = bucket_index(self.own_id, dest)
+        if b < 0:
+            return None
+        own = self.own_id ^ dest
+        best: Optional[Tuple[int, ConnID]] = None
+        with self._lock:
+            for i in [b] + list(range(b - 1, -1, -1)):
+                for nid, (_, cid) in self._buckets[i].items():
+                    if (nid ^ dest) < own and (best is None or (nid ^ dest) < (best[0] ^ dest)):
+                        best = (nid, cid)
+                if best is not None and i == b:
+                    break
+        return best
+
+    def closest(self, target: int, n: int, exclude: Iterable[ConnID] = ()) -> List[Tuple[int, Addr, ConnID]]:
+        """The n contacts nearest to target, nearest first."""
+        skip = set(exclude)
+        with self._lock:
+            contacts = [(nid, addr, cid) for bucket in self._buckets for nid, (addr, cid) in bucket.items() if cid not in skip]
+        contacts.sort(key=lambda c: c[0] ^ target)
+        return contacts[:n]
+
+    def cid_of(self, nid: int) -> Optional[ConnID]:
+        with self._lock:
+            entry = self._buckets[bucket_index(self.own_id, nid)].get(nid) if nid != self.own_id else None
+        return entry[1] if entry is not None else None
+
+    def bucket_sizes(self) -> Dict[int, int]:
+        """{bucket index: contacts} of the non-empty buckets."""
+        with self._lock:
+            return {i: len(b) for i, b in enumerate(self._buckets) if b}
+
+    def __len__(self) -> int:
+        return len(self._by_cid)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Outbound dialing: per-address backoff and connection reuse/coalescing pools."""
+import asyncio
+import concurrent.futures
+import threading
+import time
+from typing import Callable, Dict, Tuple, Optional
+
+from .config import Addr, ConnID
+
+# ---------------- Outbound dialing --------------------------------------------
+BOOTSTRAP_MAX_INFLIGHT = 8       # concurrent bootstrap connects
+BOOTSTRAP_STAGGER = 0.25         # happy-eyeballs attempt delay before starting the next dial
+BOOTSTRAP_RETRY_BASE = 1.0
+BOOTSTRAP_RETRY_MAX = 60.0
+
+class DialBackoff:
+    """Per-address exponential backoff for failed dials."""
+
+    def __init__(self, base: float, cap: float, clock: Callable[[], float] = time.monotonic):
+        self.base = base
+        self.cap = max(base, cap)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state: Dict[Addr, Tuple[float, float]] = {}   # addr -> (retry_at, last delay)
+
+    def ready(self, addr: Addr) -> bool:
+        with self._lock:
+            state = self._state.get(addr)
+        return state is None or self.clock() >= state[0]
+
+    def failed(self, addr: Addr) -> float:
+        with self._lock:
+            prev = self._state.get(addr)
+            delay = self.base if prev is None else min(prev[1] * 2, self.cap)
+            self._state[addr] = (self.clock() + delay, delay)
+            return delay
+
+    def ok(self, addr: Addr) -> None:
+        with self._lock:
+            self._state.pop(addr, None)
+
+    def next_retry(self, addrs) -> Optional[float]:
+        """Seconds until the first of addrs may be dialed again (0 = now)."""
+        now = self.clock()
+        with self._lock:
+            times = [self._state[a][0] - now if a in self._state else 0.0 for a in addrs]
+        return max(0.0, min(times)) if times else None
+
+    def prune(self, older_than: float) -> None:
+        cutoff = self.clock() - older_than
+        with self._lock:
+            for addr in [a for a, (retry_at, _) in self._state.items() if retry_at < cutoff]:
+                del self._state[addr]
+
+class DialPool:
+    """Outbound connections by address. dial() hands back the id of a healthy
+    connection to that address when there is one (either direction), and
+    concurrent dials to the same address share one attempt instead of opening
+    duplicate sockets (bootstrap, discovery and the REPL can race)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Addr, concurrent.futures.Future] = {}
+        self.stats = {"dialed": 0, "reused": 0, "joined": 0, "failed": 0}
+
+    def dial(self, addr: Addr, existing: Callable[[Addr], Optional[ConnID]], opener: Callable[[], ConnID]) -> ConnID:
+        # in-flight first: the opener registers the connection before it leaves
+        # _inflight, so a caller that finds neither would really have to dial
+        with self._lock:
+            fut = self._inflight.get(addr)
+        if fut is None:
+            cid = existing(addr)
+            if cid is not None:
+                self.stats["reused"] += 1
+                return cid
+        with self._lock:
+            fut = self._inflight.get(addr)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[addr] = concurrent.futures.Future()
+        if not owner:
+            self.stats["joined"] += 1
+            return fut.result()
+        try:
+            cid = opener()
+        except BaseException as e:
+            self.stats["failed"] += 1
+            fut.set_exception(e)
+            raise
+        else:
+            self.stats["dialed"] += 1
+            fut.set_result(cid)
+            return cid
+        finally:
+            with self._lock:
+                self._inflight.pop(addr, None)
+
+class AsyncDialPool:
+    """DialPool for the event loop: same reuse and coalescing, asyncio futures."""
+
+    def __init__(self):
+        self._inflight: Dict[Addr, asyncio.Future] = {}
+        self.stats = {"dialed": 0, "reused": 0, "joined": 0, "failed": 0}
+
+    async def dial(self, addr: Addr, existing: Callable[[Addr], Optional[ConnID]], opener) -> ConnID:
+        fut = self._inflight.get(addr)
+        if fut is not None:
+            self.stats["joined"] += 1
+            return await asyncio.shield(fut)
+        cid = existing(addr)
+        if cid is not None:
+            self.stats["reused"] += 1
+            return cid
+        fut = self._inflight[addr] = asyncio.get_running_loop().create_future()
+        try:
+            cid = await opener()
+        except Exception as e:
+            self.stats["failed"] += 1
+            fut.set_exception(e)
+            fut.exception()   # retrieved: no "never retrieved" warning when nobody joined
+            raise
+        else:
+            self.stats["dialed"] += 1
+            fut.set_result(cid)
+            return cid
+        finally:
+            del self._inflight[addr]
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Multicast discovery: announce formats and the Trickle-like announce schedule."""
+import functools
+import hashlib
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, Tuple, Optional, List
+
+from .config import Addr, DISCOVER_INTERVAL, DISCOVER_MAX_INTERVAL
+from .dialing import DialBackoff
+
+# ---------------- Multicast discovery -----------------------------------------
+# Binary announce: ANNOUNCE_HEADER (magic, version, sender ip/port, peer count,
+# peer-set digest) followed by `count` ANNOUNCE_PEER entries, the listening
+# addresses of the sender's connections. The legacy text form "DISCOVER ip port"
+# is still accepted on receive.
+ANNOUNCE_MAGIC = b"P2"
+ANNOUNCE_VERSION = 1
+ANNOUNCE_HEADER = struct.Struct("!2sB4sHHQ")
+ANNOUNCE_PEER = struct.Struct("!4sH")
+ANNOUNCE_MAX_PEERS = (1400 - ANNOUNCE_HEADER.size) // ANNOUNCE_PEER.size   # one unfragmented datagram
+ANNOUNCE_REDUNDANCY = 2
+ANNOUNCE_FORMATS = ("binary", "text")
+
+@functools.lru_cache(maxsize=4096)
+def _addr_hash(addr: Addr) -> int:
+    ip, port = addr
+    h = hashlib.blake2b(socket.inet_aton(ip) + port.to_bytes(2, "big"), digest_size=8)
+    return int.from_bytes(h.digest(), "big")
+
+def peer_set_digest(addrs) -> int:
+    """Order-independent 64-bit digest of a set of addresses (XOR of per-address hashes)."""
+    digest = 0
+    for addr in set(addrs):
+        digest ^= _addr_hash(addr)
+    return digest
+
+def encode_announce(addr: Addr, digest: int, peers: List[Addr]) -> bytes:
+    parts = [ANNOUNCE_HEADER.pack(ANNOUNCE_MAGIC, ANNOUNCE_VERSION, socket.inet_aton(addr[0]), addr[1], len(peers), digest)]
+    parts.extend(ANNOUNCE_PEER.pack(socket.inet_aton(ip), port) for ip, port in peers)
+    return b"".join(parts)
+
+def decode_announce(data: bytes) -> Optional[Tuple[Addr, Optional[int], List[Addr]]]:
+    """(sender, digest, listed peers); digest is None for a legacy text announce."""
+    if data[:2] == ANNOUNCE_MAGIC:
+        if len(data) < ANNOUNCE_HEADER.size:
+            return None
+        _, version, ip, port, count, digest = ANNOUNCE_HEADER.unpack_from(data)
+        if version != ANNOUNCE_VERSION or len(data) < ANNOUNCE_HEADER.size + count * ANNOUNCE_PEER.size:
+            return None
+        peers = [
+            (socket.inet_ntoa(pip), pport)
+            for pip, pport in ANNOUNCE_PEER.iter_unpack(data[ANNOUNCE_HEADER.size:ANNOUNCE_HEADER.size + count * ANNOUNCE_PEER.size])
+        ]
+        return (socket.inet_ntoa(ip), port), digest, peers
+    parts = data.decode("utf-8", errors="replace").split()
+    if len(parts) < 3 or parts[0] != "DISCOVER":
+        return None
+    try:
+        return (parts[1], int(parts[2])), None, []
+    except ValueError:
+        return None
+
+class DiscoveryState:
+    """What to announce, when, and which announced peers to dial; shared by both
+    engines and by the simulation in bench_p2p.py (clock and rng are injectable).
+
+    "binary" announces carry the sender's peer-set digest (itself plus the
+    listening address of every connection) and those addresses, so a single
+    packet introduces a whole neighbourhood. The schedule is Trickle-like
+    (RFC 6206): the interval doubles from imin up to imax while the peer set is
+    unchanged, drops back to imin when it changes or an unknown node shows up,
+    and a node skips its announce when `redundancy` others carrying its own
+    digest were already heard in the interval. A repeated announce (same sender,
+    same digest) is dropped without touching the registry.
+    "text" is the old fixed-interval "DISCOVER ip port"."""
+
+    def __init__(
+        self,
+        addr: Addr,
+        peer_addrs: Callable[[], List[Addr]],
+        is_connected: Callable[[Addr], bool],
+        can_dial: Callable[[Addr], bool],
+        imin: float = DISCOVER_INTERVAL,
+        imax: float = DISCOVER_MAX_INTERVAL,
+        fmt: str = "binary",
+        redundancy: int = ANNOUNCE_REDUNDANCY,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Optional[random.Random] = None,
+    ):
+        if fmt not in ANNOUNCE_FORMATS:
+            raise ValueError(f"Formato announce sconosciuto: {fmt}")
+        if fmt == "binary":
+            try:
+                socket.inet_aton(addr[0])
+            except OSError:
+                fmt = "text"   # host is not an IPv4 literal: cannot be packed
+        self.addr = addr
+        self.fmt = fmt
+        self.peer_addrs = peer_addrs
+        self.is_connected = is_connected
+        self.can_dial = can_dial
+        self.imin = imin
+        self.imax = max(imin, imax)
+        self.redundancy = redundancy
+        self.clock = clock
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.interval = imin
+        self.digest: Optional[int] = None
+        self.known: Dict[Addr, float] = {}              # addr -> last time heard of
+        self._last_digest: Dict[Addr, int] = {}         # sender -> digest of its last announce
+        self._backoff = DialBackoff(imin, self.imax, clock)
+        self.stats = {"sent": 0, "suppressed": 0, "received": 0, "invalid": 0, "fast_path": 0, "slow_path": 0, "resets": 0}
+        now = clock()
+        self._begin(now)
+        self._t_send = now   # a new node announces itself right away
+
+    def _begin(self, now: float) -> None:
+        self._t_end = now + self.interval
+        self._t_send = now + self.interval * (0.5 + 0.5 * self._rng.random())
+        self._heard = 0
+        self._sent = False
+
+    def _reset(self, now: float) -> None:
+        self._last_digest.clear()
+        if self.interval > self.imin:
+            self.stats["resets"] += 1
+            self.interval = self.imin
+            self._begin(now)
+
+    def _prune(self, now: float) -> None:
+        ttl = 3 * self.imax
+        for addr in [a for a, t in self.known.items() if now - t > ttl and not self.is_connected(a)]:
+            del self.known[addr]
+        self._backoff.prune(ttl)
+
+    def poll(self) -> Optional[bytes]:
+        """Packet to multicast now, or None; call again after next_wakeup() seconds."""
+        with self._lock:
+            now = self.clock()
+            if self.fmt == "text":
+                if now < self._t_send:
+                    return None
+                self._t_send = now + self.imin
+                self.stats["sent"] += 1
+                return f"DISCOVER {self.addr[0]} {self.addr[1]}".encode("utf-8")
+            peers = self.peer_addrs()
+            digest = peer_set_digest([self.addr, *peers])
+            if digest != self.digest:
+                self.digest = digest
+                self._reset(now)
+            packet = None
+            if not self._sent and now >= self._t_send:
+                self._sent = True
+                if self._heard < self.redundancy:
+                    self.stats["sent"] += 1
+                    packet = encode_announce(self.addr, digest, peers[:ANNOUNCE_MAX_PEERS])
+                else:
+                    self.stats["suppressed"] += 1
+            if now >= self._t_end:
+                self.interval = min(self.interval * 2, self.imax)
+                self._begin(now)
+                self._prune(now)
+            return packet
+
+    def next_wakeup(self) -> float:
+        """Seconds until poll() has something to do (at most imin, so peer-set
+        changes are noticed quickly)."""
+        with self._lock:
+            target = self._t_end if (self._sent and self.fmt == "binary") else self._t_send
+            return max(0.0, min(target - self.clock(), self.imin))
+
+    def on_packet(self, data: bytes) -> List[Addr]:
+        """Handle a received announce; returns the addresses worth dialing."""
+        ann = decode_announce(data)
+        if ann is None:
+            with self._lock:
+                self.stats["invalid"] += 1
+            return []
+        sender, digest, listed = ann
+        if sender == self.addr:
+            return []
+        with self._lock:
+            self.stats["received"] += 1
+            now = self.clock()
+            if digest is not None:
+                if digest == self.digest:
+                    # the sender sees exactly our peer set: nothing to learn
+                    self._heard += 1
+                    self.known[sender] = now
+                    self.stats["fast_path"] += 1
+                    return []
+                if self._last_digest.get(sender) == digest:
+                    self.known[sender] = now
+                    self.stats["fast_path"] += 1
+                    return []
+                self._last_digest[sender] = digest
+            self.stats["slow_path"] += 1
+            dial = []
+            unknown = False
+            for addr in (sender, *listed):
+                if addr == self.addr:
+                    continue
+                connected = self.is_connected(addr)
+                if not connected and addr not in self.known:
+                    unknown = True
+                self.known[addr] = now
+                if not connected and self.can_dial(addr) and self._backoff.ready(addr):
+                    dial.append(addr)
+            if unknown and self.fmt == "binary":
+                self._reset(now)
+            return dial
+
+    def dial_failed(self, addr: Addr) -> None:
+        self._backoff.failed(addr)
+
+    def dial_ok(self, addr: Addr) -> None:
+        self._backoff.ok(addr)
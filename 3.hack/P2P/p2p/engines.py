@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""Transport engines by name."""
+
+from .peer import Peer
+from .aio import AsyncPeer
+
+# ---------------- Engines ----------------------------------------------------
+# --engine: one class per transport, same public API.
+ENGINES = {"thread": Peer, "async": AsyncPeer}
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Epidemic broadcast: header, limits and the seen-message set."""
+import struct
+import threading
+from collections import OrderedDict
+
+# ---------------- Gossip --------------------------------------------------------
+# In gossip mode a broadcast is not sent to every connection: each node forwards
+# a new message to `fanout` random neighbours, so it reaches the whole mesh in
+# O(log N) rounds while every node keeps only a few connections. Message ids
+# plus a bounded seen-set stop the epidemic from looping.
+GOSSIP_HEADER = struct.Struct("!QB")   # message id, hops travelled
+GOSSIP_MAX_HOPS = 32
+DEFAULT_GOSSIP_FANOUT = 3
+SEEN_CAPACITY = 65536
+BROADCAST_MODES = ("direct", "gossip")
+
+class SeenSet:
+    """Bounded LRU set of gossip message ids (oldest forgotten first)."""
+
+    def __init__(self, capacity: int = SEEN_CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._ids: "OrderedDict[int, None]" = OrderedDict()
+
+    def add(self, msg_id: int) -> bool:
+        """True if msg_id is new, False if it was already seen."""
+        with self._lock:
+            if msg_id in self._ids:
+                self._ids.move_to_end(msg_id)
+                return False
+            self._ids[msg_id] = None
+            if len(self._ids) > self.capacity:
+                self._ids.popitem(last=False)
+            return True
+
+    def __len__(self) -> int:
+        return len(self._ids)
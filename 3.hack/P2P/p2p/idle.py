@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Zero-cost idle: stop wakers, poll-free socket servers and TCP keepalive."""
+import os
+import select
+import selectors
+import socket
+import socketserver
+import sys
+from typing import Optional, Tuple
+
+# ---------------- Idle / shutdown ---------------------------------------------
+# (idle s, interval s, probes) for --keepalive without values: a dead peer is
+# noticed by the kernel after ~60 + 10*5 s of silence, with no thread awake meanwhile
+KEEPALIVE_DEFAULT = (60, 10, 5)
+# the idle monitor sleeps until the oldest connection can expire, plus this
+# fraction of idle_timeout: expirations close together share one wakeup
+IDLE_SLACK = 0.05
+
+class Waker:
+    """Level-triggered stop signal that select() can wait on: an eventfd on
+    Linux, a self-pipe elsewhere. Once set it stays readable, so every thread
+    selecting on it wakes up (there is no clear: it is meant for shutdown)."""
+
+    def __init__(self):
+        if hasattr(os, "eventfd"):
+            self._r = self._w = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        else:
+            self._r, self._w = os.pipe()
+            os.set_blocking(self._r, False)
+            os.set_blocking(self._w, False)
+        self._set = False
+
+    def fileno(self) -> int:
+        return self._r
+
+    def is_set(self) -> bool:
+        return self._set
+
+    def set(self) -> None:
+        if self._set:
+            return
+        self._set = True
+        try:
+            os.write(self._w, (1).to_bytes(8, sys.byteorder))   # eventfd wants 8 bytes
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        for fd in {self._r, self._w}:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._r = self._w = -1
+
+def wait_readable(sock, waker: Waker, timeout: Optional[float] = None) -> bool:
+    """Block until sock is readable (True) or waker is set (False), with no
+    periodic wakeups in between."""
+    if hasattr(select, "poll"):
+        # poll() keeps no kernel object: nothing to build and tear down per call
+        # (an epoll selector costs three syscalls), and no fd limit
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        poller.register(waker, select.POLLIN)
+        ready = poller.poll(None if timeout is None else max(0, int(timeout * 1000 + 0.999)))
+    else:
+        with selectors.DefaultSelector() as sel:
+            sel.register(sock, selectors.EVENT_READ)
+            sel.register(waker, selectors.EVENT_READ)
+            ready = sel.select(timeout)
+    return bool(ready) and not waker.is_set()
+
+def serve_until(server: socketserver.BaseServer, waker: Waker) -> None:
+    """serve_forever() without its poll interval: sleeps in select() until a
+    client connects or waker is set. Stop with waker.set() + join + server_close()
+    (not server.shutdown(), which waits for serve_forever). Sets server.timeout
+    to 0: handle_request() then never waits (the selector already did)."""
+    server.timeout = 0
+    with selectors.DefaultSelector() as sel:
+        sel.register(server, selectors.EVENT_READ)
+        sel.register(waker, selectors.EVENT_READ)
+        while not waker.is_set():
+            ready = sel.select()
+            if waker.is_set():
+                return
+            if ready:
+                server.handle_request()
+            server.service_actions()
+
+def set_keepalive(sock: socket.socket, keepalive: Tuple[int, int, int]) -> None:
+    """Let the kernel probe an idle connection: after `idle` silent seconds it
+    sends up to `count` probes `interval` seconds apart, then fails the socket,
+    which wakes the reader (thread engine) or calls connection_lost (async)."""
+    idle, interval, count = keepalive
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    idle_opt = getattr(socket, "TCP_KEEPIDLE", None) or getattr(socket, "TCP_KEEPALIVE", None)   # macOS
+    for opt, value in ((idle_opt, idle), (getattr(socket, "TCP_KEEPINTVL", None), interval),
+                       (getattr(socket, "TCP_KEEPCNT", None), count)):
+        if opt is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, opt, value)
+            except OSError:
+                pass
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Logging: REPL buffer (buffered_log) and server logs (server_log) behind a pluggable writer."""
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, Tuple, Optional, List
+
+# ---------------- Logging helpers ---------------------------------------------
+LOG_PROMPT = "p2p-mcast> "
+
+# buffered logs for REPL (flush before prompt)
+_buffer_lock = threading.Lock()
+_buffered_logs: List[str] = []
+
+# lock used when writing immediately to stderr/stdout
+_write_lock = threading.Lock()
+
+def buffered_log(msg: str) -> None:
+    """Append a timestamped message to the buffer (thread-safe).
+    These messages will be flushed by the REPL before showing the prompt."""
+    ts = time.strftime("%H:%M:%S")
+    entry = f"[{ts}] {msg}"
+    with _buffer_lock:
+        _buffered_logs.append(entry)
+
+def flush_logs() -> None:
+    """Print and clear all buffered logs to stdout. Call from REPL before input()."""
+    with _buffer_lock:
+        if not _buffered_logs:
+            return
+        to_print = _buffered_logs[:]
+        _buffered_logs.clear()
+    with _write_lock:
+        for line in to_print:
+            # ensure these go to stdout (so they get flushed before prompt)
+            sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+# server_log() hands entries to a writer backend (set_log_backend). The default,
+# AsyncLogWriter, never writes in the caller's thread: entries go to a bounded
+# deque that a background thread formats and writes to stderr in batches.
+# Arguments are %-formatted by the writer, so a message filtered out by level
+# costs one comparison, and a full queue drops (and counts) instead of blocking.
+LOG_DEBUG, LOG_INFO, LOG_WARNING, LOG_ERROR = 10, 20, 30, 40
+LOG_LEVELS = {"debug": LOG_DEBUG, "info": LOG_INFO, "warning": LOG_WARNING, "error": LOG_ERROR}
+LOG_QUEUE_MAX = 10000
+LOG_FLUSH_INTERVAL = 0.05
+
+class AsyncLogWriter:
+    def __init__(self, maxsize: int = LOG_QUEUE_MAX, interval: float = LOG_FLUSH_INTERVAL):
+        self.maxsize = maxsize
+        self.interval = interval
+        self.level = LOG_INFO
+        self.tag = ""   # prepended to every line, e.g. "[w1] " in a worker process
+        self.written = 0
+        self.dropped = 0
+        self._reported_drops = 0
+        self._q: "deque[Tuple[float, str, tuple]]" = deque()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # set by log() when entries are waiting: an idle node does not wake the writer
+        self._pending = threading.Event()
+        self._ts_sec = -1
+        self._ts_str = ""
+
+    def log(self, level: int, msg: str, args: tuple) -> None:
+        if level < self.level:
+            return
+        if len(self._q) >= self.maxsize:
+            self.dropped += 1
+            return
+        self._q.append((time.time(), msg, args))   # deque.append is atomic, no lock
+        if not self._pending.is_set():   # plain read; set() only once per batch
+            self._pending.set()
+        if self._thread is None:
+            self._start()
+
+    def _start(self) -> None:
+        with self._flush_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _stamp(self, t: float) -> str:
+        """HH:MM:SS, recomputed at most once per second."""
+        sec = int(t)
+        if sec != self._ts_sec:
+            self._ts_str = time.strftime("%H:%M:%S", time.localtime(sec))
+            self._ts_sec = sec
+        return self._ts_str
+
+    def _run(self) -> None:
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            time.sleep(self.interval)   # let a burst pile up into one write
+            self.flush()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            q = self._q
+            lines = []
+            while q:
+                t, msg, args = q.popleft()
+                if args:
+                    try:
+                        msg = msg % args
+                    except Exception:
+                        msg = f"{msg} {args!r}"
+                lines.append(f"[{self._stamp(t)}] {self.tag}{msg}\n")
+            if self.dropped != self._reported_drops:
+                lines.append(f"[{self._stamp(time.time())}] [log] {self.dropped - self._reported_drops} messaggi di log scartati (coda piena)\n")
+                self._reported_drops = self.dropped
+            if not lines:
+                return
+            with _write_lock:
+                sys.stderr.write("".join(lines))
+                sys.stderr.flush()
+            self.written += len(lines)
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": len(self._q), "written": self.written, "dropped": self.dropped}
+
+    def _after_fork(self) -> None:
+        """The writer thread does not survive fork(): the child starts its own."""
+        self._flush_lock = threading.Lock()
+        self._pending = threading.Event()
+        self._thread = None
+
+class SyncLogWriter:
+    """Writes every entry to stderr in the caller's thread, under the write lock:
+    lines appear immediately and are never dropped, at the cost of a write +
+    flush per call (the old server_log)."""
+
+    def __init__(self):
+        self.level = LOG_INFO
+        self.tag = ""
+        self.written = 0
+        self.dropped = 0
+
+    def log(self, level: int, msg: str, args: tuple) -> None:
+        if level < self.level:
+            return
+        if args:
+            try:
+                msg = msg % args
+            except Exception:
+                msg = f"{msg} {args!r}"
+        line = f"[{time.strftime('%H:%M:%S')}] {self.tag}{msg}\n"
+        with _write_lock:
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        self.written += 1
+
+    def flush(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": 0, "written": self.written, "dropped": self.dropped}
+
+    def _after_fork(self) -> None:
+        pass
+
+class NullLogWriter(SyncLogWriter):
+    """Discards everything (benchmarks): only the level check is paid."""
+
+    def log(self, level: int, msg: str, args: tuple) -> None:
+        if level >= self.level:
+            self.dropped += 1
+
+# --log-backend
+LOG_BACKENDS = {"async": AsyncLogWriter, "sync": SyncLogWriter, "null": NullLogWriter}
+
+_log_writer = AsyncLogWriter()
+
+def _reinit_logging_after_fork() -> None:
+    global _write_lock
+    _write_lock = threading.Lock()
+    _log_writer._after_fork()
+
+os.register_at_fork(after_in_child=_reinit_logging_after_fork)
+
+def set_log_backend(name: str) -> None:
+    """Replace the server_log writer; level and tag carry over, pending
+    entries of the old writer are flushed first."""
+    global _log_writer
+    old = _log_writer
+    old.flush()
+    _log_writer = LOG_BACKENDS[name]()
+    _log_writer.level = old.level
+    _log_writer.tag = old.tag
+
+def set_log_level(name: str) -> None:
+    _log_writer.level = LOG_LEVELS[name]
+
+def set_log_tag(tag: str) -> None:
+    """Prefix for every server log line, e.g. "[w1] " in a worker process."""
+    _log_writer.tag = tag
+
+def flush_server_logs() -> None:
+    _log_writer.flush()
+
+def log_stats() -> Dict[str, int]:
+    """Lines queued, written and dropped by the current writer."""
+    return _log_writer.stats()
+
+def server_log(msg: str, *args, level: int = LOG_INFO) -> None:
+    """Non-blocking log to stderr for server-side 'refresh' logs (see AsyncLogWriter).
+    Use this for messages generated by server/listener threads so they can be redirected.
+    On hot paths pass the values as args ("... %s", x) so nothing is formatted
+    when the level is disabled.
+    WARNING: printing to stderr will still appear on the terminal unless redirected."""
+    _log_writer.log(level, msg, args)
+
+def log_critical(msg: str) -> None:
+    """Critical message printed immediately to stdout (rare)."""
+    with _write_lock:
+        sys.stdout.write("\n" + msg + "\n")
+        sys.stdout.flush()
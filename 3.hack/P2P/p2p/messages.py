@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""Typed messages: registered schemas, pluggable serializers and lazy decoding."""
+import abc
+import base64
+import binascii
+import json
+import struct
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Union
+
+from .wire import MSG_TYPED, encode_frame
+
+# ---------------- Typed messages ----------------------------------------------
+# MSG_TYPED carries structured data instead of a string split by hand:
+#   TYPED_HEADER (schema id, serializer id) + body
+# A schema is an ordered list of (field, kind) registered under the same id on
+# every node. The serializer is the sender's choice and travels in the header,
+# so nodes with a different --serializer still understand each other as long
+# as the receiver has it installed (struct and json always are).
+# Decoding is lazy: receiving a message only reads its header, a field is
+# decoded when asked for (struct unpacks that field alone), and a node that
+# forwards a routed message (send_to_node) never decodes its body at all.
+
+# Optional serializers: msgpack/cbor2 are used only where installed.
+try:
+    import msgpack as _msgpack
+except ImportError:
+    _msgpack = None
+try:
+    import cbor2 as _cbor2
+except ImportError:
+    _cbor2 = None
+
+TYPED_HEADER = struct.Struct("!HB")   # schema id, serializer id
+_VAR_LEN = struct.Struct("!I")        # length prefix of str/bytes fields (struct serializer)
+
+# kind -> struct code; None = variable length
+FIELD_KINDS = {
+    "u8": "B", "u16": "H", "u32": "I", "u64": "Q", "i32": "i", "i64": "q", "f64": "d", "bool": "?",
+    "str": None, "bytes": None,
+}
+
+# integer kind -> (min, max), from its struct code
+_INT_RANGES = {}
+for _kind, _code in FIELD_KINDS.items():
+    if _code is not None and _code in "BHIQiq":
+        _bits = 8 * struct.calcsize("!" + _code)
+        _INT_RANGES[_kind] = (0, (1 << _bits) - 1) if _code.isupper() else (-(1 << (_bits - 1)), (1 << (_bits - 1)) - 1)
+
+class MessageError(ValueError):
+    """Unknown schema or serializer, wrong fields, or a body that does not decode."""
+
+class FieldKindError(MessageError):
+    """A decoded value is not of the kind its schema declares, whichever
+    serializer carried it. The frame itself is fine: like any MessageError
+    it rejects the message, not the connection."""
+
+class Schema:
+    """Ordered, typed fields of one message type.
+
+    The struct layout packs the fixed-size fields first, in declaration order,
+    behind one precompiled Struct, then each str/bytes field with a 4-byte
+    length: any fixed field can be read with a single unpack_from at a known
+    offset, without touching the rest of the body."""
+
+    def __init__(self, schema_id: int, name: str, fields: List[Tuple[str, str]]):
+        if not 0 < schema_id < 1 << 16:
+            raise MessageError(f"Id di schema fuori intervallo: {schema_id}")
+        names = [n for n, _ in fields]
+        bad = [k for _, k in fields if k not in FIELD_KINDS]
+        if bad or len(set(names)) != len(names):
+            raise MessageError(f"Schema {name}: tipi sconosciuti {bad} o campi duplicati")
+        self.id = schema_id
+        self.name = name
+        self.fields = tuple((n, k) for n, k in fields)
+        self.names = tuple(names)
+        self.kinds = dict(self.fields)
+        fixed = [(n, k) for n, k in self.fields if FIELD_KINDS[k] is not None]
+        self.fixed = struct.Struct("!" + "".join(FIELD_KINDS[k] for _, k in fixed))
+        self.fixed_names = tuple(n for n, _ in fixed)
+        self.var_names = tuple(n for n, k in self.fields if FIELD_KINDS[k] is None)
+        self.packed_order = self.fixed_names + self.var_names == self.names   # decode needs no reordering
+        # field -> (Struct, offset) if fixed, (None, index among the variable fields) otherwise
+        self.slots: Dict[str, Tuple[object, int]] = {}
+        offset = 0
+        for n, k in fixed:
+            one = struct.Struct("!" + FIELD_KINDS[k])
+            self.slots[n] = (one, offset)
+            offset += one.size
+        for i, n in enumerate(self.var_names):
+            self.slots[n] = (None, i)
+
+    def check(self, fields: Dict[str, object]) -> None:
+        if fields.keys() != self.kinds.keys():
+            raise MessageError(f"{self.name}: campi attesi {list(self.names)}, ricevuti {sorted(fields)}")
+
+    def __repr__(self) -> str:
+        return f"Schema({self.id}, {self.name!r}, {list(self.fields)})"
+
+# ---------------- Schema registry ---------------------------------------------
+# ids below 100 are reserved for the package
+SCHEMAS: Dict[int, Schema] = {}
+SCHEMA_NAMES: Dict[str, Schema] = {}
+
+def register_schema(schema_id: int, name: str, fields: List[Tuple[str, str]]) -> Schema:
+    """Register a message type; registering the same definition again is a no-op."""
+    schema = Schema(schema_id, name, fields)
+    old = SCHEMAS.get(schema_id) or SCHEMA_NAMES.get(name)
+    if old is not None:
+        if (old.id, old.name, old.fields) == (schema.id, schema.name, schema.fields):
+            return old
+        raise MessageError(f"Schema {schema_id}/{name} in conflitto con {old.id}/{old.name}")
+    SCHEMAS[schema_id] = SCHEMA_NAMES[name] = schema
+    return schema
+
+def get_schema(schema: Union[int, str, Schema]) -> Schema:
+    if isinstance(schema, Schema):
+        return schema
+    found = SCHEMAS.get(schema) if isinstance(schema, int) else SCHEMA_NAMES.get(schema)
+    if found is None:
+        raise MessageError(f"Schema sconosciuto: {schema!r}")
+    return found
+
+SCHEMA_CHAT = register_schema(1, "chat", [("text", "str")])
+SCHEMA_PING = register_schema(2, "ping", [("seq", "u32"), ("sent", "f64")])
+
+# ---------------- Serializers -------------------------------------------------
+def _check_kinds(schema: Schema, values) -> Dict[str, object]:
+    """values (declaration order) as StructSerializer would decode them:
+    integers within the range of their kind, f64 as float (integers widened),
+    bool, str and bytes exactly. Self-describing formats (json, msgpack, cbor)
+    carry their own types, so a peer can send anything: FieldKindError on the
+    first field that does not match."""
+    out = {}
+    for (name, kind), value in zip(schema.fields, values):
+        limits = _INT_RANGES.get(kind)
+        if limits is not None:
+            ok = type(value) is int and limits[0] <= value <= limits[1]
+        elif kind == "f64":
+            ok = type(value) in (int, float)
+            if ok:
+                try:
+                    value = float(value)
+                except OverflowError:
+                    ok = False
+        elif kind == "bool":
+            ok = type(value) is bool
+        elif kind == "str":
+            ok = type(value) is str
+        else:
+            ok = isinstance(value, (bytes, bytearray))
+            if ok:
+                value = bytes(value)
+        if not ok:
+            raise FieldKindError(f"{schema.name}: {name} dovrebbe essere {kind}, ricevuto {type(value).__name__} {value!r:.40}")
+        out[name] = value
+    return out
+
+class Serializer(abc.ABC):
+    """encode(schema, fields) -> body, decode(schema, body) -> fields in
+    declaration order, field(schema, body, name) -> one value. The default
+    field() decodes the whole body; serializers with a fixed layout override it
+    and set partial_decode, otherwise TypedMessage decodes a body once and
+    serves every field from that."""
+    id = 0
+    name = ""
+    partial_decode = False
+
+    @abc.abstractmethod
+    def encode(self, schema: Schema, fields: Dict[str, object]) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def decode(self, schema: Schema, body) -> Dict[str, object]:
+        ...
+
+    def field(self, schema: Schema, body, name: str):
+        return self.decode(schema, body)[name]
+
+class StructSerializer(Serializer):
+    """Schema-driven binary layout (see Schema): no field names on the wire."""
+    id = 1
+    name = "struct"
+    partial_decode = True
+
+    def encode(self, schema: Schema, fields: Dict[str, object]) -> bytes:
+        try:
+            fixed = schema.fixed.pack(*map(fields.__getitem__, schema.fixed_names))
+            if not schema.var_names:
+                return fixed
+            parts = [fixed]
+            for n in schema.var_names:
+                value = fields[n]
+                if schema.kinds[n] == "str":
+                    value = value.encode("utf-8")
+                parts.append(_VAR_LEN.pack(len(value)))
+                parts.append(bytes(value))
+        except (struct.error, AttributeError, TypeError) as e:
+            raise MessageError(f"{schema.name}: {e}") from None
+        return b"".join(parts)
+
+    def _var(self, schema: Schema, body, offset: int, name: str) -> Tuple[object, int]:
+        if offset + _VAR_LEN.size > len(body):
+            raise MessageError(f"{schema.name}: corpo troncato prima di {name}")
+        (n,) = _VAR_LEN.unpack_from(body, offset)
+        start = offset + _VAR_LEN.size
+        if start + n > len(body):
+            raise MessageError(f"{schema.name}: {name} oltre la fine del corpo")
+        raw = body[start:start + n]
+        if schema.kinds[name] == "bytes":
+            return bytes(raw), start + n
+        try:
+            return str(raw, "utf-8"), start + n
+        except UnicodeDecodeError as e:
+            raise MessageError(f"{schema.name}: {name} non è UTF-8 ({e})") from None
+
+    def decode(self, schema: Schema, body) -> Dict[str, object]:
+        if len(body) < schema.fixed.size:
+            raise MessageError(f"{schema.name}: corpo di {len(body)} byte, attesi almeno {schema.fixed.size}")
+        values = dict(zip(schema.fixed_names, schema.fixed.unpack_from(body)))
+        offset = schema.fixed.size
+        for n in schema.var_names:
+            values[n], offset = self._var(schema, body, offset, n)
+        if offset != len(body):
+            raise MessageError(f"{schema.name}: {len(body) - offset} byte in eccesso")
+        return values if schema.packed_order else {n: values[n] for n in schema.names}
+
+    def field(self, schema: Schema, body, name: str):
+        one, pos = schema.slots[name]
+        if len(body) < schema.fixed.size:
+            raise MessageError(f"{schema.name}: corpo di {len(body)} byte, attesi almeno {schema.fixed.size}")
+        if one is not None:
+            return one.unpack_from(body, pos)[0]
+        offset = schema.fixed.size
+        for n in schema.var_names[:pos]:   # skip the variable fields before it
+            if offset + _VAR_LEN.size > len(body):
+                raise MessageError(f"{schema.name}: corpo troncato prima di {n}")
+            offset += _VAR_LEN.size + _VAR_LEN.unpack_from(body, offset)[0]
+        return self._var(schema, body, offset, name)[0]
+
+class JsonSerializer(Serializer):
+    """Self-describing JSON object; bytes fields as base64 strings."""
+    id = 2
+    name = "json"
+
+    def encode(self, schema: Schema, fields: Dict[str, object]) -> bytes:
+        try:
+            obj = {n: base64.b64encode(fields[n]).decode("ascii") if schema.kinds[n] == "bytes" else fields[n]
+                   for n in schema.names}
+            return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        except (TypeError, ValueError) as e:
+            raise MessageError(f"{schema.name}: {e}") from None
+
+    def decode(self, schema: Schema, body) -> Dict[str, object]:
+        try:
+            obj = json.loads(bytes(body))
+        except (ValueError, TypeError) as e:
+            raise MessageError(f"{schema.name}: JSON non valido ({e})") from None
+        if not isinstance(obj, dict):
+            raise MessageError(f"{schema.name}: atteso un oggetto JSON")
+        schema.check(obj)
+        values = []
+        for n in schema.names:
+            value = obj[n]
+            if schema.kinds[n] == "bytes":
+                if type(value) is not str:
+                    raise FieldKindError(f"{schema.name}: {n} dovrebbe essere base64, ricevuto {type(value).__name__}")
+                try:
+                    value = base64.b64decode(value, validate=True)
+                except (ValueError, binascii.Error) as e:
+                    raise FieldKindError(f"{schema.name}: {n} non è base64 valido ({e})") from None
+            values.append(value)
+        return _check_kinds(schema, values)
+
+class _ArraySerializer(Serializer):
+    """Field values as one array in declaration order (no names on the wire)."""
+
+    def __init__(self, dumps, loads):
+        self._dumps = dumps
+        self._loads = loads
+
+    def encode(self, schema: Schema, fields: Dict[str, object]) -> bytes:
+        try:
+            return self._dumps([fields[n] for n in schema.names])
+        except (TypeError, ValueError, OverflowError) as e:
+            raise MessageError(f"{schema.name}: {e}") from None
+
+    def decode(self, schema: Schema, body) -> Dict[str, object]:
+        try:
+            values = self._loads(bytes(body))
+        except (ValueError, TypeError) as e:
+            raise MessageError(f"{schema.name}: {self.name} non valido ({e})") from None
+        if not isinstance(values, list) or len(values) != len(schema.names):
+            raise MessageError(f"{schema.name}: attesi {len(schema.names)} valori")
+        return _check_kinds(schema, values)
+
+class MsgpackSerializer(_ArraySerializer):
+    id = 3
+    name = "msgpack"
+
+    def __init__(self):
+        super().__init__(lambda v: _msgpack.packb(v, use_bin_type=True),
+                         lambda b: _msgpack.unpackb(b, raw=False, strict_map_key=True))
+
+class CborSerializer(_ArraySerializer):
+    id = 4
+    name = "cbor"
+
+    def __init__(self):
+        super().__init__(_cbor2.dumps, _cbor2.loads)
+
+# id -> serializer, in order of preference for bench/help
+SERIALIZERS: "OrderedDict[int, Serializer]" = OrderedDict()
+for _ser in [StructSerializer(), JsonSerializer()]:
+    SERIALIZERS[_ser.id] = _ser
+if _msgpack is not None:
+    SERIALIZERS[MsgpackSerializer.id] = MsgpackSerializer()
+if _cbor2 is not None:
+    SERIALIZERS[CborSerializer.id] = CborSerializer()
+SERIALIZER_NAMES = {s.name: s for s in SERIALIZERS.values()}
+DEFAULT_SERIALIZER = "struct"
+
+def get_serializer(serializer: Union[str, Serializer]) -> Serializer:
+    if isinstance(serializer, Serializer):
+        return serializer
+    found = SERIALIZER_NAMES.get(serializer)
+    if found is None:
+        raise MessageError(f"Serializer non disponibile: {serializer} (installati: {list(SERIALIZER_NAMES)})")
+    return found
+
+# ---------------- Messages ----------------------------------------------------
+class TypedMessage:
+    """One message of a registered schema, decoded on demand.
+
+    build() encodes once (the payload is reused by every send/broadcast);
+    parse() only reads the header of a received payload: msg["field"]
+    decodes that field (struct) or the whole body, fields() the whole body;
+    a whole decode is cached."""
+
+    __slots__ = ("schema", "serializer", "body", "_fields")
+
+    def __init__(self, schema: Schema, serializer: Serializer, body: bytes, fields=None):
+        self.schema = schema
+        self.serializer = serializer
+        self.body = body
+        self._fields = fields
+
+    @classmethod
+    def build(cls, schema: Union[int, str, Schema], fields: Dict[str, object],
+              serializer: Union[str, Serializer] = DEFAULT_SERIALIZER) -> "TypedMessage":
+        schema = get_schema(schema)
+        serializer = get_serializer(serializer)
+        schema.check(fields)
+        return cls(schema, serializer, serializer.encode(schema, fields), dict(fields))
+
+    @classmethod
+    def parse(cls, payload) -> "TypedMessage":
+        """Header only; the body is kept as bytes until a field is read."""
+        if len(payload) < TYPED_HEADER.size:
+            raise MessageError("Messaggio tipizzato troppo corto")
+        schema_id, ser_id = TYPED_HEADER.unpack_from(payload)
+        schema = SCHEMAS.get(schema_id)
+        if schema is None:
+            raise MessageError(f"Schema sconosciuto: {schema_id}")
+        serializer = SERIALIZERS.get(ser_id)
+        if serializer is None:
+            raise MessageError(f"Serializer {ser_id} non installato")
+        return cls(schema, serializer, bytes(payload[TYPED_HEADER.size:]))
+
+    @property
+    def name(self) -> str:
+        return self.schema.name
+
+    def __getitem__(self, name: str):
+        if self._fields is None and not self.serializer.partial_decode:
+            self.fields()
+        if self._fields is not None:
+            return self._fields[name]
+        return self.serializer.field(self.schema, self.body, name)   # KeyError for an unknown field
+
+    def fields(self) -> Dict[str, object]:
+        if self._fields is None:
+            self._fields = self.serializer.decode(self.schema, self.body)
+        return self._fields
+
+    def payload(self) -> bytes:
+        return TYPED_HEADER.pack(self.schema.id, self.serializer.id) + self.body
+
+    def frame(self) -> bytes:
+        return encode_frame(MSG_TYPED, self.payload())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TypedMessage):
+            return NotImplemented
+        return self.schema is other.schema and self.fields() == other.fields()
+
+    def __repr__(self) -> str:
+        try:
+            return f"{self.schema.name}{self.fields()}"
+        except MessageError:
+            return f"{self.schema.name}<{len(self.body)} byte non decodificabili>"
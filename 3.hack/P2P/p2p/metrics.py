@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Per-thread counters and latency histograms, text/Prometheus rendering, HTTP exporter."""
+import http.server
+import json
+import threading
+from typing import Callable, Dict, Tuple, List
+
+from .idle import Waker, serve_until
+from .logs import LOG_DEBUG, server_log
+
+# ---------------- Metrics -----------------------------------------------------
+# Counters and latency histograms are accumulated per thread: every thread
+# writes only its own shard (a plain dict, no lock, no atomic), and snapshot()
+# adds the shards up. Shards of threads that have exited are folded into one
+# retired shard, so short-lived handler threads do not pile up.
+# Per-connection byte/message counts live on the connection itself (FrameReader,
+# SendQueue) and are folded into the counters when it closes.
+HIST_BUCKETS = 28        # bucket i counts latencies below 2**i microseconds (the last one: everything above)
+METRICS_HOST = "127.0.0.1"
+CONN_IO_KEYS = ("msgs_in", "bytes_in", "msgs_out", "bytes_out")
+
+class _MetricShard:
+    __slots__ = ("counters", "hists")
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.hists: Dict[str, List[float]] = {}   # HIST_BUCKETS counts + sum of seconds
+
+    def merge(self, other: "_MetricShard") -> None:
+        for name, n in list(other.counters.items()):
+            self.counters[name] = self.counters.get(name, 0) + n
+        for name, src in list(other.hists.items()):
+            dst = self.hists.setdefault(name, [0] * HIST_BUCKETS + [0.0])
+            for i, n in enumerate(list(src)):
+                dst[i] += n
+
+class Metrics:
+    """Named counters and latency histograms of one peer (see the section comment)."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()    # shard registration and snapshot only, never inc/observe
+        self._shards: List[Tuple[threading.Thread, _MetricShard]] = []
+        self._retired = _MetricShard()
+
+    def _shard(self) -> _MetricShard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _MetricShard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def inc(self, name: str, n: int = 1) -> None:
+        counters = self._shard().counters
+        counters[name] = counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record one latency sample in the histogram `name`."""
+        hists = self._shard().hists
+        h = hists.get(name)
+        if h is None:
+            h = hists[name] = [0] * HIST_BUCKETS + [0.0]
+        h[min(int(seconds * 1e6).bit_length(), HIST_BUCKETS - 1)] += 1
+        h[HIST_BUCKETS] += seconds
+
+    def fold_conn(self, msgs_in: int, bytes_in: int, msgs_out: int, bytes_out: int, dropped: int) -> None:
+        """Add the totals of a closed connection to the node counters."""
+        counters = self._shard().counters
+        for name, n in zip(CONN_IO_KEYS + ("send_dropped",), (msgs_in, bytes_in, msgs_out, bytes_out, dropped)):
+            counters[name] = counters.get(name, 0) + n
+
+    def snapshot(self) -> Dict[str, object]:
+        """{"counters": {name: n}, "histograms": {name: {"buckets": [...], "sum": s}}}"""
+        total = _MetricShard()
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._retired.merge(shard)   # nobody writes it any more
+            self._shards = live
+            total.merge(self._retired)
+            for _, shard in live:
+                total.merge(shard)
+        return {
+            "counters": total.counters,
+            "histograms": {name: {"buckets": h[:HIST_BUCKETS], "sum": h[HIST_BUCKETS]} for name, h in total.hists.items()},
+        }
+
+def hist_quantile(buckets: List[int], q: float) -> float:
+    """Upper bound, in seconds, of the bucket holding the q-quantile (0 if empty)."""
+    count = sum(buckets)
+    if not count:
+        return 0.0
+    rank = q * count
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= rank:
+            return (1 << i) / 1e6
+    return (1 << (len(buckets) - 1)) / 1e6
+
+def merge_stats(snaps: List[Dict[str, object]]) -> Dict[str, object]:
+    """Add up the stats() of several nodes (WorkerPool): counters, gauges and
+    histogram buckets are summed (gauges ending in _max take the max),
+    connections are concatenated."""
+    out: Dict[str, object] = {"counters": {}, "gauges": {}, "histograms": {}, "connections": []}
+    for snap in snaps:
+        for name, n in snap["counters"].items():
+            out["counters"][name] = out["counters"].get(name, 0) + n
+        for name, v in snap["gauges"].items():
+            prev = out["gauges"].get(name, 0)
+            out["gauges"][name] = max(prev, v) if name.endswith("_max") else prev + v
+        for name, h in snap["histograms"].items():
+            dst = out["histograms"].setdefault(name, {"buckets": [0] * len(h["buckets"]), "sum": 0.0})
+            dst["buckets"] = [a + b for a, b in zip(dst["buckets"], h["buckets"])]
+            dst["sum"] += h["sum"]
+        out["connections"].extend(snap["connections"])
+    return out
+
+def format_stats(snap: Dict[str, object]) -> List[str]:
+    """Human-readable lines for the REPL `stats` command."""
+    lines = [
+        "contatori: " + " ".join(f"{k}={v}" for k, v in sorted(snap["counters"].items())),
+        "gauge:     " + " ".join(f"{k}={v}" for k, v in sorted(snap["gauges"].items())),
+    ]
+    for name, h in sorted(snap["histograms"].items()):
+        n = sum(h["buckets"])
+        if not n:
+            continue
+        q = {p: hist_quantile(h["buckets"], p / 100) * 1000 for p in (50, 90, 99)}
+        lines.append(
+            f"{name}: n={n} media_ms={h['sum'] / n * 1000:.3f} "
+            f"p50_ms<={q[50]:.3f} p90_ms<={q[90]:.3f} p99_ms<={q[99]:.3f}"
+        )
+    for c in snap["connections"]:
+        lines.append(
+            f"id={c['cid']} addr={tuple(c['addr'])} in={c['msgs_in']}/{c['bytes_in']}B "
+            f"out={c['msgs_out']}/{c['bytes_out']}B depth={c['depth']} dropped={c['dropped']}"
+        )
+    return lines
+
+def _metric_name(name: str) -> str:
+    return "p2p_" + "".join(ch if ch.isalnum() else "_" for ch in name)
+
+def prometheus_text(snap: Dict[str, object]) -> str:
+    """stats() in the Prometheus text exposition format (version 0.0.4)."""
+    out = []
+    for name, n in sorted(snap["counters"].items()):
+        metric = _metric_name(name) + "_total"
+        out.append(f"# TYPE {metric} counter\n{metric} {n}\n")
+    for name, v in sorted(snap["gauges"].items()):
+        metric = _metric_name(name)
+        out.append(f"# TYPE {metric} gauge\n{metric} {v}\n")
+    for name, h in sorted(snap["histograms"].items()):
+        metric = _metric_name(name) + "_seconds"
+        out.append(f"# TYPE {metric} histogram\n")
+        seen = 0
+        for i, n in enumerate(h["buckets"][:-1]):
+            seen += n
+            out.append(f'{metric}_bucket{{le="{(1 << i) / 1e6:g}"}} {seen}\n')
+        count = seen + h["buckets"][-1]
+        out.append(f'{metric}_bucket{{le="+Inf"}} {count}\n{metric}_sum {h["sum"]:.6f}\n{metric}_count {count}\n')
+    for key in CONN_IO_KEYS + ("depth", "dropped"):
+        metric = _metric_name("conn_" + key)
+        out.append(f"# TYPE {metric} gauge\n")
+        for c in snap["connections"]:
+            ip, port = c["addr"]
+            out.append(f'{metric}{{cid="{c["cid"]}",addr="{ip}:{port}"}} {c[key]}\n')
+    return "".join(out)
+
+class MetricsExporter:
+    """Plain HTTP endpoint for a stats() callable, local by default:
+    GET /metrics -> Prometheus text, GET /stats -> the same snapshot as JSON."""
+
+    def __init__(self, source: Callable[[], Dict[str, object]], port: int, host: str = METRICS_HOST):
+        self.source = source
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self) -> None:
+        exporter = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path not in ("/metrics", "/stats"):
+                    self.send_error(404)
+                    return
+                snap = exporter.source()
+                if path == "/metrics":
+                    body, ctype = prometheus_text(snap).encode("utf-8"), "text/plain; version=0.0.4"
+                else:
+                    body, ctype = json.dumps(snap).encode("utf-8"), "application/json"
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                server_log("[metrics] " + fmt, *args, level=LOG_DEBUG)
+
+        class _Server(http.server.ThreadingHTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = _Server((self.host, self.port), _Handler)
+        self.port = self.server.server_address[1]
+        self._waker = Waker()
+        self._thread = threading.Thread(target=serve_until, args=(self.server, self._waker), name="metrics", daemon=True)
+        self._thread.start()
+        server_log(f"[metrics] Metriche su http://{self.host}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        if self.server:
+            self._waker.set()
+            self._thread.join()
+            self.server.server_close()
+            self._waker.close()
+            self.server = None
@@ -0,0 +1,1312 @@
+# -*- coding: utf-8 -*-
+"""Thread-per-connection engine: Peer and its TCP request handler."""
+import concurrent.futures
+import os
+import random
+import socket
+import socketserver
+import ssl
+import threading
+import time
+from typing import Callable, Dict, Tuple, Optional, List
+
+from .config import (
+    Addr, ConnID, DEFAULT_SEND_WAIT_TIMEOUT, DISCOVER_INTERVAL, DISCOVER_MAX_INTERVAL, IDLE_TIMEOUT,
+    MCAST_GRP, MCAST_PORT, MCAST_TTL,
+)
+from .logs import LOG_DEBUG, LOG_WARNING, buffered_log, log_stats, server_log
+from .metrics import CONN_IO_KEYS, Metrics
+from .wire import (
+    CORR_HEADER, FrameReader, HELLO_ADDR, MSG_BINARY, MSG_CODECS, MSG_COMPRESSED, MSG_FIND_NODE, MSG_GOSSIP,
+    DATA_OPENERS, MSG_FILE_OFFER, MSG_FLOW, MSG_HELLO, MSG_NODES, MSG_REPLY, MSG_REQUEST, MSG_RESPONSE, MSG_ROUTE,
+    MSG_TEXT, MSG_TYPED, OPENER_WAIT, FrameError, encode_frame, encode_message,
+)
+from .compression import COMPRESS_MIN_BYTES, Compression
+from .registry import DEFAULT_INBOX_BYTES, make_registry
+from .correlation import PendingRequests
+from .queues import (
+    DEFAULT_SEND_QUEUE, LANE_WEIGHTS, SEND_BLOCK_TIMEOUT, SLOW_POLICIES, SendQueue, set_notsent_lowat, set_rcvbuf,
+)
+from .gossip import BROADCAST_MODES, DEFAULT_GOSSIP_FANOUT, GOSSIP_HEADER, GOSSIP_MAX_HOPS, SeenSet
+from .dialing import (
+    BOOTSTRAP_MAX_INFLIGHT, BOOTSTRAP_RETRY_BASE, BOOTSTRAP_RETRY_MAX, BOOTSTRAP_STAGGER, DialBackoff,
+    DialPool,
+)
+from .peercache import PEER_CACHE_FAIL, PEER_CACHE_OK, PEER_CACHE_SEEN, PeerCache
+from .tls import PeerTLS
+from .discovery import DiscoveryState
+from .idle import IDLE_SLACK, Waker, serve_until, set_keepalive, wait_readable
+from .dht import (
+    DHT_ALPHA, DHT_DIAL_BURST, DHT_DIAL_RATE, DHT_ID_BITS, DHT_K, DHT_MAX_ROUNDS, DHT_QUERY_TIMEOUT, FIND_HEADER,
+    NODES_HEADER, ROUTE_DATA, ROUTE_DIAL, ROUTE_HEADER, ROUTE_MAX_HOPS, ROUTE_TYPED, RoutingTable, node_id,
+)
+from .transfer import FILE_CHUNK, FILE_RETRIES, FILE_TIMEOUT, FileChunkError, FileTransferError, receive_file, send_file
+from .swarm import SWARM_MAX_SOURCES, SWARM_PIPELINE, RateLimiter, fetch_blob, serve_blob
+from .messages import DEFAULT_SERIALIZER, MessageError, TypedMessage, get_serializer
+
+# ---------------- TCP handler --------------------------------------------------
+class P2PRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        peer = getattr(self.server, "peer_instance", None)
+        addr = self.client_address
+        tname = threading.current_thread().name
+
+        if peer is None:
+            server_log(f"[{tname}] Handler senza riferimento al Peer; chiudo.")
+            return
+
+        sock = self.request
+        peer._tune_socket(sock)
+        if peer.tls is not None:
+            try:
+                sock = peer.tls.accept(self.request)
+            except (ssl.SSLError, OSError) as e:
+                peer.metrics.inc("accept_fail")
+                server_log(f"[{tname}] Handshake TLS fallito con {addr}: {e}")
+                return
+
+        peer.metrics.inc("accepted")
+        reader = FrameReader()
+        try:
+            frames = peer._first_frames(sock, reader)
+        except (OSError, FrameError) as e:
+            server_log(f"[{tname}] Errore gestione connessione {addr}: {e}")
+            frames = None
+        if frames is None:
+            sock.close()
+            return
+        if frames and frames[0][0] in DATA_OPENERS:
+            # dedicated transfer connection, never registered: this thread serves it to the end
+            try:
+                peer._serve_data(frames[0][0], sock, addr, frames[0][1], tname)
+            finally:
+                sock.close()
+            return
+
+        cid = peer.registry.add(sock, addr, incoming=True)
+        peer._open_send_queue(cid, sock, addr)
+        # server-side event -> stderr (immediate)
+        server_log(f"[{tname}] Connessione IN registrata: id={cid} addr={addr}")
+
+        peer._rx_readers[cid] = reader
+        inbox = peer.registry.inbox(cid)
+        if inbox is not None:
+            peer._watch_inbox(cid, inbox)
+        try:
+            while True:
+                for msg_type, payload in frames:
+                    if msg_type in DATA_OPENERS:
+                        raise FrameError("Apertura di trasferimento su una connessione già registrata")
+                    peer._on_frame(cid, addr, msg_type, payload, tname, incoming=True)
+                if inbox is not None:
+                    inbox.wait_room()   # sender ignored MSG_FLOW: stop reading, TCP pushes back
+                if not reader.recv_from(sock):
+                    break
+                peer.registry.touch(cid)
+                frames = reader.frames()
+        except ConnectionResetError:
+            server_log(f"[{tname}] Connessione con {addr} interrotta.")
+        except Exception as e:
+            server_log(f"[{tname}] Errore gestione connessione {addr}: {e}")
+        finally:
+            server_log(f"[{tname}] Chiusura IN id={cid} addr={addr}")
+            peer.registry.remove(cid)
+            peer._release_conn(cid)
+            peer._pending.fail_connection(cid)
+            peer._forget_route(cid)
+            peer.compression.forget(cid)
+
+# ---------------- Peer class --------------------------------------------------
+class Peer:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        bootstrap: Optional[List[Tuple[str, int]]] = None,
+        mcast_group: str = MCAST_GRP,
+        mcast_port: int = MCAST_PORT,
+        discover_interval: float = DISCOVER_INTERVAL,
+        discover_max_interval: float = DISCOVER_MAX_INTERVAL,
+        announce_format: str = "binary",
+        idle_timeout: int = IDLE_TIMEOUT,
+        send_wait_timeout: float = DEFAULT_SEND_WAIT_TIMEOUT,
+        registry="default",
+        send_queue_size: int = DEFAULT_SEND_QUEUE,
+        slow_policy: str = "drop",
+        send_block_timeout: float = SEND_BLOCK_TIMEOUT,
+        broadcast_mode: str = "direct",
+        gossip_fanout: int = DEFAULT_GOSSIP_FANOUT,
+        max_peers: Optional[int] = None,
+        inbox_bytes: int = DEFAULT_INBOX_BYTES,
+        reuse_port: bool = False,
+        bootstrap_inflight: int = BOOTSTRAP_MAX_INFLIGHT,
+        bootstrap_stagger: float = BOOTSTRAP_STAGGER,
+        peer_cache: Optional[str] = None,
+        tls: Optional[PeerTLS] = None,
+        compress: Optional[List[str]] = None,
+        compress_min: int = COMPRESS_MIN_BYTES,
+        keepalive: Optional[Tuple[int, int, int]] = None,
+        dht_k: int = DHT_K,
+        files_dir: Optional[str] = None,
+        serve_rate: Optional[float] = None,
+        serializer: str = DEFAULT_SERIALIZER,
+        priority_lanes: bool = True,
+        lane_weights: Tuple[int, int] = LANE_WEIGHTS,
+        lane_rcvbuf: Optional[int] = None,
+    ):
+        # shared by both engines (AsyncPeer.__init__ is this one): the
+        # engine-specific state is set up by _init_engine() at the end
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.registry = make_registry(registry, inbox_bytes)
+        self.server = None
+        self._stop_event = threading.Event()
+
+        if slow_policy not in SLOW_POLICIES:
+            raise ValueError(f"Policy sconosciuta: {slow_policy}")
+        self.send_queue_size = send_queue_size
+        self.slow_policy = slow_policy
+        self.send_block_timeout = send_block_timeout
+        # control frames overtake queued data; False = one FIFO per connection
+        self.priority_lanes = priority_lanes
+        self.lane_weights = lane_weights
+        self.lane_rcvbuf = lane_rcvbuf
+
+        if broadcast_mode not in BROADCAST_MODES:
+            raise ValueError(f"Modalità broadcast sconosciuta: {broadcast_mode}")
+        self.broadcast_mode = broadcast_mode
+        self.gossip_fanout = gossip_fanout
+        self.max_peers = max_peers
+        self._seen = SeenSet()
+        self.gossip_stats = {"originated": 0, "delivered": 0, "duplicates": 0, "forwarded": 0}
+        self._pending = PendingRequests()
+        self.metrics = Metrics()
+        # called as on_gossip(msg_id, hops, text) for every new gossip message
+        self.on_gossip: Optional[Callable[[int, int, str], None]] = None
+
+        self.mcast_group = mcast_group
+        self.mcast_port = mcast_port
+        self.discover_interval = discover_interval
+        self.discovery = self._make_discovery(discover_max_interval, announce_format)
+
+        self.bootstrap = bootstrap or []
+        self.bootstrap_inflight = max(1, bootstrap_inflight)
+        self.bootstrap_stagger = bootstrap_stagger
+        self._bootstrap_backoff = DialBackoff(BOOTSTRAP_RETRY_BASE, BOOTSTRAP_RETRY_MAX)
+        self.peer_cache = PeerCache(peer_cache) if peer_cache else None
+        self.tls = tls
+        self.compression = Compression(compress, compress_min)
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+
+        self.node_id = node_id((host, port))
+        self.routes = RoutingTable(self.node_id, dht_k)
+        self._dht_queries = PendingRequests()
+        self.dht_stats = {"originated": 0, "forwarded": 0, "delivered": 0, "unroutable": 0, "dropped": 0, "queries": 0, "dials": 0,
+                          "dials_refused": 0}
+        # ROUTE_DIAL makes us connect out on a remote's word: bounded, see _on_dial_request
+        self._dht_dial_limiter = RateLimiter(DHT_DIAL_RATE, DHT_DIAL_BURST)
+        # called as on_route(origin_id, hops, message) for every routed message addressed to us
+        # (message is a str, or a TypedMessage for send_to_node() of one)
+        self.on_route: Optional[Callable[[int, int, object], None]] = None
+        # encoding of the TypedMessages this node builds (send_typed); any installed one is decoded
+        self.serializer = get_serializer(serializer)
+
+        # incoming files land here and are served to swarm fetches from here;
+        # None refuses every MSG_FILE_OFFER and holds no blobs. serve_rate caps uploads (bytes/s)
+        self.files_dir = files_dir
+        self.file_stats = {"sent": 0, "received": 0, "bytes_out": 0, "bytes_in": 0, "resumed": 0, "retries": 0,
+                           "bad_chunks": 0, "refused": 0, "failed": 0, "served_chunks": 0, "served_bytes": 0,
+                           "fetched": 0, "fetch_bytes": 0, "fetch_duplicates": 0}
+        self._serve_limiter = RateLimiter(serve_rate) if serve_rate else None
+        self._source_rates: Dict[Addr, float] = {}   # swarm source -> MB/s (EWMA), fastest asked first
+
+        self.send_wait_timeout = float(send_wait_timeout)
+        self._init_engine()
+
+    def _init_engine(self) -> None:
+        """Threads, sockets and queues of the thread-per-connection engine."""
+        self._server_thread = None
+        self._send_queues: Dict[ConnID, SendQueue] = {}
+        self._rx_readers: Dict[ConnID, FrameReader] = {}
+        # same stop signal as _stop_event, for the threads sleeping in select()
+        self._waker = Waker()
+        self._mcast_sock = None
+        self._mcast_thread = None
+        self._announcer_thread = None
+        self._dial_pool = DialPool()
+        self._idle_thread = None
+
+    def _make_discovery(self, max_interval: float, fmt: str) -> DiscoveryState:
+        return DiscoveryState(
+            (self.host, self.port),
+            peer_addrs=self.registry.listen_addrs,
+            is_connected=lambda addr: self.registry.find_by_addr(addr) is not None,
+            can_dial=lambda addr: self._should_initiate(addr) and self._has_room(),
+            imin=self.discover_interval,
+            imax=max_interval,
+            fmt=fmt,
+        )
+
+    def _tune_socket(self, sock: socket.socket) -> None:
+        """Options of every accepted and dialed TCP socket, plain or TLS."""
+        # frames are written whole: with Nagle a small one (a request, the first
+        # frame after a handshake) would wait for the delayed ACK, ~40ms
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.keepalive:
+            set_keepalive(sock, self.keepalive)
+
+    def _hello_frame(self) -> Optional[bytes]:
+        try:
+            addr = HELLO_ADDR.pack(socket.inet_aton(self.host), self.port)
+            return encode_frame(MSG_HELLO, addr + self.compression.hello_tail())
+        except OSError:
+            return None
+
+    def start_server(self):
+        class _Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            allow_reuse_port = self.reuse_port   # --workers: several processes on one port
+            request_queue_size = 1024   # listen() backlog, as the async engine: bursts of dials are not refused
+
+        try:
+            self.server = _Server((self.host, self.port), P2PRequestHandler)
+        except Exception as e:
+            buffered_log(f"[server] Impossibile avviare server su {self.host}:{self.port}: {e}")
+            raise
+        setattr(self.server, "peer_instance", self)
+
+        def serve():
+            # server start is a server-side event -> stderr
+            server_log(f"[server] Peer in ascolto su {self.host}:{self.port}")
+            try:
+                serve_until(self.server, self._waker)
+            except Exception as e:
+                server_log(f"[server] Terminated: {e}")
+
+        self._server_thread = threading.Thread(target=serve, name="p2p-server", daemon=True)
+        self._server_thread.start()
+
+    def stop_server(self):
+        self._stop_event.set()
+        self._waker.set()
+        # drop connections first: shutdown() wakes threads blocked in recv (close() alone
+        # does not), and remove() closes the inbox so paused readers stop waiting.
+        # server_close() joins the handler threads, so they must be able to exit.
+        for cid, (sock, _, _, _) in self.registry.items():
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                sock.close()
+            except Exception:
+                pass
+            self.registry.remove(cid)
+        if self.server:
+            try:
+                self._server_thread.join(timeout=5.0)
+                self.server.server_close()
+            except Exception:
+                pass
+        if self._mcast_thread is not None:
+            self._mcast_thread.join(timeout=1.0)
+        self._waker.close()
+        if self.peer_cache is not None:
+            self.peer_cache.close()
+
+    def _should_initiate(self, remote: Addr) -> bool:
+        return (self.host, self.port) < remote
+
+    def connect(self, ip: str, port: int, timeout: float = 3.0) -> ConnID:
+        """Id of a connection to ip:port: a healthy existing one (in either
+        direction) is reused, otherwise one is dialed through the DialPool."""
+        if ip == self.host and port == self.port:
+            raise ConnectionError("Tentativo connessione verso se stessi; ignorato.")
+        return self._dial_pool.dial((ip, port), self._healthy_conn, lambda: self._open_connection(ip, port, timeout))
+
+    def _healthy_conn(self, addr: Addr) -> Optional[ConnID]:
+        cid = self.registry.find_by_addr(addr)
+        if cid is None:
+            return None
+        entry = self.registry.get(cid)
+        if entry is not None and entry[0].fileno() != -1:
+            return cid
+        self.registry.remove(cid)   # closed underneath us: drop it and dial again
+        return None
+
+    def _cache_note(self, addr: Addr, delta: int) -> None:
+        if self.peer_cache is not None:
+            self.peer_cache.record(addr, delta)
+
+    def _dial_ok(self, addr: Addr, elapsed: float) -> None:
+        self.metrics.observe("connect", elapsed)
+        self._cache_note(addr, PEER_CACHE_OK)
+
+    def _dial_failed(self, addr: Addr) -> None:
+        self.metrics.inc("connect_fail")
+        self._cache_note(addr, PEER_CACHE_FAIL)
+
+    def _open_connection(self, ip: str, port: int, timeout: float) -> ConnID:
+        if not self._should_initiate((ip, port)):
+            raise ConnectionError("Regola anti-duplicato: non avviare connessione verso peer con ordine minore/uguale.")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._tune_socket(sock)
+        sock.settimeout(timeout)
+        t0 = time.perf_counter()
+        try:
+            sock.connect((ip, port))
+        except Exception as e:
+            sock.close()
+            self._dial_failed((ip, port))
+            raise ConnectionError(f"Connessione fallita a {ip}:{port}: {e}")
+        if self.tls is not None:
+            try:
+                sock = self.tls.dial(sock, (ip, port))
+            except (ssl.SSLError, OSError) as e:
+                sock.close()
+                self._dial_failed((ip, port))
+                raise ConnectionError(f"Handshake TLS fallito con {ip}:{port}: {e}")
+        self._dial_ok((ip, port), time.perf_counter() - t0)
+        # blocking from here on: a send timeout could cut a frame in half
+        sock.settimeout(None)
+        cid = self.registry.add(sock, (ip, port), incoming=False)
+        self._open_send_queue(cid, sock, (ip, port))
+        self.routes.add(node_id((ip, port)), (ip, port), cid)
+        hello = self._hello_frame()
+        if hello is not None:
+            self._send_queues[cid].put(hello)
+        t = threading.Thread(target=self._listen_outgoing, args=(cid,), name=f"out-{cid}", daemon=True)
+        t.start()
+        # connection established -> server-side event
+        server_log(f"[peer] Connessione OUT stabilita id={cid} addr={(ip,port)}")
+        return cid
+
+    def _listen_outgoing(self, cid: ConnID):
+        entry = self.registry.get(cid)
+        if not entry:
+            return
+        sock, addr, _, _ = entry
+        tname = threading.current_thread().name
+        reader = FrameReader()
+        self._rx_readers[cid] = reader
+        inbox = self.registry.inbox(cid)
+        if inbox is not None:
+            self._watch_inbox(cid, inbox)
+        remember = self.tls is not None
+        try:
+            while not self._stop_event.is_set():
+                if inbox is not None:
+                    inbox.wait_room()
+                try:
+                    n = reader.recv_from(sock)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                if remember:
+                    # TLS 1.3 tickets come right after the handshake: read by now
+                    self.tls.remember(addr, sock)
+                    remember = False
+                if not n:
+                    break
+                self.registry.touch(cid)
+                for msg_type, payload in reader.frames():
+                    self._on_frame(cid, addr, msg_type, payload, tname, incoming=False)
+        except Exception as e:
+            server_log(f"[{tname}] Errore ascolto id={cid}: {e}")
+        finally:
+            server_log(f"[{tname}] Connessione OUT id={cid} chiusa")
+            self.registry.remove(cid)
+            self._release_conn(cid)
+            self._pending.fail_connection(cid)
+            self._forget_route(cid)
+            self.compression.forget(cid)
+
+    def _on_frame(self, cid: ConnID, addr: Addr, msg_type: int, payload: memoryview, tname: str, incoming: bool) -> None:
+        """Deliver one received frame, queueing any reply on the same connection.
+        Replies share the writer with send()/broadcast() so frames never interleave.
+        MSG_TEXT is echoed upper-cased only by the accepting side; MSG_REQUEST is
+        answered by whichever side receives it."""
+        if msg_type == MSG_COMPRESSED:
+            msg_type, payload = self.compression.unpack(payload)   # FrameError closes the connection
+        if msg_type == MSG_GOSSIP:
+            self._on_gossip(cid, payload, tname)
+            return
+        if msg_type == MSG_ROUTE:
+            self._on_route(payload, tname)
+            return
+        if msg_type == MSG_FIND_NODE:
+            self._on_find_node(cid, payload)
+            return
+        if msg_type == MSG_NODES:
+            self._on_nodes(payload)
+            return
+        if msg_type == MSG_HELLO:
+            if len(payload) >= HELLO_ADDR.size:
+                ip, port = HELLO_ADDR.unpack_from(payload)
+                listen = (socket.inet_ntoa(ip), port)
+                self.registry.set_listen_addr(cid, listen)
+                self.routes.add(node_id(listen), listen, cid)
+                self._cache_note(listen, PEER_CACHE_SEEN)
+                if len(payload) > HELLO_ADDR.size:
+                    self.compression.negotiate(cid, payload[HELLO_ADDR.size])
+                    if self.compression.mask:
+                        self._enqueue_nowait(cid, encode_frame(MSG_CODECS, bytes([self.compression.mask])))
+            return
+        if msg_type == MSG_CODECS:
+            if len(payload) == 1:
+                self.compression.negotiate(cid, payload[0])
+            return
+        if msg_type == MSG_FLOW:
+            if len(payload) == 1:
+                self._hold_data(cid, bool(payload[0]))
+            return
+        if msg_type in (MSG_REQUEST, MSG_RESPONSE):
+            if len(payload) < CORR_HEADER.size:
+                return
+            (corr,) = CORR_HEADER.unpack_from(payload)
+            body = str(payload[CORR_HEADER.size:], "utf-8", errors="replace")
+            if msg_type == MSG_REQUEST:
+                server_log("[%s] Richiesta #%s da %s (id=%s): %s", tname, corr, addr, cid, body)
+                reply = CORR_HEADER.pack(corr) + body.upper().encode("utf-8")
+                self._enqueue_nowait(cid, self.compression.for_conn(cid, encode_frame(MSG_RESPONSE, reply)))
+            elif not self._pending.resolve(corr, body):
+                server_log("[%s] Risposta tardiva #%s da %s (id=%s): %s", tname, corr, addr, cid, body)
+            return
+        if msg_type == MSG_TYPED:
+            try:
+                message = TypedMessage.parse(payload)   # header only: fields are decoded when read
+            except MessageError as e:
+                self.metrics.inc("typed_rejected")
+                server_log("[%s] Messaggio tipizzato scartato da %s (id=%s): %s", tname, addr, cid, e, level=LOG_WARNING)
+                return
+        elif msg_type == MSG_BINARY:
+            message = bytes(payload)
+        else:
+            message = str(payload, "utf-8", errors="replace")
+        if msg_type == MSG_REPLY:
+            # echo of our own send(): never worth pausing the socket (responses queue behind it)
+            if not self.registry.offer_msg(cid, message, size=len(payload)):
+                self.metrics.inc("replies_dropped")
+                return
+        else:
+            # into the connection's inbox, read back with recv(); a full inbox pauses reading
+            self.registry.push_msg(cid, message, size=len(payload))
+        # server event to stderr
+        server_log("[%s] Ricevuto da %s (id=%s): %s", tname, addr, cid, message)
+        if msg_type == MSG_TEXT and incoming:
+            self._enqueue_nowait(cid, self.compression.for_conn(cid, encode_frame(MSG_REPLY, message.upper().encode("utf-8"))))
+
+    # ---------------- DHT routing -------------------------------------------
+    def _forget_route(self, cid: ConnID) -> None:
+        self.routes.remove(cid)
+        self._dht_queries.fail_connection(cid)
+
+    def send_to_node(self, dest: int, message) -> Optional[ConnID]:
+        """Send message (str or TypedMessage) to the node whose id is dest,
+        connected to us or not: every hop forwards it to its contact closest to
+        dest by XOR distance, O(log N) hops once the tables are filled
+        (dht_join); intermediate hops never decode a TypedMessage. Returns the
+        cid of the first hop (None if dest is this node); delivery is not acknowledged."""
+        if dest == self.node_id:
+            self._deliver_routed(self.node_id, 0, message, "dht")
+            return None
+        if isinstance(message, TypedMessage):
+            return self._route_out(dest, ROUTE_TYPED, message.payload())
+        return self._route_out(dest, ROUTE_DATA, message.encode("utf-8"))
+
+    def _route_out(self, dest: int, kind: int, body: bytes) -> ConnID:
+        hop = self.routes.next_hop(dest)
+        if hop is None:
+            self.dht_stats["unroutable"] += 1
+            raise ConnectionError(f"Nessuna rotta verso il nodo {dest:016x}")
+        self._send_frame(hop[1], encode_frame(MSG_ROUTE, ROUTE_HEADER.pack(dest, self.node_id, 0, kind) + body))
+        self.dht_stats["originated"] += 1
+        return hop[1]
+
+    def _on_route(self, payload: memoryview, tname: str) -> None:
+        if len(payload) < ROUTE_HEADER.size:
+            return
+        dest, origin, hops, kind = ROUTE_HEADER.unpack_from(payload)
+        body = payload[ROUTE_HEADER.size:]
+        hops += 1
+        if dest == self.node_id:
+            self.dht_stats["delivered"] += 1
+            if kind == ROUTE_DIAL:
+                self._on_dial_request(origin, body)
+            elif kind == ROUTE_TYPED:
+                try:
+                    self._deliver_routed(origin, hops, TypedMessage.parse(body), tname)
+                except MessageError as e:
+                    self.metrics.inc("typed_rejected")
+                    server_log("[%s] Messaggio tipizzato instradato scartato (da %016x): %s", tname, origin, e, level=LOG_WARNING)
+            else:
+                self._deliver_routed(origin, hops, str(body, "utf-8", errors="replace"), tname)
+            return
+        hop = self.routes.next_hop(dest)
+        if hop is None or hops >= ROUTE_MAX_HOPS:
+            # dest is not in the overlay (or our table is still too thin to get closer)
+            self.dht_stats["unroutable"] += 1
+            server_log("[%s] Nessuna rotta verso %016x (da %016x, hop %d)", tname, dest, origin, hops, level=LOG_DEBUG)
+            return
+        if self._enqueue_nowait(hop[1], encode_frame(MSG_ROUTE, ROUTE_HEADER.pack(dest, origin, hops, kind) + body)):
+            self.dht_stats["forwarded"] += 1
+        else:
+            self.dht_stats["dropped"] += 1
+
+    def _deliver_routed(self, origin: int, hops: int, text, tname: str) -> None:
+        if self.on_route is not None:
+            self.on_route(origin, hops, text)
+        else:
+            server_log("[%s] Messaggio instradato da %016x (%d hop): %s", tname, origin, hops, text)
+
+    def _on_dial_request(self, origin: int, body: memoryview) -> None:
+        """A node that may not dial us (anti-duplicate rule) asked us to dial it.
+        Only its own address is dialed, and at DHT_DIAL_RATE at most: any
+        peer can route us a ROUTE_DIAL, which must not turn every node into
+        a reflector that connects wherever it is told to."""
+        if len(body) < HELLO_ADDR.size:
+            return
+        ip, port = HELLO_ADDR.unpack_from(body)
+        addr = (socket.inet_ntoa(ip), port)
+        if self.registry.find_by_addr(addr) is not None or not self._should_initiate(addr) or not self._has_room():
+            return
+        if node_id(addr) != origin or not self._dht_dial_limiter.try_consume():
+            self.dht_stats["dials_refused"] += 1
+            server_log("[dht] Richiesta di connessione a %s:%d rifiutata (da %016x)", addr[0], addr[1], origin, level=LOG_DEBUG)
+            return
+        self.dht_stats["dials"] += 1
+        self._dht_dial(addr)
+
+    def _dht_dial(self, addr: Addr) -> None:
+        def dial():
+            try:
+                self.connect(*addr)
+            except Exception as e:
+                server_log(f"[dht] Connessione a {addr[0]}:{addr[1]} fallita: {e}")
+
+        threading.Thread(target=dial, name="dht-dial", daemon=True).start()
+
+    def _on_find_node(self, cid: ConnID, payload: memoryview) -> None:
+        if len(payload) != FIND_HEADER.size:
+            return
+        qid, target = FIND_HEADER.unpack(payload)
+        contacts = self.routes.closest(target, self.routes.k, exclude=(cid,))
+        body = NODES_HEADER.pack(qid) + b"".join(HELLO_ADDR.pack(socket.inet_aton(a[0]), a[1]) for _, a, _ in contacts)
+        self._enqueue_nowait(cid, encode_frame(MSG_NODES, body))
+
+    def _on_nodes(self, payload: memoryview) -> None:
+        if len(payload) < NODES_HEADER.size or (len(payload) - NODES_HEADER.size) % HELLO_ADDR.size:
+            return
+        (qid,) = NODES_HEADER.unpack_from(payload)
+        addrs = [(socket.inet_ntoa(ip), port) for ip, port in HELLO_ADDR.iter_unpack(payload[NODES_HEADER.size:])]
+        self._dht_queries.resolve(qid, addrs)
+
+    def dht_lookup(self, target: int, timeout: float = DHT_QUERY_TIMEOUT) -> List[Addr]:
+        """Iterative Kademlia lookup: ask the DHT_ALPHA contacts closest to target
+        for theirs, link to the ones that fill a bucket below k, repeat while
+        the nearest contact keeps getting closer. Returns the k nearest addresses."""
+        queried = set()
+        best = None
+        for _ in range(DHT_MAX_ROUNDS):
+            ask = self.routes.closest(target, DHT_ALPHA, exclude=queried)
+            if not ask:
+                break
+            waiting = []
+            for _, _, cid in ask:
+                queried.add(cid)
+                qid, fut = self._dht_queries.new(cid)
+                try:
+                    self._send_frame(cid, encode_frame(MSG_FIND_NODE, FIND_HEADER.pack(qid, target)))
+                except (KeyError, ConnectionError):
+                    self._dht_queries.discard(qid)
+                    continue
+                waiting.append((qid, fut, cid))
+            self.dht_stats["queries"] += len(waiting)
+            found: Dict[Addr, ConnID] = {}   # address -> connection of the contact that knows it
+            for qid, fut, cid in waiting:
+                try:
+                    found.update((addr, cid) for addr in fut.result(timeout))
+                except Exception:   # timeout, or the connection went away
+                    self._dht_queries.discard(qid)
+            called_back = [addr for addr, via in found.items() if self._dht_link(addr, via)]
+            deadline = time.monotonic() + timeout
+            while called_back and time.monotonic() < deadline:
+                # asked to dial us: give them the time to do it before judging progress
+                called_back = [a for a in called_back if self.registry.find_by_addr(a) is None]
+                time.sleep(0.01)
+            nearest = self.routes.closest(target, 1)
+            if not nearest or (best is not None and nearest[0][0] ^ target >= best):
+                break
+            best = nearest[0][0] ^ target
+        return [addr for _, addr, _ in self.routes.closest(target, self.routes.k)]
+
+    def _dht_link(self, addr: Addr, via: ConnID) -> bool:
+        """Connect to a node a lookup found, if it fills a bucket below k.
+        Nodes we may not dial are asked to dial us through `via`, the contact
+        that reported them: it is connected to them, so that is one hop.
+        True when such a request went out."""
+        if addr == (self.host, self.port) or self.registry.find_by_addr(addr) is not None:
+            return False
+        nid = node_id(addr)
+        if not self.routes.wants(nid) or not self._has_room():
+            return False
+        try:
+            if self._should_initiate(addr):
+                self.connect(*addr)
+                return False
+            body = ROUTE_HEADER.pack(nid, self.node_id, 0, ROUTE_DIAL) + HELLO_ADDR.pack(socket.inet_aton(self.host), self.port)
+            self._send_frame(via, encode_frame(MSG_ROUTE, body))
+            self.dht_stats["originated"] += 1
+            return True
+        except (ConnectionError, KeyError, OSError) as e:
+            server_log(f"[dht] Collegamento a {addr[0]}:{addr[1]} fallito: {e}", level=LOG_DEBUG)
+            return False
+
+    def dht_join(self) -> Dict[int, int]:
+        """Fill the routing table starting from the current connections: look up
+        our own id (reaches the nodes nearest to us), then a random id in every
+        bucket farther than the nearest contact that is still below k.
+        Returns routes.bucket_sizes()."""
+        self.dht_lookup(self.node_id)
+        sizes = self.routes.bucket_sizes()
+        if sizes:
+            for i in range(min(sizes) + 1, DHT_ID_BITS):
+                if self.routes.bucket_sizes().get(i, 0) < self.routes.k:
+                    self.dht_lookup(self.node_id ^ (1 << i) ^ random.getrandbits(i))
+        return self.routes.bucket_sizes()
+
+    # ---------------- File transfer ---------------------------------------
+    def send_file(self, ip: str, port: int, path: str, name: Optional[str] = None, chunk: int = FILE_CHUNK,
+                  retries: int = FILE_RETRIES) -> Dict[str, object]:
+        """Send the file at path to the node listening on ip:port as `name`
+        (default its basename). It travels on a dedicated connection, never on
+        the message one, and blocks only the calling thread; a dropped
+        connection or a bad chunk is retried up to `retries` times, resuming
+        where the receiver stopped. Returns {"size", "offset", "sent",
+        "attempts", "seconds", "mb_s"}."""
+        name = name or os.path.basename(path)
+        t0 = time.perf_counter()
+        for attempt in range(1, retries + 2):
+            try:
+                sock = self._file_socket(ip, port)
+                try:
+                    result = send_file(sock, path, name, chunk)
+                finally:
+                    sock.close()
+            except (OSError, FrameError, FileChunkError) as e:
+                if isinstance(e, FileChunkError):
+                    self.file_stats["bad_chunks"] += 1
+                if attempt > retries:
+                    self.file_stats["failed"] += 1
+                    raise
+                self.file_stats["retries"] += 1
+                server_log(f"[file] Invio di {name} a {ip}:{port} interrotto ({e}); riprendo")
+                continue
+            except FileTransferError:
+                self.file_stats["refused"] += 1
+                raise
+            break
+        elapsed = time.perf_counter() - t0
+        self.file_stats["sent"] += 1
+        self.file_stats["bytes_out"] += result["sent"]
+        if result["offset"]:
+            self.file_stats["resumed"] += 1
+        result.update(attempts=attempt, seconds=round(elapsed, 3), mb_s=round(result["sent"] / elapsed / 1e6, 1) if elapsed else 0.0)
+        server_log(f"[file] Inviato {name} a {ip}:{port}: {result['size']} byte (da offset {result['offset']}) in {elapsed:.2f}s")
+        return result
+
+    def _file_socket(self, ip: str, port: int):
+        sock = socket.create_connection((ip, port), timeout=FILE_TIMEOUT)
+        self._tune_socket(sock)
+        if self.tls is not None:
+            try:
+                sock = self.tls.dial(sock, (ip, port))
+            except (ssl.SSLError, OSError):
+                sock.close()
+                raise
+        return sock
+
+    def _serve_data(self, msg_type: int, sock, addr: Addr, payload, tname: str,
+                    progress: Optional[Callable[[int], None]] = None) -> None:
+        """Serve a connection opened with one of DATA_OPENERS, in the calling (dedicated) thread."""
+        if msg_type == MSG_FILE_OFFER:
+            self._accept_file(sock, addr, payload, tname, progress)
+        else:
+            self._serve_blob(sock, addr, payload, tname, progress)
+
+    def _accept_file(self, sock, addr: Addr, payload, tname: str,
+                     progress: Optional[Callable[[int], None]] = None) -> None:
+        """Receive a file offered on sock."""
+        sock.settimeout(FILE_TIMEOUT)
+        try:
+            result = receive_file(sock, self.files_dir, payload, progress)
+        except FileChunkError as e:
+            self.file_stats["bad_chunks"] += 1
+            server_log(f"[{tname}] {e}")
+            return
+        except FileTransferError as e:
+            self.file_stats["refused"] += 1
+            server_log(f"[{tname}] {e} da {addr}")
+            return
+        except (OSError, FrameError) as e:
+            self.file_stats["failed"] += 1
+            server_log(f"[{tname}] Ricezione file da {addr} interrotta: {e}")
+            return
+        self.file_stats["received"] += 1
+        self.file_stats["bytes_in"] += result["received"]
+        if result["offset"]:
+            self.file_stats["resumed"] += 1
+        server_log(f"[{tname}] Ricevuto {result['path']} da {addr}: {result['size']} byte (da offset {result['offset']})")
+
+    def _serve_blob(self, sock, addr: Addr, payload, tname: str,
+                    progress: Optional[Callable[[int], None]] = None) -> None:
+        """Send the chunks a swarm fetcher asks for, until it closes."""
+        sock.settimeout(FILE_TIMEOUT)
+        try:
+            served = serve_blob(sock, self.files_dir, payload, self._serve_limiter, progress)
+        except (OSError, FrameError) as e:
+            # endgame: the fetcher hangs up as soon as it has every chunk
+            served = None
+            server_log(f"[{tname}] Invio chunk a {addr} interrotto: {e}", level=LOG_DEBUG)
+        if served is not None:
+            self.file_stats["served_chunks"] += served["chunks"]
+            self.file_stats["served_bytes"] += served["bytes"]
+
+    def fetch_blob(self, name: str, sources: Optional[List[Addr]] = None, pipeline: int = SWARM_PIPELINE,
+                   max_sources: int = SWARM_MAX_SOURCES) -> Dict[str, object]:
+        """Download name into files_dir from several peers at once (swarm.py):
+        rarest chunk first, endgame duplicates, resume from <name>.part.swarm.
+        Sources default to the listening addresses of our connections, the
+        fastest in past fetches first, at most max_sources; every source's
+        throughput updates that ranking. Blocks the calling thread only."""
+        if self.files_dir is None:
+            raise ValueError("fetch_blob richiede files_dir (--files-dir)")
+        if sources is None:
+            known = [a for a in self.registry.listen_addrs() if a != (self.host, self.port)]
+            known.sort(key=lambda a: self._source_rates.get(a, 0.0), reverse=True)
+            sources = known[:max_sources]
+        result = fetch_blob(lambda addr: self._file_socket(*addr), list(sources), name, self.files_dir, pipeline)
+        for key, report in result["sources"].items():
+            ip, port = key.rsplit(":", 1)
+            addr = (ip, int(port))
+            old = self._source_rates.get(addr)
+            rate = report["mb_s"] if report["error"] is None else 0.0
+            self._source_rates[addr] = rate if old is None else 0.5 * old + 0.5 * rate
+        self.file_stats["fetched"] += 1
+        self.file_stats["fetch_bytes"] += sum(r["bytes"] for r in result["sources"].values())
+        self.file_stats["fetch_duplicates"] += result["duplicates"]
+        server_log(f"[file] Scaricato {name} da {len(result['sources'])} fonti: {result['size']} byte in {result['seconds']}s ({result['mb_s']} MB/s)")
+        return result
+
+    # ---------------- Gossip ------------------------------------------------
+    def _has_room(self) -> bool:
+        """False once max_peers connections are open (discovery stops dialing)."""
+        return self.max_peers is None or len(self.registry) < self.max_peers
+
+    def _gossip_fanout(self, frame: bytes, exclude: Optional[ConnID] = None) -> None:
+        cids = [cid for cid, _ in self.registry.items() if cid != exclude]
+        if len(cids) > self.gossip_fanout:
+            cids = random.sample(cids, self.gossip_fanout)
+        for cid in cids:
+            if self._enqueue_nowait(cid, frame):
+                self.gossip_stats["forwarded"] += 1
+
+    def _on_gossip(self, cid: ConnID, payload: memoryview, tname: str) -> None:
+        if len(payload) < GOSSIP_HEADER.size:
+            return
+        msg_id, hops = GOSSIP_HEADER.unpack_from(payload)
+        if not self._seen.add(msg_id):
+            self.gossip_stats["duplicates"] += 1
+            return
+        self.gossip_stats["delivered"] += 1
+        text = str(payload[GOSSIP_HEADER.size:], "utf-8", errors="replace")
+        if self.on_gossip is not None:
+            self.on_gossip(msg_id, hops + 1, text)
+        else:
+            server_log("[%s] Gossip %016x (hop %d) da id=%s: %s", tname, msg_id, hops + 1, cid, text)
+        if hops + 1 < GOSSIP_MAX_HOPS:
+            frame = encode_frame(MSG_GOSSIP, GOSSIP_HEADER.pack(msg_id, hops + 1) + payload[GOSSIP_HEADER.size:])
+            self._gossip_fanout(frame, exclude=cid)
+
+    def _gossip_origin(self, message: str, msg_id: Optional[int] = None) -> Tuple[int, bytes]:
+        if msg_id is None:
+            msg_id = random.getrandbits(64)
+        self._seen.add(msg_id)
+        self.gossip_stats["originated"] += 1
+        return msg_id, encode_frame(MSG_GOSSIP, GOSSIP_HEADER.pack(msg_id, 0) + message.encode("utf-8"))
+
+    def gossip(self, message: str, msg_id: Optional[int] = None) -> int:
+        """Start an epidemic broadcast; returns the message id.
+        WorkerPool passes the same msg_id to every worker so copies meeting
+        in the mesh are deduplicated."""
+        msg_id, frame = self._gossip_origin(message, msg_id)
+        self._gossip_fanout(frame)
+        return msg_id
+
+    def _first_frames(self, sock, reader: FrameReader) -> Optional[list]:
+        """Frames received on an accepted socket within OPENER_WAIT: [] if the
+        dialer stayed silent, None if it closed (or the node is stopping)."""
+        deadline = time.monotonic() + OPENER_WAIT
+        while True:
+            pending = getattr(sock, "pending", None)   # TLS: bytes already decrypted, invisible to select()
+            if not (pending is not None and pending()):
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0 or not wait_readable(sock, self._waker, remaining):
+                        return None if self._waker.is_set() else []
+                except ValueError:   # waker closed by stop_server
+                    return None
+            if not reader.recv_from(sock):
+                return None
+            frames = list(reader.frames())
+            if frames:
+                return frames
+
+    def _watch_inbox(self, cid: ConnID, inbox) -> None:
+        inbox.on_full = lambda: self._send_flow(cid, True)
+        inbox.on_drain = lambda: self._send_flow(cid, False)
+
+    def _send_flow(self, cid: ConnID, hold: bool) -> None:
+        """Ask the other side to hold (or resume) its data frames: our inbox is over its limit."""
+        self.metrics.inc("flow_hold_sent" if hold else "flow_resume_sent")
+        self._enqueue_nowait(cid, encode_frame(MSG_FLOW, b"\x01" if hold else b"\x00"))
+
+    def _hold_data(self, cid: ConnID, held: bool) -> None:
+        sq = self._send_queues.get(cid)
+        if sq is not None:
+            sq.hold(held)
+
+    def _enqueue_nowait(self, cid: ConnID, frame: bytes) -> bool:
+        """Queue a frame from a receive path (handler thread or loop callback):
+        never waits for room nor disconnects, whatever the policy. A reader
+        asleep on a full queue would stop reading MSG_FLOW resumes too."""
+        sq = self._send_queues.get(cid)
+        return sq.put(frame, block=False) if sq is not None else False
+
+    def _open_send_queue(self, cid: ConnID, sock: socket.socket, addr: Addr) -> None:
+        if self.priority_lanes:
+            set_notsent_lowat(sock)
+        if self.lane_rcvbuf:
+            set_rcvbuf(sock, self.lane_rcvbuf)
+        self._send_queues[cid] = SendQueue(
+            self.registry, cid, sock, addr,
+            maxsize=self.send_queue_size, policy=self.slow_policy, block_timeout=self.send_block_timeout,
+            lane_weights=self.lane_weights, lanes=self.priority_lanes,
+        )
+
+    def _release_conn(self, cid: ConnID) -> None:
+        """Stop the writer and drop the receive buffer of a closed connection,
+        folding its traffic into the node counters."""
+        sq = self._send_queues.pop(cid, None)
+        if sq is not None:
+            sq.close()
+        reader = self._rx_readers.pop(cid, None)
+        self.metrics.fold_conn(
+            reader.frames_in if reader is not None else 0,
+            reader.bytes_in if reader is not None else 0,
+            sq.sent if sq is not None else 0,
+            sq.sent_bytes if sq is not None else 0,
+            sq.dropped if sq is not None else 0,
+        )
+
+    def _send_frame(self, cid: ConnID, frame: bytes):
+        sq = self._send_queues.get(cid)
+        if sq is None or self.registry.get(cid) is None:
+            raise KeyError("Connessione non trovata")
+        if not sq.put(frame):
+            raise ConnectionError(f"Invio fallito su {sq.addr}: coda di invio piena (policy={self.slow_policy})")
+
+    def send(self, cid: ConnID, message):
+        self._send_frame(cid, self.compression.for_conn(cid, encode_message(message)))
+
+    def send_typed(self, cid: ConnID, schema, fields: Dict[str, object]) -> None:
+        """send() of a TypedMessage of schema (id or name), encoded with this node's serializer."""
+        self.send(cid, TypedMessage.build(schema, fields, self.serializer))
+
+    def send_request(self, cid: ConnID, message: str) -> Tuple[int, concurrent.futures.Future]:
+        """Send a MSG_REQUEST without waiting; returns (correlation id, future of the reply).
+        Any number of requests can be in flight on the same connection."""
+        corr, fut = self._pending.new(cid)
+        frame = encode_frame(MSG_REQUEST, CORR_HEADER.pack(corr) + message.encode("utf-8"))
+        try:
+            self._send_frame(cid, self.compression.for_conn(cid, frame))
+        except Exception:
+            self._pending.discard(corr)
+            raise
+        return corr, fut
+
+    def send_and_wait(self, cid: ConnID, message: str, timeout: Optional[float] = None) -> Optional[str]:
+        use_to = timeout if (timeout is not None) else self.send_wait_timeout
+        t0 = time.perf_counter()
+        corr, fut = self.send_request(cid, message)
+        try:
+            reply = fut.result(timeout=use_to)
+        except concurrent.futures.TimeoutError:
+            self._pending.discard(corr)
+            self.metrics.inc("send_wait_timeout")
+            return None
+        self.metrics.observe("send_and_wait", time.perf_counter() - t0)
+        return reply
+
+    def _send_bulk(self, cid: ConnID, frames) -> int:
+        """Queue frames in order, waiting for room whatever the slow policy (a
+        script that hands over a batch wants all of it sent, not most of it
+        dropped); stops at the first frame that still does not fit within
+        send_block_timeout. Returns how many were queued."""
+        sq = self._send_queues.get(cid)
+        if sq is None or self.registry.get(cid) is None:
+            raise KeyError("Connessione non trovata")
+        queued = 0
+        for frame in frames:
+            if not sq.put(frame, block=True):
+                break
+            queued += 1
+        return queued
+
+    def send_many(self, cid: ConnID, messages) -> int:
+        """send() for a list of messages; returns how many were queued."""
+        return self._send_bulk(cid, (self.compression.for_conn(cid, encode_message(m)) for m in messages))
+
+    def send_requests(self, cid: ConnID, messages: List[str]) -> List[Tuple[int, concurrent.futures.Future]]:
+        """send_request() for a list of messages, queued like send_many."""
+        reqs = [self._pending.new(cid) for _ in messages]
+        frames = [
+            self.compression.for_conn(cid, encode_frame(MSG_REQUEST, CORR_HEADER.pack(corr) + m.encode("utf-8")))
+            for (corr, _), m in zip(reqs, messages)
+        ]
+        try:
+            queued = self._send_bulk(cid, frames)
+        except Exception:
+            queued = 0
+            raise
+        finally:
+            for corr, _ in reqs[queued:]:
+                self._pending.discard(corr)
+        if queued < len(reqs):
+            raise ConnectionError(f"Invio fallito: coda di invio piena dopo {queued} richieste")
+        return reqs
+
+    def request_many(self, cid: ConnID, messages: List[str], timeout: Optional[float] = None,
+                     window: Optional[int] = None) -> List[Optional[str]]:
+        """Pipelined send_and_wait: requests go out `window` at a time (default
+        half a send queue, so the answers fit in the other side's queue) and
+        the replies come back in order; None = no reply within the timeout,
+        counted from the first send."""
+        use_to = timeout if (timeout is not None) else self.send_wait_timeout
+        window = max(1, window or self.send_queue_size // 2)
+        t0 = time.perf_counter()
+        deadline = t0 + use_to
+        replies = []
+        for i in range(0, len(messages), window):
+            for corr, fut in self.send_requests(cid, messages[i:i + window]):
+                try:
+                    replies.append(fut.result(timeout=max(0.0, deadline - time.perf_counter())))
+                except concurrent.futures.TimeoutError:
+                    self._pending.discard(corr)
+                    self.metrics.inc("send_wait_timeout")
+                    replies.append(None)
+        self.metrics.observe("request_many", time.perf_counter() - t0)
+        return replies
+
+    def broadcast(self, message):
+        if self.broadcast_mode == "gossip":
+            self.gossip(message)
+            return
+        frames = self._broadcast_frames(encode_message(message))
+        dropped = []
+        for cid, sq in list(self._send_queues.items()):
+            if not sq.put(frames(cid)):
+                dropped.append(sq.addr)
+        if dropped:
+            server_log(f"[broadcast] Frame non accodato per {len(dropped)} peer lenti: {dropped}")
+
+    def _broadcast_frames(self, frame: bytes) -> Callable[[ConnID], bytes]:
+        """cid -> frame to queue: encoded once and compressed once per codec,
+        the same bytes object is shared by every queue using that codec."""
+        packed: Dict[int, bytes] = {}
+
+        def for_cid(cid: ConnID) -> bytes:
+            codec = self.compression.codec(cid)
+            out = packed.get(codec)
+            if out is None:
+                out = packed[codec] = self.compression.pack(frame, codec)
+            return out
+
+        return for_cid
+
+    def send_queue_stats(self) -> List[Dict[str, object]]:
+        return [sq.stats() for _, sq in sorted(self._send_queues.items())]
+
+    def _rx_reader(self, cid: ConnID) -> Optional[FrameReader]:
+        return self._rx_readers.get(cid)
+
+    def conn_stats(self) -> List[Dict[str, object]]:
+        """Traffic of every open connection: frames/bytes in and out, queue depth."""
+        rows = []
+        for st in self.send_queue_stats():
+            reader = self._rx_reader(st["cid"])
+            rows.append({
+                "cid": st["cid"],
+                "addr": st["addr"],
+                "msgs_in": reader.frames_in if reader is not None else 0,
+                "bytes_in": reader.bytes_in if reader is not None else 0,
+                "msgs_out": st["sent"],
+                "bytes_out": st["sent_bytes"],
+                "depth": st["depth"],
+                "dropped": st["dropped"],
+            })
+        return rows
+
+    def stats(self) -> Dict[str, object]:
+        """Snapshot of the node metrics: counters (traffic of closed plus open
+        connections, connects, discovery, gossip, DHT routing, file transfers, compression, logging),
+        gauges sampled now (queues, inboxes, pending requests), latency
+        histograms and per-connection traffic. See format_stats/prometheus_text."""
+        snap = self.metrics.snapshot()
+        conns = self.conn_stats()
+        counters = snap["counters"]
+        for key in CONN_IO_KEYS:
+            counters[key] = counters.get(key, 0) + sum(c[key] for c in conns)
+        counters["send_dropped"] = counters.get("send_dropped", 0) + sum(c["dropped"] for c in conns)
+        groups = (("dial_", self._dial_pool.stats), ("discovery_", self.discovery.stats), ("gossip_", self.gossip_stats),
+                  ("dht_", self.dht_stats), ("file_", self.file_stats))
+        for prefix, group in groups:
+            counters.update((prefix + k, v) for k, v in group.items())
+        comp = self.compression.stats
+        counters.update(compress_frames=comp["frames"], compress_raw_bytes=comp["raw_bytes"],
+                        compress_wire_bytes=comp["wire_bytes"], compress_skipped=comp["skipped"])
+        logs = log_stats()
+        counters.update(log_written=logs["written"], log_dropped=logs["dropped"])
+        inboxes = [self.registry.inbox(c["cid"]) for c in conns]
+        snap["gauges"] = {
+            "connections": len(self.registry),
+            "send_queue_depth": sum(c["depth"] for c in conns),
+            "send_queue_depth_max": max((c["depth"] for c in conns), default=0),
+            "inbox_bytes": sum(i.nbytes for i in inboxes if i is not None),
+            "pending_requests": len(self._pending),
+            "dht_contacts": len(self.routes),
+            "log_queued": logs["queued"],
+        }
+        snap["connections"] = conns
+        return snap
+
+    def recv(self, cid: ConnID, timeout: Optional[float] = None):
+        """Next message received on cid (str, bytes for MSG_BINARY, TypedMessage for
+        MSG_TYPED); None on timeout."""
+        return self.registry.pop_msg(cid, timeout=timeout)
+
+    def disconnect(self, cid: ConnID) -> None:
+        entry = self.registry.get(cid)
+        if entry is None:
+            raise KeyError("Connessione non trovata")
+        try:
+            entry[0].shutdown(socket.SHUT_RDWR)   # wakes the reader blocked in recv
+        except OSError:
+            pass
+        self.registry.remove(cid)
+
+    def _conn_memory(self, cid: ConnID) -> Dict[str, int]:
+        reader = self._rx_readers.get(cid)
+        inbox = self.registry.inbox(cid)
+        sq = self._send_queues.get(cid)
+        return {
+            "rx_buf": reader.capacity if reader is not None else 0,
+            "inbox": inbox.nbytes if inbox is not None else 0,
+            "tx_queued": sq.queued_bytes if sq is not None else 0,
+        }
+
+    def list_peers(self):
+        """(cid, addr, in/out, idle_s, memory) where memory counts the bytes held
+        for the connection: receive buffer, unread inbox, queued outbound frames."""
+        rows = []
+        for cid, (sock, addr, incoming, last) in self.registry.items():
+            rows.append((cid, addr, "in" if incoming else "out", int(time.time() - last), self._conn_memory(cid)))
+        return rows
+
+    # ---------------- Multicast discovery ---------------------------------
+    def _create_mcast_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        except Exception:
+            pass
+        try:
+            sock.bind(("", self.mcast_port))
+        except Exception as e:
+            sock.close()
+            raise RuntimeError(f"Bind multicast fallito: {e}")
+        try:
+            mreq = socket.inet_aton(self.mcast_group) + socket.inet_aton(self.host)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        except Exception as e:
+            sock.close()
+            raise RuntimeError(f"Join multicast su {self.host} fallito: {e}")
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MCAST_TTL)
+        return sock
+
+    def start_discovery(self):
+        try:
+            self._mcast_sock = self._create_mcast_socket()
+        except Exception as e:
+            buffered_log(f"[mcast] Impossibile inizializzare multicast: {e}")
+            return
+
+        def listen():
+            tn = threading.current_thread().name
+            server_log(f"[{tn}] Ascolto multicast {self.mcast_group}:{self.mcast_port} iface={self.host}")
+            while not self._stop_event.is_set():
+                try:
+                    # no receive timeout: stop_discovery() wakes us through the waker
+                    if not wait_readable(self._mcast_sock, self._waker):
+                        break
+                    data, addr = self._mcast_sock.recvfrom(2048)
+                except Exception as e:
+                    server_log(f"[{tn}] Errore recvfrom: {e}")
+                    break
+                for peer_ip, peer_port in self.discovery.on_packet(data):
+                    server_log(f"[{tn}] Scoperto peer {peer_ip}:{peer_port} -> provo connessione")
+                    try:
+                        self.connect(peer_ip, peer_port)
+                        self.discovery.dial_ok((peer_ip, peer_port))
+                    except Exception as e:
+                        self.discovery.dial_failed((peer_ip, peer_port))
+                        server_log(f"[{tn}] Connessione fallita a {peer_ip}:{peer_port}: {e}")
+
+        def announce():
+            tn = threading.current_thread().name
+            try:
+                send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+                try:
+                    send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.host))
+                except Exception:
+                    pass
+                send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MCAST_TTL)
+                while not self._stop_event.is_set():
+                    packet = self.discovery.poll()
+                    if packet is not None:
+                        try:
+                            send_sock.sendto(packet, (self.mcast_group, self.mcast_port))
+                        except Exception as e:
+                            server_log(f"[{tn}] Errore invio announce: {e}")
+                    self._stop_event.wait(max(0.01, self.discovery.next_wakeup()))
+            finally:
+                try:
+                    send_sock.close()
+                except Exception:
+                    pass
+
+        self._mcast_thread = threading.Thread(target=listen, name="mcast-listener", daemon=True)
+        self._announcer_thread = threading.Thread(target=announce, name="mcast-announcer", daemon=True)
+        self._mcast_thread.start()
+        self._announcer_thread.start()
+
+        if self._bootstrap_targets():
+            t = threading.Thread(target=self._bootstrap_connect, name="bootstrap", daemon=True)
+            t.start()
+
+        self._idle_thread = threading.Thread(target=self._idle_monitor, name="idle-monitor", daemon=True)
+        self._idle_thread.start()
+
+    def _bootstrap_targets(self) -> List[Addr]:
+        """Best cached peers first (warm restart), then the configured list."""
+        cached = self.peer_cache.best() if self.peer_cache is not None else []
+        targets = cached + [a for a in self.bootstrap if a not in cached]
+        return [a for a in targets if a != (self.host, self.port) and self._should_initiate(a)]
+
+    def _bootstrap_retry(self, addr: Addr) -> bool:
+        """Configured bootstrap peers are retried until they answer; peers that
+        only come from the cache get one attempt per start (they may be gone)."""
+        return addr in self.bootstrap
+
+    def _bootstrap_connect(self):
+        """Dial the bootstrap list concurrently, happy-eyeballs style: the next
+        attempt starts after bootstrap_stagger seconds or as soon as one finishes,
+        with at most bootstrap_inflight in flight, so dead addresses no longer
+        delay the live ones. Failed addresses are retried with exponential
+        backoff until they answer (or the node is full / stopping)."""
+        targets = self._bootstrap_targets()
+        pending = set(targets)
+        lock = threading.Lock()
+        slots = threading.Semaphore(self.bootstrap_inflight)
+        finished = threading.Event()
+
+        def attempt(addr: Addr):
+            try:
+                self.connect(*addr)
+            except Exception as e:
+                if self._bootstrap_retry(addr):
+                    delay = self._bootstrap_backoff.failed(addr)
+                    server_log(f"[bootstrap] Connessione a {addr[0]}:{addr[1]} fallita: {e} (riprovo tra {delay:.0f}s)")
+                else:
+                    server_log(f"[bootstrap] Peer in cache {addr[0]}:{addr[1]} non raggiungibile: {e}")
+                    with lock:
+                        pending.discard(addr)
+            else:
+                self._bootstrap_backoff.ok(addr)
+                with lock:
+                    pending.discard(addr)
+            finally:
+                slots.release()
+                finished.set()
+
+        while not self._stop_event.is_set() and self._has_room():
+            with lock:
+                if not pending:
+                    return
+                ready = [a for a in targets if a in pending and self._bootstrap_backoff.ready(a)]
+            for addr in ready:
+                if self._stop_event.is_set() or not self._has_room():
+                    return
+                slots.acquire()
+                finished.clear()
+                server_log(f"[bootstrap] Tentativo connessione a {addr[0]}:{addr[1]}")
+                threading.Thread(target=attempt, args=(addr,), name="bootstrap-dial", daemon=True).start()
+                finished.wait(self.bootstrap_stagger)
+            # wait for every attempt of this round, then sleep until the first retry
+            for _ in range(self.bootstrap_inflight):
+                slots.acquire()
+            for _ in range(self.bootstrap_inflight):
+                slots.release()
+            with lock:
+                wait = self._bootstrap_backoff.next_retry(pending)
+            if wait is None:
+                return
+            self._stop_event.wait(wait)
+
+    def _idle_monitor(self):
+        # no fixed tick: sleep until the oldest connection can expire, so a node
+        # whose connections are all far from idle_timeout does not wake up at all
+        while not self._stop_event.is_set():
+            for cid, addr in self.registry.find_idle(self.idle_timeout):
+                server_log(f"[idle-monitor] Connessione id={cid} addr={addr} idle>={self.idle_timeout}s -> chiudo")
+                try:
+                    self.disconnect(cid)
+                except KeyError:
+                    pass
+            self._stop_event.wait(self._idle_wait())
+
+    def _idle_wait(self) -> float:
+        wait = self.registry.next_idle(self.idle_timeout)
+        if wait is None:
+            return self.idle_timeout   # a connection added now cannot expire sooner
+        return wait + self.idle_timeout * IDLE_SLACK
+
+    def stop_discovery(self):
+        self._stop_event.set()
+        self._waker.set()
+        try:
+            if self._mcast_sock:
+                try:
+                    mreq = socket.inet_aton(self.mcast_group) + socket.inet_aton(self.host)
+                    self._mcast_sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, mreq)
+                except Exception:
+                    pass
+                try:
+                    self._mcast_sock.close()
+                except Exception:
+                    pass
+        except Exception:
+            pass
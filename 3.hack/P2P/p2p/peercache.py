@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""On-disk cache of known peers for warm restarts."""
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional, List
+
+from .config import Addr
+
+try:
+    import fcntl
+except ImportError:   # no flock (Windows): one process per cache file, as without --workers
+    fcntl = None
+
+# ---------------- Peer cache --------------------------------------------------
+PEER_CACHE_MAGIC = b"P2PC\x01"
+PEER_CACHE_RECORD = struct.Struct("!4sHdb")   # ip, port, unix time, score delta
+PEER_CACHE_OK = 1        # outgoing connect succeeded
+PEER_CACHE_FAIL = -2     # outgoing connect failed
+PEER_CACHE_SEEN = 0      # peer showed up (HELLO on an incoming connection)
+PEER_CACHE_SCORE_MAX = 10
+PEER_CACHE_MIN_SCORE = -4     # below this a cached peer is not dialed at startup
+PEER_CACHE_WARM = 16          # cached peers dialed at startup
+PEER_CACHE_TTL = 7 * 86400.0
+
+def _file_id(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
+
+def _lock(fd: int, shared: bool = False) -> bool:
+    """shared=False: try the exclusive flock, else wait for a shared one.
+    True if fd holds the exclusive lock (no other process has the file open)."""
+    if fcntl is None:
+        return not shared
+    if not shared:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            pass
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    return False
+
+class PeerCache:
+    """Known peers on disk, for warm restarts.
+
+    The file is an append-only log of fixed-size records (PEER_CACHE_RECORD),
+    replayed at open into addr -> [score, last_seen]. Appends go through an
+    O_APPEND descriptor, so the processes of a WorkerPool can share one file.
+    When the log holds many more records than peers it is rewritten at open
+    with one record per peer (delta = its current score), but only by a
+    process that has the file to itself: each process holds a shared flock
+    on its descriptor, and rewriting needs the exclusive one. os.replace()
+    under a process still appending would send its records to the old,
+    unlinked file. A non-empty file without PEER_CACHE_MAGIC is not ours:
+    ValueError, it is never overwritten."""
+
+    def __init__(self, path: str, ttl: float = PEER_CACHE_TTL, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.entries: Dict[Addr, List[float]] = {}
+        self._fd: Optional[int] = self._open()
+
+    def _open(self) -> int:
+        """Load the file and return an append descriptor on it, flock'ed shared
+        for as long as it stays open."""
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                owner = _lock(fd)
+                st = os.fstat(fd)
+                if (st.st_dev, st.st_ino) != _file_id(self.path):
+                    os.close(fd)   # rewritten while we waited for the lock: open the new file
+                    continue
+                self.entries.clear()
+                records = self._load(owner)
+                if owner:
+                    if st.st_size == 0:
+                        os.write(fd, PEER_CACHE_MAGIC)
+                    elif records > 4 * max(64, len(self.entries)):
+                        self._compact()
+                        os.close(fd)   # the descriptor is on the replaced file
+                        continue
+                    # not atomic (unlock + lock): another process may have
+                    # become the owner in between and rewritten the file
+                    _lock(fd, shared=True)
+                    if (st.st_dev, st.st_ino) != _file_id(self.path):
+                        os.close(fd)
+                        continue
+                return fd
+            except BaseException:
+                os.close(fd)
+                raise
+
+    def _apply(self, addr: Addr, ts: float, delta: int) -> None:
+        entry = self.entries.setdefault(addr, [0, ts])
+        entry[0] = max(-PEER_CACHE_SCORE_MAX, min(PEER_CACHE_SCORE_MAX, entry[0] + delta))
+        entry[1] = max(entry[1], ts)
+
+    def _load(self, owner: bool) -> int:
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if not data:
+            return 0
+        if not data.startswith(PEER_CACHE_MAGIC):
+            raise ValueError(f"{self.path} non è una cache di peer: scegliere un altro file")
+        body = memoryview(data)[len(PEER_CACHE_MAGIC):]
+        usable = len(body) - len(body) % PEER_CACHE_RECORD.size
+        if usable != len(body) and owner:
+            # a crash left half a record: cut it, or every later append would be
+            # misaligned (with other processes appending it may be one in progress)
+            os.truncate(self.path, len(PEER_CACHE_MAGIC) + usable)
+        for ip, port, ts, delta in PEER_CACHE_RECORD.iter_unpack(body[:usable]):
+            self._apply((socket.inet_ntoa(ip), port), ts, delta)
+        cutoff = self.clock() - self.ttl
+        for addr in [a for a, (_, seen) in self.entries.items() if seen < cutoff]:
+            del self.entries[addr]
+        return usable // PEER_CACHE_RECORD.size
+
+    def _compact(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(prefix=".peers-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(PEER_CACHE_MAGIC)
+                for (ip, port), (score, seen) in self.entries.items():
+                    f.write(PEER_CACHE_RECORD.pack(socket.inet_aton(ip), port, seen, int(score)))
+            os.replace(tmp, self.path)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    def record(self, addr: Addr, delta: int) -> None:
+        try:
+            rec = PEER_CACHE_RECORD.pack(socket.inet_aton(addr[0]), addr[1], self.clock(), delta)
+        except (OSError, struct.error):
+            return   # not an IPv4 ip:port
+        with self._lock:
+            self._apply(addr, self.clock(), delta)
+            if self._fd is not None:
+                os.write(self._fd, rec)
+
+    def best(self, n: int = PEER_CACHE_WARM) -> List[Addr]:
+        """Up to n cached peers, highest score first (most recently seen on ties)."""
+        with self._lock:
+            ranked = sorted(self.entries.items(), key=lambda kv: (kv[1][0], kv[1][1]), reverse=True)
+        return [addr for addr, (score, _) in ranked[:n] if score >= PEER_CACHE_MIN_SCORE]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
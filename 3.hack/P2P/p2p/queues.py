@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""Bounded outbound frame queue of a connection: priority lanes and slow-consumer policies."""
+import collections
+import socket
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .config import Addr, ConnID
+from .logs import server_log
+from .wire import (
+    FRAME_HEADER, MSG_CODECS, MSG_COMPRESSED, MSG_FIND_NODE, MSG_FLOW, MSG_GOSSIP, MSG_HELLO, MSG_NODES,
+    MSG_REQUEST, MSG_RESPONSE, MSG_ROUTE,
+)
+
+# ---------------- Outbound queues ---------------------------------------------
+# Every connection owns a bounded queue of ready-to-send frames drained by its
+# own writer, so a slow peer only fills its own queue. What happens when the
+# queue is full is the slow-consumer policy:
+#   drop       - discard the new frame (counted in `dropped`)
+#   block      - the caller waits up to send_block_timeout for room, then drops
+#   disconnect - close the connection to the slow peer
+SLOW_POLICIES = ("drop", "block", "disconnect")
+DEFAULT_SEND_QUEUE = 1024
+SEND_BLOCK_TIMEOUT = 5.0
+
+# ---------------- Priority lanes ----------------------------------------------
+# A connection is one TCP stream, but its queue is split in lanes so that a
+# flood of data does not sit between a request and the socket. A frame's lane
+# depends on its message type only, never on its size: the frames of one
+# kind leave in the order they were queued.
+#   control  - handshake, requests/responses, DHT, flow control: always sent first
+#   messages - the node's own data (text, binary, typed, echo replies): one FIFO
+#   gossip   - frames relayed for others (MSG_GOSSIP)
+# messages and gossip share what is left by deficit round robin on bytes,
+# LANE_WEIGHTS[lane] * LANE_QUANTUM bytes per turn, so a gossip storm cannot
+# starve our own messages nor the other way round. A frame already being
+# written is never interrupted: a control frame waits for at most one frame
+# plus what the kernel holds, which TCP_NOTSENT_LOWAT keeps small (big files
+# belong on send_file/fetch_blob data connections anyway). What the kernel
+# already delivered to the receiver is out of reach too: an autotuned receive
+# buffer can hold megabytes of data ahead of a response. lane_rcvbuf caps it,
+# at the price of the window on high-latency links, so it is off by default.
+# The queue bound counts the frames of every lane together; control frames
+# may go LANE_CONTROL_RESERVE beyond it, so a queue full of data never
+# refuses a response or a MSG_FLOW.
+# A MSG_FLOW from the receiver (inbox full, registry.py) holds the messages and
+# gossip lanes: they fill up to the bound while control frames keep going out.
+LANE_CONTROL, LANE_MESSAGES, LANE_GOSSIP = 0, 1, 2
+LANE_NAMES = ("control", "messages", "gossip")
+LANE_WEIGHTS = (4, 1)             # messages, gossip
+LANE_QUANTUM = 16 * 1024
+LANE_CONTROL_RESERVE = 32         # control frames allowed beyond a full queue
+LANE_NOTSENT_LOWAT = 128 * 1024   # unsent bytes the kernel may hold per connection with lanes on
+CONTROL_TYPES = frozenset((
+    MSG_HELLO, MSG_CODECS, MSG_REQUEST, MSG_RESPONSE, MSG_FIND_NODE, MSG_NODES, MSG_ROUTE, MSG_FLOW,
+))
+_TCP_NOTSENT_LOWAT = getattr(socket, "TCP_NOTSENT_LOWAT", None)
+
+def frame_lane(frame: bytes) -> int:
+    """Lane of an encoded frame (a MSG_COMPRESSED one by its inner type)."""
+    msg_type = frame[4]
+    if msg_type == MSG_COMPRESSED and len(frame) > FRAME_HEADER.size + 1:
+        msg_type = frame[FRAME_HEADER.size + 1]
+    if msg_type in CONTROL_TYPES:
+        return LANE_CONTROL
+    return LANE_GOSSIP if msg_type == MSG_GOSSIP else LANE_MESSAGES
+
+def set_notsent_lowat(sock: socket.socket, nbytes: int = LANE_NOTSENT_LOWAT) -> None:
+    """Keep at most nbytes not yet sent in the kernel buffer: the rest waits in
+    the lanes, where a control frame can still overtake it (Linux/macOS)."""
+    if _TCP_NOTSENT_LOWAT is not None:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, _TCP_NOTSENT_LOWAT, nbytes)
+        except OSError:
+            pass
+
+def set_rcvbuf(sock: socket.socket, nbytes: int) -> None:
+    """Fix the receive buffer at nbytes (disables autotuning): fewer bulk bytes
+    can sit in the kernel ahead of a control frame, but the TCP window is capped
+    at about nbytes / RTT."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, nbytes)
+    except OSError:
+        pass
+
+class Lanes:
+    """Frames waiting on one connection, one FIFO per lane under one bound
+    (see above). Not thread-safe: SendQueue and the async protocol lock around
+    it. With prioritize=False every frame goes to the messages lane (plain
+    FIFO, no control reserve)."""
+
+    def __init__(self, maxsize: int, weights: Tuple[int, int] = LANE_WEIGHTS, prioritize: bool = True):
+        self.maxsize = maxsize
+        self.prioritize = prioritize
+        self._q: List[collections.deque] = [collections.deque() for _ in LANE_NAMES]
+        self._quantum = [0] + [max(1, w) * LANE_QUANTUM for w in weights]
+        self._deficit = [0] * len(LANE_NAMES)
+        self._turn = LANE_MESSAGES
+        self._len = 0
+        self.sent = [0] * len(LANE_NAMES)
+        self.held = False   # MSG_FLOW from the receiver: only control frames go out
+
+    def hold(self, held: bool) -> None:
+        """Hold or release the data lanes; a plain FIFO cannot skip frames, so it ignores it."""
+        self.held = held and self.prioritize
+
+    def ready(self) -> bool:
+        """Something pop() may return now."""
+        return bool(self._q[LANE_CONTROL]) or (self._len > 0 and not self.held)
+
+    def lane(self, frame: bytes) -> int:
+        return frame_lane(frame) if self.prioritize else LANE_MESSAGES
+
+    def full(self, lane: int) -> bool:
+        """No room for a frame of lane: the queue holds maxsize frames in all
+        (maxsize + LANE_CONTROL_RESERVE for a control frame); 0 = unbounded."""
+        if self.maxsize <= 0:
+            return False
+        return self._len >= self.maxsize + (LANE_CONTROL_RESERVE if lane == LANE_CONTROL else 0)
+
+    def push(self, frame: bytes, lane: int) -> None:
+        self._q[lane].append(frame)
+        self._len += 1
+
+    def pop(self) -> bytes:
+        """Next frame to write: control first, then deficit round robin (raises IndexError if
+        nothing is ready)."""
+        if self._q[LANE_CONTROL] or self.held:
+            return self._take(LANE_CONTROL)
+        if not self._q[LANE_GOSSIP] or not self._q[LANE_MESSAGES]:
+            lane = LANE_MESSAGES if self._q[LANE_MESSAGES] else LANE_GOSSIP
+            self._deficit[lane] = 0   # a lane alone on the link earns no credit
+            return self._take(lane)
+        while True:
+            lane = self._turn
+            if self._deficit[lane] >= len(self._q[lane][0]):
+                self._deficit[lane] -= len(self._q[lane][0])
+                return self._take(lane)
+            self._turn = LANE_GOSSIP if lane == LANE_MESSAGES else LANE_MESSAGES
+            self._deficit[self._turn] += self._quantum[self._turn]
+
+    def _take(self, lane: int) -> bytes:
+        frame = self._q[lane].popleft()
+        self._len -= 1
+        self.sent[lane] += 1
+        if not self._q[lane]:
+            self._deficit[lane] = 0
+        return frame
+
+    def depths(self) -> Dict[str, int]:
+        return {name: len(q) for name, q in zip(LANE_NAMES, self._q)}
+
+    def __len__(self) -> int:
+        return self._len
+
+class SendQueue:
+    """Bounded outbound frame queue of one connection plus its writer thread.
+    Frames are immutable bytes: broadcast encodes once and queues the very same
+    object on every connection, nothing is copied per peer. The bound and the
+    slow-consumer policy apply to the whole queue, with a small reserve that
+    keeps a queue full of data from refusing or delaying a control frame."""
+
+    def __init__(self, registry, cid: ConnID, sock: socket.socket, addr: Addr,
+                 maxsize: int = DEFAULT_SEND_QUEUE, policy: str = "drop",
+                 block_timeout: float = SEND_BLOCK_TIMEOUT,
+                 lane_weights: Tuple[int, int] = LANE_WEIGHTS, lanes: bool = True):
+        if policy not in SLOW_POLICIES:
+            raise ValueError(f"Policy sconosciuta: {policy}")
+        self.registry = registry
+        self.cid = cid
+        self.sock = sock
+        self.addr = addr
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._lanes = Lanes(maxsize, lane_weights, lanes)
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self.high_water = 0
+        self.dropped = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.queued_bytes = 0
+        self._thread = threading.Thread(target=self._drain, name=f"send-{cid}", daemon=True)
+        self._thread.start()
+
+    def put(self, frame: bytes, block: Optional[bool] = None) -> bool:
+        """Queue a frame according to the policy; False if it was not queued.
+        block=True waits for room (up to block_timeout) whatever the policy,
+        block=False drops (and counts) the frame whatever the policy."""
+        if self._closed:
+            return False
+        disconnect = block is None and self.policy == "disconnect"
+        if block is None:
+            block = self.policy == "block"
+        lane = self._lanes.lane(frame)
+        with self._lock:
+            if block and self._lanes.full(lane):
+                self._not_full.wait_for(lambda: self._closed or not self._lanes.full(lane), self.block_timeout)
+            queued = not self._closed and not self._lanes.full(lane)
+            if queued:
+                self._lanes.push(frame, lane)
+                self.queued_bytes += len(frame)
+                self.high_water = max(self.high_water, len(self._lanes))
+                self._not_empty.notify()
+            else:
+                self.dropped += 1
+        if not queued:
+            if disconnect and not self._closed:
+                server_log(f"[send-{self.cid}] Peer lento {self.addr}: coda piena -> chiudo")
+                self.registry.remove(self.cid)
+        return queued
+
+    def hold(self, held: bool) -> None:
+        """MSG_FLOW from the receiver: stop (or resume) writing data frames."""
+        with self._lock:
+            self._lanes.hold(held)
+            self._not_empty.notify()
+
+    def close(self) -> None:
+        # a writer stuck in sendall is woken by closing the socket
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def _drain(self) -> None:
+        while True:
+            with self._lock:
+                self._not_empty.wait_for(lambda: self._closed or self._lanes.ready())
+                if self._closed:
+                    return
+                frame = self._lanes.pop()
+                self._not_full.notify_all()
+            try:
+                self.sock.sendall(frame)
+            except Exception as e:
+                if not self._closed:
+                    server_log(f"[send-{self.cid}] Errore invio a {self.addr}: {e}")
+                    self.registry.remove(self.cid)
+                return
+            with self._lock:
+                self.sent += 1
+                self.sent_bytes += len(frame)
+                self.queued_bytes -= len(frame)
+            self.registry.touch(self.cid)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "cid": self.cid,
+                "addr": self.addr,
+                "depth": len(self._lanes),
+                "high_water": self.high_water,
+                "dropped": self.dropped,
+                "sent": self.sent,
+                "sent_bytes": self.sent_bytes,
+                "lanes": self._lanes.depths(),
+                "held": self._lanes.held,
+            }
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""Connection registries (single lock / sharded) and the bounded per-connection inbox."""
+import heapq
+import itertools
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Tuple, Optional, List
+
+from .config import Addr, ConnID
+
+# ---------------- Inbound buffers ---------------------------------------------
+# Messages received on a connection wait in its Inbox until the application
+# takes them with Peer.recv(). The inbox is bounded in bytes: once it holds more
+# than `limit`, the connection stops reading from its socket (the handler thread
+# waits, the async transport pauses) until it drains below half the limit, so
+# the sender is slowed down by TCP flow control instead of growing our memory.
+# A paused socket holds back every frame behind it, responses and routing
+# included, so the socket is only the last resort:
+#   over `limit`             - on_full(): the connection sends MSG_FLOW and the
+#                              other side holds its data lanes (queues.py), its
+#                              bound and slow-consumer policy push back on the
+#                              sending application; control frames keep flowing
+#   over `limit` + overdraft - stop reading the socket (a peer that ignores
+#                              MSG_FLOW, or one with lanes off)
+#   back under `limit` / 2   - on_drain(): MSG_FLOW resume, reading resumes
+# MSG_REPLY echoes of our own sends are offer()ed: kept while there is room,
+# dropped (counted) once the inbox is full, never a reason to hold anything.
+DEFAULT_INBOX_BYTES = 4 * 1024 * 1024
+INBOX_OVERDRAFT = 1024 * 1024   # at least this much room for frames already in flight when MSG_FLOW is sent
+
+class Inbox:
+    __slots__ = ("limit", "nbytes", "_items", "_cond", "closed", "on_full", "on_drain", "_throttled", "_paused",
+                 "_signal_lock", "_signalled")
+
+    def __init__(self, limit: int = DEFAULT_INBOX_BYTES):
+        self.limit = limit
+        self.nbytes = 0
+        self._items: "deque[Tuple[object, int]]" = deque()
+        self._cond = threading.Condition(threading.Lock())
+        self.closed = False
+        # called (from the pushing thread) when the inbox goes over its limit
+        self.on_full: Optional[Callable[[], None]] = None
+        # called (from the popping thread) when a throttled or paused connection may read again
+        self.on_drain: Optional[Callable[[], None]] = None
+        self._throttled = False   # over the limit: the sender was asked to hold
+        self._paused = False      # over limit + overdraft: the socket is not read
+        self._signal_lock = threading.Lock()
+        self._signalled = False   # throttled state last reported to on_full/on_drain
+
+    def push(self, msg, size: int) -> bool:
+        """Store a message; False once reading must stop (over limit + overdraft).
+        A limit of 0 keeps nothing (messages are only logged)."""
+        if self.limit <= 0:
+            return True
+        with self._cond:
+            self._items.append((msg, size))
+            self.nbytes += size
+            self._cond.notify_all()
+            throttle = not self._throttled and self.nbytes > self.limit
+            if throttle:
+                self._throttled = True
+            full = self.nbytes > self.limit + max(self.limit, INBOX_OVERDRAFT)
+            if full:
+                self._paused = True
+        if throttle:
+            self._signal()
+        return not full
+
+    def offer(self, msg, size: int) -> bool:
+        """Store a message only if it fits under the limit; never pauses reading."""
+        if self.limit <= 0:
+            return True
+        with self._cond:
+            if self._throttled or self.nbytes + size > self.limit:
+                return False
+            self._items.append((msg, size))
+            self.nbytes += size
+            self._cond.notify_all()
+            return True
+
+    def pop(self, timeout: Optional[float] = None):
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items and not self.closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if not self._items:
+                return None
+            msg, size = self._items.popleft()
+            self.nbytes -= size
+            resume = (self._throttled or self._paused) and self.nbytes <= self.limit // 2
+            if resume:
+                self._throttled = self._paused = False
+                self._cond.notify_all()
+        if resume:
+            self._signal()
+        return msg
+
+    def _signal(self) -> None:
+        """Report the throttled state through on_full/on_drain. push and pop
+        change it on different threads and call this after letting go of the
+        inbox lock: whoever gets here last reports the current state, so a
+        resume can never overtake the hold it answers and leave the sender
+        held for good."""
+        with self._signal_lock:
+            throttled = self._throttled
+            if throttled == self._signalled:
+                return
+            self._signalled = throttled
+            callback = self.on_full if throttled else self.on_drain
+            if callback is not None:
+                callback()
+
+    @property
+    def full(self) -> bool:
+        """Over limit + overdraft: the connection must stop reading."""
+        return self._paused
+
+    @property
+    def throttled(self) -> bool:
+        return self._throttled
+
+    def wait_room(self) -> None:
+        """Block the reading thread while the inbox is over its limit."""
+        with self._cond:
+            while self._paused and not self.closed:
+                self._cond.wait()
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+# ---------------- Connection registry -----------------------------------------
+def _close_conn(sock) -> None:
+    """shutdown() before close(): close() alone does not wake a thread blocked
+    in recv()/select() on the socket, shutdown() makes it see EOF at once."""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    try:
+        sock.close()
+    except Exception:
+        pass
+
+class ConnectionRegistry:
+    def __init__(self, inbox_bytes: int = DEFAULT_INBOX_BYTES):
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._conns: Dict[ConnID, Tuple[socket.socket, Addr, bool, float]] = {}
+        self.inbox_bytes = inbox_bytes
+        self._msg_queues: Dict[ConnID, Inbox] = {}
+        # addr -> cid, so discovery lookups do not scan every connection
+        self._by_addr: Dict[Addr, ConnID] = {}
+        # listening address announced by the remote side (MSG_HELLO) of incoming connections
+        self._listen: Dict[ConnID, Addr] = {}
+        # min-heap of (last_touch, cid). touch() does not push: entries go stale
+        # and are re-pushed with the real timestamp only when they reach the top
+        # in find_idle(); entries of removed connections are dropped there too.
+        self._idle_heap: List[Tuple[float, ConnID]] = []
+
+    def add(self, sock: socket.socket, addr: Addr, incoming: bool) -> ConnID:
+        with self._lock:
+            cid = self._next_id
+            self._next_id += 1
+            now = time.time()
+            self._conns[cid] = (sock, addr, incoming, now)
+            self._msg_queues[cid] = Inbox(self.inbox_bytes)
+            self._by_addr[addr] = cid
+            heapq.heappush(self._idle_heap, (now, cid))
+            return cid
+
+    def touch(self, cid: ConnID) -> None:
+        with self._lock:
+            if cid in self._conns:
+                sock, addr, incoming, _ = self._conns[cid]
+                self._conns[cid] = (sock, addr, incoming, time.time())
+
+    def remove(self, cid: ConnID) -> None:
+        with self._lock:
+            if cid in self._conns:
+                sock, addr, _, _ = self._conns.pop(cid)
+                inbox = self._msg_queues.pop(cid, None)
+                if inbox is not None:
+                    inbox.close()
+                if self._by_addr.get(addr) == cid:
+                    del self._by_addr[addr]
+                alias = self._listen.pop(cid, None)
+                if alias is not None and self._by_addr.get(alias) == cid:
+                    del self._by_addr[alias]
+                _close_conn(sock)
+
+    def set_listen_addr(self, cid: ConnID, addr: Addr) -> None:
+        """Index an incoming connection under the peer's listening address too,
+        so find_by_addr() matches what discovery announces."""
+        with self._lock:
+            if cid in self._conns:
+                self._listen[cid] = addr
+                self._by_addr.setdefault(addr, cid)
+
+    def listen_addrs(self) -> List[Addr]:
+        """Listening address of every connection whose remote end is known."""
+        with self._lock:
+            out = [addr for cid, (_, addr, incoming, _) in self._conns.items() if not incoming]
+            out.extend(self._listen.values())
+        return out
+
+    def items(self):
+        with self._lock:
+            return list(self._conns.items())
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    def get(self, cid: ConnID):
+        with self._lock:
+            return self._conns.get(cid)
+
+    def find_by_addr(self, addr: Addr):
+        with self._lock:
+            return self._by_addr.get(addr)
+
+    def find_idle(self, idle_threshold: float):
+        """Connections untouched for more than idle_threshold seconds.
+        Only heap entries older than the threshold are visited: O(k log n)."""
+        now = time.time()
+        cutoff = now - idle_threshold
+        idle = []
+        keep = []
+        with self._lock:
+            heap = self._idle_heap
+            while heap and heap[0][0] < cutoff:
+                _, cid = heapq.heappop(heap)
+                entry = self._conns.get(cid)
+                if entry is None:
+                    continue
+                last = entry[3]
+                if last < cutoff:
+                    idle.append((cid, entry[1]))
+                    keep.append((last, cid))
+                else:
+                    heapq.heappush(heap, (last, cid))
+            for item in keep:
+                heapq.heappush(heap, item)
+        return idle
+
+    def next_idle(self, idle_threshold: float) -> Optional[float]:
+        """Seconds before find_idle() can return anything (the oldest heap entry,
+        possibly stale, expires), None without connections."""
+        with self._lock:
+            if not self._idle_heap:
+                return None
+            oldest = self._idle_heap[0][0]
+        return max(0.0, oldest + idle_threshold - time.time())
+
+    def inbox(self, cid: ConnID) -> Optional[Inbox]:
+        with self._lock:
+            return self._msg_queues.get(cid)
+
+    def push_msg(self, cid: ConnID, msg: str, size: Optional[int] = None) -> bool:
+        """Queue a received message; False when the inbox is full (stop reading)."""
+        inbox = self.inbox(cid)
+        if inbox is None:
+            return True
+        return inbox.push(msg, len(msg) if size is None else size)
+
+    def offer_msg(self, cid: ConnID, msg: str, size: Optional[int] = None) -> bool:
+        """Queue a message only if the inbox has room; False = dropped."""
+        inbox = self.inbox(cid)
+        if inbox is None:
+            return True
+        return inbox.offer(msg, len(msg) if size is None else size)
+
+    def pop_msg(self, cid: ConnID, timeout: Optional[float] = None) -> Optional[str]:
+        inbox = self.inbox(cid)
+        if inbox is None:
+            return None
+        return inbox.pop(timeout)
+
+class ConnRecord:
+    """Mutable per-connection record used by ShardedConnectionRegistry.
+    touch() only stores `last` in place; iterating yields the same
+    (sock, addr, incoming, last) tuple the plain registry returns."""
+    __slots__ = ("sock", "addr", "incoming", "last", "inbox", "listen")
+
+    def __init__(self, sock: socket.socket, addr: Addr, incoming: bool, last: float,
+                 inbox_bytes: int = DEFAULT_INBOX_BYTES):
+        self.sock = sock
+        self.addr = addr
+        self.incoming = incoming
+        self.last = last
+        self.inbox = Inbox(inbox_bytes)
+        self.listen: Optional[Addr] = None
+
+    def __iter__(self):
+        return iter((self.sock, self.addr, self.incoming, self.last))
+
+    def __getitem__(self, i: int):
+        return (self.sock, self.addr, self.incoming, self.last)[i]
+
+class _Shard:
+    __slots__ = ("lock", "conns", "by_addr", "idle_heap")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conns: Dict[ConnID, ConnRecord] = {}
+        self.by_addr: Dict[Addr, ConnID] = {}
+        self.idle_heap: List[Tuple[float, ConnID]] = []
+
+class ShardedConnectionRegistry:
+    """Same API as ConnectionRegistry with the state split over N shards,
+    each behind its own lock (cid -> shard by cid % N, address index by
+    hash(addr) % N). touch() takes no lock at all: it writes the timestamp
+    into the connection's ConnRecord."""
+
+    def __init__(self, shards: int = 16, inbox_bytes: int = DEFAULT_INBOX_BYTES):
+        self.inbox_bytes = inbox_bytes
+        self._shards = [_Shard() for _ in range(shards)]
+        self._ids = itertools.count(1)   # next() is atomic under the GIL
+
+    def _shard(self, cid: ConnID) -> _Shard:
+        return self._shards[cid % len(self._shards)]
+
+    def _addr_shard(self, addr: Addr) -> _Shard:
+        return self._shards[hash(addr) % len(self._shards)]
+
+    def add(self, sock: socket.socket, addr: Addr, incoming: bool) -> ConnID:
+        cid = next(self._ids)
+        now = time.time()
+        shard = self._shard(cid)
+        with shard.lock:
+            shard.conns[cid] = ConnRecord(sock, addr, incoming, now, self.inbox_bytes)
+            heapq.heappush(shard.idle_heap, (now, cid))
+        ashard = self._addr_shard(addr)
+        with ashard.lock:
+            ashard.by_addr[addr] = cid
+        return cid
+
+    def touch(self, cid: ConnID) -> None:
+        rec = self._shard(cid).conns.get(cid)
+        if rec is not None:
+            rec.last = time.time()
+
+    def remove(self, cid: ConnID) -> None:
+        shard = self._shard(cid)
+        with shard.lock:
+            rec = shard.conns.pop(cid, None)
+        if rec is None:
+            return
+        rec.inbox.close()
+        for addr in (rec.addr, rec.listen):
+            if addr is None:
+                continue
+            ashard = self._addr_shard(addr)
+            with ashard.lock:
+                if ashard.by_addr.get(addr) == cid:
+                    del ashard.by_addr[addr]
+        _close_conn(rec.sock)
+
+    def set_listen_addr(self, cid: ConnID, addr: Addr) -> None:
+        rec = self._shard(cid).conns.get(cid)
+        if rec is None:
+            return
+        rec.listen = addr
+        ashard = self._addr_shard(addr)
+        with ashard.lock:
+            ashard.by_addr.setdefault(addr, cid)
+
+    def listen_addrs(self) -> List[Addr]:
+        out = []
+        for shard in self._shards:
+            with shard.lock:
+                for rec in shard.conns.values():
+                    addr = rec.listen if rec.incoming else rec.addr
+                    if addr is not None:
+                        out.append(addr)
+        return out
+
+    def __len__(self) -> int:
+        return sum(len(shard.conns) for shard in self._shards)
+
+    def items(self):
+        out = []
+        for shard in self._shards:
+            with shard.lock:
+                out.extend(shard.conns.items())
+        out.sort()
+        return out
+
+    def get(self, cid: ConnID):
+        return self._shard(cid).conns.get(cid)
+
+    def find_by_addr(self, addr: Addr):
+        ashard = self._addr_shard(addr)
+        with ashard.lock:
+            return ashard.by_addr.get(addr)
+
+    def find_idle(self, idle_threshold: float):
+        cutoff = time.time() - idle_threshold
+        idle = []
+        for shard in self._shards:
+            keep = []
+            with shard.lock:
+                heap = shard.idle_heap
+                while heap and heap[0][0] < cutoff:
+                    _, cid = heapq.heappop(heap)
+                    rec = shard.conns.get(cid)
+                    if rec is None:
+                        continue
+                    if rec.last < cutoff:
+                        idle.append((cid, rec.addr))
+                        keep.append((rec.last, cid))
+                    else:
+                        heapq.heappush(heap, (rec.last, cid))
+                for item in keep:
+                    heapq.heappush(heap, item)
+        return idle
+
+    def next_idle(self, idle_threshold: float) -> Optional[float]:
+        oldest = None
+        for shard in self._shards:
+            with shard.lock:
+                if shard.idle_heap and (oldest is None or shard.idle_heap[0][0] < oldest):
+                    oldest = shard.idle_heap[0][0]
+        if oldest is None:
+            return None
+        return max(0.0, oldest + idle_threshold - time.time())
+
+    def inbox(self, cid: ConnID) -> Optional[Inbox]:
+        rec = self._shard(cid).conns.get(cid)
+        return rec.inbox if rec is not None else None
+
+    def push_msg(self, cid: ConnID, msg: str, size: Optional[int] = None) -> bool:
+        rec = self._shard(cid).conns.get(cid)
+        if rec is None:
+            return True
+        return rec.inbox.push(msg, len(msg) if size is None else size)
+
+    def offer_msg(self, cid: ConnID, msg: str, size: Optional[int] = None) -> bool:
+        rec = self._shard(cid).conns.get(cid)
+        if rec is None:
+            return True
+        return rec.inbox.offer(msg, len(msg) if size is None else size)
+
+    def pop_msg(self, cid: ConnID, timeout: Optional[float] = None) -> Optional[str]:
+        rec = self._shard(cid).conns.get(cid)
+        if rec is None:
+            return None
+        return rec.inbox.pop(timeout)
+
+REGISTRIES = {"default": ConnectionRegistry, "sharded": ShardedConnectionRegistry}
+
+def make_registry(registry, inbox_bytes: int = DEFAULT_INBOX_BYTES) -> "ConnectionRegistry":
+    """Registry from a REGISTRIES name, or an already built instance."""
+    if isinstance(registry, str):
+        return REGISTRIES[registry](inbox_bytes=inbox_bytes)
+    return registry
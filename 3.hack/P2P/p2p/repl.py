@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Interactive console."""
+import json
+
+from .logs import LOG_PROMPT, flush_logs
+from .messages import SCHEMAS
+from .metrics import format_stats
+
+# ---------------- REPL (buffered flush + send_and_wait) -----------------------
+def repl(peer):
+    help_text = (
+        "Comandi disponibili:\n"
+        "  connect <ip> <port>      - Apri connessione verso peer\n"
+        "  peers                    - Lista connessioni (id, addr, in/out, idle_s, memoria in byte)\n"
+        "  recv <id>                - Leggi i messaggi ricevuti in attesa su una connessione\n"
+        "  send <id> <message>      - Invia messaggio a connessione specifica e attendi risposta\n"
+        "  typed <id> <schema> <json> - Invia un messaggio tipizzato, es. typed 1 ping {\"seq\": 1, \"sent\": 0.5}\n"
+        "  schemas                  - Schemi registrati per i messaggi tipizzati (id, nome, campi)\n"
+        "  broadcast <message>      - Invia a tutte le connessioni (o gossip, vedi --broadcast)\n"
+        "  gossip <message>         - Diffusione epidemica a tutta la mesh\n"
+        "  route <id_hex> <message> - Instrada il messaggio al nodo con quell'id DHT (anche non connesso)\n"
+        "  dht [join]               - Id DHT, contatti per bucket e contatori (join = riempi la tabella)\n"
+        "  sendfile <ip> <port> <path> - Invia un file (connessione dedicata, sendfile, ripresa automatica)\n"
+        "  fetch <name>             - Scarica un file da tutti i peer connessi che lo hanno (a sciame, in --files-dir)\n"
+        "  queues                   - Code di invio (depth, max, scartati, inviati, frame per corsia)\n"
+        "  stats                    - Metriche: contatori, gauge, latenze send (p50/p90/p99), traffico per connessione\n"
+        "  discovery                - Stato announce multicast (intervallo, digest, contatori)\n"
+        "  close <id>               - Chiudi connessione specifica\n"
+        "  exit                     - Arresta server e termina\n"
+        "  help                     - Mostra questo aiuto\n"
+    )
+    # print help directly (so user sees it immediately)
+    print(help_text, end="\n")
+
+    while True:
+        # flush buffered logs before prompt (these come from buffered_log())
+        flush_logs()
+
+        try:
+            raw = input(LOG_PROMPT).strip()
+        except (EOFError, KeyboardInterrupt):
+            print("\nUscita...")
+            break
+
+        if not raw:
+            continue
+        parts = raw.split(" ", 2)
+        cmd = parts[0].lower()
+
+        try:
+            if cmd == "help":
+                print(help_text)
+            elif cmd == "connect" and len(parts) >= 3:
+                ip = parts[1]
+                try:
+                    port = int(parts[2])
+                except ValueError:
+                    print("Porta non valida.")
+                    continue
+                try:
+                    cid = peer.connect(ip, port)
+                    print(f"Connesso: id={cid}")
+                except Exception as e:
+                    print(f"Errore connect: {e}")
+            elif cmd == "peers":
+                rows = peer.list_peers()
+                if not rows:
+                    print("Nessuna connessione attiva.")
+                else:
+                    for cid, addr, typ, idle, mem in rows:
+                        print(
+                            f"id={cid} addr={addr} type={typ} idle_s={idle} "
+                            f"rx_buf={mem['rx_buf']} inbox={mem['inbox']} tx={mem['tx_queued']}"
+                        )
+            elif cmd == "send" and len(parts) >= 3:
+                try:
+                    cid = int(parts[1])
+                except ValueError:
+                    print("ID non valido.")
+                    continue
+                message = parts[2]
+                try:
+                    resp = peer.send_and_wait(cid, message, timeout=None)
+                    print("Messaggio inviato.")
+                    if resp is None:
+                        print(f"(Nessuna risposta entro {peer.send_wait_timeout}s; la risposta apparirà al prossimo prompt)")
+                    else:
+                        print("Risposta:", resp)
+                except Exception as e:
+                    print(f"Errore invio: {e}")
+            elif cmd == "recv" and len(parts) >= 2:
+                try:
+                    cid = int(parts[1])
+                except ValueError:
+                    print("ID non valido.")
+                    continue
+                msg = peer.recv(cid, timeout=0)
+                if msg is None:
+                    print("Nessun messaggio in attesa.")
+                while msg is not None:
+                    print(f"id={cid}: {msg}")
+                    msg = peer.recv(cid, timeout=0)
+            elif cmd == "typed" and len(parts) >= 3:
+                args = raw.split(" ", 3)
+                if len(args) < 4:
+                    print("Uso: typed <id> <schema> <json>")
+                    continue
+                try:
+                    cid = int(args[1])
+                    fields = json.loads(args[3])
+                except ValueError:
+                    print("ID o JSON non valido.")
+                    continue
+                peer.send_typed(cid, args[2], fields)
+                print("Messaggio tipizzato inviato.")
+            elif cmd == "schemas":
+                for sid, schema in sorted(SCHEMAS.items()):
+                    print(f"{sid} {schema.name} " + " ".join(f"{n}:{k}" for n, k in schema.fields))
+            elif cmd == "gossip" and len(parts) >= 2:
+                msg_id = peer.gossip(raw[len("gossip ") :])
+                print(f"Gossip {msg_id:016x} inviato.")
+            elif cmd == "route" and len(parts) >= 3:
+                try:
+                    dest = int(parts[1], 16)
+                except ValueError:
+                    print("ID DHT non valido (esadecimale).")
+                    continue
+                hop = peer.send_to_node(dest, parts[2])
+                print(f"Messaggio instradato verso {dest:016x}" + (f" via id={hop}." if hop is not None else " (nodo locale)."))
+            elif cmd == "dht":
+                if len(parts) >= 2 and parts[1] == "join":
+                    peer.dht_join()
+                print(f"node_id={peer.node_id:016x} contatti={len(peer.routes)}")
+                print(" ".join(f"b{i}={n}" for i, n in sorted(peer.routes.bucket_sizes().items())))
+                print(" ".join(f"{k}={v}" for k, v in peer.dht_stats.items()))
+            elif cmd == "sendfile" and len(parts) >= 3:
+                args = raw.split(" ", 3)
+                if len(args) < 4:
+                    print("Uso: sendfile <ip> <port> <path>")
+                    continue
+                try:
+                    port = int(args[2])
+                except ValueError:
+                    print("Porta non valida.")
+                    continue
+                r = peer.send_file(args[1], port, args[3])
+                print(f"File inviato: {r['size']} byte (ripreso da {r['offset']}) in {r['seconds']}s, {r['mb_s']} MB/s")
+            elif cmd == "fetch" and len(parts) >= 2:
+                r = peer.fetch_blob(raw[len("fetch ") :])
+                print(f"Scaricato {r['path']}: {r['size']} byte in {r['seconds']}s, {r['mb_s']} MB/s, duplicati={r['duplicates']}")
+                for src, st in r["sources"].items():
+                    print(f"  {src} chunk={st['chunks']} MB/s={st['mb_s']}" + (f" errore={st['error']}" if st["error"] else ""))
+            elif cmd == "queues":
+                rows = peer.send_queue_stats()
+                if not rows:
+                    print("Nessuna connessione attiva.")
+                for st in rows:
+                    print(
+                        f"id={st['cid']} addr={st['addr']} depth={st['depth']} max={st['high_water']} "
+                        f"dropped={st['dropped']} sent={st['sent']} bytes={st['sent_bytes']} "
+                        + " ".join(f"{lane}={n}" for lane, n in st["lanes"].items())
+                        + (" (trattenuta: inbox remota piena)" if st["held"] else "")
+                    )
+            elif cmd == "stats":
+                for line in format_stats(peer.stats()):
+                    print(line)
+            elif cmd == "discovery":
+                d = peer.discovery
+                digest = f"{d.digest:016x}" if d.digest is not None else "-"
+                print(f"announce={d.fmt} interval_s={d.interval} digest={digest} noti={len(d.known)}")
+                print(" ".join(f"{k}={v}" for k, v in d.stats.items()))
+            elif cmd == "broadcast" and len(parts) >= 2:
+                message = raw[len("broadcast ") :]
+                peer.broadcast(message)
+                print("Broadcast inviato.")
+            elif cmd == "close" and len(parts) >= 2:
+                try:
+                    cid = int(parts[1])
+                except ValueError:
+                    print("ID non valido.")
+                    continue
+                peer.disconnect(cid)
+                print(f"Connessione id={cid} chiusa.")
+            elif cmd == "exit":
+                break
+            else:
+                print("Comando non riconosciuto. Digita 'help'.")
+        except Exception as e:
+            print(f"Errore nel comando: {e}")
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""Swarm download: one file fetched in chunks from several peers at once."""
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .config import Addr
+from .wire import (
+    FRAME_HEADER, MAX_FRAME_SIZE, MSG_BLOB_GET, MSG_BLOB_HAVE, MSG_BLOB_QUERY, MSG_FILE_CHUNK, FrameError,
+    encode_frame,
+)
+from .transfer import (
+    FILE_CHUNK, FILE_CHUNK_HEADER, META_SUFFIX, PART_META, PART_SUFFIX, FileChunkError, FileTransferError,
+    _preallocate, _recv_exact, _send_chunk,
+)
+
+# ---------------- Swarm download ------------------------------------------------
+# Every node serves the files in its files dir: complete ones, and the chunks
+# it already holds of a .part (a transfer or a swarm download in progress).
+# fetch_blob() opens one dedicated connection per source:
+#
+#   fetcher                              source
+#   MSG_BLOB_QUERY (name)                ->
+#                                        <-  MSG_BLOB_HAVE (size, chunk, digest, bitmap of chunks held)
+#   MSG_BLOB_GET (index) x pipeline      ->
+#                                        <-  MSG_FILE_CHUNK (offset, crc32) + bytes (sendfile)
+#
+# Each source gets a worker thread that keeps `pipeline` GETs in flight and
+# always asks for the rarest chunk its source has (fewest holders first), so
+# scarce chunks are secured before their only holder goes away and partial
+# holders have something to offer each other. Fast sources simply come back
+# for more work more often. Once every missing chunk is already in flight
+# (endgame), idle workers request those chunks again from their own source and
+# the first copy wins: a slow source cannot hold back the last chunks. A file
+# is identified by name and content digest (BLAKE2b of the whole file): only
+# the sources that agree with the majority on (size, chunk, digest) are used,
+# and the finished .part is hashed again before it replaces <name>. A holder
+# that cannot vouch for the content (a plain transfer still in progress)
+# answers with a zero digest and is never used.
+SWARM_PIPELINE = 4        # GETs in flight per source: hides one round trip per chunk
+SWARM_MAX_SOURCES = 16    # default sources, fastest known first (see Peer.fetch_blob)
+SWARM_SUFFIX = ".swarm"   # <name>.part.swarm: progress of a swarm download, for resume and partial serving
+
+DIGEST_SIZE = 16
+NO_DIGEST = bytes(DIGEST_SIZE)
+HAVE_HEADER = struct.Struct(f"!QI{DIGEST_SIZE}s")   # file size, chunk size (0 = not here), digest; then bitmap, bit i = chunk i
+GET_HEADER = struct.Struct("!I")                    # chunk index
+SWARM_META = struct.Struct(f"!QI{DIGEST_SIZE}s")    # file size, chunk size, digest; then bitmap of the chunks written
+
+def chunk_count(size: int, chunk: int) -> int:
+    return (size + chunk - 1) // chunk
+
+def file_digest(path: str) -> bytes:
+    """BLAKE2b of the content of path (DIGEST_SIZE bytes)."""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.digest()
+
+_digests: Dict[str, Tuple[int, int, bytes]] = {}   # path -> (size, mtime_ns, digest) of served files
+_digests_lock = threading.Lock()
+
+def _cached_digest(path: str) -> bytes:
+    """file_digest(path), hashed again only when size or mtime change."""
+    st = os.stat(path)
+    with _digests_lock:
+        hit = _digests.get(path)
+    if hit is not None and hit[:2] == (st.st_size, st.st_mtime_ns):
+        return hit[2]
+    digest = file_digest(path)
+    with _digests_lock:
+        _digests[path] = (st.st_size, st.st_mtime_ns, digest)
+    return digest
+
+def _has(bitmap, i: int) -> bool:
+    return bool(bitmap[i >> 3] & (0x80 >> (i & 7)))
+
+def _bitmap(n: int, held: int) -> bytes:
+    """Bitmap of n chunks where the first `held` are set."""
+    bits = bytearray((n + 7) // 8)
+    full, rest = divmod(held, 8)
+    bits[:full] = b"\xff" * full
+    if rest:
+        bits[full] = (0xff << (8 - rest)) & 0xff
+    return bytes(bits)
+
+class RateLimiter:
+    """Token bucket shared by every upload of a node: `rate` bytes/s on
+    average, bursts of up to `burst` bytes. consume() sleeps off any debt, so
+    concurrent uploads split the rate between them."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(FILE_CHUNK, int(self.rate / 10))
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate) - n
+            self._stamp = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+    def try_consume(self, n: int = 1) -> bool:
+        """consume() that never waits: False, and nothing taken, when the
+        bucket holds less than n."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._tokens < n:
+                return False
+            self._tokens -= n
+            return True
+
+def _read_frame(sock, expect: int) -> bytes:
+    head = bytearray(FRAME_HEADER.size)
+    _recv_exact(sock, memoryview(head))
+    length, msg_type = FRAME_HEADER.unpack(head)
+    if msg_type != expect or length > MAX_FRAME_SIZE:
+        raise FrameError(f"Atteso tipo {expect}, ricevuto tipo {msg_type} ({length} byte)")
+    body = bytearray(length)
+    _recv_exact(sock, memoryview(body))
+    return bytes(body)
+
+def _valid_name(name: str) -> bool:
+    return os.path.basename(name) == name and name not in ("", ".", "..")
+
+# ---------------- Source side ---------------------------------------------------
+def local_blob(directory: Optional[str], name: str) -> Optional[Tuple[str, int, int, bytes, bytes]]:
+    """(path, size, chunk, digest, bitmap) of what this node holds of name, or
+    None. digest is NO_DIGEST when the complete content is not known here."""
+    if directory is None or not _valid_name(name):
+        return None
+    path = os.path.join(directory, name)
+    if os.path.isfile(path):
+        size = os.path.getsize(path)
+        n = chunk_count(size, FILE_CHUNK)
+        return path, size, FILE_CHUNK, _cached_digest(path), _bitmap(n, n)
+    part = path + PART_SUFFIX
+    try:
+        with open(part + SWARM_SUFFIX, "rb") as m:
+            raw = m.read()
+        size, chunk, digest = SWARM_META.unpack_from(raw)
+        return part, size, chunk, digest, raw[SWARM_META.size:SWARM_META.size + (chunk_count(size, chunk) + 7) // 8]
+    except (OSError, struct.error):
+        pass
+    try:
+        with open(part + META_SUFFIX, "rb") as m:   # plain transfer in progress: a verified prefix
+            _, size, offset = PART_META.unpack(m.read(PART_META.size))
+    except (OSError, struct.error):
+        return None
+    n = chunk_count(size, FILE_CHUNK)
+    return part, size, FILE_CHUNK, NO_DIGEST, _bitmap(n, n if offset >= size else offset // FILE_CHUNK)
+
+def serve_blob(sock, directory: Optional[str], payload, limiter: Optional[RateLimiter] = None,
+               progress: Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+    """Serve a MSG_BLOB_QUERY received on sock: answer with what we hold, then
+    send every requested chunk (CRC32 + sendfile, as send_file) until the
+    fetcher closes. Returns {"chunks", "bytes"} served."""
+    name = bytes(payload).decode("utf-8", errors="replace")
+    found = local_blob(directory, name)
+    if found is None:
+        sock.sendall(encode_frame(MSG_BLOB_HAVE, HAVE_HEADER.pack(0, 0, NO_DIGEST)))
+        return {"chunks": 0, "bytes": 0}
+    path, size, chunk, digest, bitmap = found
+    served = {"chunks": 0, "bytes": 0}
+    with open(path, "rb") as f:
+        sock.sendall(encode_frame(MSG_BLOB_HAVE, HAVE_HEADER.pack(size, chunk, digest) + bitmap))
+        if size == 0:
+            return served
+        zero_copy = isinstance(sock, socket.socket)
+        head = bytearray(FRAME_HEADER.size + GET_HEADER.size)
+        head_view = memoryview(head)
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            while True:
+                try:
+                    _recv_exact(sock, head_view)
+                except ConnectionError:
+                    break   # the fetcher is done with us
+                length, msg_type = FRAME_HEADER.unpack_from(head)
+                (idx,) = GET_HEADER.unpack_from(head, FRAME_HEADER.size)
+                if msg_type != MSG_BLOB_GET or length != GET_HEADER.size or idx >= len(bitmap) * 8 or not _has(bitmap, idx):
+                    raise FrameError(f"Richiesta di chunk non valida (tipo {msg_type}, indice {idx})")
+                offset = idx * chunk
+                n = min(chunk, size - offset)
+                if limiter is not None:
+                    limiter.consume(n)
+                _send_chunk(sock, f, mm, view, offset, n, zero_copy)
+                served["chunks"] += 1
+                served["bytes"] += n
+                if progress is not None:
+                    progress(offset)
+    return served
+
+# ---------------- Fetcher side --------------------------------------------------
+class SwarmDownload:
+    """Chunk bookkeeping of one fetch: who holds what, what is written or in flight."""
+
+    def __init__(self, size: int, chunk: int, done: bytearray):
+        self.size = size
+        self.chunk = chunk
+        self.nchunks = chunk_count(size, chunk)
+        self.done = done
+        self.remaining = sum(1 for i in range(self.nchunks) if not _has(done, i))
+        self.avail = [0] * self.nchunks
+        self.holders: Dict[Addr, bytes] = {}
+        self.inflight: Dict[int, Set[Addr]] = {}
+        self.duplicates = 0
+        self.finished = threading.Event()
+        self.stopped = threading.Event()   # finished, or every source gone
+        self._lock = threading.Lock()
+        if self.remaining == 0:
+            self.finished.set()
+            self.stopped.set()
+
+    def add_source(self, src: Addr, bitmap: bytes) -> None:
+        with self._lock:
+            self.holders[src] = bitmap
+            for i in range(self.nchunks):
+                if _has(bitmap, i):
+                    self.avail[i] += 1
+
+    def drop_source(self, src: Addr, pending) -> None:
+        """A source is gone: its chunks are rarer, its requests free for others."""
+        with self._lock:
+            bitmap = self.holders.pop(src, None)
+            if bitmap is not None:
+                for i in range(self.nchunks):
+                    if _has(bitmap, i):
+                        self.avail[i] -= 1
+            for i in pending:
+                asked = self.inflight.get(i)
+                if asked is not None:
+                    asked.discard(src)
+                    if not asked:
+                        del self.inflight[i]
+            if not self.holders:
+                self.stopped.set()
+
+    def pick(self, src: Addr) -> Optional[int]:
+        """Rarest missing chunk src holds that nobody is fetching; in endgame the
+        in-flight chunk src holds with the fewest requesters. None: nothing left for src."""
+        with self._lock:
+            bitmap = self.holders.get(src)
+            if bitmap is None or self.remaining == 0:
+                return None
+            start = random.randrange(self.nchunks)   # ties go to different chunks for different workers
+            best, best_key = None, None
+            dup, dup_key = None, None
+            for j in range(self.nchunks):
+                i = (start + j) % self.nchunks
+                if _has(self.done, i) or not _has(bitmap, i):
+                    continue
+                asked = self.inflight.get(i)
+                if not asked:
+                    if best_key is None or self.avail[i] < best_key:
+                        best, best_key = i, self.avail[i]
+                elif src not in asked and (dup_key is None or len(asked) < dup_key):
+                    dup, dup_key = i, len(asked)
+            idx = best if best is not None else dup
+            if idx is not None:
+                self.inflight.setdefault(idx, set()).add(src)
+            return idx
+
+    def claim(self, idx: int, src: Addr) -> bool:
+        """src delivered chunk idx: True if it is the first copy (write it)."""
+        with self._lock:
+            asked = self.inflight.get(idx)
+            if asked is not None:
+                asked.discard(src)
+                if not asked:
+                    del self.inflight[idx]
+            if _has(self.done, idx):
+                self.duplicates += 1
+                return False
+            self.done[idx >> 3] |= 0x80 >> (idx & 7)
+            self.inflight.pop(idx, None)
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.finished.set()
+                self.stopped.set()
+            return True
+
+def _fetch_worker(sock, src: Addr, dl: SwarmDownload, fd: int, meta_fd: int, pipeline: int,
+                  report: Dict[str, object]) -> None:
+    pending: "deque[int]" = deque()
+    buf = bytearray(dl.chunk)
+    view = memoryview(buf)
+    head = bytearray(FRAME_HEADER.size + FILE_CHUNK_HEADER.size)
+    head_view = memoryview(head)
+    t0 = time.perf_counter()
+    try:
+        while not dl.finished.is_set():
+            while len(pending) < pipeline:
+                idx = dl.pick(src)
+                if idx is None:
+                    break
+                sock.sendall(encode_frame(MSG_BLOB_GET, GET_HEADER.pack(idx)))
+                pending.append(idx)
+            if not pending:
+                break
+            idx = pending[0]
+            _recv_exact(sock, head_view)
+            length, msg_type = FRAME_HEADER.unpack_from(head)
+            offset, crc = FILE_CHUNK_HEADER.unpack_from(head, FRAME_HEADER.size)
+            n = length - FILE_CHUNK_HEADER.size
+            if msg_type != MSG_FILE_CHUNK or offset != idx * dl.chunk or n != min(dl.chunk, dl.size - offset):
+                raise FrameError(f"Chunk inatteso da {src[0]}:{src[1]} (tipo {msg_type}, offset {offset})")
+            data = view[:n]
+            _recv_exact(sock, data)
+            if zlib.crc32(data) != crc:
+                raise FileChunkError(f"Checksum errato nel chunk {idx} da {src[0]}:{src[1]}")
+            pending.popleft()
+            report["bytes"] += n
+            if dl.claim(idx, src):
+                os.pwrite(fd, data, offset)
+                # progress after the data: a crash loses a chunk, never claims a missing one
+                os.pwrite(meta_fd, bytes([dl.done[idx >> 3]]), SWARM_META.size + (idx >> 3))
+                report["chunks"] += 1
+            else:
+                report["duplicates"] += 1
+    except (OSError, FrameError, FileChunkError) as e:
+        if not dl.finished.is_set():   # else: cut off by fetch_blob, see there
+            report["error"] = str(e)
+    finally:
+        dl.drop_source(src, pending)
+        elapsed = time.perf_counter() - t0
+        report["mb_s"] = round(report["bytes"] / elapsed / 1e6, 1) if elapsed > 0 else 0.0
+
+def _query(connect: Callable[[Addr], object], src: Addr, name: str):
+    sock = connect(src)
+    try:
+        sock.sendall(encode_frame(MSG_BLOB_QUERY, name.encode("utf-8")))
+        have = _read_frame(sock, MSG_BLOB_HAVE)
+        size, chunk, digest = HAVE_HEADER.unpack_from(have)
+    except Exception:
+        sock.close()
+        raise
+    if chunk == 0 or digest == NO_DIGEST or len(have) - HAVE_HEADER.size != (chunk_count(size, chunk) + 7) // 8:
+        sock.close()
+        return None
+    return sock, size, chunk, digest, have[HAVE_HEADER.size:]
+
+def fetch_blob(connect: Callable[[Addr], object], sources: List[Addr], name: str, directory: str,
+               pipeline: int = SWARM_PIPELINE) -> Dict[str, object]:
+    """Download name into directory from every source that holds it, in
+    parallel (see the protocol above). connect(addr) opens a dedicated data
+    connection. Chunks land in <name>.part (preallocated, pwrite) and are
+    recorded in <name>.part.swarm, so an interrupted fetch resumes and other
+    nodes can already download the chunks we have. Returns {"path", "size",
+    "chunks", "resumed", "duplicates", "seconds", "mb_s", "sources": {"ip:port":
+    {"chunks", "bytes", "duplicates", "mb_s", "error"}}}; raises
+    FileTransferError if no source holds the file, chunks are left missing or
+    the finished file does not match the digest the sources agreed on (the
+    .part is then discarded: the next fetch starts over)."""
+    if not _valid_name(name):
+        raise FileTransferError(f"Nome di file non valido: {name!r}")
+    t0 = time.perf_counter()
+    answers = {}
+    with concurrent.futures.ThreadPoolExecutor(max(1, min(len(sources), 32))) as pool:
+        futures = {pool.submit(_query, connect, src, name): src for src in sources}
+        for fut, src in futures.items():
+            try:
+                answer = fut.result()
+            except (OSError, FrameError, struct.error):
+                continue
+            if answer is not None:
+                answers[src] = answer
+    if not answers:
+        raise FileTransferError(f"Nessuna fonte ha {name}")
+    votes: Dict[Tuple[int, int, bytes], int] = {}
+    for _, size, chunk, digest, _ in answers.values():
+        votes[(size, chunk, digest)] = votes.get((size, chunk, digest), 0) + 1
+    size, chunk, digest = max(votes, key=votes.get)
+    for src in [s for s, a in answers.items() if a[1:4] != (size, chunk, digest)]:
+        answers.pop(src)[0].close()
+
+    dest = os.path.join(directory, name)
+    part = dest + PART_SUFFIX
+    meta_path = part + SWARM_SUFFIX
+    n = chunk_count(size, chunk)
+    done = bytearray((n + 7) // 8)
+    try:
+        with open(meta_path, "rb") as m:
+            raw = m.read()
+        if SWARM_META.unpack_from(raw) == (size, chunk, digest) and os.path.getsize(part) == size:
+            done[:] = raw[SWARM_META.size:SWARM_META.size + len(done)]
+    except (OSError, struct.error, ValueError):
+        pass
+    todo = sum(min(chunk, size - i * chunk) for i in range(n) if not _has(done, i))
+    dl = SwarmDownload(size, chunk, done)
+    resumed = n - dl.remaining
+    fd = os.open(part, os.O_RDWR | os.O_CREAT, 0o644)
+    meta_fd = os.open(meta_path, os.O_RDWR | os.O_CREAT, 0o644)
+    reports: Dict[Addr, Dict[str, object]] = {}
+    try:
+        if resumed == 0:
+            os.ftruncate(fd, 0)
+            _preallocate(fd, size)
+        os.ftruncate(meta_fd, 0)
+        os.pwrite(meta_fd, SWARM_META.pack(size, chunk, digest) + bytes(done), 0)
+        workers = []
+        for src, (sock, _, _, _, bitmap) in answers.items():
+            dl.add_source(src, bitmap)
+            reports[src] = {"chunks": 0, "bytes": 0, "duplicates": 0, "mb_s": 0.0, "error": None}
+        for src, (sock, _, _, _, _) in answers.items():
+            t = threading.Thread(target=_fetch_worker, args=(sock, src, dl, fd, meta_fd, pipeline, reports[src]),
+                                 name=f"swarm-{src[1]}", daemon=True)
+            t.start()
+            workers.append(t)
+        dl.stopped.wait()
+        # endgame tail: a worker may still wait for a chunk another source already
+        # delivered (up to FILE_TIMEOUT on a slow one); cut its connection
+        for sock, _, _, _, _ in answers.values():
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for t in workers:
+            t.join()
+    finally:
+        for sock, _, _, _, _ in answers.values():
+            sock.close()
+        os.close(fd)
+        os.close(meta_fd)
+    if dl.remaining:
+        raise FileTransferError(f"{name}: {dl.remaining}/{n} chunk mancanti (nessuna fonte rimasta); riprovare per riprendere")
+    if file_digest(part) != digest:
+        # some chunk passed its CRC but is not the content the sources agreed
+        # on: nothing tells which one, so the whole download is thrown away
+        for path in (part, meta_path):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        raise FileTransferError(f"{name}: digest del file scaricato diverso da quello annunciato dalle fonti; scartato")
+    os.replace(part, dest)
+    os.unlink(meta_path)
+    elapsed = time.perf_counter() - t0
+    return {
+        "path": dest,
+        "size": size,
+        "chunks": n,
+        "resumed": resumed,
+        "duplicates": dl.duplicates,
+        "seconds": round(elapsed, 3),
+        "mb_s": round(todo / elapsed / 1e6, 1) if elapsed > 0 else 0.0,
+        "sources": {f"{ip}:{port}": r for (ip, port), r in reports.items()},
+    }
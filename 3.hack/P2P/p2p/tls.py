@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Mutual TLS 1.3 between peers with session resumption."""
+import contextvars
+import errno
+import os
+import select
+import selectors
+import socket
+import ssl
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .config import Addr
+
+# ---------------- TLS ---------------------------------------------------------
+TLS_HANDSHAKE_TIMEOUT = 5.0
+TLS_SESSION_CACHE = 1024      # remembered sessions (one per remote address)
+# files written by SSL/2.SSL/server_client_cert_gen/server_client_cert_gen.py gen_certs
+TLS_FILES = {
+    "ca": "ca_cert.pem",
+    "server_cert": "server_cert.pem",
+    "server_key": "server_key.pem",
+    "client_cert": "client_cert.pem",
+    "client_key": "client_key.pem",
+}
+
+# session offered by the next asyncio TLS dial (create_connection has no session argument)
+_tls_session: "contextvars.ContextVar[Optional[ssl.SSLSession]]" = contextvars.ContextVar("p2p_tls_session", default=None)
+
+class _ResumingContext(ssl.SSLContext):
+    """Client context whose wrap_bio() (used by asyncio) offers _tls_session."""
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None:
+            session = _tls_session.get()
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+if hasattr(select, "poll"):
+    def _wait_fd(fd: int, write: bool) -> None:
+        # poll, not select(): no FD_SETSIZE limit (select raises ValueError for fd >= 1024)
+        poller = select.poll()
+        poller.register(fd, select.POLLOUT if write else select.POLLIN)
+        poller.poll()
+else:
+    def _wait_fd(fd: int, write: bool) -> None:
+        with selectors.DefaultSelector() as sel:
+            sel.register(fd, selectors.EVENT_WRITE if write else selectors.EVENT_READ)
+            sel.select()
+
+class _TLSConn:
+    """SSLSocket shared by the reader and the writer thread of a Peer connection.
+
+    One OpenSSL connection must not be read and written at the same time
+    (records get corrupted, e.g. while TLS 1.3 session tickets are being
+    read), so every SSL call takes a lock. The socket is non-blocking and the
+    waiting for data or buffer space happens in poll(), outside the lock."""
+
+    def __init__(self, sock: ssl.SSLSocket):
+        self._sock = sock
+        self._lock = threading.Lock()
+        sock.setblocking(False)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def _io(self, op, *args):
+        while True:
+            with self._lock:
+                fd = self._sock.fileno()
+                if fd < 0:
+                    raise OSError(errno.EBADF, "socket chiuso")
+                try:
+                    return op(*args)
+                except ssl.SSLWantReadError:
+                    write = False
+                except ssl.SSLWantWriteError:
+                    write = True
+            # no timeout: whoever closes the connection shuts it down first
+            # (registry._close_conn), which makes the socket readable here; a
+            # descriptor closed meanwhile (POLLNVAL) is caught on the next turn
+            _wait_fd(fd, write)
+
+    @property
+    def session(self) -> Optional[ssl.SSLSession]:
+        with self._lock:
+            return self._sock.session
+
+    def recv_into(self, buffer) -> int:
+        return self._io(self._sock.recv_into, buffer)
+
+    def sendall(self, data) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[self._io(self._sock.send, view):]
+
+    def settimeout(self, timeout) -> None:
+        pass   # always non-blocking underneath, see _io()
+
+    # under the lock: the descriptor must not be closed (and reused by a new
+    # connection) while another thread is inside an SSL call on it
+    def shutdown(self, how: int) -> None:
+        with self._lock:
+            self._sock.shutdown(how)
+
+    def close(self) -> None:
+        with self._lock:
+            self._sock.close()
+
+class PeerTLS:
+    """Mutual TLS (1.3 only) for peer connections.
+
+    A node builds its two contexts once: the accepting side presents the
+    server certificate, the dialing side the client certificate, both
+    checked against the shared CA (the pairs issued by the SSL/2.SSL
+    generator). Peers are dialed by IP, so identity is the CA chain, as in
+    that generator's client. The last session per remote address is kept so
+    a reconnect resumes with a ticket instead of a full handshake."""
+
+    def __init__(self, cafile: str, server_cert: str, server_key: str, client_cert: str, client_key: str, resume: bool = True):
+        self.resume = resume
+        self.server = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.client = _ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+        for ctx, cert, key in ((self.server, server_cert, server_key), (self.client, client_cert, client_key)):
+            ctx.minimum_version = ssl.TLSVersion.TLSv1_3
+            ctx.verify_mode = ssl.CERT_REQUIRED
+            ctx.load_verify_locations(cafile=cafile)
+            ctx.load_cert_chain(certfile=cert, keyfile=key)
+        self.client.check_hostname = False
+        if not resume:
+            self.server.num_tickets = 0
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[Addr, ssl.SSLSession]" = OrderedDict()
+        self.stats = {"handshakes": 0, "resumed": 0}
+
+    @classmethod
+    def from_dir(cls, path: str, resume: bool = True) -> "PeerTLS":
+        files = {k: os.path.join(path, name) for k, name in TLS_FILES.items()}
+        return cls(files["ca"], files["server_cert"], files["server_key"], files["client_cert"], files["client_key"], resume=resume)
+
+    def session_for(self, addr: Addr) -> Optional[ssl.SSLSession]:
+        if not self.resume:
+            return None
+        with self._lock:
+            return self._sessions.get(addr)
+
+    def remember(self, addr: Addr, sslobj) -> None:
+        """Keep the session of a dialed connection. TLS 1.3 tickets arrive after
+        the handshake, so call this once something has been read."""
+        if not self.resume:
+            return
+        session = sslobj.session
+        if session is None or not session.has_ticket:
+            return
+        with self._lock:
+            self._sessions[addr] = session
+            self._sessions.move_to_end(addr)
+            while len(self._sessions) > TLS_SESSION_CACHE:
+                self._sessions.popitem(last=False)
+
+    def handshake_done(self, sslobj) -> None:
+        self.stats["handshakes"] += 1
+        if sslobj.session_reused:
+            self.stats["resumed"] += 1
+
+    def accept(self, sock: socket.socket) -> _TLSConn:
+        """Server-side handshake on an accepted socket (threaded engine)."""
+        sock.settimeout(TLS_HANDSHAKE_TIMEOUT)
+        tls = self.server.wrap_socket(sock, server_side=True)
+        self.handshake_done(tls)
+        return _TLSConn(tls)
+
+    def dial(self, sock: socket.socket, addr: Addr) -> _TLSConn:
+        """Client-side handshake on a connected socket, resuming when possible."""
+        tls = self.client.wrap_socket(sock, session=self.session_for(addr))
+        self.handshake_done(tls)
+        return _TLSConn(tls)
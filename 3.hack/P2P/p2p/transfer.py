@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Bulk file transfer: sendfile streaming, per-chunk CRC32, preallocation and resume."""
+import hashlib
+import mmap
+import os
+import shutil
+import socket
+import struct
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+from .wire import FRAME_HEADER, MSG_FILE_ACK, MSG_FILE_CHUNK, MSG_FILE_OFFER, FrameError, encode_frame
+
+# ---------------- File transfer ------------------------------------------------
+# A transfer never travels on the message connection: the sender dials the
+# receiver's listening port again and opens with MSG_FILE_OFFER, which turns
+# that new connection into a dedicated data stream served by its own thread.
+# Text/requests keep flowing on the peer connection meanwhile, and a multi-GB
+# file cannot fill its send queue or inbox.
+#
+#   sender                               receiver
+#   MSG_FILE_OFFER (size, key, chunk, name)  ->
+#                                        <-  MSG_FILE_ACK (offset to resume from, OK)
+#   MSG_FILE_CHUNK (offset, crc32) + bytes   ->   (sendfile; pwrite into the .part file)
+#   ...
+#                                        <-  MSG_FILE_ACK (size, DONE)
+#
+# The receiver keeps the progress of <name>.part in <name>.part.meta, so an
+# interrupted or corrupted transfer is offered again and resumes from the last
+# chunk that passed its checksum. `key` identifies the source file version
+# (name, size, mtime): a changed file restarts from zero.
+FILE_CHUNK = 1024 * 1024        # bytes per MSG_FILE_CHUNK
+FILE_MAX_CHUNK = 16 * 1024 * 1024
+FILE_MAX_SIZE = 1 << 40         # larger offers are refused (the .part is preallocated to the offered size)
+FILE_RETRIES = 3                # send_file() re-offers (and resumes) this many times
+FILE_TIMEOUT = 30.0             # a silent transfer connection is given up after this long
+PART_SUFFIX = ".part"
+META_SUFFIX = ".meta"
+
+FILE_OFFER_HEADER = struct.Struct("!QQI")   # file size, source key, chunk size; then UTF-8 name
+FILE_ACK_HEADER = struct.Struct("!QB")      # offset, status
+FILE_CHUNK_HEADER = struct.Struct("!QI")    # offset in the file, CRC32 of the chunk bytes
+PART_META = struct.Struct("!QQQ")           # source key, file size, bytes verified and written
+
+FILE_OK = 0          # offer accepted: send from offset
+FILE_DONE = 1        # every byte received and verified, file renamed into place
+FILE_REFUSED = 2     # no --files-dir, bad name or chunk size
+FILE_BAD_CHUNK = 3   # checksum mismatch at offset: offer again to resume there
+
+# chunk header and sendfile() body leave in the same TCP segment
+_MSG_MORE = getattr(socket, "MSG_MORE", 0)
+
+class FileTransferError(Exception):
+    """Transfer refused or aborted by the other side."""
+
+class FileChunkError(FileTransferError):
+    """A chunk failed its checksum: offering the file again resumes before it."""
+
+def file_key(name: str, st: os.stat_result) -> int:
+    """64-bit id of one version of a source file."""
+    raw = f"{name}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "big")
+
+def _recv_exact(sock, view: memoryview) -> None:
+    got = 0
+    while got < len(view):
+        n = sock.recv_into(view[got:])
+        if n == 0:
+            raise ConnectionError("Connessione chiusa durante il trasferimento")
+        got += n
+
+def _ack(offset: int, status: int) -> bytes:
+    return encode_frame(MSG_FILE_ACK, FILE_ACK_HEADER.pack(offset, status))
+
+def _read_ack(sock) -> Tuple[int, int]:
+    buf = bytearray(FRAME_HEADER.size + FILE_ACK_HEADER.size)
+    _recv_exact(sock, memoryview(buf))
+    length, msg_type = FRAME_HEADER.unpack_from(buf)
+    if msg_type != MSG_FILE_ACK or length != FILE_ACK_HEADER.size:
+        raise FrameError(f"Atteso MSG_FILE_ACK, ricevuto tipo {msg_type}")
+    return FILE_ACK_HEADER.unpack_from(buf, FRAME_HEADER.size)
+
+def _preallocate(fd: int, size: int) -> None:
+    """Reserve the whole file up front: no fragmentation, and a full disk fails now, not at 90%."""
+    if size == 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):   # not on macOS / some filesystems
+        os.ftruncate(fd, size)
+
+# ---------------- Sender --------------------------------------------------------
+def _drop_pages(mm: mmap.mmap, offset: int, length: int) -> None:
+    """Unmap the pages of a sent chunk: they stay in the page cache, but do not
+    pile up in the sender's RSS for the whole file."""
+    if hasattr(mm, "madvise") and hasattr(mmap, "MADV_DONTNEED"):
+        start = offset - offset % mmap.PAGESIZE
+        mm.madvise(mmap.MADV_DONTNEED, start, offset + length - start)
+
+def _send_chunk(sock, f, mm: mmap.mmap, view: memoryview, offset: int, n: int, zero_copy: bool) -> None:
+    """One MSG_FILE_CHUNK: header + CRC32 of view[offset:offset+n], body by sendfile() from f."""
+    with view[offset:offset + n] as data:
+        header = FRAME_HEADER.pack(FILE_CHUNK_HEADER.size + n, MSG_FILE_CHUNK)
+        header += FILE_CHUNK_HEADER.pack(offset, zlib.crc32(data))
+        if zero_copy:
+            sock.sendall(header, _MSG_MORE)
+            sock.sendfile(f, offset, n)
+        else:
+            sock.sendall(header)
+            sock.sendall(data)
+    _drop_pages(mm, offset, n)
+
+def send_file(sock, path: str, name: str, chunk: int = FILE_CHUNK) -> Dict[str, int]:
+    """Offer path to the receiver on sock (a fresh, dedicated connection) and
+    stream it from the offset the receiver asks for. Each chunk goes out as a
+    frame header written with MSG_MORE followed by socket.sendfile(), so file
+    bytes go from the page cache to the socket without entering Python; the
+    CRC32 is computed over an mmap of the same pages (TLS connections cannot
+    sendfile: they sendall() the mmap slice). Returns
+    {"size", "offset" (resumed from), "sent"}; raises FileTransferError if the
+    receiver refuses or reports a bad chunk."""
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        offer = FILE_OFFER_HEADER.pack(size, file_key(name, st), chunk) + name.encode("utf-8")
+        sock.sendall(encode_frame(MSG_FILE_OFFER, offer))
+        start, status = _read_ack(sock)
+        if status != FILE_OK:
+            raise FileTransferError(f"Trasferimento rifiutato da remoto (stato {status})")
+        zero_copy = isinstance(sock, socket.socket)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        try:
+            with memoryview(mm if mm is not None else b"") as view:
+                offset = start
+                while offset < size:
+                    n = min(chunk, size - offset)
+                    _send_chunk(sock, f, mm, view, offset, n, zero_copy)
+                    offset += n
+        finally:
+            if mm is not None:
+                mm.close()
+        done, status = _read_ack(sock)
+        if status == FILE_BAD_CHUNK:
+            raise FileChunkError(f"Checksum errato a offset {done}: riprendere da lì")
+        if status != FILE_DONE or done != size:
+            raise FileTransferError(f"Trasferimento non confermato (stato {status}, {done}/{size} byte)")
+    return {"size": size, "offset": start, "sent": size - start}
+
+# ---------------- Receiver ------------------------------------------------------
+def _resume_offset(meta_path: str, key: int, size: int) -> int:
+    try:
+        with open(meta_path, "rb") as m:
+            k, s, offset = PART_META.unpack(m.read(PART_META.size))
+    except (OSError, struct.error):
+        return 0
+    return offset if (k, s) == (key, size) and offset <= size else 0
+
+def receive_file(sock, directory: Optional[str], payload,
+                 progress: Optional[Callable[[int], None]] = None) -> Dict[str, object]:
+    """Serve a MSG_FILE_OFFER received on sock: answer with the resume offset,
+    then read every chunk header and body straight into one reusable buffer,
+    check its CRC32 and pwrite() it into <directory>/<name>.part, which was
+    preallocated to the full size. Progress is recorded after each chunk; the
+    completed file is renamed into place and progress(offset), if given, is
+    called after each chunk. Returns {"path", "size", "offset", "received"}."""
+    if len(payload) < FILE_OFFER_HEADER.size:
+        raise FrameError(f"Offerta di file troppo corta ({len(payload)} byte)")
+    size, key, chunk = FILE_OFFER_HEADER.unpack_from(payload)
+    name = bytes(payload[FILE_OFFER_HEADER.size:]).decode("utf-8", errors="replace")
+    if directory is None or os.path.basename(name) != name or name in ("", ".", "..") or not 0 < chunk <= FILE_MAX_CHUNK:
+        sock.sendall(_ack(0, FILE_REFUSED))
+        raise FileTransferError(f"Offerta di file rifiutata: {name!r}")
+    dest = os.path.join(directory, name)
+    part = dest + PART_SUFFIX
+    meta_path = part + META_SUFFIX
+    offset = _resume_offset(meta_path, key, size) if os.path.exists(part) else 0
+    if size > FILE_MAX_SIZE or (offset == 0 and size > shutil.disk_usage(directory).free):
+        sock.sendall(_ack(0, FILE_REFUSED))
+        raise FileTransferError(f"Offerta di file rifiutata: {name!r} troppo grande ({size} byte)")
+    start = offset
+    fd = os.open(part, os.O_RDWR | os.O_CREAT, 0o644)
+    meta = os.open(meta_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if offset == 0:
+            os.ftruncate(fd, 0)
+            _preallocate(fd, size)
+        os.pwrite(meta, PART_META.pack(key, size, offset), 0)
+        sock.sendall(_ack(offset, FILE_OK))
+        buf = bytearray(chunk)
+        view = memoryview(buf)
+        head = bytearray(FRAME_HEADER.size + FILE_CHUNK_HEADER.size)
+        head_view = memoryview(head)
+        while offset < size:
+            _recv_exact(sock, head_view)
+            length, msg_type = FRAME_HEADER.unpack_from(head)
+            at, crc = FILE_CHUNK_HEADER.unpack_from(head, FRAME_HEADER.size)
+            n = length - FILE_CHUNK_HEADER.size
+            if msg_type != MSG_FILE_CHUNK or at != offset or not 0 < n <= min(chunk, size - offset):
+                raise FrameError(f"Chunk inatteso (tipo {msg_type}, offset {at}, {n} byte) a offset {offset}")
+            data = view[:n]
+            _recv_exact(sock, data)
+            if zlib.crc32(data) != crc:
+                sock.sendall(_ack(offset, FILE_BAD_CHUNK))
+                raise FileChunkError(f"Checksum errato nel chunk a offset {offset} di {name}")
+            os.pwrite(fd, data, offset)
+            offset += n
+            os.pwrite(meta, PART_META.pack(key, size, offset), 0)
+            if progress is not None:
+                progress(offset)
+    finally:
+        os.close(fd)
+        os.close(meta)
+    os.replace(part, dest)
+    os.unlink(meta_path)
+    sock.sendall(_ack(size, FILE_DONE))
+    return {"path": dest, "size": size, "offset": start, "received": size - start}
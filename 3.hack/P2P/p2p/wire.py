@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Length-prefixed frames: message types, encoding and the zero-copy FrameReader."""
+import socket
+import struct
+
+# ---------------- Wire protocol -----------------------------------------------
+# Every TCP message is a frame: 4-byte payload length + 1-byte type + payload.
+# TCP is a byte stream, so one recv() may hold several frames or a piece of one;
+# the header lets the receiver cut the stream back into messages.
+FRAME_HEADER = struct.Struct("!IB")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+RECV_CHUNK = 64 * 1024
+
+MSG_TEXT = 1     # UTF-8 text; the accepting side echoes it upper-cased
+MSG_REPLY = 2    # echo reply, never answered
+MSG_BINARY = 3   # opaque bytes, delivered as-is
+MSG_GOSSIP = 4   # GOSSIP_HEADER + UTF-8 text, deduplicated and re-forwarded
+MSG_REQUEST = 5  # CORR_HEADER + UTF-8 text, answered by MSG_RESPONSE on any side
+MSG_RESPONSE = 6 # CORR_HEADER + UTF-8 text, resolves the matching pending request
+MSG_HELLO = 7    # HELLO_ADDR [+ codec mask], sent once by the dialing side: its listening address
+MSG_CODECS = 8   # codec mask, the accepting side's answer to a HELLO that carries one
+MSG_COMPRESSED = 9  # COMPRESSED_HEADER + compressed payload of a MSG_TEXT/REPLY/BINARY/REQUEST/RESPONSE/TYPED
+MSG_ROUTE = 10      # ROUTE_HEADER + body, forwarded hop by hop towards a node id (dht.py)
+MSG_FIND_NODE = 11  # FIND_HEADER: which contacts do you have closest to this id?
+MSG_NODES = 12      # NODES_HEADER + HELLO_ADDR per contact, answer to MSG_FIND_NODE
+MSG_FILE_OFFER = 13 # FILE_OFFER_HEADER + UTF-8 name: turns a fresh connection into a file transfer (transfer.py)
+MSG_FILE_ACK = 14   # FILE_ACK_HEADER: receiver's answer to the offer (resume offset) and to the last chunk
+MSG_FILE_CHUNK = 15 # FILE_CHUNK_HEADER + raw file bytes, written with sendfile()
+MSG_BLOB_QUERY = 16 # UTF-8 name: turns a fresh connection into chunk downloads of a stored file (swarm.py)
+MSG_BLOB_HAVE = 17  # HAVE_HEADER + chunk bitmap, answer to MSG_BLOB_QUERY (chunk size 0: not here)
+MSG_BLOB_GET = 18   # GET_HEADER: send this chunk, answered with MSG_FILE_CHUNK
+MSG_TYPED = 19      # TYPED_HEADER + body of a registered schema, decoded lazily (messages.py)
+MSG_FLOW = 20       # 1 byte: 1 = inbox over its limit, hold data frames; 0 = send them again
+
+# first frames that turn an accepted connection into a dedicated data stream,
+# served by its own thread until it closes (transfer.py, swarm.py). An accepted
+# connection is registered as a peer only once its first frame is known not to
+# be one (peers open with MSG_HELLO), or after OPENER_WAIT of silence: nothing
+# (broadcast, gossip, idle close) may ever be written into a transfer stream.
+DATA_OPENERS = (MSG_FILE_OFFER, MSG_BLOB_QUERY)
+OPENER_WAIT = 0.5
+CORR_HEADER = struct.Struct("!Q")
+HELLO_ADDR = struct.Struct("!4sH")
+
+class FrameError(ValueError):
+    """Malformed or oversized frame: the stream cannot be resynchronised."""
+
+def encode_frame(msg_type: int, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(payload), msg_type) + payload
+
+def encode_message(message) -> bytes:
+    """str -> MSG_TEXT frame, bytes -> MSG_BINARY frame, TypedMessage -> MSG_TYPED frame."""
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return encode_frame(MSG_BINARY, bytes(message))
+    if isinstance(message, str):
+        return encode_frame(MSG_TEXT, message.encode("utf-8"))
+    return message.frame()
+
+class FrameReader:
+    """Incremental frame parser over one reusable receive buffer.
+
+    Data is received straight into the buffer (recv_into / BufferedProtocol),
+    and complete frames are yielded as memoryview slices of it, so a payload
+    is never copied chunk by chunk. A yielded payload is only valid until the
+    next writable()/recv_from() call: decode or copy it before reading again."""
+
+    def __init__(self, max_frame: int = MAX_FRAME_SIZE, min_read: int = RECV_CHUNK):
+        self.max_frame = max_frame
+        self.min_read = min_read
+        self._buf = bytearray(min_read)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self.frames_in = 0   # frames / bytes received so far (metrics)
+        self.bytes_in = 0
+
+    def _needed(self) -> int:
+        """Total size of the frame currently being assembled (header only if unknown)."""
+        if self._end - self._start < FRAME_HEADER.size:
+            return FRAME_HEADER.size
+        length, _ = FRAME_HEADER.unpack_from(self._buf, self._start)
+        if length > self.max_frame:
+            raise FrameError(f"Frame di {length} byte oltre il limite {self.max_frame}")
+        return FRAME_HEADER.size + length
+
+    def writable(self) -> memoryview:
+        """Free tail of the buffer, large enough to complete the pending frame."""
+        if self._start == self._end:
+            self._start = self._end = 0
+        need = self._needed()
+        pending = self._end - self._start
+        if self._start + need > len(self._buf) or (self._start and len(self._buf) - self._end < self.min_read):
+            if need <= len(self._buf):
+                # compact: move the partial frame to the front (at most one frame, once)
+                self._buf[:pending] = self._buf[self._start:self._end]
+            else:
+                self._resize(max(need, 2 * len(self._buf)), pending)
+            self._start, self._end = 0, pending
+        return self._view[self._end:]
+
+    def _resize(self, size: int, pending: int) -> None:
+        """Move the pending bytes to a new buffer of size bytes. Payloads already
+        yielded keep the old buffer alive, so they stay valid."""
+        buf = bytearray(size)
+        buf[:pending] = self._view[self._start:self._start + pending]
+        self._buf = buf
+        self._view = memoryview(buf)
+
+    @property
+    def capacity(self) -> int:
+        """Bytes currently allocated for the receive buffer."""
+        return len(self._buf)
+
+    def advance(self, nbytes: int) -> None:
+        self._end += nbytes
+        self.bytes_in += nbytes
+
+    def recv_from(self, sock: socket.socket) -> int:
+        """recv_into the buffer; returns bytes read (0 = EOF)."""
+        n = sock.recv_into(self.writable())
+        self._end += n
+        self.bytes_in += n
+        return n
+
+    def frames(self):
+        """Yield (msg_type, payload) for every complete frame in the buffer."""
+        while True:
+            avail = self._end - self._start
+            if avail < FRAME_HEADER.size:
+                if not avail and len(self._buf) > self.min_read:
+                    # a large frame grew the buffer: once consumed, do not pin it for the connection's life
+                    self._resize(self.min_read, 0)
+                    self._start = self._end = 0
+                return
+            length, msg_type = FRAME_HEADER.unpack_from(self._buf, self._start)
+            if length > self.max_frame:
+                raise FrameError(f"Frame di {length} byte oltre il limite {self.max_frame}")
+            total = FRAME_HEADER.size + length
+            if avail < total:
+                return
+            payload = self._view[self._start + FRAME_HEADER.size:self._start + total]
+            self._start += total
+            self.frames_in += 1
+            yield msg_type, payload
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""--workers: several forked peers sharing one port, driven over the control API."""
+import itertools
+import os
+import random
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Tuple, Optional, List
+
+from .config import Addr, ConnID, DEFAULT_SEND_WAIT_TIMEOUT
+from .logs import buffered_log, flush_server_logs, set_log_tag
+from .metrics import merge_stats
+from .peer import Peer
+from .control import ControlClient, ControlError, ControlServer, _from_jsonable, _jsonable
+
+# ---------------- Multi-process workers ---------------------------------------
+def _watch_parent(fd: int, stopped: threading.Event) -> None:
+    """Blocks on the read end of the parent's pipe: EOF means the parent is gone
+    (even without a stop), with no polling of getppid() meanwhile."""
+    try:
+        os.read(fd, 1)
+    except OSError:
+        pass
+    stopped.set()
+
+def _worker_main(index: int, factory: Callable[[], "Peer"], path: str, parent_fd: int) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl-C is handled by the parent
+    set_log_tag(f"[w{index}] ")
+    peer = factory()
+    peer.start_server()
+    ctl = ControlServer(peer, path)
+    ctl.start()
+    threading.Thread(target=_watch_parent, args=(parent_fd, ctl.stopped), name="parent-watch", daemon=True).start()
+    try:
+        ctl.stopped.wait()
+    finally:
+        ctl.stop()
+        peer.stop_discovery()
+        peer.stop_server()
+        flush_server_logs()
+
+class WorkerPool:
+    """--workers N: N forked processes, each a full peer listening on the same
+    port with SO_REUSEPORT, so the kernel spreads incoming connections (and the
+    per-message work) across N interpreters instead of one GIL.
+
+    The parent holds no connections. It talks to every worker through that
+    worker's control socket and exposes the Peer methods used by the REPL, so
+    list_peers/send/broadcast see the connections of all workers. Connection
+    ids are global: local_cid * workers + worker_index. Only worker 0 runs
+    multicast discovery, otherwise every worker would dial the same peers."""
+
+    def __init__(
+        self,
+        workers: int,
+        factory: Callable[[], "Peer"],
+        broadcast_mode: str = "direct",
+        send_wait_timeout: float = DEFAULT_SEND_WAIT_TIMEOUT,
+    ):
+        self.workers = workers
+        self.factory = factory
+        self.broadcast_mode = broadcast_mode
+        self.send_wait_timeout = send_wait_timeout
+        self.run_dir: Optional[str] = None
+        self.pids: List[int] = []
+        self.clients: List[ControlClient] = []
+        self._next = itertools.count()
+        self._alive_fd: Optional[int] = None   # write end of the pipe the workers watch
+
+    def start_server(self) -> None:
+        self.run_dir = tempfile.mkdtemp(prefix="p2p-workers-")
+        paths = [os.path.join(self.run_dir, f"worker-{i}.sock") for i in range(self.workers)]
+        parent_fd, self._alive_fd = os.pipe()
+        for i, path in enumerate(paths):
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    os.close(self._alive_fd)
+                    _worker_main(i, self.factory, path, parent_fd)
+                except BaseException:
+                    code = 1
+                finally:
+                    os._exit(code)
+            self.pids.append(pid)
+        os.close(parent_fd)
+        for path in paths:
+            self.clients.append(self._connect(path))
+        buffered_log(f"[workers] {self.workers} worker avviati, controllo in {self.run_dir}")
+
+    def _connect(self, path: str, timeout: float = 10.0) -> ControlClient:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return ControlClient(path)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise ConnectionError(f"Worker non raggiungibile su {path}")
+                time.sleep(0.05)
+
+    def _route(self, cid: ConnID) -> Tuple[ControlClient, ConnID]:
+        worker = cid % self.workers
+        return self.clients[worker], cid // self.workers
+
+    def _global(self, worker: int, cid: ConnID) -> ConnID:
+        return cid * self.workers + worker
+
+    def start_discovery(self) -> None:
+        self.clients[0].call("start_discovery")
+
+    def stop_discovery(self) -> None:
+        try:
+            self.clients[0].call("stop_discovery")
+        except (ControlError, OSError):
+            pass
+
+    def stop_server(self) -> None:
+        for client in self.clients:
+            try:
+                client.call("stop")
+            except (ControlError, OSError):
+                pass
+            client.close()
+        self.clients = []
+        deadline = time.monotonic() + 5.0
+        for pid in self.pids:
+            while os.waitpid(pid, os.WNOHANG) == (0, 0):
+                if time.monotonic() > deadline:
+                    os.kill(pid, signal.SIGTERM)
+                    os.waitpid(pid, 0)
+                    break
+                time.sleep(0.05)
+        self.pids = []
+        if self._alive_fd is not None:
+            os.close(self._alive_fd)
+            self._alive_fd = None
+        if self.run_dir:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    def list_peers(self):
+        rows = []
+        for worker, client in enumerate(self.clients):
+            for cid, addr, typ, idle, mem in client.call("list_peers"):
+                rows.append((self._global(worker, cid), tuple(addr), typ, idle, mem))
+        rows.sort()
+        return rows
+
+    def connect(self, ip: str, port: int, timeout: float = 3.0) -> ConnID:
+        for cid, addr, _, _, _ in self.list_peers():
+            if addr == (ip, port):
+                return cid
+        worker = next(self._next) % self.workers
+        cid = self.clients[worker].call("connect", ip=ip, port=port)
+        return None if cid is None else self._global(worker, cid)
+
+    def send(self, cid: ConnID, message) -> None:
+        client, local = self._route(cid)
+        client.call("send", cid=local, message=_jsonable(message))
+
+    def send_typed(self, cid: ConnID, schema, fields: Dict[str, object]) -> None:
+        client, local = self._route(cid)
+        client.call("send_typed", cid=local, schema=schema, fields={k: _jsonable(v) for k, v in fields.items()})
+
+    def send_and_wait(self, cid: ConnID, message: str, timeout: Optional[float] = None) -> Optional[str]:
+        client, local = self._route(cid)
+        return client.call("send_and_wait", cid=local, message=message, timeout=timeout)
+
+    def recv(self, cid: ConnID, timeout: Optional[float] = None):
+        client, local = self._route(cid)
+        return _from_jsonable(client.call("recv", cid=local, timeout=timeout or 0))
+
+    def disconnect(self, cid: ConnID) -> None:
+        client, local = self._route(cid)
+        client.call("disconnect", cid=local)
+
+    def broadcast(self, message) -> None:
+        if self.broadcast_mode == "gossip":
+            self.gossip(message)
+            return
+        for client in self.clients:
+            client.call("broadcast", message=_jsonable(message))
+
+    def send_many(self, cid: ConnID, messages) -> int:
+        client, local = self._route(cid)
+        return client.call("send_many", cid=local, messages=[_jsonable(m) for m in messages])
+
+    def request_many(self, cid: ConnID, messages: List[str], timeout: Optional[float] = None,
+                     window: Optional[int] = None) -> List[Optional[str]]:
+        client, local = self._route(cid)
+        return client.call("request_many", cid=local, messages=messages, timeout=timeout, window=window)
+
+    def gossip(self, message: str, msg_id: Optional[int] = None) -> int:
+        if msg_id is None:
+            msg_id = random.getrandbits(64)
+        for client in self.clients:
+            client.call("gossip", message=message, msg_id=msg_id)
+        return msg_id
+
+    def send_file(self, ip: str, port: int, path: str, name: Optional[str] = None) -> Dict[str, object]:
+        return self.clients[0].call("send_file", ip=ip, port=port, path=path, name=name)
+
+    def fetch_blob(self, name: str, sources: Optional[List[Addr]] = None) -> Dict[str, object]:
+        return self.clients[0].call("fetch_blob", name=name, sources=sources)
+
+    def send_queue_stats(self) -> List[Dict[str, object]]:
+        rows = []
+        for worker, client in enumerate(self.clients):
+            for st in client.call("queues"):
+                st["cid"] = self._global(worker, st["cid"])
+                rows.append(st)
+        return sorted(rows, key=lambda st: st["cid"])
+
+    def stats(self) -> Dict[str, object]:
+        snaps = []
+        for worker, client in enumerate(self.clients):
+            snap = client.call("stats")
+            for c in snap["connections"]:
+                c["cid"] = self._global(worker, c["cid"])
+            snaps.append(snap)
+        merged = merge_stats(snaps)
+        merged["connections"].sort(key=lambda c: c["cid"])
+        return merged
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Shared fixtures: the p2p package from this checkout, quiet logs, free ports."""
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import p2p  # noqa: E402
+
+HOST = "127.0.0.1"
+
+@pytest.fixture(autouse=True, scope="session")
+def _quiet_logs():
+    p2p.set_log_level("warning")
+
+def free_port(host: str = HOST) -> int:
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+@pytest.fixture
+def make_peer():
+    """make_peer(engine, host=HOST, **opts): a started node, stopped at teardown."""
+    peers = []
+
+    def make(engine: str, host: str = HOST, **opts):
+        peer = p2p.ENGINES[engine](host, free_port(host), **opts)
+        peer.start_server()
+        peers.append(peer)
+        return peer
+
+    yield make
+    for peer in peers:
+        peer.stop_server()
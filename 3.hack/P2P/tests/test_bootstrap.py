@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Bootstrap dialing: dead addresses must not delay the first live peer."""
+import socket
+import threading
+import time
+
+import pytest
+
+import p2p
+
+# bootstrap targets live on another loopback address: the anti-duplicate rule
+# (the lower address dials) lets a node on HOST call them
+TARGET_HOST = "127.0.0.2"
+CONNECT_TIMEOUT = 3.0   # Peer.connect default: what one dead address costs a serial dialer
+
+@pytest.fixture
+def tarpits():
+    """tarpits(n): n addresses that never answer a connect (full backlog, no
+    SYN-ACK, no RST), like a host that is down."""
+    socks = []
+
+    def make(n: int):
+        addrs = []
+        for _ in range(n):
+            srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            srv.bind((TARGET_HOST, 0))
+            srv.listen(0)
+            socks.append(srv)
+            for _ in range(2):
+                filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                filler.setblocking(False)
+                filler.connect_ex(srv.getsockname())
+                socks.append(filler)
+            addrs.append(srv.getsockname())
+        time.sleep(0.05)
+        return addrs
+
+    yield make
+    for s in socks:
+        s.close()
+
+def _start_bootstrap(peer) -> None:
+    if isinstance(peer, p2p.AsyncPeer):
+        peer._loop.call_soon_threadsafe(lambda: peer._spawn(peer._bootstrap()))
+    else:
+        threading.Thread(target=peer._bootstrap_connect, daemon=True).start()
+
+def _time_to_first_peer(peer, limit: float) -> float:
+    t0 = time.perf_counter()
+    _start_bootstrap(peer)
+    while time.perf_counter() - t0 < limit:
+        if peer.list_peers():
+            return time.perf_counter() - t0
+        time.sleep(0.005)
+    return float("inf")
+
+@pytest.mark.parametrize("engine", sorted(p2p.ENGINES))
+def test_dead_bootstrap_addresses_do_not_delay_first_peer(engine, make_peer, tarpits):
+    dead = tarpits(3)
+    live = make_peer("thread", host=TARGET_HOST)
+    peer = make_peer(engine, bootstrap=dead + [(live.host, live.port)])
+    ttfp = _time_to_first_peer(peer, limit=3 * CONNECT_TIMEOUT)
+    # staggered dials: the live address starts after 3 x bootstrap_stagger,
+    # where a serial dialer would wait out 3 connect timeouts
+    assert ttfp < 3 * p2p.BOOTSTRAP_STAGGER + 1.0
+    assert [p[1] for p in peer.list_peers()] == [(live.host, live.port)]
+
+@pytest.mark.parametrize("engine", sorted(p2p.ENGINES))
+def test_bootstrap_inflight_one_is_serial(engine, make_peer, tarpits):
+    dead = tarpits(1)
+    live = make_peer("thread", host=TARGET_HOST)
+    peer = make_peer(engine, bootstrap=dead + [(live.host, live.port)], bootstrap_inflight=1)
+    ttfp = _time_to_first_peer(peer, limit=3 * CONNECT_TIMEOUT)
+    assert CONNECT_TIMEOUT - 0.5 < ttfp < 2 * CONNECT_TIMEOUT
+
+@pytest.mark.parametrize("engine", sorted(p2p.ENGINES))
+def test_concurrent_connects_share_one_connection(engine, make_peer):
+    live = make_peer("thread", host=TARGET_HOST)
+    peer = make_peer(engine)
+    cids = []
+    threads = [threading.Thread(target=lambda: cids.append(peer.connect(live.host, live.port))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(cids)) == 1
+    assert len(peer.list_peers()) == 1
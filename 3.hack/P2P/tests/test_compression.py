@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Compression: a corrupt payload is a FrameError, counters hold under concurrent pack()."""
+import threading
+
+import pytest
+
+from p2p.compression import CODEC_NAMES, COMPRESSED_HEADER, Compression
+from p2p.wire import FRAME_HEADER, MSG_COMPRESSED, MSG_TEXT, FrameError, encode_frame
+
+TEXT = " ".join(f"riga {i} stato=ok" for i in range(500)).encode("utf-8")
+
+@pytest.mark.parametrize("name", sorted(CODEC_NAMES))
+def test_round_trip(name):
+    comp = Compression()
+    out = comp.pack(encode_frame(MSG_TEXT, TEXT), CODEC_NAMES[name])
+    assert out[4] == MSG_COMPRESSED and len(out) < len(TEXT)
+    assert comp.unpack(memoryview(out)[FRAME_HEADER.size:]) == (MSG_TEXT, TEXT)
+
+@pytest.mark.parametrize("name", sorted(CODEC_NAMES))
+def test_corrupt_payload_is_a_frame_error(name):
+    comp = Compression()
+    payload = COMPRESSED_HEADER.pack(CODEC_NAMES[name], MSG_TEXT) + b"\xff" * 64
+    with pytest.raises(FrameError):
+        comp.unpack(payload)
+
+def test_counters_under_concurrent_pack():
+    comp = Compression()
+    frame = encode_frame(MSG_TEXT, TEXT)
+    codec = next(iter(CODEC_NAMES.values()))
+    wire = len(comp.pack(frame, codec))
+    comp.stats.update(frames=0, raw_bytes=0, wire_bytes=0)
+
+    def send():
+        for _ in range(300):
+            comp.pack(frame, codec)
+
+    threads = [threading.Thread(target=send) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert comp.stats["frames"] == 1200
+    assert comp.stats["raw_bytes"] == 1200 * len(frame)
+    assert comp.stats["wire_bytes"] == 1200 * wire
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""DHT dial requests: only the origin's own address, at a bounded rate."""
+import socket
+
+from p2p.dht import DHT_DIAL_BURST, node_id
+from p2p.wire import HELLO_ADDR
+
+TARGET_HOST = "127.0.0.2"   # above HOST: the anti-duplicate rule lets our node dial it
+
+def _dial_request(addr):
+    return memoryview(HELLO_ADDR.pack(socket.inet_aton(addr[0]), addr[1]))
+
+def _recording(peer):
+    dialed = []
+    peer._dht_dial = dialed.append
+    return dialed
+
+def test_dial_request_for_another_address_is_refused(make_peer):
+    peer = make_peer("thread")
+    dialed = _recording(peer)
+    victim, origin = (TARGET_HOST, 7001), (TARGET_HOST, 7002)
+    peer._on_dial_request(node_id(origin), _dial_request(victim))
+    assert dialed == [] and peer.dht_stats["dials_refused"] == 1
+    peer._on_dial_request(node_id(origin), _dial_request(origin))
+    assert dialed == [origin] and peer.dht_stats["dials"] == 1
+
+def test_dial_requests_are_rate_limited(make_peer):
+    peer = make_peer("thread")
+    dialed = _recording(peer)
+    addrs = [(TARGET_HOST, 7100 + i) for i in range(3 * DHT_DIAL_BURST)]
+    for addr in addrs:
+        peer._on_dial_request(node_id(addr), _dial_request(addr))
+    assert DHT_DIAL_BURST <= len(dialed) < DHT_DIAL_BURST + 2
+    assert peer.dht_stats["dials_refused"] == len(addrs) - len(dialed)
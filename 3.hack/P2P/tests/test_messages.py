@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""TypedMessage: round trips through every installed serializer, lazy fields, bad bodies."""
+import json
+
+import pytest
+
+import p2p
+from p2p.messages import (
+    SERIALIZER_NAMES, SERIALIZERS, FieldKindError, MessageError, Serializer, TypedMessage, register_schema,
+)
+
+RECORD = register_schema(900, "test_record", [
+    ("id", "u64"), ("name", "str"), ("score", "f64"), ("small", "u8"), ("delta", "i32"),
+    ("blob", "bytes"), ("ok", "bool"), ("note", "str"),
+])
+FIELDS = {"id": 2 ** 63, "name": "nodo è", "score": -1.5, "small": 255, "delta": -(2 ** 31),
+          "blob": b"\x00\xff" * 10, "ok": True, "note": ""}
+
+SERIALIZER_IDS = sorted(SERIALIZER_NAMES)
+
+@pytest.mark.parametrize("serializer", SERIALIZER_IDS)
+def test_round_trip(serializer):
+    msg = TypedMessage.build(RECORD, FIELDS, serializer)
+    back = TypedMessage.parse(msg.payload())
+    assert back.schema is RECORD and back.serializer is SERIALIZER_NAMES[serializer]
+    assert back.fields() == FIELDS
+    assert back == msg
+
+@pytest.mark.parametrize("serializer", SERIALIZER_IDS)
+def test_single_field_without_full_decode(serializer):
+    back = TypedMessage.parse(TypedMessage.build(RECORD, FIELDS, serializer).payload())
+    for name, value in FIELDS.items():
+        assert back[name] == value
+    with pytest.raises(KeyError):
+        back["missing"]
+
+@pytest.mark.parametrize("serializer", SERIALIZER_IDS)
+def test_f64_sent_as_int_decodes_as_float(serializer):
+    back = TypedMessage.parse(TypedMessage.build("ping", {"seq": 1, "sent": 3}, serializer).payload())
+    assert back["sent"] == 3.0 and type(back["sent"]) is float
+
+def test_frame_round_trip_through_reader():
+    msg = TypedMessage.build("chat", {"text": "ciao"})
+    reader = p2p.FrameReader()
+    frame = msg.frame()
+    reader.writable()[:len(frame)] = frame
+    reader.advance(len(frame))
+    (msg_type, payload), = list(reader.frames())
+    assert msg_type == p2p.MSG_TYPED
+    assert TypedMessage.parse(payload)["text"] == "ciao"
+
+def test_build_checks_fields():
+    with pytest.raises(MessageError):
+        TypedMessage.build(RECORD, {"id": 1})
+    with pytest.raises(MessageError):
+        TypedMessage.build(RECORD, dict(FIELDS, small=256))
+
+def test_parse_rejects_unknown_schema_and_short_payload():
+    with pytest.raises(MessageError):
+        TypedMessage.parse(b"\x7f\xff\x01")
+    with pytest.raises(MessageError):
+        TypedMessage.parse(b"\x00")
+
+def test_truncated_struct_body():
+    payload = TypedMessage.build(RECORD, FIELDS, "struct").payload()
+    with pytest.raises(MessageError):
+        TypedMessage.parse(payload[:-3]).fields()
+
+@pytest.mark.parametrize("bad", [
+    {"id": "7"}, {"id": -1}, {"small": 256}, {"delta": 2 ** 31}, {"id": True}, {"ok": 1},
+    {"score": "1.5"}, {"name": 5}, {"blob": 5}, {"blob": "not base64!"},
+])
+def test_json_kind_mismatch_is_a_message_error(bad):
+    obj = dict(FIELDS, blob="AA==")
+    obj.update(bad)
+    body = json.dumps(obj).encode("utf-8")
+    with pytest.raises(FieldKindError) as info:
+        SERIALIZER_NAMES["json"].decode(RECORD, body)
+    # the message is rejected, the connection that carried it is not
+    assert isinstance(info.value, MessageError) and not isinstance(info.value, p2p.FrameError)
+
+@pytest.mark.parametrize("serializer", [s for s in ("msgpack", "cbor") if s in SERIALIZER_NAMES])
+def test_array_kind_mismatch_is_a_message_error(serializer):
+    ser = SERIALIZER_NAMES[serializer]
+    values = [FIELDS[n] for n in RECORD.names]
+    values[0] = "7"
+    with pytest.raises(FieldKindError):
+        ser.decode(RECORD, ser._dumps(values))
+
+@pytest.mark.parametrize("serializer", [s for s in SERIALIZER_IDS if not SERIALIZER_NAMES[s].partial_decode])
+def test_whole_body_decoded_once(serializer, monkeypatch):
+    ser = SERIALIZER_NAMES[serializer]
+    back = TypedMessage.parse(TypedMessage.build(RECORD, FIELDS, serializer).payload())
+    calls = []
+    decode = ser.decode
+    monkeypatch.setattr(ser, "decode", lambda schema, body: calls.append(1) or decode(schema, body))
+    assert [back[n] for n in FIELDS] == list(FIELDS.values())
+    assert back.fields() == FIELDS
+    assert len(calls) == 1
+
+def test_serializer_is_abstract():
+    with pytest.raises(TypeError):
+        Serializer()
+
+    class Partial(Serializer):
+        def encode(self, schema, fields):
+            return b""
+
+    with pytest.raises(TypeError):
+        Partial()
+
+def test_serializer_ids_are_unique():
+    assert len({s.id for s in SERIALIZERS.values()}) == len(SERIALIZERS)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Peer cache: replay, compaction only by the sole owner, foreign files left alone."""
+import os
+import socket
+import time
+
+import pytest
+
+from p2p.peercache import PEER_CACHE_MAGIC, PEER_CACHE_OK, PEER_CACHE_RECORD, PeerCache
+
+PEER = ("127.0.0.1", 5000)
+
+def _write_log(path, records: int) -> None:
+    rec = PEER_CACHE_RECORD.pack(socket.inet_aton(PEER[0]), PEER[1], time.time(), PEER_CACHE_OK)
+    with open(path, "wb") as f:
+        f.write(PEER_CACHE_MAGIC + rec * records)
+
+def test_replay_and_compaction(tmp_path):
+    path = str(tmp_path / "peers.bin")
+    _write_log(path, 1000)
+    cache = PeerCache(path)
+    try:
+        assert cache.best() == [PEER]
+        assert os.path.getsize(path) == len(PEER_CACHE_MAGIC) + PEER_CACHE_RECORD.size
+        cache.record(("127.0.0.2", 6000), PEER_CACHE_OK)
+    finally:
+        cache.close()
+    again = PeerCache(path)
+    try:
+        assert sorted(again.best()) == [PEER, ("127.0.0.2", 6000)]
+    finally:
+        again.close()
+
+def test_no_compaction_under_another_writer(tmp_path):
+    """flock locks belong to the open file, so a second PeerCache in this
+    process stands in for another --workers process."""
+    path = str(tmp_path / "peers.bin")
+    first = PeerCache(path)   # alone: creates the file, then holds it shared
+    rec = PEER_CACHE_RECORD.pack(socket.inet_aton(PEER[0]), PEER[1], time.time(), PEER_CACHE_OK)
+    with open(path, "ab") as f:
+        f.write(rec * 1000)
+    second = PeerCache(path)
+    try:
+        assert second.best() == [PEER]
+        assert os.path.getsize(path) == len(PEER_CACHE_MAGIC) + 1000 * PEER_CACHE_RECORD.size
+        ino = os.stat(path).st_ino
+        first.record(("127.0.0.3", 7000), PEER_CACHE_OK)
+        second.record(("127.0.0.4", 8000), PEER_CACHE_OK)
+        assert os.stat(path).st_ino == ino
+    finally:
+        first.close()
+        second.close()
+    reader = PeerCache(path)
+    try:
+        assert {("127.0.0.3", 7000), ("127.0.0.4", 8000)} <= set(reader.best())
+    finally:
+        reader.close()
+
+def test_foreign_file_is_refused_and_kept(tmp_path):
+    path = tmp_path / "peers.bin"
+    path.write_bytes(b"not a peer cache")
+    with pytest.raises(ValueError):
+        PeerCache(str(path))
+    assert path.read_bytes() == b"not a peer cache"
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Priority lanes: routing by type, order, round robin, bound and hold."""
+import socket
+import threading
+import time
+
+import pytest
+
+from p2p.queues import (
+    LANE_CONTROL, LANE_CONTROL_RESERVE, LANE_GOSSIP, LANE_MESSAGES, LANE_QUANTUM, Lanes, SendQueue, frame_lane,
+)
+from p2p.wire import (
+    MSG_BINARY, MSG_COMPRESSED, MSG_FLOW, MSG_GOSSIP, MSG_REQUEST, MSG_RESPONSE, MSG_TEXT, MSG_TYPED, encode_frame,
+)
+
+def _fill(lanes: Lanes, frames):
+    for f in frames:
+        lanes.push(f, lanes.lane(f))
+
+def _drain(lanes: Lanes):
+    out = []
+    while lanes.ready():
+        out.append(lanes.pop())
+    return out
+
+def test_lane_depends_on_type_not_size():
+    assert frame_lane(encode_frame(MSG_REQUEST, b"x")) == LANE_CONTROL
+    assert frame_lane(encode_frame(MSG_FLOW, b"\x01")) == LANE_CONTROL
+    assert frame_lane(encode_frame(MSG_GOSSIP, b"x")) == LANE_GOSSIP
+    for msg_type in (MSG_TEXT, MSG_BINARY, MSG_TYPED):
+        assert frame_lane(encode_frame(msg_type, b"x")) == LANE_MESSAGES
+        assert frame_lane(encode_frame(msg_type, bytes(1 << 20))) == LANE_MESSAGES
+
+def test_compressed_frame_goes_by_inner_type():
+    # COMPRESSED_HEADER starts with the codec id, then the inner type
+    assert frame_lane(encode_frame(MSG_COMPRESSED, bytes([1, MSG_RESPONSE]) + b"zz")) == LANE_CONTROL
+    assert frame_lane(encode_frame(MSG_COMPRESSED, bytes([1, MSG_TEXT]) + b"zz")) == LANE_MESSAGES
+
+def test_user_frames_keep_their_order_whatever_their_size():
+    lanes = Lanes(0)
+    frames = [encode_frame(MSG_BINARY, bytes(n)) for n in (10, 100000, 5, 70000, 1, 20)]
+    _fill(lanes, frames)
+    assert _drain(lanes) == frames
+
+def test_control_overtakes_queued_data():
+    lanes = Lanes(0)
+    data = [encode_frame(MSG_TEXT, b"d%d" % i) for i in range(5)]
+    gossip = [encode_frame(MSG_GOSSIP, b"g%d" % i) for i in range(5)]
+    _fill(lanes, data + gossip)
+    req = encode_frame(MSG_REQUEST, b"ping")
+    lanes.push(req, lanes.lane(req))
+    out = _drain(lanes)
+    assert out[0] == req
+    assert [f for f in out if f in data] == data
+    assert [f for f in out if f in gossip] == gossip
+
+def test_round_robin_shares_bytes_by_weight():
+    lanes = Lanes(0, weights=(4, 1))
+    size = LANE_QUANTUM // 4
+    _fill(lanes, [encode_frame(MSG_TEXT, bytes(size)) for _ in range(400)])
+    _fill(lanes, [encode_frame(MSG_GOSSIP, bytes(size)) for _ in range(400)])
+    first = [frame_lane(lanes.pop()) for _ in range(200)]
+    ratio = first.count(LANE_MESSAGES) / first.count(LANE_GOSSIP)
+    assert 3 <= ratio <= 5
+
+def test_plain_fifo_keeps_arrival_order():
+    lanes = Lanes(0, prioritize=False)
+    frames = [encode_frame(MSG_TEXT, b"a"), encode_frame(MSG_REQUEST, b"b"), encode_frame(MSG_GOSSIP, b"c")]
+    _fill(lanes, frames)
+    assert _drain(lanes) == frames
+
+def test_bound_is_total_with_control_reserve():
+    lanes = Lanes(10)
+    _fill(lanes, [encode_frame(MSG_TEXT, b"x")] * 6 + [encode_frame(MSG_GOSSIP, b"y")] * 4)
+    assert lanes.full(LANE_MESSAGES) and lanes.full(LANE_GOSSIP)
+    assert not lanes.full(LANE_CONTROL)
+    ctl = encode_frame(MSG_RESPONSE, b"r")
+    for _ in range(LANE_CONTROL_RESERVE):
+        lanes.push(ctl, LANE_CONTROL)
+    assert lanes.full(LANE_CONTROL)
+    assert len(lanes) == 10 + LANE_CONTROL_RESERVE
+
+def test_hold_lets_only_control_out():
+    lanes = Lanes(0)
+    data = encode_frame(MSG_TEXT, b"d")
+    lanes.push(data, LANE_MESSAGES)
+    lanes.hold(True)
+    assert not lanes.ready()
+    ctl = encode_frame(MSG_FLOW, b"\x00")
+    lanes.push(ctl, LANE_CONTROL)
+    assert _drain(lanes) == [ctl]
+    lanes.hold(False)
+    assert _drain(lanes) == [data]
+
+def test_plain_fifo_ignores_hold():
+    lanes = Lanes(0, prioritize=False)
+    lanes.hold(True)
+    data = encode_frame(MSG_TEXT, b"d")
+    lanes.push(data, lanes.lane(data))
+    assert _drain(lanes) == [data]
+
+class _Registry:
+    def __init__(self):
+        self.removed = []
+
+    def touch(self, cid):
+        pass
+
+    def remove(self, cid):
+        self.removed.append(cid)
+
+def test_send_queue_counts_under_load():
+    a, b = socket.socketpair()
+    received = bytearray()
+
+    def read():
+        while True:
+            chunk = b.recv(1 << 16)
+            if not chunk:
+                return
+            received.extend(chunk)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    sq = SendQueue(_Registry(), 1, a, ("127.0.0.1", 1), maxsize=64, policy="block")
+    frame = encode_frame(MSG_BINARY, bytes(1000))
+    putters = [threading.Thread(target=lambda: [sq.put(frame) for _ in range(500)]) for _ in range(4)]
+    for t in putters:
+        t.start()
+    for t in putters:
+        t.join()
+    deadline = time.monotonic() + 10
+    while sq.stats()["sent"] < 2000 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    st = sq.stats()
+    sq.close()
+    a.shutdown(socket.SHUT_RDWR)
+    a.close()
+    reader.join(5)
+    b.close()
+    assert (st["sent"], st["dropped"], st["depth"]) == (2000, 0, 0)
+    assert st["sent_bytes"] == 2000 * len(frame) == len(received)
+    assert sq.queued_bytes == 0
+
+@pytest.mark.parametrize("policy", ["block", "disconnect"])
+def test_put_without_block_drops_whatever_the_policy(policy):
+    """Receive paths (echo, replies, forwarded routes) must neither sleep on a
+    full queue nor close the connection: the frame is dropped and counted."""
+    a, b = socket.socketpair()   # b never reads: the writer gets stuck in sendall
+    registry = _Registry()
+    sq = SendQueue(registry, 1, a, ("127.0.0.1", 1), maxsize=4, policy=policy, block_timeout=5)
+    frame = encode_frame(MSG_BINARY, bytes(1 << 20))
+    t0 = time.monotonic()
+    queued = [sq.put(frame, block=False) for _ in range(20)]
+    assert time.monotonic() - t0 < 1
+    assert not all(queued) and sq.stats()["dropped"] == queued.count(False)
+    assert registry.removed == []
+    sq.close()
+    a.close()
+    b.close()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Inbox limits: hold signal, hard pause, resume, and what offer() may drop."""
+import threading
+
+from p2p.registry import INBOX_OVERDRAFT, Inbox
+
+class _Signals:
+    def __init__(self, inbox: Inbox):
+        self.events = []
+        inbox.on_full = lambda: self.events.append("hold")
+        inbox.on_drain = lambda: self.events.append("resume")
+
+def test_soft_limit_signals_hold_once():
+    inbox = Inbox(limit=1000)
+    sig = _Signals(inbox)
+    for _ in range(10):
+        assert inbox.push(b"m", 100)
+    assert sig.events == []
+    assert inbox.push(b"m", 100)
+    assert inbox.push(b"m", 100)
+    assert sig.events == ["hold"]
+    assert inbox.throttled and not inbox.full
+
+def test_hard_limit_pauses_reading():
+    limit = 1000
+    inbox = Inbox(limit=limit)
+    hard = limit + max(limit, INBOX_OVERDRAFT)
+    pushed = 0
+    while inbox.push(b"m", 1000):
+        pushed += 1000
+    assert pushed <= hard < pushed + 1000
+    assert inbox.full
+
+def test_resume_at_half_limit():
+    inbox = Inbox(limit=1000)
+    sig = _Signals(inbox)
+    for _ in range(20):
+        inbox.push(b"m", 100)
+    while inbox.nbytes > 500:
+        assert sig.events == ["hold"]
+        inbox.pop(0)
+    assert sig.events == ["hold", "resume"]
+    assert not inbox.throttled and not inbox.full
+
+def test_offer_never_goes_over_the_limit():
+    inbox = Inbox(limit=1000)
+    assert inbox.offer(b"a", 600)
+    assert not inbox.offer(b"b", 600)
+    assert inbox.push(b"c", 600)   # over the limit: hold
+    assert not inbox.offer(b"d", 1)
+    assert [inbox.pop(0), inbox.pop(0), inbox.pop(0)] == [b"a", b"c", None]
+
+def test_zero_limit_keeps_nothing():
+    inbox = Inbox(limit=0)
+    assert inbox.push(b"m", 10) and inbox.offer(b"m", 10)
+    assert inbox.pop(0) is None
+
+def test_wait_room_blocks_until_drained():
+    inbox = Inbox(limit=100)
+    while inbox.push(b"m", 100):
+        pass
+    released = threading.Event()
+
+    def reader():
+        inbox.wait_room()
+        released.set()
+
+    t = threading.Thread(target=reader, daemon=True)
+    t.start()
+    assert not released.wait(0.1)
+    while inbox.pop(0) is not None:
+        pass
+    assert released.wait(2)
+
+def test_signals_stay_ordered_under_races():
+    """push (reader thread) and pop (consumer thread) race around the limit:
+    the last signal must always match the final state."""
+    for _ in range(50):
+        inbox = Inbox(limit=1000)
+        sig = _Signals(inbox)
+        stop = threading.Event()
+
+        def consume():
+            while not stop.is_set() or inbox.nbytes:
+                inbox.pop(0.001)
+
+        t = threading.Thread(target=consume)
+        t.start()
+        for _ in range(200):
+            inbox.push(b"m", 100)
+        stop.set()
+        t.join()
+        assert not inbox.throttled
+        assert sig.events[-1:] in ([], ["resume"])
+        assert all(a != b for a, b in zip(sig.events, sig.events[1:]))
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Swarm download: a stalled source cannot hold back the end, a bad answer is ignored."""
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from conftest import HOST
+from p2p.swarm import HAVE_HEADER, _bitmap, _read_frame, chunk_count, fetch_blob, file_digest
+from p2p.transfer import FILE_CHUNK
+from p2p.wire import MSG_BLOB_HAVE, MSG_BLOB_QUERY, encode_frame
+
+SIZE = 8 * FILE_CHUNK + 123
+
+@pytest.fixture
+def fake_source():
+    """fake_source(have_payload): an address that answers a blob query with
+    have_payload, then swallows every request without serving a chunk."""
+    servers = []
+
+    def make(have: bytes):
+        srv = socket.create_server((HOST, 0))
+        servers.append(srv)
+
+        def serve():
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            with conn:
+                _read_frame(conn, MSG_BLOB_QUERY)
+                conn.sendall(encode_frame(MSG_BLOB_HAVE, have))
+                while conn.recv(65536):
+                    pass
+
+        threading.Thread(target=serve, daemon=True).start()
+        return srv.getsockname()
+
+    yield make
+    for srv in servers:
+        srv.close()
+
+@pytest.fixture
+def seeded(tmp_path, make_peer):
+    """A node holding data.bin, and an empty destination directory."""
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "data.bin").write_bytes(os.urandom(SIZE))
+    dest = tmp_path / "dst"
+    dest.mkdir()
+    peer = make_peer("thread", files_dir=str(src))
+    return (peer.host, peer.port), str(src / "data.bin"), str(dest)
+
+def _connect(addr):
+    return socket.create_connection(addr, timeout=10)
+
+def test_stalled_source_is_cut_at_the_end(seeded, fake_source):
+    good, path, dest = seeded
+    n = chunk_count(SIZE, FILE_CHUNK)
+    stalled = fake_source(HAVE_HEADER.pack(SIZE, FILE_CHUNK, file_digest(path)) + _bitmap(n, n))
+    t0 = time.perf_counter()
+    r = fetch_blob(_connect, [good, stalled], "data.bin", dest)
+    assert time.perf_counter() - t0 < 5   # the stalled connection would hold it for its 10 s timeout
+    assert open(r["path"], "rb").read() == open(path, "rb").read()
+    assert r["sources"][f"{stalled[0]}:{stalled[1]}"]["chunks"] == 0
+
+def test_short_bitmap_drops_the_source(seeded, fake_source):
+    good, path, dest = seeded
+    liar = fake_source(HAVE_HEADER.pack(SIZE, FILE_CHUNK, file_digest(path)))   # no bitmap at all
+    r = fetch_blob(_connect, [liar, good], "data.bin", dest)
+    assert list(r["sources"]) == [f"{good[0]}:{good[1]}"]
+    assert open(r["path"], "rb").read() == open(path, "rb").read()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""File transfer: an interrupted transfer resumes from the verified offset."""
+import os
+import socket
+import threading
+
+import pytest
+
+from p2p.transfer import (
+    FILE_MAX_SIZE, FILE_OFFER_HEADER, META_SUFFIX, PART_SUFFIX, FileTransferError, receive_file, send_file,
+)
+from p2p.wire import FRAME_HEADER, MSG_FILE_OFFER, FrameError
+
+CHUNK = 64 * 1024
+
+class _Stop(Exception):
+    pass
+
+def _read_offer(sock) -> bytes:
+    head = sock.recv(FRAME_HEADER.size, socket.MSG_WAITALL)
+    length, msg_type = FRAME_HEADER.unpack(head)
+    assert msg_type == MSG_FILE_OFFER
+    return sock.recv(length, socket.MSG_WAITALL)
+
+def _transfer(src: str, directory: str, stop_at=None):
+    """send_file on one end of a socketpair, receive_file on the other.
+    stop_at: the receiver gives up once that many bytes are written."""
+    a, b = socket.socketpair()
+    result = {}
+
+    def progress(offset):
+        if stop_at is not None and offset >= stop_at:
+            raise _Stop
+
+    def receive():
+        try:
+            result["received"] = receive_file(b, directory, _read_offer(b), progress)
+        except _Stop:
+            result["stopped"] = True
+        except FileTransferError as e:
+            result["refused"] = e
+        finally:
+            b.close()
+
+    t = threading.Thread(target=receive)
+    t.start()
+    try:
+        result["sent"] = send_file(a, src, os.path.basename(src), CHUNK)
+    except (OSError, FileTransferError) as e:
+        result["error"] = e
+    finally:
+        a.close()
+        t.join(10)
+    return result
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "src" / "data.bin"
+    path.parent.mkdir()
+    path.write_bytes(os.urandom(10 * CHUNK + 123))
+    return str(path)
+
+def test_full_transfer(source, tmp_path):
+    dest = tmp_path / "dst"
+    dest.mkdir()
+    r = _transfer(source, str(dest))
+    assert r["sent"] == {"size": os.path.getsize(source), "offset": 0, "sent": os.path.getsize(source)}
+    assert (dest / "data.bin").read_bytes() == open(source, "rb").read()
+    assert sorted(os.listdir(dest)) == ["data.bin"]
+
+def test_interrupted_transfer_resumes(source, tmp_path):
+    dest = tmp_path / "dst"
+    dest.mkdir()
+    r = _transfer(source, str(dest), stop_at=4 * CHUNK)
+    assert r.get("stopped") and "error" in r
+    assert sorted(os.listdir(dest)) == ["data.bin" + PART_SUFFIX, "data.bin" + PART_SUFFIX + META_SUFFIX]
+    r = _transfer(source, str(dest))
+    size = os.path.getsize(source)
+    assert r["sent"]["offset"] == 4 * CHUNK
+    assert r["sent"]["sent"] == size - 4 * CHUNK
+    assert (dest / "data.bin").read_bytes() == open(source, "rb").read()
+    assert sorted(os.listdir(dest)) == ["data.bin"]
+
+def test_changed_source_starts_over(source, tmp_path):
+    dest = tmp_path / "dst"
+    dest.mkdir()
+    _transfer(source, str(dest), stop_at=4 * CHUNK)
+    with open(source, "r+b") as f:   # new version: another mtime, another key
+        f.write(b"changed")
+    os.utime(source, ns=(0, 12345))
+    r = _transfer(source, str(dest))
+    assert r["sent"]["offset"] == 0
+    assert (dest / "data.bin").read_bytes() == open(source, "rb").read()
+
+def test_refused_without_directory(source):
+    r = _transfer(source, None)
+    assert isinstance(r["error"], FileTransferError)
+    assert isinstance(r["refused"], FileTransferError)
+
+def test_short_offer_is_a_frame_error(tmp_path):
+    a, b = socket.socketpair()
+    with a, b, pytest.raises(FrameError):
+        receive_file(b, str(tmp_path), FILE_OFFER_HEADER.pack(1, 2, CHUNK)[:-1])
+
+@pytest.mark.parametrize("size", [FILE_MAX_SIZE + 1, 2 ** 63])
+def test_oversized_offer_is_refused(tmp_path, size):
+    a, b = socket.socketpair()
+    with a, b, pytest.raises(FileTransferError):
+        receive_file(b, str(tmp_path), FILE_OFFER_HEADER.pack(size, 2, CHUNK) + b"big.bin")
+    assert os.listdir(tmp_path) == []
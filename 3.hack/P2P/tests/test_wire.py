@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Frame codec: encode_frame / encode_message and the incremental FrameReader."""
+import itertools
+import random
+import socket
+import threading
+
+import pytest
+
+from p2p.wire import (
+    FRAME_HEADER, MSG_BINARY, MSG_TEXT, RECV_CHUNK, FrameError, FrameReader, encode_frame, encode_message,
+)
+
+def _feed(reader: FrameReader, data: bytes, sizes):
+    """Push data through writable()/advance() in pieces of the given sizes
+    (repeated as needed, capped by the free buffer) and collect every frame
+    (payloads copied: the buffer is reused)."""
+    out = []
+    pos = 0
+    for n in itertools.cycle(sizes):
+        if pos >= len(data):
+            break
+        buf = reader.writable()
+        n = min(n, len(buf), len(data) - pos)
+        buf[:n] = data[pos:pos + n]
+        reader.advance(n)
+        pos += n
+        out.extend((t, bytes(p)) for t, p in reader.frames())
+    return out
+
+def test_encode_frame_layout():
+    frame = encode_frame(MSG_BINARY, b"abc")
+    assert FRAME_HEADER.unpack_from(frame) == (3, MSG_BINARY)
+    assert frame[FRAME_HEADER.size:] == b"abc"
+
+def test_encode_message_by_type():
+    assert encode_message("è") == encode_frame(MSG_TEXT, "è".encode("utf-8"))
+    assert encode_message(b"\x00") == encode_frame(MSG_BINARY, b"\x00")
+    assert encode_message(bytearray(b"\x01")) == encode_frame(MSG_BINARY, b"\x01")
+
+@pytest.mark.parametrize("piece", [1, 2, 5, 7, 4096, 1 << 20])
+def test_reader_reassembles_frames_across_reads(piece):
+    rng = random.Random(piece)
+    sent = [(rng.choice((MSG_TEXT, MSG_BINARY)), rng.randbytes(rng.choice((0, 1, 100, 70000)))) for _ in range(40)]
+    stream = b"".join(encode_frame(t, p) for t, p in sent)
+    reader = FrameReader()
+    assert _feed(reader, stream, [piece]) == sent
+    assert reader.frames_in == len(sent)
+    assert reader.bytes_in == len(stream)
+
+def test_reader_random_read_sizes():
+    rng = random.Random(7)
+    sent = [(MSG_BINARY, rng.randbytes(rng.randrange(0, 300000))) for _ in range(30)]
+    stream = b"".join(encode_frame(t, p) for t, p in sent)
+    sizes = [rng.randrange(1, 200000) for _ in range(1000)]
+    assert _feed(FrameReader(), stream, sizes) == sent
+
+def test_reader_rejects_oversized_frame():
+    reader = FrameReader(max_frame=1000)
+    buf = reader.writable()
+    header = FRAME_HEADER.pack(1001, MSG_BINARY)
+    buf[:len(header)] = header
+    reader.advance(len(header))
+    with pytest.raises(FrameError):
+        list(reader.frames())
+
+def test_reader_shrinks_after_large_frame():
+    reader = FrameReader()
+    big = encode_frame(MSG_BINARY, bytes(4 * RECV_CHUNK))
+    frames = _feed(reader, big + encode_frame(MSG_TEXT, b"x"), [RECV_CHUNK])
+    assert [t for t, _ in frames] == [MSG_BINARY, MSG_TEXT]
+    assert reader.capacity == RECV_CHUNK
+
+def test_payload_survives_buffer_growth():
+    """A yielded payload stays valid if the buffer is resized for the next frame."""
+    reader = FrameReader()
+    small = encode_frame(MSG_TEXT, b"hello")
+    big = encode_frame(MSG_BINARY, bytes(3 * RECV_CHUNK))
+    data = small + big[:10]
+    buf = reader.writable()
+    buf[:len(data)] = data
+    reader.advance(len(data))
+    (msg_type, payload), = list(reader.frames())
+    _feed(reader, big[10:], [RECV_CHUNK])
+    assert bytes(payload) == b"hello"
+
+def test_recv_from_socket():
+    a, b = socket.socketpair()
+    try:
+        frames = [encode_frame(MSG_TEXT, b"uno"), encode_frame(MSG_BINARY, bytes(200000))]
+
+        def send():
+            a.sendall(b"".join(frames))
+            a.close()
+
+        threading.Thread(target=send, daemon=True).start()
+        reader = FrameReader()
+        got = []
+        while reader.recv_from(b):
+            got.extend((t, bytes(p)) for t, p in reader.frames())
+        assert got == [(MSG_TEXT, b"uno"), (MSG_BINARY, bytes(200000))]
+    finally:
+        b.close()